@@ -1,4 +1,5 @@
 from app.models.database import Database
+from utils.password_hasher import password_hasher
 
 class AuthController:
     def __init__(self):
@@ -6,6 +7,7 @@ class AuthController:
         Initialize the authentication controller
         """
         self.db = Database()
+        self.hasher = password_hasher
     
     def register(self, username, password, is_admin_creation=False):
         """
@@ -25,10 +27,8 @@ class AuthController:
             # Only allow admin registration with a special admin key or from admin panel
             return False, "The username 'admin' is reserved. Please choose another username."
             
-        # In a real application, you would hash the password here
-        # For simplicity, we're storing the password as plain text
-        # This is NOT recommended for production applications
-        success = self.db.register_user(username, password)
+        # Only a salted KDF hash of the password is stored
+        success = self.db.register_user(username, self.hasher.hash(password))
         return success, None if success else "Username already exists"
         
     def create_admin_user(self, admin_key, username, password):
@@ -62,5 +62,16 @@ class AuthController:
         Returns:
             int or None: user_id if authentication was successful, None otherwise
         """
-        # In a real application, you would verify the hashed password
-        return self.db.authenticate_user(username, password)
+        user = self.db.get_user_credentials(username)
+        if not user:
+            return None
+        
+        user_id, stored_hash = user
+        if not self.hasher.verify(password, stored_hash):
+            return None
+        
+        # Transparently upgrade plaintext passwords and hashes made with old parameters
+        if self.hasher.needs_rehash(stored_hash):
+            self.db.update_password(user_id, self.hasher.hash(password))
+        
+        return user_id
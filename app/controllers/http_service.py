@@ -0,0 +1,686 @@
+"""
+Local HTTP/JSON service around the application controllers
+
+Lets scripts and other machines on the network use the same login, upload,
+analyze and history paths as the desktop window:
+
+    POST /login          {"username": ..., "password": ...} -> {"token": ..., "user_id": ...}
+    POST /logout
+    POST /analyze        raw image bytes, optional X-Filename header
+    POST /analyze/batch  multipart/form-data with one file part per image,
+                         or {"images": [{"name": ..., "data": base64}, ...]} for small batches
+    POST /analyze/fruits raw image bytes of several fruits, ?classifier=local|model
+    GET  /fruits         ?image_id=...
+    GET  /history        ?limit=50&offset=0
+    GET  /search         ?q=bruis*&limit=50&offset=0
+    GET  /health
+
+Every call except /login and /health needs an "Authorization: Bearer <token>"
+header. Connections are kept alive between requests, uploads are streamed to
+disk in blocks instead of being read into memory, and at most max_concurrent
+requests do work at a time; the others wait briefly and then get a 503.
+All sessions share one controller, each request passes its session's
+context, so requests of the same and of different users run in parallel.
+
+Usage:
+    python -m app.controllers.http_service --port 8080 --max-concurrent 8
+"""
+import argparse
+import base64
+import binascii
+import json
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from email.parser import BytesHeaderParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from dotenv import load_dotenv
+from app.controllers.main_controller import MainController
+from app.models.database import UserNotFoundError
+from utils.analysis_scheduler import analysis_scheduler
+from utils.fruit_detector import LOCAL, MODEL
+from utils.image_validator import ImageValidationError, image_validator
+from utils.logger import logger
+from utils.metrics import Histogram, tracer
+from utils.roi import roi_cropper
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Uploads are written here while they are validated, then copied into the image store
+UPLOAD_DIR = 'data/uploads'
+
+# Size of the blocks an upload is read and written in
+UPLOAD_BLOCK_SIZE = 64 * 1024
+
+# Largest JSON batch, which is read into memory whole. Larger batches are sent as multipart/form-data.
+JSON_BATCH_BYTES = 8 * 1024 * 1024
+
+# Largest header block of a multipart part
+PART_HEADER_BYTES = 16 * 1024
+
+class ServiceError(Exception):
+    """
+    Raised inside a request handler to answer with an error status
+    """
+    
+    def __init__(self, status, message, close=False):
+        """
+        Args:
+            status (int): The HTTP status code
+            message (str): The error message sent to the client
+            close (bool): Close the connection afterwards, for example when the body was not read
+        """
+        Exception.__init__(self, message)
+        self.status = status
+        self.close = close
+
+class ServiceSession:
+    """
+    A logged in client
+    """
+    
+    def __init__(self, context):
+        self.context = context
+        self.last_used = time.monotonic()
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FruitRipeness/1.0'
+    
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _read_blocks(self, limit):
+        """
+        Yield the request body in blocks, with Content-Length or chunked transfer encoding
+        
+        Raises:
+            ServiceError: If the body is larger than limit or malformed
+        """
+        received = 0
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                line = self.rfile.readline(1024)
+                try:
+                    size = int(line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    raise ServiceError(400, "Malformed chunked body", close=True)
+                if size == 0:
+                    # Skip the optional trailer up to the closing empty line
+                    while self.rfile.readline(1024) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                received += size
+                if limit and received > limit:
+                    raise ServiceError(413, f"Request body is larger than {limit // 1024} KB", close=True)
+                while size > 0:
+                    block = self.rfile.read(min(size, UPLOAD_BLOCK_SIZE))
+                    if not block:
+                        raise ServiceError(400, "Request body is incomplete", close=True)
+                    size -= len(block)
+                    yield block
+                self.rfile.readline(1024)
+        else:
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                raise ServiceError(400, "Invalid Content-Length", close=True)
+            if limit and length > limit:
+                raise ServiceError(413, f"Request body is larger than {limit // 1024} KB", close=True)
+            while received < length:
+                block = self.rfile.read(min(length - received, UPLOAD_BLOCK_SIZE))
+                if not block:
+                    raise ServiceError(400, "Request body is incomplete", close=True)
+                received += len(block)
+                yield block
+    
+    def _upload_path(self, name):
+        """
+        Get a path for an upload in a directory of its own, so the saved image keeps the client's file name
+        """
+        os.makedirs(self.server.upload_dir, exist_ok=True)
+        return os.path.join(tempfile.mkdtemp(dir=self.server.upload_dir), os.path.basename(name) or 'upload.jpg')
+    
+    def _read_json(self, limit):
+        try:
+            return json.loads(b''.join(self._read_blocks(limit)).decode('utf-8') or '{}')
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise ServiceError(400, "Request body is not valid JSON")
+    
+    def _body_pending(self):
+        return (self.headers.get('Transfer-Encoding', '').lower() == 'chunked' or
+                int(self.headers.get('Content-Length', 0) or 0) > 0)
+    
+    def _session(self):
+        """
+        Find the session of the bearer token
+        
+        Raises:
+            ServiceError: If the token is missing, unknown or expired
+        """
+        authorization = self.headers.get('Authorization', '')
+        if not authorization.startswith('Bearer '):
+            raise ServiceError(401, "Missing bearer token", close=self._body_pending())
+        session = self.server.get_session(authorization[len('Bearer '):].strip())
+        if session is None:
+            raise ServiceError(401, "Unknown or expired token", close=self._body_pending())
+        return session
+    
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        route = self.server.routes.get((method, url.path.rstrip('/') or '/'))
+        start = time.perf_counter()
+        status = 500
+        try:
+            if route is None:
+                raise ServiceError(404, "Not found", close=self._body_pending())
+            name, handler, limited = route
+            if limited and not self.server.acquire():
+                # Refuse without reading the upload, the connection cannot be reused
+                raise ServiceError(503, "Service busy, try again", close=self._body_pending())
+            try:
+                with tracer.span(f'service.{name}'):
+                    status, payload = handler(self, parse_qs(url.query))
+            finally:
+                if limited:
+                    self.server.release()
+            self._send_json(status, payload)
+        except ServiceError as e:
+            status = e.status
+            if e.close:
+                self.close_connection = True
+            headers = {'Retry-After': '1'} if e.status == 503 else None
+            self._send_json(e.status, {"error": str(e)}, headers)
+        except UserNotFoundError as e:
+            # The account was deleted while logged in, none of its tokens may write again
+            self.server.end_user_sessions(e.user_id)
+            status = 401
+            self.close_connection = True
+            self._send_json(401, {"error": "The account no longer exists"})
+        except Exception as e:
+            logger.error("Error handling %s %s: %s", method, url.path, e)
+            status = 500
+            self.close_connection = True
+            self._send_json(500, {"error": "Internal error"})
+        finally:
+            self.server.record(url.path, status, (time.perf_counter() - start) * 1000)
+    
+    def do_GET(self):
+        self._handle('GET')
+    
+    def do_POST(self):
+        self._handle('POST')
+    
+    def login(self, query):
+        body = self._read_json(64 * 1024)
+        context = self.server.controller.authenticate(str(body.get('username', '')), str(body.get('password', '')))
+        if context is None:
+            return 401, {"error": "Invalid username or password"}
+        token = self.server.create_session(context)
+        return 200, {"token": token, "user_id": context.user_id, "username": context.username}
+    
+    def logout(self, query):
+        authorization = self.headers.get('Authorization', '')
+        self.server.end_session(authorization[len('Bearer '):].strip())
+        return 200, {"ok": True}
+    
+    def _receive_upload(self):
+        """
+        Stream the raw image of the request body to disk and check it
+        
+        Returns:
+            str: The path of the upload, in a directory of its own that the caller removes
+        
+        Raises:
+            ServiceError: If the upload is not an acceptable image
+        """
+        upload_path = self._upload_path(self.headers.get('X-Filename', ''))
+        try:
+            with open(upload_path, 'wb') as upload_file:
+                for block in self._read_blocks(self.server.max_upload_bytes):
+                    upload_file.write(block)
+            image_validator.validate(upload_path)
+        except ImageValidationError as e:
+            shutil.rmtree(os.path.dirname(upload_path), ignore_errors=True)
+            raise ServiceError(422, str(e))
+        except BaseException:
+            shutil.rmtree(os.path.dirname(upload_path), ignore_errors=True)
+            raise
+        return upload_path
+    
+    def analyze(self, query):
+        session = self._session()
+        upload_path = self._receive_upload()
+        try:
+            saved_path, result, analysis_details = self.server.controller.save_and_analyze_image(
+                upload_path, context=session.context)
+        finally:
+            shutil.rmtree(os.path.dirname(upload_path), ignore_errors=True)
+        return 200, {"image_path": saved_path, "ripeness": result, "analysis": analysis_details}
+    
+    def analyze_fruits(self, query):
+        session = self._session()
+        classifier = query.get('classifier', [None])[0]
+        if classifier not in (None, LOCAL, MODEL):
+            raise ServiceError(400, f"classifier must be '{LOCAL}' or '{MODEL}'", close=self._body_pending())
+        upload_path = self._receive_upload()
+        try:
+            saved_path, analysis = self.server.controller.save_and_analyze_fruits(
+                upload_path, classifier, context=session.context)
+        finally:
+            shutil.rmtree(os.path.dirname(upload_path), ignore_errors=True)
+        return 200, {
+            "image_id": analysis["image_id"],
+            "image_path": saved_path,
+            "ripeness": analysis["ripeness"],
+            "counts": analysis["counts"],
+            "fruits": [{"box": list(box), "ripeness": ripeness, "confidence": confidence}
+                       for box, ripeness, confidence in analysis["fruits"]],
+        }
+    
+    def _receive_multipart_uploads(self):
+        """
+        Stream the files of a multipart/form-data body to disk, each in a directory of its own
+        
+        The body is scanned block by block for the part boundaries, so no more than a
+        block and a boundary are held in memory however large the batch is. Parts
+        without a file name, such as plain form fields, are skipped.
+        
+        Returns:
+            list: A (name, upload_path, None) tuple per file in the order they were sent,
+                  the caller removes the directories
+        
+        Raises:
+            ServiceError: If the body is malformed, holds too many files or a file is too large
+        """
+        match = re.search(r'boundary="?([^";]+)"?', self.headers.get('Content-Type', ''))
+        if match is None:
+            raise ServiceError(400, "multipart/form-data needs a boundary", close=True)
+        delimiter = b'\r\n--' + match.group(1).encode('latin-1')
+        max_files = self.server.max_batch_images
+        max_bytes = self.server.max_upload_bytes
+        
+        uploads = []
+        upload_file = None
+        written = 0
+        # The first delimiter starts the body, the line break in front of it is implied
+        buffer = b'\r\n'
+        state = 'preamble'
+        try:
+            for block in self._read_blocks(max_bytes * max_files + PART_HEADER_BYTES * max_files if max_bytes else 0):
+                buffer += block
+                while state != 'end':
+                    if state in ('preamble', 'data'):
+                        index = buffer.find(delimiter)
+                        # Without a delimiter, keep the bytes that may be the start of one
+                        data = buffer[:index] if index >= 0 else buffer[:max(0, len(buffer) - len(delimiter) + 1)]
+                        if upload_file:
+                            written += len(data)
+                            if max_bytes and written > max_bytes:
+                                raise ServiceError(413, f"An image is larger than {max_bytes // 1024} KB", close=True)
+                            upload_file.write(data)
+                        if index < 0:
+                            buffer = buffer[len(data):]
+                            break
+                        if upload_file:
+                            upload_file.close()
+                            upload_file = None
+                        buffer = buffer[index + len(delimiter):]
+                        state = 'delimiter'
+                    elif state == 'delimiter':
+                        if len(buffer) < 2:
+                            break
+                        if buffer.startswith(b'--'):
+                            # The closing delimiter, anything after it is ignored
+                            state = 'end'
+                        elif buffer.startswith(b'\r\n'):
+                            buffer = buffer[2:]
+                            state = 'headers'
+                        else:
+                            raise ServiceError(400, "Malformed multipart body", close=True)
+                    else:
+                        index = buffer.find(b'\r\n\r\n')
+                        if index < 0:
+                            if len(buffer) > PART_HEADER_BYTES:
+                                raise ServiceError(400, "Multipart part headers are too large", close=True)
+                            break
+                        headers = BytesHeaderParser().parsebytes(buffer[:index + 2])
+                        buffer = buffer[index + 4:]
+                        name = headers.get_param('filename', header='content-disposition')
+                        if name is not None:
+                            if len(uploads) == max_files:
+                                raise ServiceError(413, f"At most {max_files} images per batch", close=True)
+                            upload_path = self._upload_path(str(name))
+                            uploads.append((os.path.basename(upload_path), upload_path, None))
+                            upload_file = open(upload_path, 'wb')
+                            written = 0
+                        state = 'data'
+                if state == 'end':
+                    buffer = b''
+            if state != 'end':
+                raise ServiceError(400, "Multipart body is incomplete", close=True)
+        except BaseException:
+            if upload_file:
+                upload_file.close()
+            for _, upload_path, _ in uploads:
+                shutil.rmtree(os.path.dirname(upload_path), ignore_errors=True)
+            raise
+        return uploads
+    
+    def _receive_json_uploads(self):
+        """
+        Write the base64 images of a JSON batch to disk, each in a directory of its own
+        
+        Returns:
+            list: A (name, upload_path, error) tuple per image in the order they were sent,
+                  with no path for an image that could not be decoded
+        """
+        images = self._read_json(JSON_BATCH_BYTES).get('images')
+        if not isinstance(images, list):
+            raise ServiceError(400, "Expected a non-empty list of images")
+        if len(images) > self.server.max_batch_images:
+            raise ServiceError(413, f"At most {self.server.max_batch_images} images per batch")
+        
+        uploads = []
+        for image in images:
+            name = os.path.basename(str(image.get('name', ''))) if isinstance(image, dict) else ''
+            try:
+                data = base64.b64decode(image.get('data', ''), validate=True) if isinstance(image, dict) else b''
+            except (binascii.Error, TypeError):
+                uploads.append((name, None, "Image data is not valid base64"))
+                continue
+            upload_path = self._upload_path(name)
+            with open(upload_path, 'wb') as upload_file:
+                upload_file.write(data)
+            uploads.append((name, upload_path, None))
+        return uploads
+    
+    def analyze_batch(self, query):
+        session = self._session()
+        if self.headers.get('Content-Type', '').lower().startswith('multipart/form-data'):
+            uploads = self._receive_multipart_uploads()
+        else:
+            uploads = self._receive_json_uploads()
+        
+        try:
+            if not uploads:
+                raise ServiceError(400, "Expected a non-empty list of images")
+            results = [None] * len(uploads)
+            accepted = []
+            for index, (name, upload_path, error) in enumerate(uploads):
+                # A bad image fails on its own, the rest of the batch is still analyzed
+                if upload_path:
+                    try:
+                        image_validator.validate(upload_path)
+                    except ImageValidationError as e:
+                        error = str(e)
+                if error:
+                    results[index] = {"name": name, "error": error}
+                else:
+                    accepted.append((index, name, upload_path))
+            
+            if accepted:
+                analyzed = self.server.controller.save_and_analyze_images([path for _, _, path in accepted],
+                                                                          context=session.context)
+                for (index, name, _), (saved_path, result, analysis_details) in zip(accepted, analyzed):
+                    results[index] = {"name": name, "image_path": saved_path, "ripeness": result,
+                                      "analysis": analysis_details}
+        finally:
+            for _, upload_path, _ in uploads:
+                if upload_path:
+                    shutil.rmtree(os.path.dirname(upload_path), ignore_errors=True)
+        return 200, {"results": results}
+    
+    def history(self, query):
+        session = self._session()
+        try:
+            limit = max(1, min(int(query.get('limit', ['50'])[0]), 1000))
+            offset = max(0, int(query.get('offset', ['0'])[0]))
+        except ValueError:
+            raise ServiceError(400, "limit and offset must be integers")
+        
+        total, images = self.server.controller.get_user_images_page(limit, offset, context=session.context)
+        return 200, {
+            "total": total,
+            "images": [{"image_id": image_id, "image_path": image_path, "ripeness": result, "timestamp": timestamp}
+                       for image_id, image_path, result, timestamp in images],
+        }
+    
+    def search(self, query):
+        session = self._session()
+        text = query.get('q', [''])[0]
+        if not text.strip():
+            raise ServiceError(400, "q is required")
+        try:
+            limit = max(1, min(int(query.get('limit', ['50'])[0]), 1000))
+            offset = max(0, int(query.get('offset', ['0'])[0]))
+        except ValueError:
+            raise ServiceError(400, "limit and offset must be integers")
+        
+        total, rows = self.server.controller.search_user_images(text, limit, offset, context=session.context)
+        return 200, {
+            "total": total,
+            "images": [{"image_id": image_id, "image_path": image_path, "ripeness": result, "timestamp": timestamp,
+                        "snippet": snippet}
+                       for image_id, _, image_path, result, timestamp, snippet in rows],
+        }
+    
+    def fruits(self, query):
+        session = self._session()
+        try:
+            image_id = int(query.get('image_id', [''])[0])
+        except ValueError:
+            raise ServiceError(400, "image_id must be an integer")
+        
+        fruits = self.server.controller.get_image_fruits(image_id, context=session.context)
+        return 200, {
+            "image_id": image_id,
+            "fruits": [{"index": index, "box": list(box), "ripeness": ripeness, "confidence": confidence}
+                       for index, box, ripeness, confidence in fruits],
+        }
+    
+    def health(self, query):
+        return 200, self.server.get_stats()
+    
+    def log_message(self, format, *args):
+        # Per-request lines are too chatty for the application log
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+class FruitService(ThreadingHTTPServer):
+    """
+    Threaded HTTP server holding the controller, the sessions, the concurrency limit and the statistics
+    """
+    daemon_threads = True
+    
+    # (method, path) -> (name, handler method, counts against max_concurrent)
+    routes = {
+        ('POST', '/login'): ('login', ServiceRequestHandler.login, True),
+        ('POST', '/logout'): ('logout', ServiceRequestHandler.logout, False),
+        ('POST', '/analyze'): ('analyze', ServiceRequestHandler.analyze, True),
+        ('POST', '/analyze/batch'): ('analyze_batch', ServiceRequestHandler.analyze_batch, True),
+        ('POST', '/analyze/fruits'): ('analyze_fruits', ServiceRequestHandler.analyze_fruits, True),
+        ('GET', '/history'): ('history', ServiceRequestHandler.history, True),
+        ('GET', '/search'): ('search', ServiceRequestHandler.search, True),
+        ('GET', '/fruits'): ('fruits', ServiceRequestHandler.fruits, True),
+        ('GET', '/health'): ('health', ServiceRequestHandler.health, False),
+    }
+    
+    def __init__(self, address=('127.0.0.1', 8080), max_concurrent=None, queue_timeout=None, session_ttl=None,
+                 max_batch_images=None, upload_dir=UPLOAD_DIR):
+        """
+        Initialize the service
+        
+        Settings that are not given are read from the environment
+        (FRUIT_APP_SERVICE_MAX_CONCURRENT, FRUIT_APP_SERVICE_QUEUE_TIMEOUT,
+        FRUIT_APP_SERVICE_SESSION_TTL, FRUIT_APP_SERVICE_MAX_BATCH).
+        
+        Args:
+            address (tuple): (host, port) to listen on, port 0 picks a free port
+            max_concurrent (int, optional): Requests doing work at the same time
+            queue_timeout (float, optional): Seconds a request waits for a slot before a 503
+            session_ttl (float, optional): Seconds a session stays valid after its last use
+            max_batch_images (int, optional): Most images accepted by /analyze/batch
+            upload_dir (str): Where uploads are written while they are validated
+        """
+        ThreadingHTTPServer.__init__(self, address, ServiceRequestHandler)
+        self.max_concurrent = int(max_concurrent or os.getenv('FRUIT_APP_SERVICE_MAX_CONCURRENT', 8))
+        self.queue_timeout = float(queue_timeout if queue_timeout is not None
+                                   else os.getenv('FRUIT_APP_SERVICE_QUEUE_TIMEOUT', 5.0))
+        self.session_ttl = float(session_ttl or os.getenv('FRUIT_APP_SERVICE_SESSION_TTL', 3600))
+        self.max_batch_images = int(max_batch_images or os.getenv('FRUIT_APP_SERVICE_MAX_BATCH', 16))
+        self.max_upload_bytes = image_validator.max_bytes
+        self.upload_dir = upload_dir
+        self.controller = MainController()
+        
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.stats = {"requests": 0, "errors": 0, "rejected_busy": 0, "active": 0}
+        self.latency = {}
+    
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def acquire(self):
+        """
+        Wait for a free request slot
+        
+        Returns:
+            bool: False if none came free within queue_timeout
+        """
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.stats["rejected_busy"] += 1
+            return False
+        with self._lock:
+            self.stats["active"] += 1
+        return True
+    
+    def release(self):
+        with self._lock:
+            self.stats["active"] -= 1
+        self._slots.release()
+    
+    def create_session(self, context):
+        """
+        Store a logged in user's context under a new token
+        
+        Returns:
+            str: The bearer token of the session
+        """
+        token = secrets.token_urlsafe(24)
+        with self._lock:
+            self._expire_sessions()
+            self._sessions[token] = ServiceSession(context)
+        return token
+    
+    def get_session(self, token):
+        """
+        Get the session of a token, refreshing its expiry
+        
+        Returns:
+            ServiceSession: The session, or None if the token is unknown or expired
+        """
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None or time.monotonic() - session.last_used > self.session_ttl:
+                self._sessions.pop(token, None)
+                return None
+            session.last_used = time.monotonic()
+            return session
+    
+    def end_session(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+    
+    def end_user_sessions(self, user_id):
+        """
+        End every session of a user, for example once the account is deleted
+        """
+        with self._lock:
+            for token in [token for token, session in self._sessions.items()
+                          if session.context.user_id == user_id]:
+                del self._sessions[token]
+    
+    def _expire_sessions(self):
+        now = time.monotonic()
+        for token in [token for token, session in self._sessions.items()
+                      if now - session.last_used > self.session_ttl]:
+            del self._sessions[token]
+    
+    def record(self, path, status, elapsed_ms):
+        with self._lock:
+            self.stats["requests"] += 1
+            if status >= 500:
+                self.stats["errors"] += 1
+            self.latency.setdefault(path, Histogram()).record(elapsed_ms)
+    
+    def get_stats(self):
+        """
+        Get the request counters and per-endpoint latencies
+        
+        Returns:
+            dict: Counters, sessions, uptime, a latency summary per path, the analyzer queues,
+                  the fruit crop and the database writer's group commits
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["sessions"] = len(self._sessions)
+            stats["latency"] = {path: histogram.summary() for path, histogram in self.latency.items()}
+        stats["max_concurrent"] = self.max_concurrent
+        stats["uptime_seconds"] = round(time.monotonic() - self.started, 1)
+        stats["scheduler"] = analysis_scheduler.get_stats()
+        stats["roi"] = roi_cropper.get_stats()
+        writer = self.controller.image_controller.db.writer
+        if writer:
+            stats["db_writer"] = writer.get_stats()
+        return stats
+    
+    def start_in_thread(self):
+        """
+        Serve in a daemon thread, for use inside benchmarks
+        
+        Returns:
+            threading.Thread: The serving thread
+        """
+        thread = threading.Thread(target=self.serve_forever, name='fruit-service', daemon=True)
+        thread.start()
+        return thread
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the fruit ripeness analysis over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-concurrent', type=int, default=None, help="Requests doing work at the same time")
+    parser.add_argument('--queue-timeout', type=float, default=None, help="Seconds to wait for a slot before a 503")
+    args = parser.parse_args()
+    
+    service = FruitService((args.host, args.port), max_concurrent=args.max_concurrent,
+                           queue_timeout=args.queue_timeout)
+    logger.info("Fruit ripeness service listening on %s", service.url)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        service.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,90 +1,230 @@
 import os
 import random
 import shutil
+import tempfile
+from collections import Counter
 from datetime import datetime
-from app.models.database import Database
 from PIL import Image
+from app.models.database import Database, UserNotFoundError
+from utils.metrics import tracer
+from utils.analysis_scheduler import BATCH, INTERACTIVE, analysis_scheduler
+from utils.analyzer_backends import get_analyzer
+from utils.fruit_detector import LOCAL, MODEL, fruit_detector
+from utils.image_loader import decode_image, image_cache
+from utils.image_validator import image_validator
+
+def run_analysis(context, image_path, on_ripeness=None, on_text=None):
+    """
+    Analyze an image with the configured analyzer backend, without saving anything
+    
+    When callbacks are given the response is streamed, so the ripeness can
+    be shown before the full analysis has arrived. The callbacks run on the
+    calling thread.
+    
+    Args:
+        context (RequestContext): Who the analysis is for, and its priority
+        image_path (str): The path to the image file
+        on_ripeness (callable, optional): Called with the ripeness class once it is decided
+        on_text (callable, optional): Called with the analysis text received so far
+    
+    Returns:
+        dict: The analyzer's result, with at least 'ripeness' and 'full_analysis'
+    """
+    # Waits for an analyzer slot, callers ahead of it in a higher class go first
+    with tracer.span('image.analyze'), analysis_scheduler.slot(context.priority, context.user_id):
+        if on_ripeness or on_text:
+            return get_analyzer().analyze_streaming(image_path, on_ripeness, on_text)
+        return get_analyzer().analyze(image_path)
+
+def run_batch_analysis(context, image_paths):
+    """
+    Analyze several images in as few model calls as the analyzer backend allows, without saving anything
+    
+    A batch is never scheduled as interactive, an interactive context is lowered to batch.
+    
+    Args:
+        context (RequestContext): Who the analysis is for, and its priority
+        image_paths (list): The paths to the image files
+    
+    Returns:
+        list: The analyzer's result dict per image, in the same order
+    """
+    priority = BATCH if context.priority == INTERACTIVE else context.priority
+    with tracer.span('image.analyze_batch', images=len(image_paths)), \
+            analysis_scheduler.slot(priority, context.user_id, cost=len(image_paths)):
+        return get_analyzer().analyze_batch(image_paths)
+
+def run_fruit_analysis(context, image_path, classifier=None):
+    """
+    Find every fruit in an image and classify each one, without saving anything
+    
+    The fruits are found on the decode shared with the preview. The local
+    classifier votes on their pixels in one pass, the model classifier sends
+    a crop of every fruit in one batch call.
+    
+    Args:
+        context (RequestContext): Who the analysis is for, and its priority
+        image_path (str): The path to the image file
+        classifier (str, optional): 'local' or 'model', FRUIT_APP_FRUITS_CLASSIFIER ('local') if not given
+    
+    Returns:
+        dict: 'fruits' with a ((left, top, right, bottom), ripeness, confidence) tuple per fruit in image
+              pixels, 'counts' with the number of fruits per ripeness, 'ripeness' with the most common
+              ripeness and 'full_analysis' with a summary
+    """
+    classifier = classifier or os.getenv('FRUIT_APP_FRUITS_CLASSIFIER', LOCAL)
+    if classifier not in (LOCAL, MODEL):
+        raise ValueError(f"Unknown fruit classifier '{classifier}', use '{LOCAL}' or '{MODEL}'")
+    
+    with tracer.span('image.analyze_fruits', classifier=classifier) as span:
+        image = image_cache.get(image_path)
+        labels, boxes = fruit_detector.detect(image)
+        if classifier == LOCAL:
+            with tracer.span('fruits.classify_local'):
+                classes = fruit_detector.classify_local(image, labels, len(boxes))
+        elif boxes:
+            with tempfile.TemporaryDirectory() as crop_dir:
+                crop_paths = fruit_detector.crop_fruits(image, boxes, crop_dir)
+                analysis_results = run_batch_analysis(context, crop_paths)
+            classes = [(result.get('ripeness', 'Unknown'), result.get('confidence')) for result in analysis_results]
+        else:
+            classes = []
+        span.set(fruits=len(boxes))
+    
+    # Boxes in the pixels of the stored image rather than of the reduced decode
+    with Image.open(image_path) as original:
+        scale = max(original.size) / max(image.size)
+    fruits = [(tuple(round(value * scale) for value in box), ripeness, confidence)
+              for box, (ripeness, confidence) in zip(boxes, classes)]
+    
+    counts = Counter(ripeness for _, ripeness, _ in fruits)
+    if not fruits:
+        summary = "No fruit found in the image."
+    else:
+        listed = ', '.join(f"{count} {ripeness}" for ripeness, count in counts.most_common())
+        summary = f"{len(fruits)} fruits found: {listed}."
+    return {
+        "fruits": fruits,
+        "counts": dict(counts),
+        "ripeness": counts.most_common(1)[0][0] if fruits else 'Unknown',
+        "full_analysis": summary,
+    }
 
 class ImageController:
-    def __init__(self, user_id=None):
+    """
+    Saving, analyzing and looking up the images of users
+    
+    The controller holds no per-user state: every call takes the
+    RequestContext of the user it is made for, so one controller can be
+    shared by all threads and users.
+    """
+    
+    def __init__(self, image_dir=os.path.join('data', 'images')):
         """
         Initialize the image controller
         
         Args:
-            user_id (int, optional): The ID of the current user
+            image_dir (str): Where the images of all users are stored
         """
         self.db = Database()
-        self.user_id = user_id
-        self.image_dir = os.path.join('data', 'images')
+        self.image_dir = image_dir
         os.makedirs(self.image_dir, exist_ok=True)
     
-    def set_user_id(self, user_id):
-        """
-        Set the current user ID
-        
-        Args:
-            user_id (int): The ID of the current user
-        """
-        self.user_id = user_id
-    
-    def save_image(self, image_path):
+    def save_image(self, context, image_path):
         """
         Save an image to the application's image directory
         
         Args:
+            context (RequestContext): The user the image is saved for
             image_path (str): The path to the image file
             
         Returns:
             str: The path where the image was saved
+            
+        Raises:
+            ImageValidationError: If the file is not an acceptable image
+            UserNotFoundError: If the user was deleted, for example while still logged in
         """
-        if not self.user_id:
-            raise ValueError("User ID is not set")
+        # Check the headers before copying anything
+        with tracer.span('image.validate'):
+            image_validator.validate(image_path)
+        if not self.db.user_exists(context.user_id):
+            raise UserNotFoundError(context.user_id)
         
         # Create user directory if it doesn't exist
-        user_dir = os.path.join(self.image_dir, str(self.user_id))
+        user_dir = os.path.join(self.image_dir, str(context.user_id))
         os.makedirs(user_dir, exist_ok=True)
         
         # Generate a unique filename
-        filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.path.basename(image_path)}"
+        # Microseconds keep files with the same name from overwriting each other during bursts
+        filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{os.path.basename(image_path)}"
         destination = os.path.join(user_dir, filename)
         
-        # Copy the image to the destination
-        shutil.copy2(image_path, destination)
+        # Copy the image to the destination. Its modification time is the time of the copy,
+        # so the storage reconciler sees a fresh file and leaves it alone until its row is written.
+        with tracer.span('image.save_copy') as span:
+            shutil.copy(image_path, destination)
+            span.set(bytes=os.path.getsize(destination))
+        
+        # The copy has the same pixels, let the analysis reuse the preview's decode
+        image_cache.alias(destination, image_path)
         
         return destination
     
-    def analyze_image(self, image_path):
+    def analyze_image(self, context, image_path, on_ripeness=None, on_text=None, job_id=None, fallback=True):
         """
-        Analyze the image to determine fruit ripeness using Google Gemini API
+        Analyze the image to determine fruit ripeness and save the result
         
         Args:
+            context (RequestContext): The user the result is saved for, and the priority of the analysis
             image_path (str): The path to the image file
+            on_ripeness (callable, optional): Called with the ripeness class once it is decided
+            on_text (callable, optional): Called with the analysis text received so far
+            job_id (int, optional): The analysis job, so a repeated attempt doesn't save a second row
+            fallback (bool): Save a random result when the analysis fails. Unattended callers pass
+                             False to fail their job and have it retried instead.
             
         Returns:
             str: The ripeness classification result
             dict: Additional analysis details (if available)
+        
+        Raises:
+            RuntimeError: If the analysis fails and fallback is False
         """
+        if not fallback:
+            analysis_result = run_analysis(context, image_path, on_ripeness, on_text)
+            result = analysis_result.get('ripeness', 'Unknown')
+            if result == 'Unknown':
+                raise RuntimeError(analysis_result.get('full_analysis') or "Analysis returned no result")
+            with tracer.span('db.save_image_data'):
+                self.db.save_image_data(context.user_id, image_path, result, analysis_result.get('full_analysis'),
+                                        job_id=job_id)
+            return result, analysis_result.get('full_analysis', None)
+        
         try:
-            # Import the Gemini API utility
-            from utils.gemini_api import analyze_fruit_image
-            
-            # Use Gemini API to analyze the image
-            analysis_result = analyze_fruit_image(image_path)
+            # Use the configured backend (Gemini by default) to analyze the image
+            analysis_result = run_analysis(context, image_path, on_ripeness, on_text)
             
             # Get the ripeness classification
             result = analysis_result.get('ripeness', 'Unknown')
+            analysis = analysis_result.get('full_analysis')
             
             # Fallback to random selection if API fails
             if result == 'Unknown':
-                print("Gemini API analysis failed, falling back to random selection")
+                print("Analysis failed, falling back to random selection")
                 results = ["Ripe", "Unripe", "Overripe"]
                 result = random.choice(results)
+                # The error message is not worth searching
+                analysis = None
             
-            # Save the result to the database
-            if self.user_id:
-                self.db.save_image_data(self.user_id, image_path, result)
+            # Save the result and the analysis text to the database
+            with tracer.span('db.save_image_data'):
+                self.db.save_image_data(context.user_id, image_path, result, analysis, job_id=job_id)
             
             return result, analysis_result.get('full_analysis', None)
+        except UserNotFoundError:
+            # Nothing can be saved for a deleted user, not even a fallback
+            raise
         except Exception as e:
             print(f"Error in analyze_image: {e}")
             # Fallback to random selection if anything goes wrong
@@ -92,35 +232,142 @@ class ImageController:
             result = random.choice(results)
             
             # Save the result to the database
-            if self.user_id:
-                self.db.save_image_data(self.user_id, image_path, result)
+            self.db.save_image_data(context.user_id, image_path, result, job_id=job_id)
             
             return result, None
     
-    def get_user_images(self):
+    def analyze_images(self, context, image_paths, job_ids=None):
         """
-        Get all images for the current user
+        Analyze several images in as few model calls as the analyzer backend allows and save the results
         
+        Args:
+            context (RequestContext): The user the results are saved for, see run_batch_analysis() for the priority
+            image_paths (list): The paths to the image files
+            job_ids (list, optional): The analysis job of each image, see analyze_image()
+            
+        Returns:
+            list: A (result, analysis details) tuple per image, in the same order
+        """
+        try:
+            analysis_results = run_batch_analysis(context, image_paths)
+        except Exception as e:
+            print(f"Error in analyze_images: {e}")
+            analysis_results = [{} for _ in image_paths]
+        
+        results = []
+        job_ids = job_ids or [None] * len(image_paths)
+        for image_path, job_id, analysis_result in zip(image_paths, job_ids, analysis_results):
+            result = analysis_result.get('ripeness', 'Unknown')
+            analysis = analysis_result.get('full_analysis')
+            
+            # Fallback to random selection if API fails, as for a single image
+            if result == 'Unknown':
+                print("Analysis failed, falling back to random selection")
+                result = random.choice(["Ripe", "Unripe", "Overripe"])
+                analysis = None
+            
+            # Save the result and the analysis text to the database
+            with tracer.span('db.save_image_data'):
+                self.db.save_image_data(context.user_id, image_path, result, analysis, job_id=job_id)
+            results.append((result, analysis_result.get('full_analysis', None)))
+        return results
+    
+    def analyze_fruits(self, context, image_path, classifier=None, job_id=None):
+        """
+        Find and classify every fruit in an image and save the image with its fruits
+        
+        The image's result is the most common ripeness, its analysis a summary of the counts.
+        
+        Args:
+            context (RequestContext): The user the result is saved for, and the priority of the analysis
+            image_path (str): The path to the image file
+            classifier (str, optional): See run_fruit_analysis()
+            job_id (int, optional): The analysis job, see analyze_image()
+            
+        Returns:
+            dict: The result of run_fruit_analysis() with the 'image_id' of the saved row
+        """
+        try:
+            analysis_result = run_fruit_analysis(context, image_path, classifier)
+        except Exception as e:
+            print(f"Error in analyze_fruits: {e}")
+            analysis_result = {"fruits": [], "counts": {}, "ripeness": 'Unknown', "full_analysis": None}
+        
+        # Save the image and one row per fruit in one transaction
+        with tracer.span('db.save_image_data', fruits=len(analysis_result["fruits"])):
+            analysis_result["image_id"] = self.db.save_image_data(
+                context.user_id, image_path, analysis_result["ripeness"], analysis_result["full_analysis"],
+                fruits=analysis_result["fruits"], job_id=job_id)
+        return analysis_result
+    
+    def get_image_fruits(self, context, image_id):
+        """
+        Get the fruits found in one of a user's images
+        
+        Args:
+            context (RequestContext): The user
+            image_id (int): The ID of the image
+            
+        Returns:
+            list: (fruit_index, box, ripeness, confidence) tuples, empty if the image is not the user's
+        """
+        return self.db.get_image_fruits(image_id, context.user_id)
+    
+    def get_user_images(self, context):
+        """
+        Get all images of a user
+        
+        Args:
+            context (RequestContext): The user
+            
         Returns:
             list: A list of tuples containing image data
         """
-        if not self.user_id:
-            raise ValueError("User ID is not set")
+        return self.db.get_user_images(context.user_id)
+    
+    def get_user_images_page(self, context, limit=50, offset=0):
+        """
+        Get one page of a user's images, newest first
         
-        return self.db.get_user_images(self.user_id)
+        Args:
+            context (RequestContext): The user
+            limit (int): The page size
+            offset (int): How many images to skip
+            
+        Returns:
+            tuple: (total, rows), see Database.get_user_images_page
+        """
+        with tracer.span('db.get_user_images_page'):
+            return self.db.get_user_images_page(context.user_id, limit, offset)
+    
+    def search_images(self, context, text, limit=50, offset=0):
+        """
+        Search the analysis text of a user's images
+        
+        Args:
+            context (RequestContext): The user
+            text (str): The words to search for
+            limit (int): The page size
+            offset (int): How many matches to skip
+            
+        Returns:
+            tuple: (total, rows), see Database.search_images
+        """
+        with tracer.span('db.search_images'):
+            return self.db.search_images(text, context.user_id, limit, offset)
     
     def open_image(self, image_path):
         """
-        Open an image using PIL
+        Decode an image at full resolution, without keeping the file open
         
         Args:
             image_path (str): The path to the image file
             
         Returns:
-            PIL.Image: The opened image
+            PIL.Image: The decoded RGB image
         """
         try:
-            return Image.open(image_path)
+            return decode_image(image_path)
         except Exception as e:
             print(f"Error opening image: {e}")
             return None
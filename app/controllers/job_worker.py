@@ -0,0 +1,142 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+import uuid
+from app.models.database import Database
+from app.models.job_queue import JobQueue
+from utils.analysis_scheduler import BATCH, PRIORITIES, analysis_scheduler
+from utils.analyzer_backends import get_analyzer
+from utils.logger import logger
+
+def analyze_with_default_backend(image_path):
+    """
+    Default analyzer used by the worker, the backend selected by FRUIT_APP_ANALYZER
+    
+    Args:
+        image_path (str): Path to the fruit image
+    
+    Returns:
+        dict: A dictionary containing ripeness status and detailed analysis
+    """
+    return get_analyzer().analyze(image_path)
+
+class JobWorker:
+    def __init__(self, queue=None, db=None, analyzer=None, worker_id=None, poll_interval=1.0, priority=BATCH):
+        """
+        Initialize a worker that drains the analysis job queue
+        
+        Args:
+            queue (JobQueue, optional): The job queue to drain
+            db (Database, optional): The database the results are written to
+            analyzer (callable, optional): A function taking an image path and returning
+                                           a dict with 'ripeness' and 'full_analysis'
+            worker_id (str, optional): A unique identifier of this worker
+            poll_interval (float): Seconds to wait when the queue is empty
+            priority (str): The scheduling class of the analyses, 'background' for re-scoring runs
+        """
+        self.queue = queue or JobQueue()
+        self.db = db or Database()
+        self.analyzer = analyzer or analyze_with_default_backend
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.poll_interval = poll_interval
+        self.priority = priority
+        self.processed = 0
+        self.failed = 0
+    
+    def process_one(self):
+        """
+        Lease and process a single job
+        
+        Returns:
+            bool: True if a job was leased, False if the queue was empty
+        """
+        job = self.queue.lease(self.worker_id)
+        if job is None:
+            return False
+        
+        job_id, user_id, image_path, attempts = job
+        try:
+            with analysis_scheduler.slot(self.priority, user_id):
+                analysis_result = self.analyzer(image_path)
+            result = analysis_result.get('ripeness', 'Unknown')
+            
+            # Unlike the interactive path, the worker retries instead of guessing
+            if result == 'Unknown':
+                raise RuntimeError(analysis_result.get('full_analysis') or "Analysis returned no result")
+            
+            # Only write the result if we still hold the lease. Should the lease be lost after this
+            # check, the job's next attempt finds the saved row instead of adding a second one.
+            if self.queue.extend_lease(job_id, self.worker_id):
+                self.db.save_image_data(user_id, image_path, result, analysis_result.get('full_analysis'),
+                                        job_id=job_id)
+                self.queue.complete(job_id, self.worker_id, result)
+                self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.warning("Job %s attempt %s failed: %s", job_id, attempts, e)
+            try:
+                self.queue.fail(job_id, self.worker_id, e)
+            except Exception as fail_error:
+                # The lease expires and another attempt picks the job up
+                logger.error("Could not record the failure of job %s: %s", job_id, fail_error)
+        return True
+    
+    def run(self, stop_event=None, drain=False):
+        """
+        Process jobs until stopped
+        
+        Args:
+            stop_event (threading.Event, optional): Set this event to stop the worker
+            drain (bool): Return as soon as the queue has no available jobs
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                leased = self.process_one()
+            except Exception as e:
+                # Leasing failed, for example while the database was locked for too long
+                logger.error("Could not lease a job: %s", e)
+                stop_event.wait(self.poll_interval)
+                continue
+            if not leased:
+                if drain:
+                    return
+                stop_event.wait(self.poll_interval)
+
+def _run_worker_process(db_path, drain, priority):
+    """
+    Entry point of a worker process started by main()
+    """
+    worker = JobWorker(queue=JobQueue(db_path), db=Database(db_path), priority=priority)
+    worker.run(drain=drain)
+
+def main():
+    """
+    Run one or more worker processes from the command line
+    """
+    parser = argparse.ArgumentParser(description="Drain the fruit analysis job queue")
+    parser.add_argument('--db', default='data/fruit_app.db', help="Path to the SQLite database")
+    parser.add_argument('--processes', type=int, default=1, help="Number of worker processes")
+    parser.add_argument('--drain', action='store_true', help="Exit once the queue is empty")
+    parser.add_argument('--priority', choices=PRIORITIES, default=BATCH,
+                        help="Scheduling class of the analyses within each process")
+    args = parser.parse_args()
+    
+    processes = [
+        multiprocessing.Process(target=_run_worker_process, args=(args.db, args.drain, args.priority))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,69 @@
+import os
+import threading
 from app.controllers.auth_controller import AuthController
 from app.controllers.image_controller import ImageController
+from app.controllers.request_context import RequestContext
+from app.controllers.user_deleter import UserDeleter
+from app.controllers.video_intake import VideoIntake
+from app.models.job_queue import JobQueue
+from utils.analysis_scheduler import BATCH
+from utils.password_hasher import password_hasher
+from utils.metrics import tracer
 
 class MainController:
+    """
+    Entry point of the views and the service into the controllers
+    
+    The window logs one user in and the calls act for them. Calls that take
+    a context act for that user instead, which lets a single controller serve
+    many users from many threads, as the HTTP service does.
+    """
+    
     def __init__(self):
         """
         Initialize the main controller
         """
         self.auth_controller = AuthController()
         self.image_controller = ImageController()
-        self.current_user_id = None
-        self.current_username = None
+        self.job_queue = JobQueue()
+        self.worker_id = f"gui:{os.getpid()}"
+        self.user_deleter = UserDeleter()
+        # The user logged in through the window, replaced as a whole so readers never see half of it
+        self.context = None
+        
+        # In-process cache of user metadata, invalidated explicitly on every change
+        self._user_cache = {}
+        self._all_users = None
+        # Bumped by every invalidation, a read that raced with one doesn't fill the cache
+        self._cache_generation = 0
+        self._cache_lock = threading.Lock()
+        self.cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+    
+    @property
+    def current_user_id(self):
+        """
+        The ID of the user logged in through the window, or None
+        """
+        return self.context.user_id if self.context else None
+    
+    @property
+    def current_username(self):
+        """
+        The username of the user logged in through the window, or None
+        """
+        return self.context.username if self.context else None
+    
+    def _context(self, context):
+        """
+        Get the context a call acts for, the logged in user's if none is given
+        
+        Raises:
+            ValueError: If no context is given and nobody is logged in
+        """
+        context = context or self.context
+        if context is None:
+            raise ValueError("User is not logged in")
+        return context
     
     def register_user(self, username, password):
         """
@@ -42,6 +96,29 @@ class MainController:
         """
         return self.auth_controller.create_admin_user(admin_key, username, password)
     
+    def authenticate(self, username, password):
+        """
+        Check a user's credentials without logging them in to this controller
+        
+        Args:
+            username (str): The username to authenticate
+            password (str): The password to authenticate
+            
+        Returns:
+            RequestContext or None: The context to pass to later calls, None if authentication failed
+        """
+        with self._cache_lock:
+            generation = self._cache_generation
+        user_id = self.auth_controller.login(username, password)
+        if not user_id:
+            return None
+        
+        # Login already told us the username, no need to look it up later
+        with self._cache_lock:
+            if self._cache_generation == generation:
+                self._user_cache[user_id] = (user_id, username)
+        return RequestContext(user_id, username)
+    
     def login_user(self, username, password):
         """
         Authenticate a user
@@ -53,11 +130,9 @@ class MainController:
         Returns:
             bool: True if authentication was successful, False otherwise
         """
-        user_id = self.auth_controller.login(username, password)
-        if user_id:
-            self.current_user_id = user_id
-            self.current_username = username
-            self.image_controller.set_user_id(user_id)
+        context = self.authenticate(username, password)
+        if context:
+            self.context = context
             return True
         return False
     
@@ -65,16 +140,17 @@ class MainController:
         """
         Log out the current user
         """
-        self.current_user_id = None
-        self.current_username = None
-        self.image_controller.set_user_id(None)
+        self.context = None
     
-    def save_and_analyze_image(self, image_path):
+    def save_and_analyze_image(self, image_path, on_ripeness=None, on_text=None, context=None):
         """
         Save and analyze an image
         
         Args:
             image_path (str): The path to the image file
+            on_ripeness (callable, optional): Called with the ripeness class as soon as it is decided
+            on_text (callable, optional): Called with the analysis text received so far
+            context (RequestContext, optional): The user to act for, the logged in user if not given
             
         Returns:
             tuple: (saved_path, result, analysis_details) where:
@@ -82,25 +158,154 @@ class MainController:
                   - result is the ripeness classification result
                   - analysis_details is the detailed analysis from the AI (if available)
         """
-        if not self.current_user_id:
-            raise ValueError("User is not logged in")
+        context = self._context(context)
         
-        saved_path = self.image_controller.save_image(image_path)
-        result, analysis_details = self.image_controller.analyze_image(saved_path)
+        with tracer.span('pipeline.save_and_analyze') as span:
+            saved_path = self.image_controller.save_image(context, image_path)
+            
+            # Record the job before analyzing, leased to this process. If the application
+            # is closed mid-analysis the lease expires and a background worker resumes it.
+            with tracer.span('job.enqueue'):
+                job_id = self.job_queue.enqueue(context.user_id, saved_path, worker_id=self.worker_id)
+            result, analysis_details = self.image_controller.analyze_image(context, saved_path, on_ripeness, on_text,
+                                                                          job_id=job_id)
+            with tracer.span('job.complete'):
+                self.job_queue.complete(job_id, self.worker_id, result)
+            span.set(result=result)
         
         return saved_path, result, analysis_details
     
-    def get_user_images(self):
+    def save_and_analyze_images(self, image_paths, context=None):
+        """
+        Save and analyze several images, sharing model calls where the backend supports it
+        
+        Args:
+            image_paths (list): The paths to the image files
+            context (RequestContext, optional): The user to act for, the logged in user if not given
+            
+        Returns:
+            list: A (saved_path, result, analysis_details) tuple per image, in the same order
+        """
+        context = self._context(context)
+        
+        with tracer.span('pipeline.save_and_analyze_batch', images=len(image_paths)):
+            saved_paths = [self.image_controller.save_image(context, image_path) for image_path in image_paths]
+            with tracer.span('job.enqueue'):
+                job_ids = [self.job_queue.enqueue(context.user_id, saved_path, worker_id=self.worker_id)
+                           for saved_path in saved_paths]
+            results = self.image_controller.analyze_images(context, saved_paths, job_ids)
+            with tracer.span('job.complete'):
+                for job_id, (result, _) in zip(job_ids, results):
+                    self.job_queue.complete(job_id, self.worker_id, result)
+        
+        return [(saved_path, result, analysis_details)
+                for saved_path, (result, analysis_details) in zip(saved_paths, results)]
+    
+    def save_and_analyze_fruits(self, image_path, classifier=None, context=None):
+        """
+        Save an image holding several fruits and classify each of them
+        
+        Args:
+            image_path (str): The path to the image file
+            classifier (str, optional): 'local' or 'model', see run_fruit_analysis()
+            context (RequestContext, optional): The user to act for, the logged in user if not given
+            
+        Returns:
+            tuple: (saved_path, analysis) where analysis is the dict of ImageController.analyze_fruits
+                   with the fruits, their counts per ripeness, the most common ripeness and the image_id
+        """
+        context = self._context(context)
+        
+        with tracer.span('pipeline.save_and_analyze_fruits') as span:
+            saved_path = self.image_controller.save_image(context, image_path)
+            with tracer.span('job.enqueue'):
+                job_id = self.job_queue.enqueue(context.user_id, saved_path, worker_id=self.worker_id)
+            analysis = self.image_controller.analyze_fruits(context, saved_path, classifier, job_id)
+            with tracer.span('job.complete'):
+                self.job_queue.complete(job_id, self.worker_id, analysis["ripeness"])
+            span.set(fruits=len(analysis["fruits"]))
+        
+        return saved_path, analysis
+    
+    def analyze_video(self, source, on_result=None, stop_event=None, context=None):
+        """
+        Analyze every fruit passing through a video file or a camera's picture, until it ends or is stopped
+        
+        Args:
+            source (str or int): A video file, a stream URL or the number of a local camera
+            on_result (callable, optional): Called on a worker thread with (frame_index, saved_path, result)
+            stop_event (threading.Event, optional): Set this event to stop a camera
+            context (RequestContext, optional): The user to act for, the logged in user if not given
+            
+        Returns:
+            dict: The intake statistics, see VideoIntake.get_stats()
+            
+        Raises:
+            ValueError: If no frame could be read from the source
+        """
+        # A video brings many fruits at once, it must not hold up the Analyze button
+        context = self._context(context)._replace(priority=BATCH)
+        intake = VideoIntake(source, context, on_result=on_result)
+        with tracer.span('pipeline.analyze_video'):
+            intake.run(stop_event, stats_interval=0)
+        stats = intake.get_stats()
+        if stats["decoded"] == 0:
+            raise ValueError(f"Could not read any frames from {source}")
+        return stats
+    
+    def get_image_fruits(self, image_id, context=None):
+        """
+        Get the fruits found in one of the current user's images
+        
+        Args:
+            image_id (int): The ID of the image
+            context (RequestContext, optional): The user to act for, the logged in user if not given
+            
+        Returns:
+            list: (fruit_index, (left, top, right, bottom), ripeness, confidence) tuples in fruit order
+        """
+        return self.image_controller.get_image_fruits(self._context(context), image_id)
+    
+    def get_user_images(self, context=None):
         """
         Get all images for the current user
         
+        Args:
+            context (RequestContext, optional): The user to act for, the logged in user if not given
+            
         Returns:
             list: A list of tuples containing image data
         """
-        if not self.current_user_id:
-            raise ValueError("User is not logged in")
+        return self.image_controller.get_user_images(self._context(context))
+    
+    def get_user_images_page(self, limit=50, offset=0, context=None):
+        """
+        Get one page of the current user's images, newest first
+        
+        Args:
+            limit (int): The page size
+            offset (int): How many images to skip
+            context (RequestContext, optional): The user to act for, the logged in user if not given
+            
+        Returns:
+            tuple: (total, rows) with rows of (image_id, image_path, result, timestamp)
+        """
+        return self.image_controller.get_user_images_page(self._context(context), limit, offset)
+    
+    def search_user_images(self, text, limit=50, offset=0, context=None):
+        """
+        Search the analyses of the current user's images, best matches first
         
-        return self.image_controller.get_user_images()
+        Args:
+            text (str): The words to search for
+            limit (int): The page size
+            offset (int): How many matches to skip
+            context (RequestContext, optional): The user to act for, the logged in user if not given
+            
+        Returns:
+            tuple: (total, rows) with rows of (image_id, user_id, image_path, result, timestamp, snippet)
+        """
+        return self.image_controller.search_images(self._context(context), text, limit, offset)
     
     def is_logged_in(self):
         """
@@ -109,7 +314,7 @@ class MainController:
         Returns:
             bool: True if a user is logged in, False otherwise
         """
-        return self.current_user_id is not None
+        return self.context is not None
     
     def get_current_username(self):
         """
@@ -119,3 +324,164 @@ class MainController:
             str: The username of the current user, or None if no user is logged in
         """
         return self.current_username
+    
+    def is_admin(self, user_id):
+        """
+        Check if a user has the admin role
+        
+        Args:
+            user_id (int): The ID of the user
+            
+        Returns:
+            bool: True if the user is an admin, False otherwise
+        """
+        user = self.get_user(user_id)
+        return bool(user) and user[1].lower() == 'admin'
+    
+    def is_current_user_admin(self):
+        """
+        Check if the currently logged in user has the admin role
+        
+        Returns:
+            bool: True if the current user is an admin, False otherwise
+        """
+        context = self.context
+        return context is not None and self.is_admin(context.user_id)
+    
+    def get_user(self, user_id):
+        """
+        Get a user's metadata, from the cache if possible
+        
+        Args:
+            user_id (int): The ID of the user
+            
+        Returns:
+            tuple or None: (user_id, username) or None if the user doesn't exist
+        """
+        user_id = int(user_id)
+        with self._cache_lock:
+            if user_id in self._user_cache:
+                self.cache_stats["hits"] += 1
+                return self._user_cache[user_id]
+            self.cache_stats["misses"] += 1
+            generation = self._cache_generation
+        
+        user = self.auth_controller.db.get_user(user_id)
+        if user:
+            with self._cache_lock:
+                if self._cache_generation == generation:
+                    self._user_cache[user_id] = user
+        return user
+    
+    def get_all_users(self):
+        """
+        Get the metadata of all users, from the cache if possible
+        
+        Returns:
+            list: A list of (user_id, username) tuples
+        """
+        with self._cache_lock:
+            if self._all_users is not None:
+                self.cache_stats["hits"] += 1
+                return list(self._all_users)
+            self.cache_stats["misses"] += 1
+            generation = self._cache_generation
+        
+        users = self.auth_controller.db.get_all_users()
+        with self._cache_lock:
+            if self._cache_generation == generation:
+                self._all_users = users
+                self._user_cache.update((user[0], user) for user in users)
+        return list(users)
+    
+    def invalidate_user_cache(self, user_id=None):
+        """
+        Drop cached user metadata
+        
+        Args:
+            user_id (int, optional): Only drop this user, plus the list of all users.
+                                     If not given, the whole cache is cleared.
+        """
+        with self._cache_lock:
+            if user_id is None:
+                self._user_cache.clear()
+            else:
+                self._user_cache.pop(int(user_id), None)
+            self._all_users = None
+            self._cache_generation += 1
+            self.cache_stats["invalidations"] += 1
+    
+    def add_user(self, username, password):
+        """
+        Add a new user with admin privileges
+        
+        Returns:
+            tuple: (success, error_message) as returned by register_user
+        """
+        success, error_message = self.auth_controller.register(username, password, is_admin_creation=True)
+        if success:
+            # A new user only makes the list of all users stale
+            with self._cache_lock:
+                self._all_users = None
+                self._cache_generation += 1
+                self.cache_stats["invalidations"] += 1
+        return success, error_message
+    
+    def update_user(self, user_id, username, password=None):
+        """
+        Update a user's username and, optionally, password
+        
+        Args:
+            user_id (int): The ID of the user
+            username (str): The new username
+            password (str, optional): The new password
+        """
+        password_hash = password_hasher.hash(password) if password else None
+        self.auth_controller.db.update_user(user_id, username, password_hash)
+        self.invalidate_user_cache(user_id)
+        
+        # Keep the session in sync if the admin renamed themselves
+        context = self.context
+        if context and context.user_id == int(user_id):
+            self.context = context._replace(username=username)
+    
+    def delete_user(self, user_id):
+        """
+        Delete a user now and their images and files in the background
+        
+        Args:
+            user_id (int): The ID of the user
+            
+        Returns:
+            int or None: The ID of the deletion job, see get_deletion_progress(), None if the user doesn't exist
+        """
+        deletion_id = self.user_deleter.delete_user(user_id)
+        self.invalidate_user_cache(user_id)
+        return deletion_id
+    
+    def get_deletion_progress(self, deletion_id):
+        """
+        Get the progress of a background user deletion
+        
+        Returns:
+            dict or None: username, status, total_images, deleted_images, deleted_files and last_error
+        """
+        return self.user_deleter.get_progress(deletion_id)
+    
+    def resume_user_deletions(self):
+        """
+        Continue user deletions that were interrupted, for example by closing the application
+        """
+        self.user_deleter.resume()
+    
+    def get_cache_stats(self):
+        """
+        Get the user cache counters
+        
+        Returns:
+            dict: hits, misses and invalidations, where every hit is a database query avoided
+        """
+        with self._cache_lock:
+            stats = dict(self.cache_stats)
+        stats["queries_avoided"] = stats["hits"]
+        return stats
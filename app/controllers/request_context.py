@@ -0,0 +1,23 @@
+from collections import namedtuple
+from utils.analysis_scheduler import INTERACTIVE
+
+class RequestContext(namedtuple('RequestContext', ['user_id', 'username', 'priority'])):
+    """
+    Who a controller call is made for, passed along with every call
+    
+    The controllers keep no per-user state, so one controller serves any
+    number of users and threads at the same time; everything that differs
+    between calls travels in the context. A context is immutable, use
+    _replace() to derive one, for example with another priority.
+    
+    Attributes:
+        user_id (int): The ID of the logged in user
+        username (str or None): Their username, if known
+        priority (str): The scheduling class of the analyses, see utils.analysis_scheduler
+    """
+    __slots__ = ()
+    
+    def __new__(cls, user_id, username=None, priority=INTERACTIVE):
+        if not user_id:
+            raise ValueError("User is not logged in")
+        return super().__new__(cls, int(user_id), username, priority)
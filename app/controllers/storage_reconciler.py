@@ -0,0 +1,327 @@
+import argparse
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from utils.logger import logger
+from utils.metrics import tracer
+
+# Orphaned files are moved here, outside the image store, unless they are deleted
+QUARANTINE_DIR = os.path.join('data', 'quarantine')
+
+class StorageReconciler:
+    """
+    Reconciles the image store on disk with the images table
+    
+    The image paths referenced by the database (and by unfinished analysis
+    jobs) are loaded into an in-memory index, then the image directory is
+    walked with os.scandir. Files nobody references are quarantined or
+    deleted in batches, with a pause between batches so the disk is not kept
+    busy; rows whose file no longer exists are reported. Files younger than
+    min_age_seconds are left alone, as save_image copies a file before its
+    row is written, and right before a batch is handled the rows and jobs
+    written since the index was loaded are checked for its files.
+    """
+    QUARANTINE = 'quarantine'
+    DELETE = 'delete'
+    REPORT = 'report'
+    
+    def __init__(self, db_path='data/fruit_app.db', image_dir=os.path.join('data', 'images'),
+                 quarantine_dir=QUARANTINE_DIR, action=QUARANTINE, batch_size=500, batch_pause=0.05,
+                 min_age_seconds=3600, missing_limit=1000):
+        """
+        Initialize the reconciler
+        
+        Args:
+            db_path (str): Path to the SQLite database file
+            image_dir (str): The image store to reconcile
+            quarantine_dir (str): Where orphaned files are moved by the quarantine action
+            action (str): 'quarantine', 'delete', or 'report' to only count the orphans
+            batch_size (int): Orphans handled before each pause
+            batch_pause (float): Seconds to sleep between batches
+            min_age_seconds (float): Files modified or created more recently than this are never touched
+            missing_limit (int): Most rows with a missing file listed in the report
+        """
+        if action not in (self.QUARANTINE, self.DELETE, self.REPORT):
+            raise ValueError(f"Unknown action: {action}")
+        self.db_path = db_path
+        self.image_dir = os.path.abspath(image_dir)
+        self.quarantine_dir = quarantine_dir
+        self.action = action
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.min_age_seconds = min_age_seconds
+        self.missing_limit = missing_limit
+        
+        self._prefix = self.image_dir + os.sep
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.progress = {}
+        self.report = None
+        # The newest image and job when the index was loaded, later rows are looked up per batch
+        self._last_image_id = 0
+        self._last_job_id = 0
+    
+    def _key(self, image_path):
+        """
+        Index key of a stored path, relative to the image directory when it is inside it
+        """
+        path = os.path.normcase(os.path.abspath(image_path))
+        return path[len(self._prefix):] if path.startswith(self._prefix) else path
+    
+    def _update(self, **values):
+        with self._lock:
+            self.progress.update(values)
+    
+    def build_index(self, conn):
+        """
+        Load every referenced image path
+        
+        Returns:
+            set: The index keys of the referenced paths
+        """
+        index = set()
+        # Both ids are AUTOINCREMENT, so a row written later always has a higher one
+        self._last_image_id = conn.execute('SELECT COALESCE(MAX(image_id), 0) FROM images').fetchone()[0]
+        for image_path, in conn.execute('SELECT image_path FROM images WHERE image_id <= ?', (self._last_image_id,)):
+            index.add(self._key(image_path))
+        # A file saved for an analysis that has not finished yet has no images row
+        if self._has_jobs(conn):
+            self._last_job_id = conn.execute('SELECT COALESCE(MAX(job_id), 0) FROM jobs').fetchone()[0]
+            for image_path, in conn.execute("SELECT image_path FROM jobs WHERE status IN ('pending', 'leased') "
+                                            "AND job_id <= ?", (self._last_job_id,)):
+                index.add(self._key(image_path))
+        return index
+    
+    def _has_jobs(self, conn):
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'jobs'").fetchone() is not None
+    
+    def referenced_since_index(self):
+        """
+        Load the image paths referenced by rows and jobs written after build_index()
+        
+        Returns:
+            set: Their index keys
+        """
+        referenced = set()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            for image_path, in conn.execute('SELECT image_path FROM images WHERE image_id > ?',
+                                            (self._last_image_id,)):
+                referenced.add(self._key(image_path))
+            if self._has_jobs(conn):
+                for image_path, in conn.execute('SELECT image_path FROM jobs WHERE job_id > ?', (self._last_job_id,)):
+                    referenced.add(self._key(image_path))
+        finally:
+            conn.close()
+        return referenced
+    
+    def _walk(self, directory, relative):
+        """
+        Yield (index key, DirEntry) for every file below a directory
+        
+        Hidden files and directories are skipped. The application never saves images under
+        such names, and some are part of the checkout, such as data/images/.gitkeep.
+        """
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    key = os.path.normcase(relative + entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from self._walk(entry.path, key + os.sep)
+                    else:
+                        yield key, entry
+        except FileNotFoundError:
+            # Removed while walking, for example a user directory being deleted
+            return
+    
+    def _dispose(self, batch):
+        """
+        Quarantine or delete a batch of orphaned files
+        
+        Returns:
+            tuple: (files handled, files that failed)
+        """
+        handled, failed = 0, 0
+        for key, path, _ in batch:
+            try:
+                if self.action == self.DELETE:
+                    os.remove(path)
+                else:
+                    destination = os.path.join(self.quarantine_dir, key)
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    shutil.move(path, destination)
+                handled += 1
+            except FileNotFoundError:
+                # Deleted by someone else in the meantime
+                pass
+            except OSError as e:
+                logger.warning("Could not %s %s: %s", self.action, path, e)
+                failed += 1
+        return handled, failed
+    
+    def run(self):
+        """
+        Reconcile the image store once
+        
+        Returns:
+            dict: Counters, the rows with a missing file and the time taken by each phase
+        """
+        start = time.monotonic()
+        self._update(phase='indexing', scanned=0, orphans=0, handled=0)
+        with tracer.span('reconcile.run', action=self.action) as span:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                with tracer.span('reconcile.index'):
+                    index = self.build_index(conn)
+            finally:
+                conn.close()
+            referenced = len(index)
+            indexed = time.monotonic()
+            self._update(phase='scanning', referenced=referenced)
+            
+            cutoff = time.time() - self.min_age_seconds
+            counts = {"scanned": 0, "orphans": 0, "orphan_bytes": 0, "handled": 0, "failed": 0, "recent": 0}
+            batch = []
+            for key, entry in self._walk(self.image_dir, ''):
+                if self._stop_event.is_set():
+                    break
+                counts["scanned"] += 1
+                if key in index:
+                    # Whatever is left in the index afterwards has no file
+                    index.discard(key)
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                # save_image keeps the source's mtime on some paths, the ctime is set when the copy is made
+                if max(stat.st_mtime, stat.st_ctime) > cutoff:
+                    counts["recent"] += 1
+                    continue
+                counts["orphans"] += 1
+                counts["orphan_bytes"] += stat.st_size
+                batch.append((key, entry.path, stat.st_size))
+                if len(batch) >= self.batch_size:
+                    self._finish_batch(batch, counts)
+                    batch = []
+            if batch:
+                self._finish_batch(batch, counts)
+            scanned = time.monotonic()
+            
+            # Paths outside the image directory were never walked, check them one by one
+            missing_keys, missing = [], []
+            if not self._stop_event.is_set():
+                missing_keys = [key for key in index if not os.path.exists(os.path.join(self.image_dir, key))]
+                if missing_keys:
+                    missing = self._missing_rows(set(missing_keys))
+            span.set(scanned=counts["scanned"], orphans=counts["orphans"], missing=len(missing_keys))
+        
+        self.report = dict(counts, action=self.action, referenced=referenced, missing_count=len(missing_keys),
+                           missing=missing, stopped=self._stop_event.is_set(),
+                           index_seconds=round(indexed - start, 2), scan_seconds=round(scanned - indexed, 2),
+                           elapsed_seconds=round(time.monotonic() - start, 2))
+        self._update(phase='done')
+        logger.info("Storage reconciled: %d files scanned, %d orphans (%s), %d rows with a missing file",
+                    counts["scanned"], counts["orphans"], self.action, len(missing_keys))
+        return self.report
+    
+    def _finish_batch(self, batch, counts):
+        # A file indexed as an orphan may have got its row while the directory was walked
+        referenced = self.referenced_since_index()
+        if referenced:
+            orphans = [item for item in batch if item[0] not in referenced]
+            counts["orphans"] -= len(batch) - len(orphans)
+            counts["orphan_bytes"] -= sum(size for key, _, size in batch if key in referenced)
+            counts["recent"] += len(batch) - len(orphans)
+            batch = orphans
+        if self.action != self.REPORT and batch:
+            handled, failed = self._dispose(batch)
+            counts["handled"] += handled
+            counts["failed"] += failed
+        self._update(scanned=counts["scanned"], orphans=counts["orphans"], handled=counts["handled"])
+        # Give the disk and the other threads a breather between batches
+        if self.batch_pause:
+            self._stop_event.wait(self.batch_pause)
+    
+    def _missing_rows(self, missing_keys):
+        """
+        Look up the rows that point at a missing file
+        
+        Returns:
+            list: (image_id, user_id, image_path) tuples, at most missing_limit
+        """
+        rows = []
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            for image_id, user_id, image_path in conn.execute('SELECT image_id, user_id, image_path FROM images'):
+                if self._key(image_path) in missing_keys:
+                    rows.append((image_id, user_id, image_path))
+                    if len(rows) >= self.missing_limit:
+                        break
+        finally:
+            conn.close()
+        return rows
+    
+    def start(self):
+        """
+        Run the reconciliation in a background thread
+        
+        Returns:
+            threading.Thread: The reconciling thread
+        """
+        self._stop_event.clear()
+        self.report = None
+        self._thread = threading.Thread(target=self.run, name='storage-reconciler', daemon=True)
+        self._thread.start()
+        return self._thread
+    
+    def stop(self):
+        """
+        Ask a running reconciliation to stop after the current file
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+    
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def get_progress(self):
+        """
+        Get the progress of the running reconciliation
+        
+        Returns:
+            dict: phase ('indexing', 'scanning' or 'done') and the counters so far
+        """
+        with self._lock:
+            return dict(self.progress)
+
+def main():
+    """
+    Run the reconciler from the command line
+    """
+    parser = argparse.ArgumentParser(description="Find image files no longer referenced by the database")
+    parser.add_argument('--action', choices=['report', 'quarantine', 'delete'], default='report')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--batch-pause', type=float, default=0.05, help="Seconds between batches")
+    parser.add_argument('--min-age', type=float, default=3600, help="Skip files modified in the last seconds")
+    args = parser.parse_args()
+    
+    reconciler = StorageReconciler(action=args.action, batch_size=args.batch_size, batch_pause=args.batch_pause,
+                                   min_age_seconds=args.min_age)
+    report = reconciler.run()
+    print(f"{report['scanned']} files scanned, {report['referenced']} referenced, "
+          f"{report['orphans']} orphans ({report['orphan_bytes'] // 1024} KB)")
+    if args.action != 'report':
+        print(f"{report['handled']} orphans {args.action}d, {report['failed']} failed")
+    print(f"{report['missing_count']} rows point at a missing file")
+    for image_id, user_id, image_path in report['missing']:
+        print(f"  image {image_id} of user {user_id}: {image_path}")
+
+if __name__ == "__main__":
+    main()
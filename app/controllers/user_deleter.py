@@ -0,0 +1,185 @@
+import argparse
+import os
+import shutil
+import threading
+from app.models.deletion_queue import DeletionQueue
+from utils.image_loader import image_cache
+from utils.logger import logger
+from utils.metrics import tracer
+
+class UserDeleter:
+    """
+    Carries out user deletions in a background thread
+    
+    Each chunk of images first has its files removed and then its rows
+    deleted in a short transaction that also records the progress, so the
+    database is never locked for long and the admin panel stays responsive.
+    A file that is already gone is skipped, which makes a chunk that was
+    interrupted between the two steps safe to repeat. Deletions left
+    unfinished by a crash are picked up again by resume().
+    """
+    
+    def __init__(self, queue=None, image_dir=os.path.join('data', 'images'), chunk_size=500, chunk_pause=0.02):
+        """
+        Initialize the deleter
+        
+        Args:
+            queue (DeletionQueue, optional): The deletion jobs
+            image_dir (str): The image store, the user's directory in it is removed at the end
+            chunk_size (int): Images deleted per transaction
+            chunk_pause (float): Seconds to sleep between chunks, so other writers get their turn
+        """
+        self.queue = queue or DeletionQueue()
+        self.image_dir = image_dir
+        self.chunk_size = chunk_size
+        self.chunk_pause = chunk_pause
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+    
+    def delete_user(self, user_id):
+        """
+        Remove a user's account now and delete their data in the background
+        
+        Args:
+            user_id (int): The ID of the user
+        
+        Returns:
+            int or None: The ID of the deletion job, see get_progress(), None if the user doesn't exist
+        """
+        deletion_id = self.queue.create(int(user_id))
+        if deletion_id is not None:
+            self.resume()
+        return deletion_id
+    
+    def resume(self):
+        """
+        Start the background thread if it isn't running, it works through every unfinished deletion
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._run, name='user-deleter', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while not self._stop_event.is_set():
+            # Decided under the lock, so a deletion created meanwhile either is seen here or starts a new thread
+            with self._lock:
+                unfinished = self.queue.get_unfinished()
+                if not unfinished:
+                    self._thread = None
+                    return
+            progressed = False
+            for deletion_id, user_id in unfinished:
+                try:
+                    self.process(deletion_id, user_id)
+                    progressed = True
+                except Exception as e:
+                    logger.error("Deleting the data of user %s failed: %s", user_id, e)
+                    self.queue.record_error(deletion_id, e)
+                if self._stop_event.is_set():
+                    return
+            if not progressed:
+                # Every deletion failed, try again on the next resume instead of spinning
+                return
+    
+    def process(self, deletion_id, user_id):
+        """
+        Delete all data of one user, chunk by chunk
+        
+        Args:
+            deletion_id (int): The ID of the deletion job
+            user_id (int): The ID of the deleted user
+        """
+        with tracer.span('user_delete.run', user_id=user_id):
+            # A save that was already under way when the account went can still land a row,
+            # so the deletion is only finished once a last look finds none
+            finished = False
+            while not finished:
+                while not self._stop_event.is_set():
+                    chunk = self.queue.next_chunk(user_id, self.chunk_size)
+                    if not chunk:
+                        break
+                    with tracer.span('user_delete.chunk', images=len(chunk)):
+                        deleted_files = 0
+                        for _, image_path in chunk:
+                            try:
+                                os.remove(image_path)
+                                deleted_files += 1
+                            except FileNotFoundError:
+                                pass
+                            image_cache.discard(image_path)
+                        self.queue.delete_chunk(deletion_id, [image_id for image_id, _ in chunk], deleted_files)
+                    self._stop_event.wait(self.chunk_pause)
+                if self._stop_event.is_set():
+                    return
+                
+                while self.queue.delete_analysis_jobs(user_id, self.chunk_size):
+                    self._stop_event.wait(self.chunk_pause)
+                
+                # User IDs are never reused, whatever is left in the directory belonged to this user
+                shutil.rmtree(os.path.join(self.image_dir, str(user_id)), ignore_errors=True)
+                finished = self.queue.finish(deletion_id, user_id)
+        logger.info("Deleted the data of user %s", user_id)
+    
+    def get_progress(self, deletion_id):
+        """
+        Get the progress of a deletion
+        
+        Returns:
+            dict or None: username, status, total_images, deleted_images, deleted_files and last_error
+        """
+        job = self.queue.get_job(deletion_id)
+        if job is None:
+            return None
+        _, _, username, status, total_images, deleted_images, deleted_files, last_error = job
+        return {
+            "username": username,
+            "status": status,
+            "total_images": total_images,
+            "deleted_images": deleted_images,
+            "deleted_files": deleted_files,
+            "last_error": last_error,
+        }
+    
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def join(self, timeout=None):
+        """
+        Wait for the background thread to finish its work
+        """
+        if self._thread:
+            self._thread.join(timeout)
+    
+    def stop(self):
+        """
+        Stop after the current chunk, the rest is done on the next resume
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+def main():
+    """
+    Finish interrupted user deletions from the command line
+    """
+    parser = argparse.ArgumentParser(description="Finish user deletions that were interrupted")
+    parser.add_argument('--db', default='data/fruit_app.db', help="Path to the SQLite database")
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+    
+    deleter = UserDeleter(DeletionQueue(args.db), chunk_size=args.chunk_size, chunk_pause=0)
+    unfinished = deleter.queue.get_unfinished()
+    print(f"{len(unfinished)} unfinished deletions")
+    deleter.resume()
+    try:
+        deleter.join()
+    except KeyboardInterrupt:
+        deleter.stop()
+    for deletion_id, _ in unfinished:
+        print(deleter.get_progress(deletion_id))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+"""
+Video intake: analyzes the fruits passing a camera or filmed in a video file
+
+A decoder thread reads frames with OpenCV into a small ring buffer, so
+memory stays bounded however long the stream runs. The motion gate looks at
+a reduced, blurred copy of every frame and compares it with a running average
+of the empty belt. When enough of the frame differs a fruit has come into
+view; the frame where the most differs is kept, and once the frame has
+settled back to belt that one frame is saved and analyzed like an upload.
+A fruit therefore costs one analysis, however many frames it is filmed in,
+and the belt between fruits costs none.
+
+A camera does not wait: when the gate or the analysis falls behind, the
+oldest frames in the ring are dropped. A file is read no faster than the
+gate takes its frames.
+
+Usage:
+    python -m app.controllers.video_intake conveyor.mp4 --user line1
+    python -m app.controllers.video_intake 0 --user line1 --ring-frames 32
+"""
+import argparse
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from dotenv import load_dotenv
+from app.controllers.image_controller import ImageController
+from app.controllers.request_context import RequestContext
+from app.models.database import Database
+from app.models.job_queue import JobQueue
+from utils.analysis_scheduler import BATCH
+from utils.logger import logger
+from utils.metrics import Histogram, tracer
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v')
+
+class FrameRing:
+    """
+    Fixed-size buffer of decoded frames between the decoder and the gate
+    
+    With block=True a full ring makes the producer wait, as for a file. With
+    block=False the oldest frame is dropped instead, as for a camera that
+    keeps filming whether the reader keeps up or not.
+    """
+    
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity (int): Most frames held at a time
+        """
+        self.capacity = capacity
+        self._frames = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+        self.high_water = 0
+    
+    def put(self, item, block=True):
+        """
+        Add a frame
+        
+        Args:
+            item: The frame and whatever belongs to it
+            block (bool): Wait for room when full, otherwise drop the oldest frame
+        
+        Returns:
+            bool: False if the ring was closed while waiting for room
+        """
+        with self._condition:
+            while block and len(self._frames) >= self.capacity and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                return False
+            if len(self._frames) >= self.capacity:
+                self._frames.popleft()
+                self.dropped += 1
+            self._frames.append(item)
+            self.high_water = max(self.high_water, len(self._frames))
+            self._condition.notify_all()
+            return True
+    
+    def get(self, timeout=None):
+        """
+        Take the oldest frame
+        
+        Returns:
+            The item, or None once the ring is closed and empty or the timeout passed
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frames or self._closed, timeout):
+                return None
+            if not self._frames:
+                return None
+            item = self._frames.popleft()
+            self._condition.notify_all()
+            return item
+    
+    def close(self):
+        """
+        Stop accepting frames, the ones held can still be taken
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+    
+    def done(self):
+        """
+        Check whether the ring is closed and every frame has been taken
+        """
+        with self._condition:
+            return self._closed and not self._frames
+    
+    def __len__(self):
+        with self._condition:
+            return len(self._frames)
+
+class MotionGate:
+    """
+    Picks one frame per fruit passing through the picture by differencing against the belt
+    
+    Frames are compared on a small blurred copy, which costs a few
+    milliseconds and smooths away sensor noise and the fine texture of a
+    moving belt. The background is a running average that only learns where nothing
+    moves, so a passing fruit is not absorbed into it.
+    """
+    
+    def __init__(self, width=160, threshold=25, enter=None, leave=None, learning_rate=0.05, max_event_frames=300):
+        """
+        Options that are not given are read from the environment (FRUIT_APP_VIDEO_MIN_MOTION).
+        
+        Args:
+            width (int): Width of the reduced copy the frames are compared on
+            threshold (int): Difference from the background in any colour channel that counts as moving
+            enter (float, optional): Share of the picture that must differ for a fruit to be in view
+            leave (float, optional): Share below which the picture counts as belt again, half of enter by default
+            learning_rate (float): Weight of a new frame in the background average
+            max_event_frames (int): Frames after which a fruit that stays in view is analyzed anyway
+                                    and becomes part of the background, for example on a stopped belt
+        """
+        self.width = width
+        self.threshold = threshold
+        self.enter = float(enter if enter is not None else os.getenv('FRUIT_APP_VIDEO_MIN_MOTION', 0.01))
+        self.leave = leave if leave is not None else self.enter / 2
+        self.learning_rate = learning_rate
+        self.max_event_frames = max_event_frames
+        
+        self.background = None
+        self._event = None
+    
+    def _small(self, frame):
+        height = max(1, round(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (5, 5), 0).astype('float32')
+    
+    def update(self, frame, index):
+        """
+        Look at the next frame
+        
+        Args:
+            frame (numpy.ndarray): The BGR frame as decoded, kept by reference while it is the best of a fruit
+            index (int): The frame's number in the stream
+        
+        Returns:
+            tuple or None: (frame, index, motion) of the best frame once a fruit has passed, otherwise None
+        """
+        small = self._small(frame)
+        if self.background is None:
+            self.background = small
+            return None
+        
+        # Per colour channel, brown fruit on a grey belt can have the belt's brightness
+        moving = cv2.absdiff(small, self.background).max(axis=2) > self.threshold
+        motion = float(moving.mean())
+        cv2.accumulateWeighted(small, self.background, self.learning_rate, mask=(~moving).astype('uint8'))
+        
+        if self._event is None and motion < self.enter:
+            return None
+        # The best frame shows the most of the fruit, nearest the middle of the picture
+        rows, columns = moving.nonzero()
+        offset = abs(rows.mean() / moving.shape[0] - 0.5) + abs(columns.mean() / moving.shape[1] - 0.5) \
+            if rows.size else 1.0
+        score = motion * (1 - offset / 2)
+        
+        if self._event is None:
+            self._event = {"frame": frame, "index": index, "motion": motion, "score": score, "frames": 1}
+            return None
+        
+        event = self._event
+        event["frames"] += 1
+        if score > event["score"]:
+            event.update(frame=frame, index=index, motion=motion, score=score)
+        if motion < self.leave:
+            return self.flush()
+        if event["frames"] >= self.max_event_frames:
+            # Whatever stays in view is now part of the belt
+            self.background = small
+            return self.flush()
+        return None
+    
+    def flush(self):
+        """
+        End the fruit in view, for example at the end of a file
+        
+        Returns:
+            tuple or None: (frame, index, motion) of its best frame, None if no fruit is in view
+        """
+        event, self._event = self._event, None
+        if event is None:
+            return None
+        return event["frame"], event["index"], event["motion"]
+
+class VideoIntake:
+    """
+    Feeds the fruits seen by a camera or in a video file through the save, analyze and persist path
+    
+    One thread decodes, the calling thread gates, worker threads analyze.
+    Frames picked by the gate are written as JPEGs and handled like a file
+    of the watch folder: saved, recorded as a job and analyzed.
+    """
+    
+    def __init__(self, source, context, workers=2, ring_frames=None, stride=1, gate=None, on_result=None):
+        """
+        Initialize the intake
+        
+        Args:
+            source (str or int): A video file, a stream URL or the number of a local camera
+            context (RequestContext): The user the fruits are saved for, and the priority of their analyses
+            workers (int): Number of analysis threads
+            ring_frames (int, optional): Decoded frames held at most, FRUIT_APP_VIDEO_RING_FRAMES (16) if not given
+            stride (int): Gate every stride-th frame only, the others are skipped without being converted
+            gate (MotionGate, optional): The frame gate, a default MotionGate if not given
+            on_result (callable, optional): Called on a worker thread with (frame_index, saved_path, result)
+                                            after every analysis
+        """
+        if cv2 is None:
+            raise RuntimeError("Video intake needs the opencv-python package")
+        
+        self.source = int(source) if isinstance(source, str) and source.isdigit() else source
+        # Cameras and network streams go on filming while we are busy, files wait for us
+        self.live = isinstance(self.source, int) or '://' in str(self.source)
+        self.context = context
+        self.workers = workers
+        self.stride = max(1, stride)
+        self.gate = gate or MotionGate()
+        self.on_result = on_result
+        self.ring = FrameRing(int(ring_frames or os.getenv('FRUIT_APP_VIDEO_RING_FRAMES', 16)))
+        self.job_queue = JobQueue()
+        self.worker_id = f"video:{os.getpid()}"
+        self.controller = ImageController()
+        
+        self._name = os.path.splitext(os.path.basename(str(self.source)))[0] or 'camera'
+        self._capture_dir = None
+        # Frames picked by the gate, waiting for an analysis worker
+        self._queue = queue.Queue(maxsize=workers * 2)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+        
+        self.started = None
+        self.finished = None
+        self.stats = {"decoded": 0, "skipped": 0, "gated": 0, "fruits": 0, "analyzed": 0, "failed": 0,
+                      "frame_bytes": 0}
+        # Gate time per frame, and time from the frame that ended a fruit being decoded to its result being stored
+        self.gate_ms = Histogram()
+        self.latency = Histogram()
+    
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+    
+    def _decode(self):
+        """
+        Read frames into the ring until the source ends or the intake is stopped
+        """
+        capture = cv2.VideoCapture(self.source)
+        try:
+            if not capture.isOpened():
+                logger.error("Could not open video source %s", self.source)
+                return
+            index = 0
+            while not self._stop_event.is_set():
+                if index % self.stride:
+                    # Skipped frames are still decoded by the codec, but not converted or copied
+                    if not capture.grab():
+                        break
+                    self._count("skipped")
+                else:
+                    ok, frame = capture.read()
+                    if not ok:
+                        break
+                    with self._lock:
+                        self.stats["decoded"] += 1
+                        self.stats["frame_bytes"] = frame.nbytes
+                    if not self.ring.put((index, time.monotonic(), frame), block=not self.live):
+                        break
+                index += 1
+        except Exception as e:
+            logger.error("Decoding %s failed: %s", self.source, e)
+        finally:
+            capture.release()
+            self.ring.close()
+    
+    def _submit(self, frame, index, decoded_at):
+        """
+        Write a picked frame as a JPEG and queue it for analysis, waiting while the workers are busy
+        """
+        path = os.path.join(self._capture_dir, f"{self._name}_frame{index:07d}.jpg")
+        if not cv2.imwrite(path, frame, [cv2.IMWRITE_JPEG_QUALITY, 90]):
+            logger.error("Could not write frame %d to %s", index, path)
+            self._count("failed")
+            return
+        self._count("fruits")
+        self._queue.put((path, index, decoded_at))
+    
+    def process_frame(self, path, index, decoded_at):
+        """
+        Save, analyze and persist one picked frame
+        
+        Args:
+            path (str): The frame written as a JPEG
+            index (int): The frame's number in the stream
+            decoded_at (float): When the frame was decoded, from time.monotonic()
+        """
+        try:
+            with tracer.span('video.process', frame=index) as span:
+                saved_path = self.controller.save_image(self.context, path)
+                # Same steps as the Analyze button, so an interrupted analysis is resumed by the job worker
+                job_id = self.job_queue.enqueue(self.context.user_id, saved_path, worker_id=self.worker_id)
+                try:
+                    result, _ = self.controller.analyze_image(self.context, saved_path, job_id=job_id, fallback=False)
+                except Exception as e:
+                    # Like the job worker, retry instead of guessing. The job keeps the saved frame.
+                    span.set(result='failed')
+                    self.job_queue.fail(job_id, self.worker_id, e)
+                    raise
+                self.job_queue.complete(job_id, self.worker_id, result)
+                span.set(result=result)
+            
+            with self._lock:
+                self.stats["analyzed"] += 1
+                self.latency.record((time.monotonic() - decoded_at) * 1000)
+            if self.on_result:
+                self.on_result(index, saved_path, result)
+        except Exception as e:
+            logger.error("Failed to analyze frame %d of %s: %s", index, self.source, e)
+            self._count("failed")
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self.process_frame(*item)
+    
+    def start(self):
+        """
+        Start the decoder and the worker threads
+        """
+        self.started = time.monotonic()
+        self._capture_dir = tempfile.mkdtemp(prefix='fruit_video_')
+        decoder = threading.Thread(target=self._decode, name='video-decoder', daemon=True)
+        decoder.start()
+        self._threads.append(decoder)
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"video-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def run(self, stop_event=None, stats_interval=60.0):
+        """
+        Gate the decoded frames until the source ends or the intake is stopped, then finish the analyses
+        
+        Args:
+            stop_event (threading.Event, optional): Set this event to stop the intake
+            stats_interval (float): Seconds between statistics log lines, 0 disables them
+        """
+        stop_event = stop_event or self._stop_event
+        if not self._threads:
+            self.start()
+        
+        last_report = time.monotonic()
+        while not stop_event.is_set() and not self.ring.done():
+            item = self.ring.get(timeout=0.5)
+            if item is not None:
+                index, decoded_at, frame = item
+                start = time.perf_counter()
+                picked = self.gate.update(frame, index)
+                elapsed = (time.perf_counter() - start) * 1000
+                with self._lock:
+                    self.stats["gated"] += 1
+                    self.gate_ms.record(elapsed)
+                if picked:
+                    self._submit(picked[0], picked[1], decoded_at)
+            if stats_interval and time.monotonic() - last_report >= stats_interval:
+                logger.info("Video intake: %s", self.get_stats())
+                last_report = time.monotonic()
+        
+        # A fruit still in view when the video ends
+        picked = self.gate.flush()
+        if picked:
+            self._submit(picked[0], picked[1], time.monotonic())
+        self.stop()
+    
+    def stop(self):
+        """
+        Stop decoding, let the workers finish the picked frames and stop them
+        """
+        self._stop_event.set()
+        self.ring.close()
+        workers = [thread for thread in self._threads if thread.name != 'video-decoder']
+        for _ in workers:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._capture_dir:
+            shutil.rmtree(self._capture_dir, ignore_errors=True)
+            self._capture_dir = None
+        self.finished = time.monotonic()
+    
+    def get_stats(self):
+        """
+        Get the intake counters, frame rates and latencies
+        
+        Returns:
+            dict: Counters, decoded frames per second, ring use and memory, gate time and latency summaries
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["gate"] = self.gate_ms.summary()
+            stats["latency"] = self.latency.summary()
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0
+        stats["frames_per_second"] = round((stats["decoded"] + stats["skipped"]) / elapsed, 1) if elapsed else 0.0
+        stats["dropped"] = self.ring.dropped
+        stats["ring_high_water"] = self.ring.high_water
+        stats["ring_bytes"] = self.ring.capacity * stats.pop("frame_bytes")
+        return stats
+
+def main():
+    """
+    Run the intake from the command line
+    """
+    parser = argparse.ArgumentParser(description="Analyze the fruits filmed by a camera or in a video file")
+    parser.add_argument('source', help="A video file, a stream URL or the number of a local camera")
+    parser.add_argument('--user', required=True, help="The username the fruits are saved for")
+    parser.add_argument('--workers', type=int, default=2, help="Number of analysis threads")
+    parser.add_argument('--ring-frames', type=int, default=None, help="Decoded frames held at most")
+    parser.add_argument('--stride', type=int, default=1, help="Gate every n-th frame only")
+    parser.add_argument('--min-motion', type=float, default=None,
+                        help="Share of the picture that must change for a fruit to be in view")
+    parser.add_argument('--stats-interval', type=float, default=60.0, help="Seconds between statistics log lines")
+    args = parser.parse_args()
+    
+    credentials = Database().get_user_credentials(args.user)
+    if not credentials:
+        parser.error(f"Unknown user: {args.user}")
+    
+    intake = VideoIntake(args.source, RequestContext(credentials[0], args.user, BATCH), workers=args.workers,
+                         ring_frames=args.ring_frames, stride=args.stride, gate=MotionGate(enter=args.min_motion))
+    logger.info("Analyzing video from %s for user %s", args.source, args.user)
+    try:
+        intake.run(stats_interval=args.stats_interval)
+    except KeyboardInterrupt:
+        intake.stop()
+    logger.info("Video intake stopped: %s", intake.get_stats())
+
+if __name__ == "__main__":
+    main()
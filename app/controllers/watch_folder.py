@@ -0,0 +1,396 @@
+import argparse
+import hashlib
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from app.controllers.image_controller import ImageController
+from app.controllers.request_context import RequestContext
+from app.models.database import Database
+from app.models.job_queue import JobQueue
+from utils.analysis_scheduler import BATCH
+from utils.image_validator import ImageValidationError
+from utils.logger import logger
+from utils.metrics import Histogram, tracer
+
+# Files are moved into these sub-directories of the watched folder once handled
+PROCESSED_DIR = 'processed'
+REJECTED_DIR = 'rejected'
+DUPLICATES_DIR = 'duplicates'
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+class FolderScanner:
+    """
+    Polls a directory tree for image files that have finished being written
+    
+    A file is reported once its size and modification time have not changed
+    for settle_seconds, so files still being copied in are left alone.
+    Only the standard library is used, no file system notification service.
+    """
+    
+    def __init__(self, directory, settle_seconds=2.0, extensions=IMAGE_EXTENSIONS):
+        """
+        Args:
+            directory (str): The folder to watch, including its sub-directories
+            settle_seconds (float): How long a file must stay unchanged before it is reported
+            extensions (tuple): Lower case file extensions to pick up
+        """
+        self.directory = directory
+        self.settle_seconds = settle_seconds
+        self.extensions = extensions
+        self.skip_dirs = {PROCESSED_DIR, REJECTED_DIR, DUPLICATES_DIR}
+        # path -> (size, mtime_ns, first_seen, last_change), times from time.monotonic()
+        self._files = {}
+    
+    def _walk(self, directory):
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if directory != self.directory or entry.name not in self.skip_dirs:
+                            yield from self._walk(entry.path)
+                    elif entry.name.lower().endswith(self.extensions):
+                        yield entry
+        except FileNotFoundError:
+            # The directory was removed between listing and opening it
+            return
+    
+    def scan(self):
+        """
+        Look at every file once and report the settled ones
+        
+        Returns:
+            list: (path, first_seen) of every settled file, oldest first
+        """
+        now = time.monotonic()
+        present = set()
+        ready = []
+        for entry in self._walk(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            present.add(entry.path)
+            
+            known = self._files.get(entry.path)
+            if known is None or (known[0], known[1]) != (stat.st_size, stat.st_mtime_ns):
+                first_seen = known[2] if known else now
+                self._files[entry.path] = (stat.st_size, stat.st_mtime_ns, first_seen, now)
+            elif now - known[3] >= self.settle_seconds:
+                ready.append((entry.path, known[2]))
+        
+        # Forget files that were moved or deleted
+        for path in list(self._files):
+            if path not in present:
+                self._files.pop(path, None)
+        
+        ready.sort(key=lambda item: item[1])
+        return ready
+    
+    def forget(self, path):
+        """
+        Stop tracking a file, for example after it was moved away
+        """
+        self._files.pop(path, None)
+    
+    def pending_count(self):
+        """
+        Get how many files are being tracked, settled or not
+        """
+        return len(self._files)
+
+class FolderWatcher:
+    """
+    Headless intake: feeds images dropped into a folder through the save,
+    analyze and persist path of the application
+    
+    A polling thread hands settled files to a bounded queue served by worker
+    threads. When the queue is full, files simply stay in the folder until
+    there is room, so a burst never builds an unbounded backlog in memory.
+    Files with the same content as one already handled are set aside as
+    duplicates. Every handled file is moved into a sub-directory, which also
+    keeps it from being picked up again after a restart.
+    """
+    
+    def __init__(self, directory, user_id, workers=2, max_queued=None, settle_seconds=2.0,
+                 poll_interval=1.0, dedupe_size=100000):
+        """
+        Initialize the watcher
+        
+        Args:
+            directory (str): The folder to watch
+            user_id (int): The user the images are saved for
+            workers (int): Number of analysis threads
+            max_queued (int, optional): Files waiting for a worker before intake pauses, defaults to 4 per worker
+            settle_seconds (float): How long a file must stay unchanged before it is picked up
+            poll_interval (float): Seconds between scans of the folder
+            dedupe_size (int): How many content digests are remembered for duplicate detection
+        """
+        self.directory = directory
+        self.user_id = user_id
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.dedupe_size = dedupe_size
+        self.scanner = FolderScanner(directory, settle_seconds)
+        self.job_queue = JobQueue()
+        self.worker_id = f"watch:{os.getpid()}"
+        # Shared by the worker threads, the controller keeps no per-call state
+        self.controller = ImageController()
+        self.context = RequestContext(user_id, priority=BATCH)
+        
+        self._queue = queue.Queue(maxsize=max_queued or workers * 4)
+        self._in_flight = set()
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+        
+        self.started = None
+        self.stats = {"picked_up": 0, "processed": 0, "duplicates": 0, "rejected": 0, "failed": 0,
+                      "intake_paused": 0}
+        # Time from first sighting to the result being stored, and the part spent processing
+        self.latency = Histogram()
+        self.processing = Histogram()
+    
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+    
+    def poll_once(self):
+        """
+        Scan the folder once and queue settled files while there is room
+        
+        Returns:
+            int: How many files were queued
+        """
+        queued = 0
+        for path, first_seen in self.scanner.scan():
+            with self._lock:
+                if path in self._in_flight:
+                    continue
+                self._in_flight.add(path)
+            if self._queue.full():
+                self._count("intake_paused")
+            try:
+                # Wait a little for room, the workers free a slot with every finished file
+                self._queue.put((path, first_seen), timeout=self.poll_interval)
+            except queue.Full:
+                # Backpressure, the rest waits in the folder for the next scan
+                with self._lock:
+                    self._in_flight.discard(path)
+                break
+            queued += 1
+        self._count("picked_up", queued)
+        return queued
+    
+    def _move(self, path, subdir):
+        """
+        Move a handled file into a sub-directory, keeping its relative path
+        """
+        relative = os.path.relpath(path, self.directory)
+        destination = os.path.join(self.directory, subdir, relative)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        base, extension = os.path.splitext(destination)
+        index = 1
+        while os.path.exists(destination):
+            destination = f"{base}_{index}{extension}"
+            index += 1
+        shutil.move(path, destination)
+        self.scanner.forget(path)
+    
+    def _is_duplicate(self, path):
+        """
+        Check the file content against the recently handled files
+        """
+        digest = hashlib.sha1()
+        with open(path, 'rb') as image_file:
+            for block in iter(lambda: image_file.read(1024 * 1024), b''):
+                digest.update(block)
+        key = digest.digest()
+        
+        with self._lock:
+            if key in self._digests:
+                self._digests.move_to_end(key)
+                return True
+            self._digests[key] = True
+            if len(self._digests) > self.dedupe_size:
+                self._digests.popitem(last=False)
+        return False
+    
+    def process_file(self, path, first_seen):
+        """
+        Save, analyze and persist one file, then move it out of the way
+        
+        Args:
+            path (str): The file in the watched folder
+            first_seen (float): When the scanner first saw the file, from time.monotonic()
+        """
+        start = time.monotonic()
+        try:
+            with tracer.span('watch.process') as span:
+                if self._is_duplicate(path):
+                    self._move(path, DUPLICATES_DIR)
+                    self._count("duplicates")
+                    span.set(outcome='duplicate')
+                    return
+                
+                try:
+                    saved_path = self.controller.save_image(self.context, path)
+                except ImageValidationError as e:
+                    logger.warning("Rejected %s: %s", path, e)
+                    self._move(path, REJECTED_DIR)
+                    self._count("rejected")
+                    span.set(outcome='rejected')
+                    return
+                
+                # Same steps as the Analyze button, so an interrupted analysis is resumed by the job worker
+                job_id = self.job_queue.enqueue(self.user_id, saved_path, worker_id=self.worker_id)
+                try:
+                    result, _ = self.controller.analyze_image(self.context, saved_path, job_id=job_id, fallback=False)
+                except Exception as e:
+                    # Like the job worker, retry instead of guessing. The job keeps the saved copy.
+                    retry = self.job_queue.fail(job_id, self.worker_id, e)
+                    logger.warning("Analysis of %s failed%s: %s", path, ", the job worker retries it" if retry else "", e)
+                    self._move(path, PROCESSED_DIR if retry else REJECTED_DIR)
+                    self._count("failed")
+                    span.set(outcome='failed')
+                    return
+                self.job_queue.complete(job_id, self.worker_id, result)
+                self._move(path, PROCESSED_DIR)
+                span.set(outcome='processed', result=result)
+            
+            end = time.monotonic()
+            with self._lock:
+                self.stats["processed"] += 1
+                self.latency.record((end - first_seen) * 1000)
+                self.processing.record((end - start) * 1000)
+        except Exception as e:
+            logger.error("Failed to process %s: %s", path, e)
+            self._count("failed")
+            try:
+                self._move(path, REJECTED_DIR)
+            except OSError:
+                pass
+    
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, first_seen = item
+            try:
+                # A scan that overlapped the previous move may have queued it again
+                if os.path.exists(path):
+                    self.process_file(path, first_seen)
+            finally:
+                with self._lock:
+                    self._in_flight.discard(path)
+                self._queue.task_done()
+    
+    def start(self):
+        """
+        Start the worker threads
+        """
+        self.started = time.monotonic()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"watch-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def idle(self):
+        """
+        Check whether every file seen so far has been handled
+        
+        Returns:
+            bool: True if nothing is queued, being processed or waiting to settle
+        """
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return in_flight == 0 and self.scanner.pending_count() == 0
+    
+    def run(self, stop_event=None, drain=False, stats_interval=60.0):
+        """
+        Poll the folder until stopped
+        
+        Args:
+            stop_event (threading.Event, optional): Set this event to stop the watcher
+            drain (bool): Return once the folder holds no more unhandled files
+            stats_interval (float): Seconds between statistics log lines, 0 disables them
+        """
+        stop_event = stop_event or self._stop_event
+        if not self._threads:
+            self.start()
+        
+        last_report = time.monotonic()
+        while not stop_event.is_set():
+            self.poll_once()
+            if drain and self.idle():
+                break
+            if stats_interval and time.monotonic() - last_report >= stats_interval:
+                logger.info("Watch folder: %s", self.get_stats())
+                last_report = time.monotonic()
+            stop_event.wait(self.poll_interval)
+        self.stop()
+    
+    def stop(self):
+        """
+        Let the workers finish the queued files and stop them
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+    
+    def get_stats(self):
+        """
+        Get the intake counters, throughput and latencies
+        
+        Returns:
+            dict: Counters, files per second since start, queue depth and latency summaries
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["latency"] = self.latency.summary()
+            stats["processing"] = self.processing.summary()
+        elapsed = time.monotonic() - self.started if self.started else 0
+        stats["files_per_second"] = round(stats["processed"] / elapsed, 2) if elapsed else 0.0
+        stats["queued"] = self._queue.qsize()
+        stats["waiting_in_folder"] = self.scanner.pending_count()
+        return stats
+
+def main():
+    """
+    Run the watcher from the command line
+    """
+    parser = argparse.ArgumentParser(description="Analyze images dropped into a folder")
+    parser.add_argument('directory', help="The folder the cameras write to")
+    parser.add_argument('--user', required=True, help="The username the images are saved for")
+    parser.add_argument('--workers', type=int, default=2, help="Number of analysis threads")
+    parser.add_argument('--max-queued', type=int, default=None, help="Files waiting for a worker before intake pauses")
+    parser.add_argument('--settle', type=float, default=2.0, help="Seconds a file must stay unchanged")
+    parser.add_argument('--poll', type=float, default=1.0, help="Seconds between folder scans")
+    parser.add_argument('--drain', action='store_true', help="Exit once the folder is empty")
+    parser.add_argument('--stats-interval', type=float, default=60.0, help="Seconds between statistics log lines")
+    args = parser.parse_args()
+    
+    credentials = Database().get_user_credentials(args.user)
+    if not credentials:
+        parser.error(f"Unknown user: {args.user}")
+    
+    watcher = FolderWatcher(args.directory, credentials[0], workers=args.workers, max_queued=args.max_queued,
+                            settle_seconds=args.settle, poll_interval=args.poll)
+    logger.info("Watching %s for user %s", args.directory, args.user)
+    try:
+        watcher.run(drain=args.drain, stats_interval=args.stats_interval)
+    except KeyboardInterrupt:
+        watcher.stop()
+    logger.info("Watch folder stopped: %s", watcher.get_stats())
+
+if __name__ == "__main__":
+    main()
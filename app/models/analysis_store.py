@@ -0,0 +1,408 @@
+import argparse
+import datetime
+import os
+import re
+import sqlite3
+import struct
+import threading
+import zlib
+from collections import Counter
+from dotenv import load_dotenv
+from utils.logger import logger
+
+try:
+    import zstandard
+except ImportError:
+    # Optional, only needed for FRUIT_APP_ANALYSIS_CODEC=zstd
+    zstandard = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+
+# A stored analysis starts with the codec and the ID of its dictionary, 0 for none
+_HEADER = struct.Struct('>BI')
+_CODEC_IDS = {ZLIB: 1, ZSTD: 2}
+
+# zlib only looks 32 KB back, a longer preset dictionary is never used
+ZLIB_MAX_DICT_SIZE = 32768
+
+# Fewer samples than this give a dictionary that fits them too closely
+MIN_TRAINING_SAMPLES = 50
+
+def train_zlib_dictionary(samples, size=ZLIB_MAX_DICT_SIZE):
+    """
+    Build a zlib preset dictionary from sample texts
+    
+    zlib has no trainer, it finds matches in the preset dictionary as if it
+    preceded the text. The dictionary is made of the lines and phrases that
+    recur across the samples, the most valuable last, where the matches are
+    closest and cheapest to encode.
+    
+    Args:
+        samples (list): Analysis texts
+        size (int): Most bytes in the dictionary
+    
+    Returns:
+        bytes: The dictionary
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(re.findall(r'[^\n.,]+[\n.,]?', sample)))
+    scored = sorted(((count * len(segment), segment) for segment, count in counts.items() if count > 1),
+                    reverse=True)
+    chosen, total = [], 0
+    for _, segment in scored:
+        data = segment.encode('utf-8')
+        if total + len(data) <= size:
+            chosen.append(data)
+            total += len(data)
+    return b''.join(reversed(chosen))
+
+class AnalysisStore:
+    """
+    Compressed storage of the analysis text of images
+    
+    Model explanations repeat the same phrases over and over, so each one is
+    compressed with a dictionary trained on earlier analyses, with zlib or,
+    when the zstandard package is installed and asked for, zstd. On short
+    analyses zlib with a dictionary of recurring phrases compresses better,
+    see benchmarks/bench_analysis_store.py. The dictionaries live in
+    the analysis_dicts table and are never changed; a stored value names the
+    codec and dictionary it was written with, so retraining only affects new
+    text. Values written before compression was added are plain text and
+    are returned as they are.
+    
+    Reading is transparent: register() adds an analysis_text() SQL function
+    to a connection, which search snippets and the index rebuild use. Writing
+    the images table doesn't need it.
+    """
+    
+    def __init__(self, db_path='data/fruit_app.db', codec=None, dict_size=None, train_after=None):
+        """
+        Initialize the store
+        
+        Settings that are not given are read from the environment
+        (FRUIT_APP_ANALYSIS_CODEC, FRUIT_APP_ANALYSIS_DICT_SIZE,
+        FRUIT_APP_ANALYSIS_TRAIN_AFTER).
+        
+        Args:
+            db_path (str): Path to the SQLite database file
+            codec (str, optional): 'zstd' or 'zlib'
+            dict_size (int, optional): Most bytes in a trained dictionary
+            train_after (int, optional): Analyses stored without a dictionary before one is trained
+        """
+        self.codec = codec or os.getenv('FRUIT_APP_ANALYSIS_CODEC', ZLIB)
+        if self.codec not in _CODEC_IDS:
+            raise ValueError(f"Unknown analysis codec: {self.codec}")
+        if self.codec == ZSTD and zstandard is None:
+            raise ValueError("The zstd analysis codec needs the zstandard package")
+        
+        self.db_path = db_path
+        self.dict_size = int(dict_size or os.getenv('FRUIT_APP_ANALYSIS_DICT_SIZE', 16384))
+        self.train_after = int(train_after or os.getenv('FRUIT_APP_ANALYSIS_TRAIN_AFTER', 200))
+        
+        self._lock = threading.Lock()
+        # dict_id -> (codec, dictionary), the zstd ones as prepared zstandard dictionaries
+        self._dicts = {}
+        self._current = 0
+        # Analyses stored without a dictionary, counted on first use
+        self._untrained = None
+        # Set while a saver trains the first dictionary, so the others don't train one too
+        self._training = False
+        self.create_tables()
+        self.load_dictionaries()
+    
+    def connect(self):
+        """
+        Create a new connection to the SQLite database, with analysis_text() registered
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        self.register(conn)
+        return conn
+    
+    def register(self, conn):
+        """
+        Add the analysis_text(value) SQL function to a connection
+        
+        Every connection that reads the analysis text in SQL needs it, such as
+        the images_text view behind the search index.
+        """
+        conn.create_function('analysis_text', 1, self.decompress, deterministic=True)
+    
+    def create_tables(self):
+        """
+        Create the dictionaries table if it doesn't exist
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_dicts (
+                dict_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                codec TEXT NOT NULL,
+                data BLOB NOT NULL,
+                samples INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def load_dictionaries(self):
+        """
+        Load the stored dictionaries, the newest one of the codec is used for new text
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            rows = conn.execute('SELECT dict_id, codec, data FROM analysis_dicts ORDER BY dict_id').fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            for dict_id, codec, data in rows:
+                if dict_id not in self._dicts:
+                    self._dicts[dict_id] = (codec, self._prepare(codec, data))
+                if codec == self.codec:
+                    self._current = dict_id
+    
+    def _prepare(self, codec, data):
+        if codec == ZSTD:
+            if zstandard is None:
+                # Kept as bytes, reading text written with it raises a clear error
+                return data
+            dictionary = zstandard.ZstdCompressionDict(data)
+            dictionary.precompute_compress(level=3)
+            return dictionary
+        return data
+    
+    def _dictionary(self, dict_id):
+        """
+        Get a dictionary by ID, loading it if another process trained it
+        """
+        if dict_id not in self._dicts:
+            self.load_dictionaries()
+        if dict_id not in self._dicts:
+            raise ValueError(f"Analysis dictionary {dict_id} doesn't exist")
+        return self._dicts[dict_id]
+    
+    def compress(self, text):
+        """
+        Compress an analysis for storage
+        
+        Args:
+            text (str or None): The analysis text
+        
+        Returns:
+            bytes or None: The stored value
+        """
+        if text is None:
+            return None
+        self._count_untrained()
+        dict_id = self._current
+        data = text.encode('utf-8')
+        
+        if self.codec == ZSTD:
+            dictionary = self._dictionary(dict_id)[1] if dict_id else None
+            compressor = zstandard.ZstdCompressor(level=3, dict_data=dictionary, write_checksum=False,
+                                                  write_dict_id=False)
+            body = compressor.compress(data)
+        else:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=self._dictionary(dict_id)[1]) if dict_id \
+                else zlib.compressobj(9, zlib.DEFLATED, -15)
+            body = compressor.compress(data) + compressor.flush()
+        return _HEADER.pack(_CODEC_IDS[self.codec], dict_id) + body
+    
+    def decompress(self, value):
+        """
+        Get the text of a stored analysis
+        
+        Args:
+            value (bytes, str or None): The stored value, plain text if written before compression
+        
+        Returns:
+            str or None: The analysis text
+        """
+        if value is None or isinstance(value, str):
+            return value
+        codec_id, dict_id = _HEADER.unpack_from(value)
+        body = memoryview(value)[_HEADER.size:]
+        dictionary = self._dictionary(dict_id)[1] if dict_id else None
+        
+        if codec_id == _CODEC_IDS[ZSTD]:
+            if zstandard is None:
+                raise ValueError("Reading zstd compressed analyses needs the zstandard package")
+            data = zstandard.ZstdDecompressor(dict_data=dictionary).decompress(body)
+        else:
+            decompressor = zlib.decompressobj(-15, zdict=dictionary) if dictionary else zlib.decompressobj(-15)
+            data = decompressor.decompress(body) + decompressor.flush()
+        return data.decode('utf-8')
+    
+    def _count_untrained(self):
+        """
+        Train the first dictionary once enough analyses were stored without one
+        """
+        if self._current:
+            return
+        with self._lock:
+            if self._untrained is None:
+                conn = sqlite3.connect(self.db_path, timeout=30)
+                try:
+                    self._untrained = conn.execute(
+                        'SELECT COUNT(*) FROM images WHERE analysis IS NOT NULL').fetchone()[0]
+                except sqlite3.OperationalError:
+                    # The images table doesn't exist yet
+                    self._untrained = 0
+                finally:
+                    conn.close()
+            self._untrained += 1
+            if self._untrained < self.train_after or self._training:
+                return
+            self._untrained = 0
+            self._training = True
+        try:
+            self.train()
+        except Exception as e:
+            # Saving must not fail because of the dictionary, try again after the next batch
+            logger.warning("Training the analysis dictionary failed: %s", e)
+        finally:
+            with self._lock:
+                self._training = False
+    
+    def train(self, max_samples=2000):
+        """
+        Train a dictionary on the most recent analyses and use it for new text
+        
+        Args:
+            max_samples (int): Most analyses to learn from
+        
+        Returns:
+            int or None: The ID of the new dictionary, None if there are too few analyses
+        """
+        conn = self.connect()
+        try:
+            samples = [text for text, in conn.execute(
+                'SELECT analysis_text(analysis) FROM images WHERE analysis IS NOT NULL '
+                'ORDER BY image_id DESC LIMIT ?', (max_samples,))]
+        finally:
+            conn.close()
+        if len(samples) < MIN_TRAINING_SAMPLES:
+            return None
+        
+        if self.codec == ZSTD:
+            data = zstandard.train_dictionary(self.dict_size, [text.encode('utf-8') for text in samples]).as_bytes()
+        else:
+            data = train_zlib_dictionary(samples, min(self.dict_size, ZLIB_MAX_DICT_SIZE))
+        
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cursor = conn.execute(
+                'INSERT INTO analysis_dicts (codec, data, samples, created_at) VALUES (?, ?, ?, ?)',
+                (self.codec, data, len(samples), datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            conn.commit()
+            dict_id = cursor.lastrowid
+        finally:
+            conn.close()
+        
+        with self._lock:
+            self._dicts[dict_id] = (self.codec, self._prepare(self.codec, data))
+            self._current = dict_id
+        logger.info("Trained analysis dictionary %d (%s, %d bytes) on %d analyses",
+                    dict_id, self.codec, len(data), len(samples))
+        return dict_id
+    
+    def recompress(self, batch_size=500):
+        """
+        Rewrite the analyses that don't use the current dictionary, a batch per transaction
+        
+        Returns:
+            int: How many analyses were rewritten
+        """
+        current = _HEADER.pack(_CODEC_IDS[self.codec], self._current)
+        rewritten, last_id = 0, 0
+        conn = self.connect()
+        try:
+            while True:
+                rows = conn.execute(
+                    'SELECT image_id, analysis FROM images WHERE image_id > ? AND analysis IS NOT NULL '
+                    'ORDER BY image_id LIMIT ?', (last_id, batch_size)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                updates = [(self.compress(self.decompress(value)), image_id) for image_id, value in rows
+                           if isinstance(value, str) or value[:_HEADER.size] != current]
+                if updates:
+                    # The text stays the same, so the search index is left as it is
+                    conn.executemany('UPDATE images SET analysis = ? WHERE image_id = ?', updates)
+                    conn.commit()
+                    rewritten += len(updates)
+        finally:
+            conn.close()
+        return rewritten
+    
+    def get_stats(self):
+        """
+        Get the size of the stored analyses
+        
+        Returns:
+            dict: analyses, stored_bytes, text_bytes, ratio, codec and current_dict
+        """
+        conn = self.connect()
+        try:
+            count, stored, text = conn.execute(
+                'SELECT COUNT(*), SUM(length(CAST(analysis AS BLOB))), '
+                'SUM(length(CAST(analysis_text(analysis) AS BLOB))) FROM images WHERE analysis IS NOT NULL').fetchone()
+        finally:
+            conn.close()
+        return {
+            "analyses": count,
+            "stored_bytes": stored or 0,
+            "text_bytes": text or 0,
+            "ratio": round((text or 0) / stored, 2) if stored else None,
+            "codec": self.codec,
+            "current_dict": self._current or None,
+        }
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_analysis_store(db_path='data/fruit_app.db'):
+    """
+    Get the shared store of a database, so its dictionaries are loaded once per process
+    
+    Args:
+        db_path (str): Path to the SQLite database file
+    
+    Returns:
+        AnalysisStore: The store
+    """
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = AnalysisStore(db_path)
+        return _stores[key]
+
+def main():
+    """
+    Train a dictionary and recompress stored analyses from the command line
+    """
+    parser = argparse.ArgumentParser(description="Compress the stored analysis text")
+    parser.add_argument('--db', default='data/fruit_app.db', help="Path to the SQLite database")
+    parser.add_argument('--train', action='store_true', help="Train a new dictionary on the recent analyses")
+    parser.add_argument('--recompress', action='store_true', help="Rewrite analyses with the current dictionary")
+    args = parser.parse_args()
+    
+    from app.models.database import Database
+    # Creates the tables, the search index and the triggers if needed
+    Database(args.db)
+    store = get_analysis_store(args.db)
+    if args.train:
+        dict_id = store.train()
+        print(f"trained dictionary {dict_id}" if dict_id else "too few analyses to train a dictionary")
+    if args.recompress:
+        print(f"{store.recompress()} analyses rewritten")
+    print(store.get_stats())
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,59 @@
 import sqlite3
 import os
+import re
 import datetime
+import threading
+from app.models.analysis_store import get_analysis_store
+from app.models.db_writer import get_database_writer
+
+def fts_query(text):
+    """
+    Turn search box input into an FTS5 query matching all of its words
+    
+    Every word is quoted, so characters with a meaning in the FTS5 query
+    syntax can't cause errors. A word ending in * matches as a prefix.
+    
+    Returns:
+        str or None: The query, or None if the text has no words
+    """
+    terms = [f'"{word.rstrip("*")}"' + ('*' if word.endswith('*') else '')
+             for word in re.findall(r'\w+\*?', text)]
+    return ' '.join(terms) or None
+
+class UserNotFoundError(ValueError):
+    """
+    Raised when data is saved for a user that doesn't exist, for example one deleted meanwhile
+    """
+    def __init__(self, user_id):
+        super().__init__(f"User {user_id} doesn't exist")
+        self.user_id = user_id
+
+def has_search_index(conn):
+    """
+    Check whether a database has the full-text index over the analysis text
+    """
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images_fts'").fetchone() is not None
+
+def unindex_images(conn, analysis_store, condition, parameters=()):
+    """
+    Remove images from the full-text index, before their rows are deleted in the same transaction
+    
+    The index is kept by the application rather than by triggers, so the
+    images table can be changed by connections without analysis_text(),
+    such as the sqlite3 shell. Removing a row from the index needs the text
+    it was indexed with, which is decompressed here.
+    
+    Args:
+        conn (sqlite3.Connection): The connection that deletes the rows
+        analysis_store (AnalysisStore): Decompresses the analysis text
+        condition (str): SQL condition selecting the images, for example 'user_id = ?'
+        parameters (tuple): The condition's parameters
+    """
+    if not has_search_index(conn):
+        return
+    rows = conn.execute(f'SELECT image_id, analysis, user_id FROM images WHERE {condition}', parameters)
+    conn.executemany("INSERT INTO images_fts (images_fts, rowid, analysis, user_id) VALUES ('delete', ?, ?, ?)",
+                     [(image_id, analysis_store.decompress(analysis), user_id) for image_id, analysis, user_id in rows])
 
 class Database:
     def __init__(self, db_path='data/fruit_app.db'):
@@ -11,14 +64,31 @@ class Database:
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         
         self.db_path = db_path
-        self.conn = None
+        # Each thread opens and closes its own connection, so one Database can be shared between threads
+        self._local = threading.local()
+        self.analysis_store = get_analysis_store(db_path)
         self.create_tables()
+        # Results are saved through the shared writer thread, FRUIT_APP_DB_WRITER=0 writes them directly
+        self.writer = get_database_writer(db_path) if os.getenv('FRUIT_APP_DB_WRITER', '1') != '0' else None
+    
+    @property
+    def conn(self):
+        """
+        The connection last opened by the calling thread, or None
+        """
+        return getattr(self._local, 'conn', None)
+    
+    @conn.setter
+    def conn(self, conn):
+        self._local.conn = conn
     
     def connect(self):
         """
         Create a connection to the SQLite database
         """
         self.conn = sqlite3.connect(self.db_path)
+        # Reads the compressed analysis text, search snippets need it
+        self.analysis_store.register(self.conn)
         return self.conn
     
     def close(self):
@@ -27,6 +97,7 @@ class Database:
         """
         if self.conn:
             self.conn.close()
+            self.conn = None
     
     def create_tables(self):
         """
@@ -52,23 +123,125 @@ class Database:
             image_path TEXT NOT NULL,
             result TEXT,
             timestamp TEXT NOT NULL,
+            analysis TEXT,
+            job_id INTEGER,
             FOREIGN KEY (user_id) REFERENCES users (user_id)
         )
         ''')
         
+        # Databases created before the analysis text or the job were stored lack the columns
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(images)')]
+        if 'analysis' not in columns:
+            cursor.execute('ALTER TABLE images ADD COLUMN analysis TEXT')
+        if 'job_id' not in columns:
+            cursor.execute('ALTER TABLE images ADD COLUMN job_id INTEGER')
+        
+        # History lookups and user deletion select images by user
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_user_id ON images (user_id)')
+        # A job saves its result once, however often it is attempted. Rows without a job are not constrained.
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_images_job_id ON images (job_id)')
+        
+        # Create image_fruits table, one row per fruit found in a multi-fruit image
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_fruits (
+            fruit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            image_id INTEGER NOT NULL,
+            fruit_index INTEGER NOT NULL,
+            box_left INTEGER NOT NULL,
+            box_top INTEGER NOT NULL,
+            box_right INTEGER NOT NULL,
+            box_bottom INTEGER NOT NULL,
+            ripeness TEXT NOT NULL,
+            confidence INTEGER,
+            FOREIGN KEY (image_id) REFERENCES images (image_id)
+        )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_fruits_image_id ON image_fruits (image_id)')
+        # Foreign keys are not enforced on these connections, so the fruits go with their image here
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS image_fruits_delete AFTER DELETE ON images BEGIN
+            DELETE FROM image_fruits WHERE image_id = old.image_id;
+        END
+        ''')
+        
+        self.fts_enabled = self._create_search_index(cursor)
+        
         conn.commit()
         self.close()
     
-    def register_user(self, username, password):
+    def _create_search_index(self, cursor):
+        """
+        Create the full-text index over the analysis text
+        
+        The FTS5 table is an external-content table: it stores only the index
+        and reads the text for snippets through the images_text view, which
+        decompresses images.analysis with analysis_text(). The user ID is
+        indexed as a second column so a user's search is narrowed inside the
+        index, and is left out of the ranking. Every row is indexed, a row
+        without analysis text simply never matches.
+        
+        There are no triggers: save_image_data() indexes the plain text it is
+        given and unindex_images() removes rows before they are deleted, so
+        the images table can be written by connections without analysis_text().
+        Rows inserted or deleted by other programs are not in the index until
+        rebuild_search_index() runs; deleted ones are left out of the results,
+        but still counted in the totals.
+        
+        Returns:
+            bool: False if this SQLite build has no FTS5, search then falls back to LIKE
+        """
+        # The triggers of earlier versions called analysis_text(), the index is now kept by save and delete
+        for trigger in ('images_fts_insert', 'images_fts_delete', 'images_fts_update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        exists = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'images_fts'").fetchone()
+        if exists and 'images_text' not in exists[0]:
+            # Built over the plain column before analysis text was compressed
+            cursor.execute('DROP TABLE images_fts')
+            exists = None
+        
+        cursor.execute('''
+        CREATE VIEW IF NOT EXISTS images_text AS
+            SELECT image_id, user_id, analysis_text(analysis) AS analysis FROM images
+        ''')
+        try:
+            cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+                analysis, user_id, content='images_text', content_rowid='image_id', tokenize='porter unicode61'
+            )
+            ''')
+        except sqlite3.OperationalError:
+            return False
+        
+        # Rank by the analysis text only, and index the rows written before the index existed
+        if not exists:
+            cursor.execute("INSERT INTO images_fts (images_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')")
+            cursor.execute("INSERT INTO images_fts (images_fts) VALUES ('rebuild')")
+        return True
+    
+    def rebuild_search_index(self):
+        """
+        Index the analysis text of every row again, after the images table was changed by another program
+        """
+        conn = self.connect()
+        try:
+            if has_search_index(conn):
+                conn.execute("INSERT INTO images_fts (images_fts) VALUES ('rebuild')")
+                conn.commit()
+        finally:
+            self.close()
+    
+    def register_user(self, username, password_hash):
         """
         Register a new user
+        
+        The password column stores an encoded hash from utils.password_hasher
         """
         conn = self.connect()
         cursor = conn.cursor()
         
         try:
             cursor.execute('INSERT INTO users (username, password) VALUES (?, ?)', 
-                          (username, password))
+                          (username, password_hash))
             conn.commit()
             return True
         except sqlite3.IntegrityError:
@@ -77,36 +250,179 @@ class Database:
         finally:
             self.close()
     
-    def authenticate_user(self, username, password):
+    def get_user_credentials(self, username):
         """
-        Authenticate a user
+        Get the stored password hash of a user
+        
+        The lookup is by username only, so it is served by the UNIQUE index on users.username
+        
+        Returns:
+            tuple or None: (user_id, password_hash) or None if the user doesn't exist
         """
         conn = self.connect()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT user_id FROM users WHERE username = ? AND password = ?', 
-                      (username, password))
+        cursor.execute('SELECT user_id, password FROM users WHERE username = ?', (username,))
         user = cursor.fetchone()
         self.close()
         
-        if user:
-            return user[0]  # Return user_id
-        return None
+        return user
     
-    def save_image_data(self, user_id, image_path, result):
+    def update_password(self, user_id, password_hash):
         """
-        Save image data to the database
+        Replace the stored password hash of a user
         """
         conn = self.connect()
         cursor = conn.cursor()
         
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        cursor.execute('INSERT INTO images (user_id, image_path, result, timestamp) VALUES (?, ?, ?, ?)', 
-                      (user_id, image_path, result, timestamp))
+        cursor.execute('UPDATE users SET password = ? WHERE user_id = ?', (password_hash, user_id))
         conn.commit()
         self.close()
+    
+    def get_user(self, user_id):
+        """
+        Get a user's metadata
+        
+        Returns:
+            tuple or None: (user_id, username) or None if the user doesn't exist
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT user_id, username FROM users WHERE user_id = ?', (user_id,))
+        user = cursor.fetchone()
+        self.close()
+        
+        return user
+    
+    def get_all_users(self):
+        """
+        Get the metadata of all users
+        
+        Returns:
+            list: A list of (user_id, username) tuples
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT user_id, username FROM users')
+        users = cursor.fetchall()
+        self.close()
+        
+        return users
+    
+    def update_user(self, user_id, username, password_hash=None):
+        """
+        Update a user's username and, optionally, password hash
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            if password_hash:
+                cursor.execute('UPDATE users SET username = ?, password = ? WHERE user_id = ?', 
+                              (username, password_hash, user_id))
+            else:
+                cursor.execute('UPDATE users SET username = ? WHERE user_id = ?', 
+                              (username, user_id))
+            conn.commit()
+        finally:
+            self.close()
+    
+    def delete_user(self, user_id):
+        """
+        Delete a user and all their images
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            unindex_images(conn, self.analysis_store, 'user_id = ?', (user_id,))
+            cursor.execute('DELETE FROM images WHERE user_id = ?', (user_id,))
+            cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+            conn.commit()
+        finally:
+            self.close()
+    
+    def save_image_data(self, user_id, image_path, result, analysis=None, fruits=None, job_id=None):
+        """
+        Save image data to the database
         
+        The analysis text, when given, is stored compressed and indexed for search_images().
+        With the writer, the row is committed together with the other threads' rows
+        and this call returns once the commit is on disk.
+        
+        A result saved for a job is saved once: when a job is attempted again, for example
+        after a crash before it was completed or after its lease expired during a slow
+        analysis, the row of the earlier attempt is kept and its image_id returned.
+        
+        The row is only written while its user exists, checked in the same transaction,
+        so nothing is saved for a user once their deletion has removed the account.
+        
+        Args:
+            user_id (int): The owner of the image
+            image_path (str): Where the image is stored
+            result (str): The ripeness result
+            analysis (str, optional): The analysis text
+            fruits (list, optional): For a multi-fruit image, a ((left, top, right, bottom), ripeness, confidence)
+                                     tuple per fruit, saved in the same transaction as the image
+            job_id (int, optional): The analysis job the result belongs to
+        
+        Returns:
+            int: The image_id of the new row, or of the job's existing row
+        
+        Raises:
+            UserNotFoundError: If the user doesn't exist
+        """
+        text, analysis = analysis, self.analysis_store.compress(analysis)
+        fts_enabled = self.fts_enabled
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        sql = ('INSERT INTO images (user_id, image_path, result, timestamp, analysis, job_id) '
+               'SELECT ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?) '
+               'ON CONFLICT (job_id) DO NOTHING')
+        parameters = (user_id, image_path, result, timestamp, analysis, job_id, user_id)
+        
+        def insert(conn):
+            cursor = conn.execute(sql, parameters)
+            if cursor.rowcount == 0:
+                # An earlier attempt of the job saved its result, its fruits came with it
+                row = (conn.execute('SELECT image_id FROM images WHERE job_id = ?', (job_id,)).fetchone()
+                       if job_id is not None else None)
+                if row is None:
+                    raise UserNotFoundError(user_id)
+                return row[0]
+            image_id = cursor.lastrowid
+            if fts_enabled:
+                # Indexed from the plain text, so no connection needs analysis_text() to write images
+                conn.execute('INSERT INTO images_fts (rowid, analysis, user_id) VALUES (?, ?, ?)',
+                             (image_id, text, user_id))
+            conn.executemany('INSERT INTO image_fruits (image_id, fruit_index, box_left, box_top, box_right, '
+                             'box_bottom, ripeness, confidence) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             [(image_id, index, *box, ripeness, confidence)
+                              for index, (box, ripeness, confidence) in enumerate(fruits or [], 1)])
+            return image_id
+        
+        if self.writer:
+            return self.writer.execute(insert)
+        
+        conn = self.connect()
+        try:
+            with conn:
+                image_id = insert(conn)
+        finally:
+            self.close()
+        return image_id
+    
+    def user_exists(self, user_id):
+        """
+        Check whether a user account exists
+        """
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,)).fetchone() is not None
+        finally:
+            self.close()
+    
     def get_user_images(self, user_id):
         """
         Get all images for a specific user
@@ -120,3 +436,168 @@ class Database:
         self.close()
         
         return images
+    
+    def get_user_images_page(self, user_id, limit=50, offset=0):
+        """
+        Get one page of a user's images, newest first
+        
+        Args:
+            user_id (int): The ID of the user
+            limit (int): The page size
+            offset (int): How many images to skip
+        
+        Returns:
+            tuple: (total, rows) with the number of images of the user and a page of
+                   (image_id, image_path, result, timestamp) tuples
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('SELECT COUNT(*) FROM images WHERE user_id = ?', (user_id,))
+            total = cursor.fetchone()[0]
+            # The image_id breaks ties between images saved in the same second, so pages don't overlap
+            cursor.execute('SELECT image_id, image_path, result, timestamp FROM images WHERE user_id = ? '
+                           'ORDER BY timestamp DESC, image_id DESC LIMIT ? OFFSET ?',
+                           (user_id, limit, offset))
+            rows = cursor.fetchall()
+        finally:
+            self.close()
+        
+        return total, rows
+    
+    def get_image_analysis(self, image_id):
+        """
+        Get the analysis text of an image
+        
+        Args:
+            image_id (int): The ID of the image
+            
+        Returns:
+            str or None: The analysis text, None if the image has none
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT analysis FROM images WHERE image_id = ?', (image_id,))
+        row = cursor.fetchone()
+        self.close()
+        
+        return self.analysis_store.decompress(row[0]) if row else None
+    
+    def get_image_fruits(self, image_id, user_id=None):
+        """
+        Get the fruits found in a multi-fruit image
+        
+        Args:
+            image_id (int): The ID of the image
+            user_id (int, optional): Only return them if the image belongs to this user
+        
+        Returns:
+            list: (fruit_index, (left, top, right, bottom), ripeness, confidence) tuples in fruit order,
+                  empty for a single-fruit image
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        sql = ('SELECT fruit_index, box_left, box_top, box_right, box_bottom, ripeness, confidence '
+               'FROM image_fruits WHERE image_id = ?')
+        params = (image_id,)
+        if user_id:
+            sql += ' AND image_id IN (SELECT image_id FROM images WHERE image_id = ? AND user_id = ?)'
+            params += (image_id, user_id)
+        cursor.execute(sql + ' ORDER BY fruit_index', params)
+        rows = cursor.fetchall()
+        self.close()
+        
+        return [(row[0], tuple(row[1:5]), row[5], row[6]) for row in rows]
+    
+    def get_fruit_counts(self, user_id):
+        """
+        Count a user's fruits by ripeness, over all their multi-fruit images
+        
+        Returns:
+            dict: Number of fruits per ripeness label
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT image_fruits.ripeness, COUNT(*) FROM image_fruits '
+                       'JOIN images ON images.image_id = image_fruits.image_id '
+                       'WHERE images.user_id = ? GROUP BY image_fruits.ripeness', (user_id,))
+        counts = dict(cursor.fetchall())
+        self.close()
+        
+        return counts
+    
+    def search_images(self, text, user_id=None, limit=50, offset=0):
+        """
+        Search the stored analysis text, best matches first
+        
+        Args:
+            text (str): The words to search for, all of them must appear
+            user_id (int, optional): Only search this user's images
+            limit (int): The page size
+            offset (int): How many matches to skip
+        
+        Returns:
+            tuple: (total, rows) with the number of matches and a page of
+                   (image_id, user_id, image_path, result, timestamp, snippet) tuples
+        """
+        if not self.fts_enabled:
+            return self._search_images_like(text, user_id, limit, offset)
+        
+        query = fts_query(text)
+        if query is None:
+            return 0, []
+        
+        if user_id:
+            query = f'user_id : "{int(user_id)}" AND analysis : ({query})'
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('SELECT COUNT(*) FROM images_fts WHERE images_fts MATCH ?', (query,))
+            total = cursor.fetchone()[0]
+            
+            # rank is bm25() over the analysis text, lower is a better match. CROSS JOIN keeps the
+            # full-text index as the outer loop, so the query runs once and not once per image.
+            cursor.execute("SELECT images.image_id, images.user_id, images.image_path, images.result, images.timestamp, "
+                           "snippet(images_fts, 0, '[', ']', '...', 12) "
+                           "FROM images_fts CROSS JOIN images ON images.image_id = images_fts.rowid "
+                           "WHERE images_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+                           (query, limit, offset))
+            rows = cursor.fetchall()
+        finally:
+            self.close()
+        
+        return total, rows
+    
+    def _search_images_like(self, text, user_id, limit, offset):
+        """
+        Search with LIKE scans, newest first, for SQLite builds without FTS5
+        """
+        words = [word.rstrip('*') for word in re.findall(r'\w+\*?', text)]
+        if not words:
+            return 0, []
+        
+        conditions = ' AND '.join(['analysis_text(analysis) LIKE ?'] * len(words))
+        params = tuple(f'%{word}%' for word in words)
+        if user_id:
+            conditions += ' AND user_id = ?'
+            params += (user_id,)
+        
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(f'SELECT COUNT(*) FROM images WHERE {conditions}', params)
+            total = cursor.fetchone()[0]
+            cursor.execute(f'SELECT image_id, user_id, image_path, result, timestamp, substr(analysis_text(analysis), 1, 80) '
+                           f'FROM images WHERE {conditions} ORDER BY timestamp DESC LIMIT ? OFFSET ?',
+                           params + (limit, offset))
+            rows = cursor.fetchall()
+        finally:
+            self.close()
+        
+        return total, rows
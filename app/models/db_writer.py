@@ -0,0 +1,259 @@
+"""
+Single writer thread with group commit for the SQLite database
+
+Analysis workers that finish at the same time would each take SQLite's
+write lock and sync the journal on their own, waiting in line behind each
+other and failing with "database is locked" once the line gets long. With
+the writer, callers submit their statement and get a future back. One
+thread owns the only writing connection: it takes the first waiting
+statement, collects more until max_batch statements are waiting or the
+first has waited max_wait_ms, runs them all in one transaction and
+resolves every caller's future once the commit is on disk. A statement
+that fails only fails its own future, the rest of the group is committed.
+Writes of several statements that belong together, such as an image and
+its fruits, are submitted as one function that runs in a savepoint.
+
+A caller must not wait for a future while it holds a write transaction on
+another connection to the same database, the writer would wait for that
+transaction to end.
+"""
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from utils.logger import logger
+from utils.metrics import Histogram
+
+class DatabaseWriter:
+    """
+    Runs the write statements of all threads on one connection, committing them in groups
+    """
+    
+    def __init__(self, db_path='data/fruit_app.db', max_batch=None, max_wait_ms=None):
+        """
+        Options that are not given are read from the environment
+        (FRUIT_APP_DB_WRITER_BATCH, FRUIT_APP_DB_WRITER_WAIT_MS).
+        
+        Args:
+            db_path (str): Path to the SQLite database file
+            max_batch (int, optional): Most statements committed together
+            max_wait_ms (float, optional): How long the first statement of a group waits for others,
+                                           statements queued during the previous commit never wait
+        """
+        self.db_path = db_path
+        self.max_batch = int(max_batch or os.getenv('FRUIT_APP_DB_WRITER_BATCH', 256))
+        self.max_wait_ms = float(max_wait_ms if max_wait_ms is not None
+                                 else os.getenv('FRUIT_APP_DB_WRITER_WAIT_MS', 0))
+        
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self.stats = {"commits": 0, "writes": 0, "failed_writes": 0, "failed_commits": 0, "max_batch": 0}
+        # Time from submitting a statement to its commit, and the time the commits take
+        self.latency = Histogram()
+        self.commit_ms = Histogram()
+        
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+    
+    def submit(self, sql, parameters=()):
+        """
+        Queue a write statement for the next group commit
+        
+        Args:
+            sql (str or callable): The statement, or a function taking the writer's connection that
+                                   runs several statements and returns the future's result.
+                                   If the function raises, none of its statements are committed.
+            parameters (tuple): The statement's parameters
+        
+        Returns:
+            concurrent.futures.Future: Resolves to the statement's lastrowid, or the function's
+                                       return value, once committed
+        """
+        if self._closed:
+            raise RuntimeError("DatabaseWriter is closed")
+        
+        future = Future()
+        self._queue.put((sql, parameters, future, time.monotonic()))
+        return future
+    
+    def execute(self, sql, parameters=()):
+        """
+        Run a write statement through the writer and wait for its commit
+        
+        Returns:
+            int: The statement's lastrowid, or the function's return value
+        """
+        return self.submit(sql, parameters).result()
+    
+    def _collect(self):
+        """
+        Wait for the next group
+        
+        Returns:
+            list: (sql, parameters, future, submitted) tuples, or None once closed and drained
+        """
+        item = self._queue.get()
+        if item is None:
+            return None
+        
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Commit what we have, then stop on the next call
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+    
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+    
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                batch = self._collect()
+                if batch is None:
+                    return
+                self._commit(conn, batch)
+        finally:
+            conn.close()
+    
+    def _commit(self, conn, batch):
+        """
+        Run one group in a transaction and resolve its futures
+        """
+        start = time.monotonic()
+        results = []
+        failed = 0
+        commit_failed = False
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for sql, parameters, future, _ in batch:
+                try:
+                    if callable(sql):
+                        results.append((future, self._run_function(conn, sql)))
+                    else:
+                        results.append((future, conn.execute(sql, parameters).lastrowid))
+                except Exception as e:
+                    # SQLite undoes just the failed statement or savepoint, unless it had to give up the whole transaction
+                    if not conn.in_transaction:
+                        raise
+                    future.set_exception(e)
+                    failed += 1
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.error("Group commit of %d writes failed: %s", len(batch), e)
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            results = []
+            failed = len(batch)
+            commit_failed = True
+        
+        end = time.monotonic()
+        for future, lastrowid in results:
+            future.set_result(lastrowid)
+        with self._lock:
+            self.stats["commits"] += 1
+            self.stats["writes"] += len(batch)
+            self.stats["failed_writes"] += failed
+            self.stats["failed_commits"] += commit_failed
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+            self.commit_ms.record((end - start) * 1000)
+            for _, _, _, submitted in batch:
+                self.latency.record((end - submitted) * 1000)
+    
+    def _run_function(self, conn, function):
+        """
+        Run a submitted function in a savepoint, so that it either writes all its statements or none
+        """
+        conn.execute('SAVEPOINT write_function')
+        try:
+            result = function(conn)
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK TO write_function')
+                conn.execute('RELEASE write_function')
+            raise
+        conn.execute('RELEASE write_function')
+        return result
+    
+    def get_stats(self):
+        """
+        Get the group commit counters
+        
+        Returns:
+            dict: Commit and write counts, the mean and largest group, the queued statements
+                  and summaries of the write latency and of the commit time
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["latency"] = self.latency.summary()
+            stats["commit"] = self.commit_ms.summary()
+        stats["mean_batch"] = round(stats["writes"] / stats["commits"], 2) if stats["commits"] else 0.0
+        stats["queued"] = self._queue.qsize()
+        return stats
+    
+    def close(self):
+        """
+        Stop accepting statements, commit the ones still queued and stop the thread
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_database_writer(db_path='data/fruit_app.db'):
+    """
+    Get the shared writer of a database, so a process has one writing connection per database
+    
+    Args:
+        db_path (str): Path to the SQLite database file
+    
+    Returns:
+        DatabaseWriter: The writer
+    """
+    key = os.path.abspath(db_path)
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = DatabaseWriter(db_path)
+        return _writers[key]
+
+def _forget_database_writers():
+    """
+    Drop the writers inherited by a forked child process, their threads were not copied into it
+    """
+    global _writers_lock
+    _writers.clear()
+    _writers_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_database_writers)
+
+@atexit.register
+def close_database_writers():
+    """
+    Commit the queued statements of every writer before the process exits
+    """
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
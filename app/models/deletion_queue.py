@@ -0,0 +1,234 @@
+import sqlite3
+import os
+import datetime
+from app.models.analysis_store import get_analysis_store
+from app.models.database import unindex_images
+
+class DeletionQueue:
+    """
+    Durable record of user deletions that are carried out in the background
+    
+    Deleting a user removes the user row at once, so the account disappears
+    and cannot log in, and records a deletion job. The user's images, files
+    and analysis jobs are then removed in small chunks, each in its own short
+    transaction that also advances the job's progress, so a deletion that was
+    interrupted continues where it stopped.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    
+    def __init__(self, db_path='data/fruit_app.db'):
+        """
+        Initialize the deletion queue
+        
+        Args:
+            db_path (str): Path to the SQLite database file
+        """
+        # Ensure the directory exists
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        
+        self.db_path = db_path
+        self.create_tables()
+    
+    def connect(self):
+        """
+        Create a new connection to the SQLite database
+        
+        A fresh connection is returned on every call so that the queue can be
+        shared between threads. Transactions are managed explicitly.
+        """
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+    
+    def create_tables(self):
+        """
+        Create the deletion jobs table if it doesn't exist
+        """
+        conn = self.connect()
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS deletion_jobs (
+                deletion_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                username TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total_images INTEGER NOT NULL,
+                deleted_images INTEGER NOT NULL DEFAULT 0,
+                deleted_files INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_deletion_jobs_status ON deletion_jobs (status)')
+        finally:
+            conn.close()
+    
+    def _timestamp(self):
+        """
+        Get the current time formatted like the rest of the database
+        """
+        return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    def create(self, user_id):
+        """
+        Remove a user's account and record the deletion of their data
+        
+        Args:
+            user_id (int): The ID of the user
+        
+        Returns:
+            int or None: The ID of the deletion job, None if the user doesn't exist
+        """
+        timestamp = self._timestamp()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            user = conn.execute('SELECT username FROM users WHERE user_id = ?', (user_id,)).fetchone()
+            if user is None:
+                conn.execute('COMMIT')
+                return None
+            
+            # Served by the index on images.user_id
+            total_images, = conn.execute('SELECT COUNT(*) FROM images WHERE user_id = ?', (user_id,)).fetchone()
+            cursor = conn.execute(
+                'INSERT INTO deletion_jobs (user_id, username, status, total_images, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (user_id, user[0], self.PENDING, total_images, timestamp, timestamp))
+            conn.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+            conn.execute('COMMIT')
+            return cursor.lastrowid
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+    
+    def get_unfinished(self):
+        """
+        Get the deletions that still have work left, oldest first
+        
+        Returns:
+            list: (deletion_id, user_id) tuples
+        """
+        conn = self.connect()
+        try:
+            return conn.execute(
+                'SELECT deletion_id, user_id FROM deletion_jobs WHERE status IN (?, ?) ORDER BY deletion_id',
+                (self.PENDING, self.RUNNING)).fetchall()
+        finally:
+            conn.close()
+    
+    def next_chunk(self, user_id, chunk_size):
+        """
+        Get the next images of a user to delete
+        
+        Returns:
+            list: (image_id, image_path) tuples, empty when all images are gone
+        """
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT image_id, image_path FROM images WHERE user_id = ? LIMIT ?',
+                                (user_id, chunk_size)).fetchall()
+        finally:
+            conn.close()
+    
+    def delete_chunk(self, deletion_id, image_ids, deleted_files):
+        """
+        Delete a chunk of image rows and record the progress in the same short transaction
+        
+        Args:
+            deletion_id (int): The ID of the deletion job
+            image_ids (list): The rows to delete
+            deleted_files (int): How many of their files were removed
+        """
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            condition = f"image_id IN ({','.join('?' * len(image_ids))})"
+            unindex_images(conn, get_analysis_store(self.db_path), condition, image_ids)
+            cursor = conn.execute(f"DELETE FROM images WHERE {condition}", image_ids)
+            conn.execute(
+                'UPDATE deletion_jobs SET status = ?, deleted_images = deleted_images + ?, '
+                'deleted_files = deleted_files + ?, updated_at = ? WHERE deletion_id = ?',
+                (self.RUNNING, cursor.rowcount, deleted_files, self._timestamp(), deletion_id))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+    
+    def delete_analysis_jobs(self, user_id, chunk_size):
+        """
+        Delete a chunk of a user's analysis jobs
+        
+        Returns:
+            int: How many jobs were deleted, 0 when none are left
+        """
+        conn = self.connect()
+        try:
+            has_jobs = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'jobs'").fetchone()
+            if not has_jobs:
+                return 0
+            cursor = conn.execute(
+                'DELETE FROM jobs WHERE job_id IN (SELECT job_id FROM jobs WHERE user_id = ? LIMIT ?)',
+                (user_id, chunk_size))
+            return cursor.rowcount
+        finally:
+            conn.close()
+    
+    def finish(self, deletion_id, user_id):
+        """
+        Mark a deletion as done, unless rows of the user were written while it ran
+        
+        Returns:
+            bool: True if the deletion is done, False if the user still has images or jobs to delete
+        """
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            has_jobs = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'jobs'").fetchone()
+            if (conn.execute('SELECT 1 FROM images WHERE user_id = ? LIMIT 1', (user_id,)).fetchone() or
+                    has_jobs and conn.execute('SELECT 1 FROM jobs WHERE user_id = ? LIMIT 1', (user_id,)).fetchone()):
+                conn.execute('COMMIT')
+                return False
+            conn.execute('UPDATE deletion_jobs SET status = ?, last_error = NULL, updated_at = ? WHERE deletion_id = ?',
+                         (self.DONE, self._timestamp(), deletion_id))
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+    
+    def record_error(self, deletion_id, error):
+        """
+        Remember why a deletion stopped, it stays unfinished and is retried on the next resume
+        """
+        conn = self.connect()
+        try:
+            conn.execute('UPDATE deletion_jobs SET last_error = ?, updated_at = ? WHERE deletion_id = ?',
+                         (str(error), self._timestamp(), deletion_id))
+        finally:
+            conn.close()
+    
+    def get_job(self, deletion_id):
+        """
+        Get the progress of a deletion
+        
+        Returns:
+            tuple or None: (deletion_id, user_id, username, status, total_images, deleted_images,
+                           deleted_files, last_error)
+        """
+        conn = self.connect()
+        try:
+            return conn.execute(
+                'SELECT deletion_id, user_id, username, status, total_images, deleted_images, deleted_files, '
+                'last_error FROM deletion_jobs WHERE deletion_id = ?', (deletion_id,)).fetchone()
+        finally:
+            conn.close()
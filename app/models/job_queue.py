@@ -0,0 +1,285 @@
+import sqlite3
+import os
+import time
+import datetime
+
+class JobQueue:
+    """
+    Durable queue of analysis jobs stored in the application's SQLite database
+    
+    Jobs are leased by a worker for a limited time. A lease that is not
+    completed before it expires (for example because the application was
+    closed mid-analysis) makes the job available again, so work is never lost.
+    """
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    def __init__(self, db_path='data/fruit_app.db', lease_seconds=120, max_attempts=3, retry_backoff=5.0):
+        """
+        Initialize the job queue
+        
+        Args:
+            db_path (str): Path to the SQLite database file
+            lease_seconds (float): How long a leased job stays reserved for its worker
+            max_attempts (int): How many times a job is tried before it is marked failed
+            retry_backoff (float): Base delay in seconds before a failed job is retried
+        """
+        # Ensure the directory exists
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.create_tables()
+    
+    def connect(self):
+        """
+        Create a new connection to the SQLite database
+        
+        A fresh connection is returned on every call so that the queue can be
+        shared between threads. Transactions are managed explicitly.
+        """
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+    
+    def create_tables(self):
+        """
+        Create the jobs table if it doesn't exist
+        """
+        conn = self.connect()
+        try:
+            # WAL lets workers read the queue while another process writes to it
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                image_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                available_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_expires REAL,
+                result TEXT,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_user_id ON jobs (user_id)')
+        finally:
+            conn.close()
+    
+    def _timestamp(self):
+        """
+        Get the current time formatted like the rest of the database
+        """
+        return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    def enqueue(self, user_id, image_path, worker_id=None):
+        """
+        Add a job to the queue
+        
+        Args:
+            user_id (int): The ID of the user who owns the image
+            image_path (str): The path of the saved image to analyze
+            worker_id (str, optional): If given, the job is created already leased
+                                       by this worker so nobody else picks it up
+        
+        Returns:
+            int: The ID of the new job
+        """
+        now = time.time()
+        timestamp = self._timestamp()
+        
+        if worker_id:
+            status, attempts, lease_expires = self.LEASED, 1, now + self.lease_seconds
+        else:
+            status, attempts, lease_expires = self.PENDING, 0, None
+        
+        conn = self.connect()
+        try:
+            cursor = conn.execute(
+                'INSERT INTO jobs (user_id, image_path, status, attempts, max_attempts, available_at, '
+                'lease_owner, lease_expires, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (user_id, image_path, status, attempts, self.max_attempts, now,
+                 worker_id, lease_expires, timestamp, timestamp))
+            return cursor.lastrowid
+        finally:
+            conn.close()
+    
+    def lease(self, worker_id):
+        """
+        Lease the next available job
+        
+        Pending jobs are handed out in FIFO order. Jobs whose lease has expired
+        are handed out again, or marked failed once they have used up their
+        attempts. The lease is taken inside an IMMEDIATE transaction, so two
+        workers can never lease the same job.
+        
+        Args:
+            worker_id (str): A unique identifier of the leasing worker
+        
+        Returns:
+            tuple or None: (job_id, user_id, image_path, attempts) or None if the queue is empty
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            
+            # Give up on abandoned jobs that have no attempts left
+            conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires = NULL, "
+                "last_error = 'Lease expired', updated_at = ? "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts",
+                (self.FAILED, self._timestamp(), self.LEASED, now))
+            
+            row = conn.execute(
+                'SELECT job_id, user_id, image_path, attempts FROM jobs '
+                'WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires < ?) '
+                'ORDER BY job_id LIMIT 1',
+                (self.PENDING, now, self.LEASED, now)).fetchone()
+            
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            
+            job_id, user_id, image_path, attempts = row
+            conn.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, '
+                'lease_expires = ?, updated_at = ? WHERE job_id = ?',
+                (self.LEASED, worker_id, now + self.lease_seconds, self._timestamp(), job_id))
+            conn.execute('COMMIT')
+            return job_id, user_id, image_path, attempts + 1
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+    
+    def extend_lease(self, job_id, worker_id):
+        """
+        Extend the lease of a job that is still being worked on
+        
+        Returns:
+            bool: True if the worker still holds the lease, False otherwise
+        """
+        conn = self.connect()
+        try:
+            cursor = conn.execute(
+                'UPDATE jobs SET lease_expires = ?, updated_at = ? '
+                'WHERE job_id = ? AND status = ? AND lease_owner = ?',
+                (time.time() + self.lease_seconds, self._timestamp(), job_id, self.LEASED, worker_id))
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+    
+    def complete(self, job_id, worker_id, result):
+        """
+        Mark a leased job as done
+        
+        Args:
+            job_id (int): The ID of the job
+            worker_id (str): The worker holding the lease
+            result (str): The ripeness classification result
+        
+        Returns:
+            bool: True if the job was completed, False if the lease was lost
+        """
+        conn = self.connect()
+        try:
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, lease_owner = NULL, lease_expires = NULL, '
+                'last_error = NULL, updated_at = ? WHERE job_id = ? AND status = ? AND lease_owner = ?',
+                (self.DONE, result, self._timestamp(), job_id, self.LEASED, worker_id))
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+    
+    def fail(self, job_id, worker_id, error):
+        """
+        Record a failed attempt of a leased job
+        
+        The job is scheduled for a retry with exponential backoff, or marked
+        failed if it has no attempts left.
+        
+        Args:
+            job_id (int): The ID of the job
+            worker_id (str): The worker holding the lease
+            error (str): A description of the failure
+        
+        Returns:
+            bool: True if the job will be retried, False otherwise
+        """
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT attempts, max_attempts FROM jobs WHERE job_id = ? AND status = ? AND lease_owner = ?',
+                (job_id, self.LEASED, worker_id)).fetchone()
+            
+            if row is None:
+                # The lease was lost, another worker owns the job now
+                conn.execute('COMMIT')
+                return False
+            
+            attempts, max_attempts = row
+            retry = attempts < max_attempts
+            if retry:
+                available_at = time.time() + self.retry_backoff * (2 ** (attempts - 1))
+                conn.execute(
+                    'UPDATE jobs SET status = ?, available_at = ?, lease_owner = NULL, lease_expires = NULL, '
+                    'last_error = ?, updated_at = ? WHERE job_id = ?',
+                    (self.PENDING, available_at, str(error), self._timestamp(), job_id))
+            else:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires = NULL, '
+                    'last_error = ?, updated_at = ? WHERE job_id = ?',
+                    (self.FAILED, str(error), self._timestamp(), job_id))
+            conn.execute('COMMIT')
+            return retry
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+    
+    def get_job(self, job_id):
+        """
+        Get a single job
+        
+        Returns:
+            tuple or None: (job_id, user_id, image_path, status, attempts, result, last_error)
+        """
+        conn = self.connect()
+        try:
+            return conn.execute(
+                'SELECT job_id, user_id, image_path, status, attempts, result, last_error FROM jobs WHERE job_id = ?',
+                (job_id,)).fetchone()
+        finally:
+            conn.close()
+    
+    def get_status_counts(self):
+        """
+        Get the number of jobs in each status
+        
+        Returns:
+            dict: A mapping of status to job count
+        """
+        conn = self.connect()
+        try:
+            rows = conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        finally:
+            conn.close()
+        
+        counts = {self.PENDING: 0, self.LEASED: 0, self.DONE: 0, self.FAILED: 0}
+        counts.update(dict(rows))
+        return counts
@@ -1,18 +1,24 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from app.models.database import Database
+from app.controllers.storage_reconciler import StorageReconciler
+from app.models.database import Database, unindex_images
+
+# Search matches shown per page in the images tab
+SEARCH_PAGE_SIZE = 100
 
 class AdminView(tk.Toplevel):
-    def __init__(self, parent):
+    def __init__(self, parent, controller):
         """
         Initialize the admin view
         
         Args:
             parent: The parent widget
+            controller: The main controller
         """
         tk.Toplevel.__init__(self, parent)
         self.title("Admin Panel")
         self.geometry("800x500")
+        self.controller = controller
         self.db = Database()
         
         # Create a notebook (tabbed interface)
@@ -87,7 +93,15 @@ class AdminView(tk.Toplevel):
         ttk.Button(button_frame, text="Update User", command=self._update_user).pack(side="left", padx=5)
         ttk.Button(button_frame, text="Delete User", command=self._delete_user).pack(side="left", padx=5)
         ttk.Button(button_frame, text="Add New User", command=self._add_user).pack(side="left", padx=5)
-        ttk.Button(button_frame, text="Refresh", command=self._load_users).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Refresh", command=lambda: self._load_users(refresh=True)).pack(side="left", padx=5)
+        
+        # User cache counters
+        self.cache_stats_var = tk.StringVar()
+        ttk.Label(self.user_details_frame, textvariable=self.cache_stats_var, foreground="gray").grid(row=5, column=0, columnspan=2, pady=5)
+        
+        # Progress of background user deletions
+        self.deletion_var = tk.StringVar()
+        ttk.Label(self.user_details_frame, textvariable=self.deletion_var, foreground="gray").grid(row=6, column=0, columnspan=2, pady=5)
         
         # Load the users
         self._load_users()
@@ -96,6 +110,21 @@ class AdminView(tk.Toplevel):
         """
         Set up the images tab
         """
+        # Search over the stored analyses of all users
+        search_frame = ttk.Frame(self.images_frame)
+        search_frame.pack(fill="x", padx=5, pady=(5, 0))
+        self.search_var = tk.StringVar()
+        self.search_status_var = tk.StringVar()
+        self.search_offset, self.search_total = 0, 0
+        search_entry = ttk.Entry(search_frame, textvariable=self.search_var)
+        search_entry.pack(side="left", fill="x", expand=True)
+        search_entry.bind("<Return>", lambda event: self._search_images())
+        ttk.Button(search_frame, text="Search", command=self._search_images).pack(side="left", padx=5)
+        ttk.Button(search_frame, text="Previous",
+                   command=lambda: self._search_images(max(0, self.search_offset - SEARCH_PAGE_SIZE))).pack(side="left")
+        ttk.Button(search_frame, text="Next", command=self._next_search_page).pack(side="left", padx=5)
+        ttk.Label(self.images_frame, textvariable=self.search_status_var, foreground="gray").pack(anchor="w", padx=5)
+        
         # Create a frame for the image list
         self.images_list_frame = ttk.Frame(self.images_frame)
         self.images_list_frame.pack(fill="both", expand=True, padx=5, pady=5)
@@ -123,32 +152,37 @@ class AdminView(tk.Toplevel):
         
         ttk.Button(button_frame, text="Refresh", command=self._load_images).pack(side="left", padx=5)
         ttk.Button(button_frame, text="Delete Selected", command=self._delete_image).pack(side="left", padx=5)
+        self.reconcile_button = ttk.Button(button_frame, text="Clean Up Storage", command=self._reconcile_storage)
+        self.reconcile_button.pack(side="left", padx=5)
+        
+        # Storage clean-up progress
+        self.reconcile_var = tk.StringVar()
+        ttk.Label(self.images_frame, textvariable=self.reconcile_var, foreground="gray").pack(pady=(0, 5))
+        self.reconciler = None
         
         # Load the images
         self._load_images()
     
-    def _load_users(self):
+    def _load_users(self, refresh=False):
         """
-        Load the users from the database
+        Load the users through the controller's user cache
+        
+        Args:
+            refresh (bool): Drop the cached users and query the database again
         """
         # Clear the treeview
         for item in self.users_tree.get_children():
             self.users_tree.delete(item)
         
-        # Connect to the database
-        conn = self.db.connect()
-        cursor = conn.cursor()
-        
-        # Get all users
-        cursor.execute("SELECT user_id, username FROM users")
-        users = cursor.fetchall()
+        if refresh:
+            self.controller.invalidate_user_cache()
         
         # Add users to the treeview
-        for user in users:
+        for user in self.controller.get_all_users():
             self.users_tree.insert("", "end", values=user)
         
-        # Close the connection
-        self.db.close()
+        stats = self.controller.get_cache_stats()
+        self.cache_stats_var.set(f"User cache: {stats['queries_avoided']} queries avoided, {stats['misses']} misses")
     
     def _load_images(self):
         """
@@ -173,6 +207,40 @@ class AdminView(tk.Toplevel):
         # Close the connection
         self.db.close()
     
+    def _search_images(self, offset=0):
+        """
+        Show a page of the images whose analysis matches the search text, best matches first
+        
+        Args:
+            offset (int): How many matches to skip
+        """
+        text = self.search_var.get()
+        if not text.strip():
+            self.search_status_var.set("")
+            self._load_images()
+            return
+        
+        # Clear the treeview
+        for item in self.images_tree.get_children():
+            self.images_tree.delete(item)
+        
+        total, rows = self.db.search_images(text, limit=SEARCH_PAGE_SIZE, offset=offset)
+        self.search_offset, self.search_total = offset, total
+        for image_id, user_id, image_path, result, timestamp, _ in rows:
+            self.images_tree.insert("", "end", values=(image_id, user_id, image_path, result, timestamp))
+        
+        if total:
+            self.search_status_var.set(f"{total} matches, showing {offset + 1}-{offset + len(rows)}")
+        else:
+            self.search_status_var.set("No analyses match the search")
+    
+    def _next_search_page(self):
+        """
+        Show the next page of search matches, if there is one
+        """
+        if self.search_offset + SEARCH_PAGE_SIZE < self.search_total:
+            self._search_images(self.search_offset + SEARCH_PAGE_SIZE)
+    
     def _on_user_select(self, event):
         """
         Handle the user selection event
@@ -207,29 +275,15 @@ class AdminView(tk.Toplevel):
             messagebox.showerror("Error", "Username cannot be empty")
             return
         
-        # Connect to the database
-        conn = self.db.connect()
-        cursor = conn.cursor()
-        
         try:
-            # Update the user
-            if password:
-                cursor.execute("UPDATE users SET username = ?, password = ? WHERE user_id = ?", 
-                              (username, password, user_id))
-            else:
-                cursor.execute("UPDATE users SET username = ? WHERE user_id = ?", 
-                              (username, user_id))
-            
-            conn.commit()
+            # Update the user, this also invalidates the cached entry
+            self.controller.update_user(user_id, username, password or None)
             messagebox.showinfo("Success", "User updated successfully")
             
             # Reload the users
             self._load_users()
         except Exception as e:
             messagebox.showerror("Error", f"Error updating user: {e}")
-        finally:
-            # Close the connection
-            self.db.close()
     
     def _delete_user(self):
         """
@@ -246,19 +300,12 @@ class AdminView(tk.Toplevel):
         if not messagebox.askyesno("Confirm", "Are you sure you want to delete this user? This will also delete all their images."):
             return
         
-        # Connect to the database
-        conn = self.db.connect()
-        cursor = conn.cursor()
-        
         try:
-            # Delete the user's images
-            cursor.execute("DELETE FROM images WHERE user_id = ?", (user_id,))
-            
-            # Delete the user
-            cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-            
-            conn.commit()
-            messagebox.showinfo("Success", "User deleted successfully")
+            # The account goes now, the images are deleted in the background. This also invalidates the cached entry
+            deletion_id = self.controller.delete_user(user_id)
+            messagebox.showinfo("Success", "User deleted successfully. Their images are being removed in the background.")
+            if deletion_id is not None:
+                self.after(200, self._poll_deletion, deletion_id)
             
             # Clear the user details form
             self.user_id_var.set("")
@@ -270,9 +317,27 @@ class AdminView(tk.Toplevel):
             self._load_images()
         except Exception as e:
             messagebox.showerror("Error", f"Error deleting user: {e}")
-        finally:
-            # Close the connection
-            self.db.close()
+    
+    def _poll_deletion(self, deletion_id):
+        """
+        Show the progress of a background user deletion until it has finished
+        """
+        if not self.winfo_exists():
+            return
+        
+        progress = self.controller.get_deletion_progress(deletion_id)
+        if progress is None:
+            return
+        
+        if progress["status"] == "done":
+            self.deletion_var.set(f"Deleted {progress['username']}: {progress['deleted_images']} images removed")
+            self._load_images()
+        elif progress["last_error"]:
+            self.deletion_var.set(f"Deleting {progress['username']} stopped: {progress['last_error']}")
+        else:
+            self.deletion_var.set(f"Deleting {progress['username']}: "
+                                  f"{progress['deleted_images']} of {progress['total_images']} images removed")
+            self.after(500, self._poll_deletion, deletion_id)
     
     def _add_user(self):
         """
@@ -286,13 +351,9 @@ class AdminView(tk.Toplevel):
             messagebox.showerror("Error", "Please enter both username and password")
             return
         
-        # Create a temporary controller to use the register method with admin privileges
-        from app.controllers.main_controller import MainController
-        temp_controller = MainController()
-        
         try:
-            # Add the user with admin privileges (is_admin_creation=True)
-            success, error_message = temp_controller.auth_controller.register(username, password, is_admin_creation=True)
+            # Add the user with admin privileges
+            success, error_message = self.controller.add_user(username, password)
             
             if success:
                 messagebox.showinfo("Success", "User added successfully")
@@ -308,7 +369,7 @@ class AdminView(tk.Toplevel):
                 messagebox.showerror("Error", error_message or "Error adding user")
         except Exception as e:
             messagebox.showerror("Error", f"Error adding user: {e}")
-
+    
     
     def _delete_image(self):
         """
@@ -332,7 +393,8 @@ class AdminView(tk.Toplevel):
         cursor = conn.cursor()
         
         try:
-            # Delete the image
+            # Delete the image, and its analysis from the search index
+            unindex_images(conn, self.db.analysis_store, 'image_id = ?', (image_id,))
             cursor.execute("DELETE FROM images WHERE image_id = ?", (image_id,))
             
             conn.commit()
@@ -345,3 +407,43 @@ class AdminView(tk.Toplevel):
         finally:
             # Close the connection
             self.db.close()
+    
+    def _reconcile_storage(self):
+        """
+        Quarantine image files no longer referenced by the database, in the background
+        """
+        if not messagebox.askyesno("Confirm", "Move image files that no image record refers to into data/quarantine?"):
+            return
+        
+        self.reconcile_button.config(state="disabled")
+        self.reconciler = StorageReconciler(action=StorageReconciler.QUARANTINE)
+        self.reconciler.start()
+        self.after(200, self._poll_reconcile)
+    
+    def _poll_reconcile(self):
+        """
+        Show the clean-up progress until it has finished
+        """
+        if not self.winfo_exists():
+            return
+        
+        if self.reconciler.is_running():
+            progress = self.reconciler.get_progress()
+            self.reconcile_var.set(f"Cleaning up storage: {progress.get('scanned', 0)} files checked, "
+                                   f"{progress.get('handled', 0)} moved to quarantine")
+            self.after(200, self._poll_reconcile)
+            return
+        
+        self.reconcile_button.config(state="normal")
+        report = self.reconciler.report
+        if report is None:
+            self.reconcile_var.set("Storage clean-up failed, see the log")
+            return
+        
+        self.reconcile_var.set(f"Last clean-up: {report['handled']} of {report['scanned']} files moved to quarantine, "
+                               f"{report['missing_count']} records without a file")
+        message = f"{report['handled']} unreferenced files ({report['orphan_bytes'] // 1024} KB) were moved to data/quarantine."
+        if report['missing_count']:
+            message += f"\n\n{report['missing_count']} image records point at a file that no longer exists, for example:\n"
+            message += "\n".join(image_path for _, _, image_path in report['missing'][:5])
+        messagebox.showinfo("Storage Clean-Up", message)
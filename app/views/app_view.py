@@ -24,8 +24,8 @@ class AppView(tk.Tk):
         
         # Set application icon (if available)
         try:
-            icon_img = Image.open('resources/app_icon.png')
-            icon_photo = ImageTk.PhotoImage(icon_img)
+            with Image.open('resources/app_icon.png') as icon_img:
+                icon_photo = ImageTk.PhotoImage(icon_img)
             self.iconphoto(True, icon_photo)
         except Exception as e:
             print(f"Could not load icon: {e}")  # Icon not found, continue without it
@@ -33,6 +33,9 @@ class AppView(tk.Tk):
         # Initialize the main controller
         self.controller = MainController()
         
+        # Finish user deletions an earlier session left behind
+        self.controller.resume_user_deletions()
+        
         # Create a container for the frames
         self.container = ttk.Frame(self)
         self.container.pack(side="top", fill="both", expand=True, padx=20, pady=20)
@@ -32,8 +32,8 @@ class AuthView(tk.Frame):
         logo_path = os.path.join('resources', 'fruit_logo.png')
         if os.path.exists(logo_path):
             try:
-                logo_img = Image.open(logo_path)
-                logo_img = logo_img.resize((150, 150), Image.LANCZOS)
+                with Image.open(logo_path) as logo_img:
+                    logo_img = logo_img.resize((150, 150), Image.LANCZOS)
                 self.logo_photo = ImageTk.PhotoImage(logo_img)
                 logo_label = ttk.Label(self.image_frame, image=self.logo_photo, background=ThemeManager.COLORS["card"])
                 logo_label.pack()
@@ -1,8 +1,17 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk
+from PIL import ImageTk
 import os
+import queue
+import threading
 from utils.theme import ThemeManager
+from utils.image_loader import image_cache
+from utils.image_pool import resize_to_fit
+from utils.image_validator import ImageValidationError, image_validator
+from app.controllers.video_intake import VIDEO_EXTENSIONS
+
+# Search matches shown per page in the history window
+HISTORY_PAGE_SIZE = 50
 
 class MainView(tk.Frame):
     def __init__(self, parent, controller):
@@ -17,6 +26,7 @@ class MainView(tk.Frame):
         self.controller = controller
         self.parent = parent
         self.current_image_path = None
+        self.current_image_info = None  # Header information from the validator
         self.photo_image = None  # Keep a reference to prevent garbage collection
         
         # Configure the main view
@@ -77,6 +87,15 @@ class MainView(tk.Frame):
         )
         self.upload_button.pack(pady=(0, 15))
         
+        # Analyzes every fruit passing through a recording of the conveyor
+        self.video_button = ThemeManager.create_rounded_button(
+            self.left_frame, 
+            text="Analyze Video", 
+            command=self.analyze_video,
+            bg_color=ThemeManager.COLORS["secondary"]
+        )
+        self.video_button.pack(pady=(0, 15))
+        
         # Image display area - with a border and better styling
         self.image_frame = ttk.Frame(self.left_frame, style="Card.TFrame", width=400, height=300)
         self.image_frame.pack(fill="both", expand=True)
@@ -180,8 +199,8 @@ class MainView(tk.Frame):
         if username:
             self.welcome_label.config(text=f"Welcome, {username}!")
             
-            # Show admin button for admin users (in this case, just for 'admin' username)
-            if username.lower() == 'admin':
+            # Show admin button for admin users, the role comes from the controller's user cache
+            if self.controller.is_current_user_admin():
                 self.admin_button.pack(side="left", padx=5)
             else:
                 self.admin_button.pack_forget()
@@ -209,6 +228,7 @@ class MainView(tk.Frame):
         Reset the view to its initial state
         """
         self.current_image_path = None
+        self.current_image_info = None
         self.photo_image = None
         self.image_label.config(text="No image uploaded", image="")
         self.analyze_button.config(state="disabled")
@@ -224,6 +244,13 @@ class MainView(tk.Frame):
         )
         
         if file_path:
+            # Reject corrupt, oversized or disguised files from their headers, before decoding them
+            try:
+                self.current_image_info = image_validator.validate(file_path)
+            except ImageValidationError as e:
+                messagebox.showerror("Invalid Image", f"This image can't be analyzed: {e}")
+                return
+            
             self.current_image_path = file_path
             self.display_image(file_path)
             self.analyze_button.config(state="normal")
@@ -236,9 +263,8 @@ class MainView(tk.Frame):
             image_path (str): The path to the image file
         """
         try:
-            # Open the image and resize it to fit the frame
-            image = Image.open(image_path)
-            image = self.resize_image(image, 380, 300)
+            # Decode once at the analysis size, the analysis reuses the same buffer
+            image = self.resize_image(image_cache.get(image_path), 380, 300)
             
             # Convert to PhotoImage and display
             self.photo_image = ImageTk.PhotoImage(image)
@@ -258,57 +284,209 @@ class MainView(tk.Frame):
         Returns:
             PIL.Image: The resized image
         """
-        width, height = image.size
-        ratio = min(max_width / width, max_height / height)
-        new_width = int(width * ratio)
-        new_height = int(height * ratio)
-        return image.resize((new_width, new_height), Image.LANCZOS)
+        return resize_to_fit(image, max_width, max_height)
     
     def analyze_image(self):
         """
         Handle the analyze image button click
+        
+        The analysis runs on a background thread and reports its progress
+        through a queue polled by the Tk main loop, so the ripeness is shown
+        as soon as the model has decided it and the window stays responsive.
         """
         if not self.current_image_path:
             messagebox.showerror("Error", "Please upload an image first")
             return
         
+        # Only one analysis at a time
+        self.analyze_button.config(state="disabled")
+        self.upload_button.config(state="disabled")
+        self.result_label.config(text="Analyzing...", foreground=ThemeManager.COLORS["text_secondary"])
+        
+        updates = queue.Queue()
+        thread = threading.Thread(target=self._run_analysis, args=(self.current_image_path, updates), daemon=True)
+        thread.start()
+        self.after(50, self._poll_analysis, updates, None, None)
+    
+    def _run_analysis(self, image_path, updates):
+        """
+        Save and analyze an image on a background thread, posting progress to the queue
+        
+        Args:
+            image_path (str): The path to the image file
+            updates (queue.Queue): Receives (kind, value) tuples for the main loop
+        """
         try:
-            # Save and analyze the image
-            saved_path, result, analysis_details = self.controller.save_and_analyze_image(self.current_image_path)
-            
-            # Extract fruit name and condition from analysis_details if available
-            fruit_name = "Fruit"  # Default value
-            if analysis_details:
-                # Try to extract the fruit name from the analysis
-                lower_analysis = analysis_details.lower()
-                common_fruits = ["apple", "banana", "orange", "strawberry", "mango", "pear", "grape", "pineapple", "kiwi", "avocado", "watermelon", "peach", "plum", "cherry", "lemon", "lime", "blueberry", "raspberry"]
-                
-                for fruit in common_fruits:
-                    if fruit in lower_analysis:
-                        fruit_name = fruit.capitalize()
-                        break
-            
-            # Update the result label with styled text including fruit name
-            self.result_label.config(text=f"{fruit_name}: {result}", anchor="center", justify="center")
-            
-            # We'll hide the detailed analysis as requested
-            # If we previously had an analysis frame, hide it
-            if hasattr(self, 'analysis_frame'):
-                self.analysis_frame.pack_forget()
-            if hasattr(self, 'analysis_title'):
-                self.analysis_title.pack_forget()
+            saved_path, result, analysis_details = self.controller.save_and_analyze_image(
+                image_path,
+                on_ripeness=lambda ripeness: updates.put(("ripeness", ripeness)),
+                on_text=lambda text: updates.put(("text", text))
+            )
+            updates.put(("done", (result, analysis_details)))
+        except Exception as e:
+            updates.put(("error", e))
+    
+    def _poll_analysis(self, updates, ripeness, analysis_text):
+        """
+        Apply the progress of the background analysis, runs on the Tk main loop
+        
+        Args:
+            updates (queue.Queue): The progress queue of the running analysis
+            ripeness (str): The ripeness shown so far, or None
+            analysis_text (str): The analysis text received so far, or None
+        """
+        # Take everything that arrived since the last poll, only the latest text matters
+        finished = None
+        changed = False
+        while True:
+            try:
+                kind, value = updates.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "ripeness":
+                ripeness = value
+                changed = True
+            elif kind == "text":
+                analysis_text = value
+                changed = True
+            else:
+                finished = (kind, value)
+        
+        if finished is None:
+            if ripeness and changed:
+                self.show_result(ripeness, analysis_text)
+            self.after(50, self._poll_analysis, updates, ripeness, analysis_text)
+            return
+        
+        self.analyze_button.config(state="normal")
+        self.upload_button.config(state="normal")
+        kind, value = finished
+        if kind == "error":
+            self.result_label.config(text="No analysis performed yet")
+            messagebox.showerror("Error", f"Error analyzing image: {value}")
+            return
+        
+        result, analysis_details = value
+        fruit_name = self.show_result(result, analysis_details)
+        
+        # We'll hide the detailed analysis as requested
+        # If we previously had an analysis frame, hide it
+        if hasattr(self, 'analysis_frame'):
+            self.analysis_frame.pack_forget()
+        if hasattr(self, 'analysis_title'):
+            self.analysis_title.pack_forget()
+        
+        messagebox.showinfo("Analysis Complete", f"The {fruit_name.lower()} is {result.lower()}")
+    
+    def analyze_video(self):
+        """
+        Handle the analyze video button click
+        
+        Only frames with a new fruit in view are analyzed, on background
+        threads. The counts so far are shown while the video is read.
+        """
+        file_path = filedialog.askopenfilename(
+            title="Select Video",
+            filetypes=[("Video files", " ".join(f"*{extension}" for extension in VIDEO_EXTENSIONS))]
+        )
+        if not file_path:
+            return
+        
+        self.analyze_button.config(state="disabled")
+        self.upload_button.config(state="disabled")
+        self.video_button.config(state="disabled")
+        self.result_label.config(text="Reading video...", foreground=ThemeManager.COLORS["text_secondary"])
+        
+        updates = queue.Queue()
+        thread = threading.Thread(target=self._run_video_analysis, args=(file_path, updates), daemon=True)
+        thread.start()
+        self.after(100, self._poll_video_analysis, updates, {})
+    
+    def _run_video_analysis(self, video_path, updates):
+        """
+        Analyze the fruits of a video on a background thread, posting every result to the queue
+        
+        Args:
+            video_path (str): The path to the video file
+            updates (queue.Queue): Receives (kind, value) tuples for the main loop
+        """
+        try:
+            stats = self.controller.analyze_video(
+                video_path, on_result=lambda frame_index, saved_path, result: updates.put(("fruit", result)))
+            updates.put(("done", stats))
+        except Exception as e:
+            updates.put(("error", e))
+    
+    def _poll_video_analysis(self, updates, counts):
+        """
+        Show the fruits counted so far, runs on the Tk main loop
+        
+        Args:
+            updates (queue.Queue): The progress queue of the running video analysis
+            counts (dict): Fruits counted so far per ripeness
+        """
+        finished = None
+        while True:
+            try:
+                kind, value = updates.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "fruit":
+                counts[value] = counts.get(value, 0) + 1
+            else:
+                finished = (kind, value)
+        
+        summary = ", ".join(f"{count} {result}" for result, count in sorted(counts.items())) or "no fruit yet"
+        self.result_label.config(text=f"Video: {summary}")
+        if finished is None:
+            self.after(100, self._poll_video_analysis, updates, counts)
+            return
+        
+        self.analyze_button.config(state="normal" if self.current_image_path else "disabled")
+        self.upload_button.config(state="normal")
+        self.video_button.config(state="normal")
+        kind, value = finished
+        if kind == "error":
+            messagebox.showerror("Error", f"Error analyzing video: {value}")
+            return
+        messagebox.showinfo("Video Analysis Complete",
+                            f"{value['analyzed']} fruits analyzed from {value['decoded']} frames: {summary}")
+    
+    def show_result(self, result, analysis_details):
+        """
+        Show a ripeness result, with the fruit name if the analysis mentions one
+        
+        Args:
+            result (str): The ripeness classification result
+            analysis_details (str): The analysis text, possibly still incomplete
             
-            # Change the color based on the result
-            if result == "Ripe":
-                self.result_label.config(foreground=ThemeManager.COLORS["success"], font=("Helvetica", 12, "bold"))
-            elif result == "Unripe":
-                self.result_label.config(foreground=ThemeManager.COLORS["warning"], font=("Helvetica", 12, "bold"))
-            elif result == "Overripe":
-                self.result_label.config(foreground=ThemeManager.COLORS["error"], font=("Helvetica", 12, "bold"))
+        Returns:
+            str: The fruit name shown
+        """
+        # Extract fruit name and condition from analysis_details if available
+        fruit_name = "Fruit"  # Default value
+        if analysis_details:
+            # Try to extract the fruit name from the analysis
+            lower_analysis = analysis_details.lower()
+            common_fruits = ["apple", "banana", "orange", "strawberry", "mango", "pear", "grape", "pineapple", "kiwi", "avocado", "watermelon", "peach", "plum", "cherry", "lemon", "lime", "blueberry", "raspberry"]
             
-            messagebox.showinfo("Analysis Complete", f"The {fruit_name.lower()} is {result.lower()}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Error analyzing image: {e}")
+            for fruit in common_fruits:
+                if fruit in lower_analysis:
+                    fruit_name = fruit.capitalize()
+                    break
+        
+        # Update the result label with styled text including fruit name
+        self.result_label.config(text=f"{fruit_name}: {result}", anchor="center", justify="center")
+        
+        # Change the color based on the result
+        if result == "Ripe":
+            self.result_label.config(foreground=ThemeManager.COLORS["success"], font=("Helvetica", 12, "bold"))
+        elif result == "Unripe":
+            self.result_label.config(foreground=ThemeManager.COLORS["warning"], font=("Helvetica", 12, "bold"))
+        elif result == "Overripe":
+            self.result_label.config(foreground=ThemeManager.COLORS["error"], font=("Helvetica", 12, "bold"))
+        
+        return fruit_name
     
     def show_admin_panel(self):
         """
@@ -316,7 +494,7 @@ class MainView(tk.Frame):
         """
         try:
             from app.views.admin_view import AdminView
-            admin_view = AdminView(self)
+            admin_view = AdminView(self, self.controller)
         except Exception as e:
             messagebox.showerror("Error", f"Error showing admin panel: {e}")
     
@@ -411,20 +589,40 @@ class MainView(tk.Frame):
             # Create a new window for the history
             history_window = tk.Toplevel(self)
             history_window.title("Image History")
-            history_window.geometry("600x400")
+            history_window.geometry("800x450")
+            
+            # Search over the stored analyses, with paging through the matches
+            search_frame = ttk.Frame(history_window)
+            search_frame.pack(side="top", fill="x", padx=10, pady=(10, 5))
+            search_var = tk.StringVar()
+            status_var = tk.StringVar()
+            search_entry = ttk.Entry(search_frame, textvariable=search_var)
+            search_entry.pack(side="left", fill="x", expand=True)
             
             # Create a treeview to display the history
-            columns = ("ID", "Image", "Result", "Timestamp")
+            columns = ("ID", "Image", "Result", "Timestamp", "Match")
             tree = ttk.Treeview(history_window, columns=columns, show="headings")
             
             # Set column headings
             for col in columns:
                 tree.heading(col, text=col)
-                tree.column(col, width=100)
+                tree.column(col, width=300 if col == "Match" else 100)
+            
+            search = lambda offset=0: self._search_history(tree, status_var, search_var.get(), offset)
+            search_entry.bind("<Return>", lambda event: search())
+            ttk.Button(search_frame, text="Search", command=search).pack(side="left", padx=5)
+            ttk.Button(search_frame, text="Previous",
+                       command=lambda: search(max(0, self.history_offset - HISTORY_PAGE_SIZE))).pack(side="left")
+            ttk.Button(search_frame, text="Next",
+                       command=lambda: search(self.history_offset + HISTORY_PAGE_SIZE
+                                              if self.history_offset + HISTORY_PAGE_SIZE < self.history_total
+                                              else self.history_offset)).pack(side="left", padx=5)
+            ttk.Label(history_window, textvariable=status_var).pack(side="top", anchor="w", padx=10)
             
             # Add data to the treeview
+            self.history_offset, self.history_total = 0, len(images)
             for image_id, image_path, result, timestamp in images:
-                tree.insert("", "end", values=(image_id, os.path.basename(image_path), result, timestamp))
+                tree.insert("", "end", values=(image_id, os.path.basename(image_path), result, timestamp, ""))
             
             # Add scrollbar
             scrollbar = ttk.Scrollbar(history_window, orient="vertical", command=tree.yview)
@@ -439,3 +637,34 @@ class MainView(tk.Frame):
             close_button.pack(pady=10)
         except Exception as e:
             messagebox.showerror("Error", f"Error showing history: {e}")
+    
+    def _search_history(self, tree, status_var, text, offset):
+        """
+        Fill the history with a page of matches for the search text, best matches first
+        
+        Args:
+            tree (ttk.Treeview): The history list
+            status_var (tk.StringVar): Shows the number of matches
+            text (str): The words to search for, empty shows the whole history
+            offset (int): How many matches to skip
+        """
+        for item in tree.get_children():
+            tree.delete(item)
+        
+        if not text.strip():
+            images = self.controller.get_user_images()
+            self.history_offset, self.history_total = 0, len(images)
+            for image_id, image_path, result, timestamp in images:
+                tree.insert("", "end", values=(image_id, os.path.basename(image_path), result, timestamp, ""))
+            status_var.set("")
+            return
+        
+        total, rows = self.controller.search_user_images(text, HISTORY_PAGE_SIZE, offset)
+        self.history_offset, self.history_total = offset, total
+        for image_id, _, image_path, result, timestamp, snippet in rows:
+            tree.insert("", "end", values=(image_id, os.path.basename(image_path), result, timestamp,
+                                           " ".join(snippet.split())))
+        if total:
+            status_var.set(f"{total} matches, showing {offset + 1}-{offset + len(rows)}")
+        else:
+            status_var.set("No analyses match the search")
@@ -0,0 +1,123 @@
+"""
+Benchmark of the compressed analysis text store
+
+Writes the same synthetic analyses to a fresh database per storage mode:
+plain text as before compression, zlib and zstd without a dictionary, and
+both with a dictionary trained on the first analyses. Reports the stored
+bytes per analysis, the compression ratio, the database size (including the
+search index) and the latency of reading an analysis back and of a search
+that builds snippets from the text. Runs in a temporary directory; the zstd
+modes need the zstandard package.
+
+Usage:
+    python -m benchmarks.bench_analysis_store --rows 200000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from benchmarks.synthetic import generate_analysis
+from utils.metrics import percentile
+
+# (mode, codec, train a dictionary)
+MODES = [
+    ("plain", None, False),
+    ("zlib", "zlib", False),
+    ("zlib+dict", "zlib", True),
+    ("zstd", "zstd", False),
+    ("zstd+dict", "zstd", True),
+]
+
+def populate(db, analyses, codec, train, train_samples, users):
+    """
+    Write the analyses, training the dictionary after the first train_samples of them
+    
+    Returns:
+        float: Seconds taken, including the training and indexing
+    """
+    store = db.analysis_store
+    start = time.perf_counter()
+    conn = store.connect()
+    bounds = sorted(set(range(0, len(analyses), 20000)) | {train_samples, len(analyses)})
+    for first, last in zip(bounds, bounds[1:]):
+        if train and first == train_samples:
+            conn.commit()
+            store.train()
+        rows = []
+        for number in range(first, last):
+            ripeness, analysis = analyses[number]
+            stored = store.compress(analysis) if codec else analysis
+            rows.append((number % users + 1, f"data/images/{number:07d}.jpg", ripeness, '2025-01-01 00:00:00', stored))
+        conn.executemany('INSERT INTO images (user_id, image_path, result, timestamp, analysis) VALUES (?, ?, ?, ?, ?)',
+                         rows)
+    conn.commit()
+    conn.close()
+    if train:
+        # The first analyses were written before the dictionary existed
+        store.recompress()
+    db.rebuild_search_index()
+    return time.perf_counter() - start
+
+def run(mode, codec, train, analyses, args, tmp_dir):
+    # Imported here so each mode picks up its codec from the environment
+    from app.models.database import Database
+    
+    if codec:
+        os.environ['FRUIT_APP_ANALYSIS_CODEC'] = codec
+    # Training is done explicitly at a fixed point
+    os.environ['FRUIT_APP_ANALYSIS_TRAIN_AFTER'] = str(10 ** 12)
+    db = Database(os.path.join(tmp_dir, mode, 'fruit_app.db'))
+    elapsed = populate(db, analyses, codec, train, args.train_samples, args.users)
+    
+    stats = db.analysis_store.get_stats()
+    conn = db.connect()
+    conn.execute('VACUUM')
+    db.close()
+    size = os.path.getsize(db.db_path) / 1024 / 1024
+    
+    rng = random.Random(args.seed)
+    read_latencies = []
+    for _ in range(args.reads):
+        image_id = rng.randint(1, len(analyses))
+        start = time.perf_counter()
+        db.get_image_analysis(image_id)
+        read_latencies.append((time.perf_counter() - start) * 1000)
+    
+    search_latencies = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        db.search_images("brown spots", user_id=1, limit=50)
+        search_latencies.append((time.perf_counter() - start) * 1000)
+    return stats, size, elapsed, read_latencies, search_latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compressed analysis storage")
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--train-samples', type=int, default=2000, help="Analyses written before training")
+    parser.add_argument('--reads', type=int, default=2000)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    from app.models import analysis_store
+    rng = random.Random(args.seed)
+    analyses = [generate_analysis(rng) for _ in range(args.rows)]
+    text_bytes = sum(len(analysis.encode('utf-8')) for _, analysis in analyses)
+    print(f"{args.rows} analyses, {text_bytes / args.rows:.0f} bytes of text each on average\n")
+    
+    print(f"{'mode':<10} {'bytes/row':>10} {'ratio':>6} {'db MB':>7} {'write s':>8} {'read p50 ms':>12} "
+          f"{'read p99 ms':>12} {'search p50 ms':>14}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode, codec, train in MODES:
+            if codec == analysis_store.ZSTD and analysis_store.zstandard is None:
+                print(f"{mode:<10} skipped, the zstandard package is not installed")
+                continue
+            stats, size, elapsed, reads, searches = run(mode, codec, train, analyses, args, tmp_dir)
+            print(f"{mode:<10} {stats['stored_bytes'] / args.rows:>10.0f} {stats['ratio']:>6.2f} {size:>7.1f} "
+                  f"{elapsed:>8.1f} {percentile(reads, 50):>12.3f} {percentile(reads, 99):>12.3f} "
+                  f"{percentile(searches, 50):>14.1f}")
+
+if __name__ == "__main__":
+    main()
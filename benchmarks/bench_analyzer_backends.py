@@ -0,0 +1,78 @@
+"""
+Offline benchmark of the GUI analysis path with the local analyzer backends
+
+Drives MainController.save_and_analyze_image, exactly as the Analyze button
+does, against the in-process 'stub' backend and the 'http' backend talking
+to a local stub server. Runs in a temporary working directory so the real
+database and image store are untouched.
+
+Usage:
+    python -m benchmarks.bench_analyzer_backends --images 50 --latency-ms 30
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from benchmarks.synthetic import write_image_set
+from utils.analyzer_backends import HttpBackend, StubBackend, set_analyzer
+from utils.metrics import percentile
+from utils.stub_server import StubServer
+
+def run_pipeline(paths):
+    """
+    Save and analyze every image through a fresh MainController
+    
+    Returns:
+        list: The latency of each image in milliseconds
+    """
+    # Imported here so the controller picks up the temporary working directory
+    from app.controllers.main_controller import MainController
+    
+    controller = MainController()
+    controller.register_user('bench', 'bench')
+    controller.login_user('bench', 'bench')
+    
+    latencies = []
+    for path in paths:
+        start = time.perf_counter()
+        controller.save_and_analyze_image(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline offline")
+    parser.add_argument('--images', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            paths = write_image_set('input', args.images, (640, 480))
+            
+            stub = StubBackend(latency_ms=args.latency_ms, seed=args.seed)
+            server = StubServer(('127.0.0.1', 0), StubBackend(latency_ms=args.latency_ms, seed=args.seed))
+            server.start_in_thread()
+            
+            for name, backend in [("stub", stub), ("http", HttpBackend(url=server.url))]:
+                set_analyzer(backend)
+                latencies = run_pipeline(paths)
+                print(json.dumps({
+                    "backend": name,
+                    "images": len(paths),
+                    "p50_ms": round(percentile(latencies, 50), 2),
+                    "p95_ms": round(percentile(latencies, 95), 2),
+                    "p99_ms": round(percentile(latencies, 99), 2),
+                    "images_per_second": round(len(paths) / (sum(latencies) / 1000), 1),
+                }))
+            
+            server.shutdown()
+            set_analyzer(None)
+        finally:
+            os.chdir(original_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Offline benchmark of micro-batched analysis against one call per image
+
+Client threads analyze synthetic images through the 'http' backend talking
+to a local stub server, first one request per image and then through a
+MicroBatcher at several batch sizes. The stub server limits how many calls
+it serves at once, like a provider quota, and charges a fixed cost per call
+plus a small cost per extra image.
+
+Every batched result is checked against the unbatched result of the same
+image, so the run fails if results are routed back to the wrong caller.
+
+Usage:
+    python -m benchmarks.bench_batching --clients 16 --images 160
+    python -m benchmarks.bench_batching --batch-sizes 4,8,16 --wait-ms 20 --max-concurrent 2
+"""
+import argparse
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.synthetic import write_image_set
+from utils.analyzer_backends import HttpBackend, StubBackend
+from utils.metrics import percentile
+from utils.micro_batcher import BatchingBackend
+from utils.stub_server import StubServer
+
+def run_clients(backend, paths, clients):
+    """
+    Analyze every image from a pool of client threads
+    
+    Returns:
+        tuple: (results in path order, latencies in milliseconds, elapsed seconds)
+    """
+    def analyze(path):
+        start = time.perf_counter()
+        result = backend.analyze(path)
+        return result, (time.perf_counter() - start) * 1000
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        outcomes = list(pool.map(analyze, paths))
+    elapsed = time.perf_counter() - start
+    return [result for result, _ in outcomes], [latency for _, latency in outcomes], elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched analysis offline")
+    parser.add_argument('--images', type=int, default=160)
+    parser.add_argument('--clients', type=int, default=16, help="Concurrent client threads")
+    parser.add_argument('--batch-sizes', default='4,8,16', help="Comma separated batch sizes")
+    parser.add_argument('--wait-ms', type=float, default=20.0, help="Longest wait for a batch to fill")
+    parser.add_argument('--latency-ms', type=float, default=100.0, help="Stub latency of every call")
+    parser.add_argument('--per-image-ms', type=float, default=5.0, help="Stub latency of every extra image in a call")
+    parser.add_argument('--max-concurrent', type=int, default=4, help="Calls the stub serves at once")
+    args = parser.parse_args()
+    
+    server_backend = StubBackend(latency_ms=args.latency_ms, per_image_ms=args.per_image_ms,
+                                 max_concurrent=args.max_concurrent, seed=0)
+    server = StubServer(('127.0.0.1', 0), server_backend)
+    server.start_in_thread()
+    http = HttpBackend(url=server.url)
+    
+    rows = []
+    mismatches = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = write_image_set(tmp_dir, args.images, (320, 240))
+        
+        calls = server_backend.calls
+        expected, latencies, elapsed = run_clients(http, paths, args.clients)
+        rows.append(("unbatched", latencies, elapsed, server_backend.calls - calls, 1.0))
+        
+        for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+            backend = BatchingBackend(http, max_batch_size=batch_size, max_wait_ms=args.wait_ms,
+                                      max_in_flight=args.max_concurrent)
+            calls = server_backend.calls
+            results, latencies, elapsed = run_clients(backend, paths, args.clients)
+            backend.batcher.close()
+            rows.append((f"batch of {batch_size}", latencies, elapsed, server_backend.calls - calls,
+                         backend.get_stats()["mean_batch_size"]))
+            
+            for path, result, reference in zip(paths, results, expected):
+                if (result.get('ripeness'), result.get('confidence')) != (reference.get('ripeness'), reference.get('confidence')):
+                    mismatches += 1
+                    print(f"Mismatch for {path} with batches of {batch_size}: {result} != {reference}")
+    
+    server.shutdown()
+    server.server_close()
+    
+    print(f"{args.images} images from {args.clients} clients, stub call {args.latency_ms:g} ms "
+          f"+ {args.per_image_ms:g} ms per extra image, {args.max_concurrent} concurrent calls\n")
+    print(f"{'mode':<14} {'images/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'calls':>7} {'mean batch':>11}")
+    for name, latencies, elapsed, calls, mean_batch in rows:
+        print(f"{name:<14} {len(latencies) / elapsed:>9.1f} {percentile(latencies, 50):>9.1f} "
+              f"{percentile(latencies, 95):>9.1f} {calls:>7} {mean_batch:>11.2f}")
+    
+    if mismatches:
+        print(f"\n{mismatches} batched results differ from the unbatched results")
+        sys.exit(1)
+    print("\nEvery batched result matches its unbatched result")
+
+if __name__ == "__main__":
+    main()
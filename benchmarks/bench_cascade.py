@@ -0,0 +1,137 @@
+"""
+Offline benchmark of the cascade analyzer against the heavy model alone
+
+Synthetic images with known labels are classified by the heavy backend on
+its own and by cascades at several confidence thresholds. A share of the
+images have blemishes in the colour of another class, so the colour
+heuristic is unsure about them and should escalate. The heavy tier is a
+stub that knows the true labels and sleeps like a remote model.
+
+Usage:
+    python -m benchmarks.bench_cascade --images 200 --heavy-latency-ms 300
+    python -m benchmarks.bench_cascade --thresholds 50,75,90 --blemished 0.4
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from PIL import ImageDraw
+from benchmarks.synthetic import RIPENESS_COLORS, generate_fruit_image
+from utils.analyzer_backends import CascadeBackend, ColorHeuristicBackend, StubBackend, image_key
+from utils.metrics import percentile
+
+class OracleBackend(StubBackend):
+    """
+    Heavy tier stand-in that answers with the true label of each image
+    """
+    
+    def __init__(self, labels, latency_ms):
+        """
+        Args:
+            labels (dict): image_key() -> true ripeness
+            latency_ms (float): Simulated latency of every call
+        """
+        StubBackend.__init__(self, latency_ms=latency_ms, jitter_ms=0, distribution='fixed', error_rate=0, seed=0)
+        self.labels = labels
+    
+    def classify(self, key):
+        return self.labels[key], 95
+
+def write_labelled_images(directory, count, blemished_share, resolution=(640, 480), seed=0):
+    """
+    Write synthetic images and return their true labels
+    
+    Blemished images get patches in the colour of another class over roughly
+    a tenth to a half of the fruit; their label stays the class of the peel.
+    
+    Returns:
+        list: (path, ripeness) pairs
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    labels = list(RIPENESS_COLORS)
+    images = []
+    for i in range(count):
+        ripeness = labels[i % len(labels)]
+        image = generate_fruit_image(*resolution, seed=seed + i, ripeness=ripeness)
+        if rng.random() < blemished_share:
+            # Paint blotches of another class somewhere on the fruit
+            fruit = list(zip(*_fruit_pixels(image, ripeness)))
+            draw = ImageDraw.Draw(image)
+            other = RIPENESS_COLORS[rng.choice([label for label in labels if label != ripeness])]
+            spot = max(4, int(len(fruit) ** 0.5 * 8 * 0.12))
+            for x, y in rng.sample(fruit, min(len(fruit), rng.randint(2, 14))):
+                draw.ellipse([x - spot, y - spot, x + spot, y + spot], fill=other)
+        path = os.path.join(directory, f"fruit_{i:06d}.jpg")
+        image.save(path, 'JPEG')
+        images.append((path, ripeness))
+    return images
+
+def _fruit_pixels(image, ripeness):
+    """
+    Coordinates of pixels close to the peel colour, sampled on a coarse grid
+    """
+    r, g, b = RIPENESS_COLORS[ripeness]
+    pixels = image.load()
+    xs, ys = [], []
+    for y in range(0, image.height, 8):
+        for x in range(0, image.width, 8):
+            pr, pg, pb = pixels[x, y]
+            if abs(pr - r) + abs(pg - g) + abs(pb - b) < 60:
+                xs.append(x)
+                ys.append(y)
+    return xs, ys
+
+def run(backend, images):
+    """
+    Classify every image and measure latency and accuracy
+    
+    Returns:
+        dict: mean/p50/p95 latency in milliseconds and accuracy
+    """
+    latencies = []
+    correct = 0
+    for path, ripeness in images:
+        start = time.perf_counter()
+        result = backend.analyze(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+        correct += result['ripeness'] == ripeness
+    return {
+        "mean_ms": sum(latencies) / len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "accuracy": correct / len(images),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cascade analyzer offline")
+    parser.add_argument('--images', type=int, default=150)
+    parser.add_argument('--blemished', type=float, default=0.3, help="Share of images with blemishes of another class")
+    parser.add_argument('--heavy-latency-ms', type=float, default=300.0)
+    parser.add_argument('--thresholds', default='50,75,90', help="Comma separated cascade thresholds")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        images = write_labelled_images(tmp_dir, args.images, args.blemished)
+        heavy = OracleBackend({image_key(path): ripeness for path, ripeness in images}, args.heavy_latency_ms)
+        
+        rows = [("heavy only", run(heavy, images), None),
+                ("colour only", run(ColorHeuristicBackend(), images), None)]
+        for threshold in [float(value) for value in args.thresholds.split(',')]:
+            cascade = CascadeBackend(fast=[ColorHeuristicBackend()], heavy=heavy, threshold=threshold)
+            rows.append((f"cascade @{threshold:g}", run(cascade, images), cascade.get_stats()))
+    
+    print(f"{args.images} images, {args.blemished:.0%} blemished, heavy tier {args.heavy_latency_ms:g} ms\n")
+    print(f"{'backend':<16} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'accuracy':>9} {'escalated':>10}")
+    for name, summary, stats in rows:
+        escalated = f"{stats['escalation_rate']:.1%}" if stats else '-'
+        print(f"{name:<16} {summary['mean_ms']:>9.1f} {summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f} "
+              f"{summary['accuracy']:>9.1%} {escalated:>10}")
+    
+    for name, _, stats in rows:
+        if stats:
+            print(f"\n{name}: " + ", ".join(f"{key}={value}" for key, value in stats.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark of saving results from many threads at once
+
+Producer threads call Database.save_image_data, as analysis workers do when
+they finish, with a synthetic analysis text each. "direct" is the previous
+path, where every call opens a connection, takes the write lock and commits
+on its own. "writer" sends the rows through the writer thread of
+app.models.db_writer, which commits whatever is queued in one transaction;
+"writer+Nms" also holds each group open for up to N ms to gather more rows.
+Reports writes per second, the latency of a save, the mean group size and
+"database is locked" errors for every producer count. Runs in a temporary
+directory on the same disk as the working directory, so commits really sync.
+
+Usage:
+    python -m benchmarks.bench_db_writer --producers 1,4,16,64 --seconds 3
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from benchmarks.synthetic import generate_analysis
+from utils.metrics import percentile
+
+def produce(db, user_id, analyses, stop, latencies, errors):
+    """
+    Save results one after another until stopped
+    """
+    number = 0
+    while not stop.is_set():
+        ripeness, analysis = analyses[number % len(analyses)]
+        start = time.perf_counter()
+        try:
+            db.save_image_data(user_id, f"data/images/{user_id}/{number:07d}.jpg", ripeness, analysis)
+        except sqlite3.OperationalError as e:
+            errors.append(str(e))
+            continue
+        finally:
+            number += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+
+def run(mode, producers, args, analyses, tmp_dir):
+    # Imported here so the environment below applies
+    from app.models.database import Database
+    from app.models.db_writer import DatabaseWriter
+    
+    # The writer is attached below, so only the modes that use one start a thread
+    os.environ['FRUIT_APP_DB_WRITER'] = '0'
+    db = Database(os.path.join(tmp_dir, f"{mode}_{producers}", 'fruit_app.db'))
+    conn = db.connect()
+    # WAL, like the job queue sets on the application's database
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executemany('INSERT INTO users (username, password) VALUES (?, ?)',
+                     [(f"user{number}", 'x') for number in range(args.users)])
+    conn.commit()
+    db.close()
+    if mode != 'direct':
+        wait_ms = float(mode.split('+')[1][:-2]) if '+' in mode else 0
+        db.writer = DatabaseWriter(db.db_path, max_wait_ms=wait_ms)
+    
+    stop = threading.Event()
+    latencies = [[] for _ in range(producers)]
+    errors = [[] for _ in range(producers)]
+    threads = [threading.Thread(target=produce, args=(db, number % args.users + 1, analyses, stop,
+                                                     latencies[number], errors[number]))
+               for number in range(producers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    mean_batch = 1.0
+    if db.writer:
+        mean_batch = db.writer.get_stats()["mean_batch"]
+        db.writer.close()
+    return [value for values in latencies for value in values], sum(len(values) for values in errors), \
+        elapsed, mean_batch
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent result saving with and without group commit")
+    parser.add_argument('--producers', default='1,2,4,8,16,32,64', help="Producer thread counts, comma separated")
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--modes', default='direct,writer,writer+2ms')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    rng = random.Random(args.seed)
+    analyses = [generate_analysis(rng) for _ in range(500)]
+    
+    print(f"{'mode':<12} {'producers':>9} {'writes/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'group':>6} {'locked':>7}")
+    with tempfile.TemporaryDirectory(dir=os.getcwd()) as tmp_dir:
+        for producers in [int(count) for count in args.producers.split(',')]:
+            for mode in args.modes.split(','):
+                latencies, errors, elapsed, mean_batch = run(mode, producers, args, analyses, tmp_dir)
+                print(f"{mode:<12} {producers:>9} {len(latencies) / elapsed:>9.0f} {percentile(latencies, 50):>8.2f} "
+                      f"{percentile(latencies, 95):>8.2f} {percentile(latencies, 99):>8.2f} {mean_batch:>6.1f} "
+                      f"{errors:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark of finding and classifying every fruit of a tray photo
+
+Writes synthetic trays of fruits of mixed ripeness as JPEGs, with gaps
+between the fruits, touching fruits and slightly overlapping ones, and runs
+utils.fruit_detector on the decode the analysis uses. Reports how often the
+fruit count is exact, how many fruits were found (a box overlapping a
+drawn fruit by IoU 0.5 or more), the share of found fruits whose local
+label is right and the time per tray.
+
+Then compares the ways of classifying the fruits of a tray against a stub
+model: the local pixel vote, one batch call with a crop of every fruit
+(run_fruit_analysis with the model classifier) and one call per fruit.
+
+Usage:
+    python -m benchmarks.bench_fruits --trays 20 --rows 4 --columns 6 --latency-ms 300
+"""
+import argparse
+import os
+import tempfile
+import time
+from app.controllers.image_controller import run_analysis, run_fruit_analysis
+from app.controllers.request_context import RequestContext
+from benchmarks.synthetic import generate_tray_scene
+from utils.analyzer_backends import StubBackend, set_analyzer
+from utils.fruit_detector import LOCAL, MODEL, fruit_detector
+from utils.image_loader import image_cache
+from utils.metrics import percentile
+
+def iou(first, second):
+    width = min(first[2], second[2]) - max(first[0], second[0])
+    height = min(first[3], second[3]) - max(first[1], second[1])
+    overlap = max(0, width) * max(0, height)
+    area = lambda box: (box[2] - box[0]) * (box[3] - box[1])
+    return overlap / (area(first) + area(second) - overlap)
+
+def match(found, truth, scale):
+    """
+    Pair found fruits with drawn ones, best overlap first
+    
+    Returns:
+        list: (found index, drawn index) pairs with an IoU of at least 0.5
+    """
+    scaled = [tuple(value * scale for value in box) for box, _ in truth]
+    candidates = sorted(((iou(box, drawn), found_index, drawn_index)
+                         for found_index, box in enumerate(found)
+                         for drawn_index, drawn in enumerate(scaled)), reverse=True)
+    pairs, used_found, used_drawn = [], set(), set()
+    for overlap, found_index, drawn_index in candidates:
+        if overlap < 0.5:
+            break
+        if found_index not in used_found and drawn_index not in used_drawn:
+            pairs.append((found_index, drawn_index))
+            used_found.add(found_index)
+            used_drawn.add(drawn_index)
+    return pairs
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multi-fruit detection and classification")
+    parser.add_argument('--trays', type=int, default=20, help="Trays per gap")
+    parser.add_argument('--rows', type=int, default=4)
+    parser.add_argument('--columns', type=int, default=6)
+    parser.add_argument('--gaps', default='0.08,0,-0.05', help="Space between fruits as a fraction of their size")
+    parser.add_argument('--resolution', default='1920x1080')
+    parser.add_argument('--latency-ms', type=float, default=300, help="Stub model latency per call")
+    parser.add_argument('--per-image-ms', type=float, default=10, help="Stub model latency per extra batch image")
+    parser.add_argument('--model-trays', type=int, default=3, help="Trays classified through the stub model")
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.resolution.split('x'))
+    per_tray = args.rows * args.columns
+    
+    print(f"Trays of {per_tray} fruits at {width}x{height}, found on {fruit_detector.detect_size} px\n")
+    print(f"{'gap':>6} {'exact count':>12} {'found':>7} {'extra':>6} {'labels':>7} "
+          f"{'segment p50':>12} {'classify p50':>13}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for gap in [float(value) for value in args.gaps.split(',')]:
+            exact = found = extra = right = 0
+            segment_ms, classify_ms = [], []
+            for seed in range(args.trays):
+                image, truth = generate_tray_scene(width, height, seed=seed, rows=args.rows,
+                                                   columns=args.columns, gap=gap)
+                path = os.path.join(tmp_dir, f"tray_{gap}_{seed:04d}.jpg")
+                image.save(path, 'JPEG', quality=90)
+                paths.append(path)
+                
+                image = image_cache.get(path)
+                start = time.perf_counter()
+                labels, boxes, _ = fruit_detector.segment(image)
+                segment_ms.append((time.perf_counter() - start) * 1000)
+                start = time.perf_counter()
+                classes = fruit_detector.classify_local(image, labels, len(boxes))
+                classify_ms.append((time.perf_counter() - start) * 1000)
+                
+                pairs = match(boxes, truth, image.size[0] / width)
+                exact += len(boxes) == len(truth)
+                found += len(pairs)
+                extra += len(boxes) - len(pairs)
+                right += sum(classes[found_index][0] == truth[drawn_index][1] for found_index, drawn_index in pairs)
+            total = args.trays * per_tray
+            print(f"{gap:>6.2f} {exact / args.trays:>12.0%} {found / total:>7.1%} {extra:>6} "
+                  f"{right / max(1, found):>7.1%} {percentile(segment_ms, 50):>9.1f} ms "
+                  f"{percentile(classify_ms, 50):>10.1f} ms")
+        
+        set_analyzer(StubBackend(latency_ms=args.latency_ms, jitter_ms=0, per_image_ms=args.per_image_ms))
+        context = RequestContext(1, 'bench')
+        trays = paths[:args.model_trays]
+        print(f"\nClassifying {len(trays)} trays, stub model at {args.latency_ms:.0f} ms per call "
+              f"+ {args.per_image_ms:.0f} ms per extra batch image")
+        print(f"{'classifier':<22} {'calls':>6} {'s per tray':>11} {'fruits/s':>9}")
+        for name in (LOCAL, MODEL, 'model, call per fruit'):
+            calls = fruits = 0
+            start = time.perf_counter()
+            for path in trays:
+                if name == 'model, call per fruit':
+                    image = image_cache.get(path)
+                    _, boxes = fruit_detector.detect(image)
+                    crop_dir = tempfile.mkdtemp(dir=tmp_dir)
+                    for crop_path in fruit_detector.crop_fruits(image, boxes, crop_dir):
+                        run_analysis(context, crop_path)
+                    calls += len(boxes)
+                    fruits += len(boxes)
+                else:
+                    result = run_fruit_analysis(context, path, name)
+                    calls += name == MODEL
+                    fruits += len(result["fruits"])
+            elapsed = time.perf_counter() - start
+            print(f"{name:<22} {calls:>6} {elapsed / len(trays):>11.3f} {fruits / elapsed:>9.1f}")
+
+if __name__ == "__main__":
+    main()
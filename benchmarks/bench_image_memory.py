@@ -0,0 +1,152 @@
+"""
+Soak benchmark of image memory and file handles over many uploads
+
+Repeats the upload path of the window thousands of times: preview, copy into
+the image store, decode for the analysis. "legacy" opens the files the way
+the code did before, with Image.open() and no close, and decodes the preview
+and the analysis input separately at full resolution. "managed" goes through
+utils.image_loader: one reduced draft() decode shared by the preview and the
+analysis, with every file closed. Resident memory and open file descriptors
+are sampled along the way; the managed column should stay flat.
+
+Usage:
+    python -m benchmarks.bench_image_memory --uploads 2000
+"""
+import argparse
+import gc
+import os
+import shutil
+import tempfile
+import time
+from PIL import Image
+from benchmarks.synthetic import generate_fruit_image
+from utils.image_loader import DecodedImageCache
+from utils.image_pool import resize_to_fit
+
+def rss_mb():
+    """
+    Get the resident memory of this process in MB, from /proc where available
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def open_files():
+    """
+    Count the open file descriptors of this process, -1 where /proc is missing
+    """
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return -1
+
+def write_inputs(directory):
+    """
+    Write a mix of camera sized photos, a PNG and an animated GIF
+    
+    Returns:
+        list: The input paths
+    """
+    paths = []
+    for seed, (width, height) in enumerate([(4032, 3024), (3000, 4000), (1920, 1080), (4032, 3024)]):
+        path = os.path.join(directory, f"photo{seed}.jpg")
+        image = generate_fruit_image(width, height, seed=seed)
+        if seed == 1:
+            # Portrait photo stored sideways, as phones do
+            exif = Image.Exif()
+            exif[0x0112] = 6
+            image.save(path, 'JPEG', quality=90, exif=exif.tobytes())
+        else:
+            image.save(path, 'JPEG', quality=90)
+        paths.append(path)
+    
+    path = os.path.join(directory, 'scan.png')
+    generate_fruit_image(1600, 1200, seed=9).save(path, 'PNG')
+    paths.append(path)
+    
+    path = os.path.join(directory, 'clip.gif')
+    frames = [generate_fruit_image(480, 360, seed=i) for i in range(8)]
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=80)
+    paths.append(path)
+    return paths
+
+def legacy_upload(source, store, state):
+    # display_image(): open, resize, keep the photo for the label
+    image = Image.open(source)
+    state["preview"] = resize_to_fit(image, 380, 300)
+    state["shown"] = image
+    saved = os.path.join(store, os.path.basename(source))
+    shutil.copy2(source, saved)
+    # analyze_fruit_image(): open the copy and decode it at full resolution
+    analysis = Image.open(saved)
+    analysis.load()
+    state["analysis"] = analysis
+    state["opened"].append(analysis)
+    return saved
+
+def managed_upload(source, store, state, cache):
+    state["preview"] = resize_to_fit(cache.get(source), 380, 300)
+    saved = os.path.join(store, os.path.basename(source))
+    shutil.copy2(source, saved)
+    cache.alias(saved, source)
+    state["analysis"] = cache.get(saved)
+    return saved
+
+def soak(mode, paths, uploads, samples, keep_opened):
+    """
+    Run the uploads and sample memory and file handles
+    
+    Returns:
+        tuple: (list of (upload, rss MB, open files), mean ms per upload, cache stats or None)
+    """
+    cache = DecodedImageCache(max_entries=4, max_size=1024) if mode == 'managed' else None
+    state = {"opened": []}
+    trace = [(0, rss_mb(), open_files())]
+    with tempfile.TemporaryDirectory() as store:
+        start = time.perf_counter()
+        for upload in range(1, uploads + 1):
+            source = paths[upload % len(paths)]
+            if cache:
+                saved = managed_upload(source, store, state, cache)
+            else:
+                saved = legacy_upload(source, store, state)
+                # Objects the window or the SDK may still hold between uploads
+                del state["opened"][:-keep_opened]
+            os.remove(saved)
+            if upload % max(1, uploads // samples) == 0:
+                trace.append((upload, rss_mb(), open_files()))
+        elapsed = time.perf_counter() - start
+        state.clear()
+        gc.collect()
+    return trace, elapsed * 1000 / uploads, cache.get_stats() if cache else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test image memory and file handles over many uploads")
+    parser.add_argument('--uploads', type=int, default=2000)
+    parser.add_argument('--samples', type=int, default=10, help="Memory samples per run")
+    parser.add_argument('--keep-opened', type=int, default=8,
+                        help="Legacy images still referenced between uploads, as held by the UI and SDK")
+    parser.add_argument('--mode', choices=['legacy', 'managed', 'both'], default='both')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = write_inputs(tmp_dir)
+        modes = ['legacy', 'managed'] if args.mode == 'both' else [args.mode]
+        for mode in modes:
+            gc.collect()
+            trace, per_upload_ms, cache_stats = soak(mode, paths, args.uploads, args.samples, args.keep_opened)
+            print(f"\n{mode}: {per_upload_ms:.1f} ms per upload")
+            print(f"{'upload':>7} {'RSS MB':>8} {'open fds':>9}")
+            for upload, rss, files in trace:
+                print(f"{upload:>7} {rss:>8.1f} {files:>9}")
+            steady = trace[len(trace) // 2:]
+            print(f"RSS change over the second half: {steady[-1][1] - steady[0][1]:+.1f} MB, "
+                  f"open fds {steady[0][2]} -> {steady[-1][2]}")
+            if cache_stats:
+                print(f"cache: {cache_stats}")
+
+if __name__ == "__main__":
+    main()
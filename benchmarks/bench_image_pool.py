@@ -0,0 +1,66 @@
+"""
+Speedup of the image preprocessing pool versus core count
+
+Decodes, resizes and extracts features from a synthetic image set, first
+serially in this process and then with ImagePreprocessPool at increasing
+worker counts. Then does the same for the decode a batch analysis needs,
+DecodedImageCache.get_many() with and without the pool.
+
+Usage:
+    python -m benchmarks.bench_image_pool --images 64 --resolution large
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from benchmarks.synthetic import RESOLUTIONS, write_image_set
+from utils.image_loader import DecodedImageCache
+from utils.image_pool import ImagePreprocessPool, preprocess_image
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the image preprocessing pool")
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--resolution', choices=list(RESOLUTIONS), default='large')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = write_image_set(tmp_dir, args.images, RESOLUTIONS[args.resolution])
+        
+        start = time.perf_counter()
+        for path in paths:
+            preprocess_image(path)
+        serial = time.perf_counter() - start
+        print(json.dumps({"workers": 0, "mode": "serial", "seconds": round(serial, 3),
+                          "images_per_second": round(len(paths) / serial, 1)}))
+        
+        # Nothing is kept, so every batch decodes all of its images
+        cache = DecodedImageCache(max_entries=0)
+        start = time.perf_counter()
+        cache.get_many(paths)
+        serial_decode = time.perf_counter() - start
+        print(json.dumps({"workers": 0, "mode": "analysis decode, serial", "seconds": round(serial_decode, 3),
+                          "images_per_second": round(len(paths) / serial_decode, 1)}))
+        
+        workers = 1
+        while workers <= args.max_workers:
+            with ImagePreprocessPool(workers=workers) as pool:
+                # Warm up the worker processes before timing
+                pool.map(paths[:workers])
+                start = time.perf_counter()
+                pool.map(paths)
+                elapsed = time.perf_counter() - start
+                start = time.perf_counter()
+                cache.get_many(paths, pool)
+                decode_elapsed = time.perf_counter() - start
+            print(json.dumps({"workers": workers, "mode": "pool", "seconds": round(elapsed, 3),
+                              "images_per_second": round(len(paths) / elapsed, 1),
+                              "speedup": round(serial / elapsed, 2)}))
+            print(json.dumps({"workers": workers, "mode": "analysis decode, pool", "seconds": round(decode_elapsed, 3),
+                              "images_per_second": round(len(paths) / decode_elapsed, 1),
+                              "speedup": round(serial_decode / decode_elapsed, 2)}))
+            workers *= 2
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark of header validation against a full decode
+
+For accepted images of every format and resolution, a JPEG with a large
+trailer after its end marker like a motion photo, and for rejected inputs
+(a decompression bomb header, a truncated JPEG, a text file), compares the
+time of ImageValidator.validate() with Image.open() + load(), which is when
+the problems were found before.
+
+Usage:
+    python -m benchmarks.bench_image_validation --repeat 200
+"""
+import argparse
+import os
+import struct
+import tempfile
+import time
+import zlib
+from PIL import Image
+from benchmarks.synthetic import RESOLUTIONS, generate_fruit_image
+from utils.image_validator import ImageValidator
+from utils.metrics import percentile
+
+def write_inputs(directory):
+    """
+    Write the accepted and rejected test inputs
+    
+    Returns:
+        list: (label, path) pairs
+    """
+    inputs = []
+    for label, resolution in RESOLUTIONS.items():
+        image = generate_fruit_image(*resolution, seed=1)
+        for image_format, extension in (('JPEG', 'jpg'), ('PNG', 'png')):
+            path = os.path.join(directory, f"{label}.{extension}")
+            image.save(path, image_format)
+            inputs.append((f"{extension} {label}", path))
+    
+    frames = [generate_fruit_image(320, 240, seed=i) for i in range(20)]
+    path = os.path.join(directory, 'animated.gif')
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=50)
+    inputs.append(("gif 20 frames", path))
+    
+    # A small PNG that claims to be 40000x40000
+    header = struct.pack('>IIBBBBB', 40000, 40000, 8, 2, 0, 0, 0)
+    path = os.path.join(directory, 'bomb.png')
+    with open(path, 'wb') as bomb_file:
+        bomb_file.write(b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + header +
+                        struct.pack('>I', zlib.crc32(b'IHDR' + header)) +
+                        struct.pack('>I', 0) + b'IDAT' + struct.pack('>I', zlib.crc32(b'IDAT')) +
+                        struct.pack('>I', 0) + b'IEND' + struct.pack('>I', zlib.crc32(b'IEND')))
+    inputs.append(("bomb png", path))
+    
+    with open(inputs[0][1], 'rb') as source:
+        data = source.read()
+    # A motion photo carries its video after the end of the JPEG
+    path = os.path.join(directory, 'motion.jpg')
+    with open(path, 'wb') as motion_file:
+        motion_file.write(data + os.urandom(2 * 1024 * 1024).replace(b'\xff', b'\x00'))
+    inputs.append(("jpg 2 MB trailer", path))
+    
+    path = os.path.join(directory, 'truncated.jpg')
+    with open(path, 'wb') as truncated_file:
+        truncated_file.write(data[:len(data) // 3])
+    inputs.append(("truncated jpg", path))
+    
+    path = os.path.join(directory, 'notes.jpg')
+    with open(path, 'w') as text_file:
+        text_file.write("not an image\n" * 100)
+    inputs.append(("text as jpg", path))
+    return inputs
+
+def time_call(operation, repeat):
+    """
+    Run an operation repeatedly and return each latency in microseconds, and
+    the outcome of the last run
+    """
+    latencies = []
+    outcome = "ok"
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            operation()
+            outcome = "ok"
+        except Exception as e:
+            outcome = f"rejected: {e}"
+        latencies.append((time.perf_counter() - start) * 1000000)
+    return latencies, outcome
+
+def full_decode(path):
+    with Image.open(path) as image:
+        for frame in range(getattr(image, 'n_frames', 1)):
+            image.seek(frame)
+            image.load()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark header validation against a full decode")
+    parser.add_argument('--repeat', type=int, default=200, help="Validations per input")
+    parser.add_argument('--decode-repeat', type=int, default=5, help="Full decodes per input")
+    args = parser.parse_args()
+    
+    validator = ImageValidator()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        inputs = write_inputs(tmp_dir)
+        print(f"{'input':<16} {'validate p50':>13} {'decode p50':>13}  validator outcome")
+        for label, path in inputs:
+            validate, outcome = time_call(lambda: validator.validate(path), args.repeat)
+            decode, _ = time_call(lambda: full_decode(path), args.decode_repeat)
+            print(f"{label:<16} {percentile(validate, 50):>10.1f} us {percentile(decode, 50):>10.1f} us  {outcome}")
+
+if __name__ == "__main__":
+    main()
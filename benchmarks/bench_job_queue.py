@@ -0,0 +1,82 @@
+"""
+Throughput benchmark for the durable analysis job queue
+
+Enqueues a batch of jobs and drains it with N worker processes that use the
+stub analyzer backend, then checks that every job was processed exactly once.
+
+Usage:
+    python -m benchmarks.bench_job_queue --jobs 500 --workers 1,2,4,8 --latency-ms 20
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from app.models.database import Database
+from app.models.job_queue import JobQueue
+from app.controllers.job_worker import JobWorker
+from utils.analyzer_backends import StubBackend
+
+def _worker_process(db_path, latency):
+    """
+    Drain the queue in a separate process
+    """
+    worker = JobWorker(
+        queue=JobQueue(db_path),
+        db=Database(db_path),
+        analyzer=StubBackend(latency_ms=latency * 1000, seed=0).analyze,
+        poll_interval=0.01
+    )
+    worker.run(drain=True)
+
+def run_benchmark(jobs, workers, latency):
+    """
+    Run one benchmark round
+    
+    Returns:
+        dict: The measured throughput and the consistency checks
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'bench.db')
+        db = Database(db_path)
+        queue = JobQueue(db_path)
+        db.register_user('bench', 'bench')
+        
+        for i in range(jobs):
+            queue.enqueue(1, f"data/images/1/bench_{i}.jpg")
+        
+        start = time.perf_counter()
+        processes = [multiprocessing.Process(target=_worker_process, args=(db_path, latency)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        
+        conn = db.connect()
+        rows, distinct_paths = conn.execute('SELECT COUNT(*), COUNT(DISTINCT image_path) FROM images').fetchone()
+        db.close()
+        
+        return {
+            "workers": workers,
+            "jobs": jobs,
+            "latency_ms": latency * 1000,
+            "seconds": round(elapsed, 3),
+            "jobs_per_second": round(jobs / elapsed, 1),
+            "status_counts": queue.get_status_counts(),
+            "duplicates": rows - distinct_paths,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis job queue")
+    parser.add_argument('--jobs', type=int, default=500)
+    parser.add_argument('--workers', default='1,2,4,8', help="Comma separated worker counts")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Latency of the stub analyzer")
+    args = parser.parse_args()
+    
+    for workers in [int(w) for w in args.workers.split(',')]:
+        print(json.dumps(run_benchmark(args.jobs, workers, args.latency_ms / 1000)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Logging overhead per analysis
+
+Emulates the log calls of one analysis (a handful of INFO records and a
+burst of DEBUG records) and measures the time spent on the calling thread
+with a synchronous FileHandler versus the queued setup from utils.logger.
+
+Usage:
+    python -m benchmarks.bench_logging --analyses 2000 2>/dev/null
+"""
+import argparse
+import json
+import logging
+import tempfile
+import time
+from utils.logger import LOG_FORMAT, setup_logger, shutdown_logger
+
+INFO_PER_ANALYSIS = 5
+DEBUG_PER_ANALYSIS = 40
+
+def emit_analysis_logs(logger, index):
+    for step in range(INFO_PER_ANALYSIS):
+        logger.info("Analysis %d step %d finished", index, step)
+    for step in range(DEBUG_PER_ANALYSIS):
+        logger.debug("Analysis %d detail %d: %s", index, step, {"width": 1920, "height": 1080})
+
+def measure(logger, analyses):
+    """
+    Return the mean caller-side time per analysis in microseconds
+    """
+    start = time.perf_counter()
+    for index in range(analyses):
+        emit_analysis_logs(logger, index)
+    return (time.perf_counter() - start) / analyses * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark logging overhead per analysis")
+    parser.add_argument('--analyses', type=int, default=2000)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Baseline: the previous synchronous setup with a file and a console handler
+        sync_logger = logging.getLogger('bench_sync')
+        sync_logger.setLevel(logging.DEBUG)
+        sync_logger.propagate = False
+        file_handler = logging.FileHandler(f"{tmp_dir}/sync.log")
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.INFO)
+        for handler in (file_handler, console_handler):
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            sync_logger.addHandler(handler)
+        sync_us = measure(sync_logger, args.analyses)
+        file_handler.close()
+        
+        results = [{"setup": "sync_file_handler", "us_per_analysis": round(sync_us, 1)}]
+        for label, options in [("queued", {}), ("queued_json", {"json_format": True}),
+                               ("queued_debug_sampled_10pct", {"debug_sample_rate": 0.1})]:
+            queued_logger = setup_logger(f"bench_{label}", log_dir=tmp_dir, **options)
+            queued_logger.propagate = False
+            caller_us = measure(queued_logger, args.analyses)
+            start = time.perf_counter()
+            # Only this setup's listener, the application's logger keeps running
+            shutdown_logger(f"bench_{label}")
+            drain_ms = (time.perf_counter() - start) * 1000
+            results.append({"setup": label, "us_per_analysis": round(caller_us, 1),
+                            "drain_ms": round(drain_ms, 1)})
+        
+        for result in results:
+            print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+End-to-end benchmark of ingest, analysis, persistence and history
+
+Stages:
+    ingest    ImageController.save_image on synthetic images per resolution
+    analyze   ImageController.analyze_image with the stub analyzer backend
+    persist   Database.save_image_data on tables of 1k/100k/1M rows
+    history   Database.get_user_images on tables of 1k/100k/1M rows
+
+Results are written as JSON and compared against benchmarks/baseline.json.
+The script exits with status 1 when any metric regresses by more than the
+tolerance, so it can gate changes.
+
+Usage:
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --rows 1000,100000 --output results.json
+    python -m benchmarks.bench_pipeline --update-baseline
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+from benchmarks.report import compare_to_baseline, load_baseline, save_results, summarize
+from benchmarks.synthetic import RESOLUTIONS, write_image_set
+from utils.analyzer_backends import StubBackend, set_analyzer
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Users the seeded rows are spread over
+SEED_USERS = 100
+
+def timed(operation, repeat):
+    """
+    Run an operation repeatedly and return each latency in milliseconds
+    """
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        operation(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def seed_images_table(db, rows):
+    """
+    Bulk insert rows into the images table, spread over SEED_USERS users
+    """
+    conn = db.connect()
+    cursor = conn.cursor()
+    cursor.executemany('INSERT OR IGNORE INTO users (user_id, username, password) VALUES (?, ?, ?)',
+                       ((user_id, f"user{user_id}", 'x') for user_id in range(1, SEED_USERS + 1)))
+    
+    start = datetime.datetime(2025, 1, 1)
+    batch = []
+    for i in range(rows):
+        timestamp = (start + datetime.timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S")
+        batch.append((i % SEED_USERS + 1, f"data/images/{i % SEED_USERS + 1}/seed_{i}.jpg", "Ripe", timestamp))
+        if len(batch) == 50000:
+            cursor.executemany('INSERT INTO images (user_id, image_path, result, timestamp) VALUES (?, ?, ?, ?)', batch)
+            batch = []
+    if batch:
+        cursor.executemany('INSERT INTO images (user_id, image_path, result, timestamp) VALUES (?, ?, ?, ?)', batch)
+    conn.commit()
+    db.close()
+
+def bench_ingest_and_analyze(results, images, latency_ms):
+    """
+    Benchmark saving and analyzing synthetic images of every resolution
+    """
+    from app.controllers.image_controller import ImageController
+    from app.controllers.request_context import RequestContext
+    
+    controller = ImageController()
+    context = RequestContext(1)
+    controller.db.register_user('bench', 'x')
+    set_analyzer(StubBackend(latency_ms=latency_ms, seed=0))
+    
+    for label, resolution in RESOLUTIONS.items():
+        paths = write_image_set(os.path.join('input', label), images, resolution)
+        saved = []
+        results[f"ingest.save_image.{label}"] = summarize(
+            timed(lambda i: saved.append(controller.save_image(context, paths[i])), len(paths)))
+        results[f"analyze.analyze_image.{label}"] = summarize(
+            timed(lambda i: controller.analyze_image(context, saved[i]), len(saved)))
+    
+    set_analyzer(None)
+
+def bench_database(results, row_counts, operations):
+    """
+    Benchmark persistence and history queries at several table sizes
+    """
+    from app.models.database import Database
+    
+    for rows in row_counts:
+        db = Database(os.path.join('db', f"rows_{rows}.db"))
+        seed_images_table(db, rows)
+        label = f"{rows // 1000}k" if rows < 1000000 else f"{rows // 1000000}m"
+        
+        results[f"persist.save_image_data.{label}"] = summarize(
+            timed(lambda i: db.save_image_data(i % SEED_USERS + 1, f"bench_{i}.jpg", "Ripe"), operations))
+        results[f"history.get_user_images.{label}"] = summarize(
+            timed(lambda i: db.get_user_images(i % SEED_USERS + 1), operations))
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark")
+    parser.add_argument('--images', type=int, default=20, help="Images per resolution")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Latency of the stub analyzer")
+    parser.add_argument('--rows', default='1000,100000,1000000', help="Comma separated table sizes")
+    parser.add_argument('--operations', type=int, default=50, help="Database operations per table size")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative regression")
+    parser.add_argument('--update-baseline', action='store_true', help="Store these results as the new baseline")
+    args = parser.parse_args()
+    
+    results = {}
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            bench_ingest_and_analyze(results, args.images, args.latency_ms)
+            bench_database(results, [int(rows) for rows in args.rows.split(',')], args.operations)
+        finally:
+            os.chdir(original_dir)
+    
+    for name, summary in sorted(results.items()):
+        print(f"{name:<40} {summary['ops_per_second']:>10.1f}/s  p50 {summary['p50_ms']:>9.3f} ms  "
+              f"p95 {summary['p95_ms']:>9.3f} ms  p99 {summary['p99_ms']:>9.3f} ms")
+    
+    if args.output:
+        save_results(args.output, results)
+    
+    if args.update_baseline:
+        save_results(args.baseline, results)
+        print(f"Baseline written to {args.baseline}")
+        return
+    
+    baseline = load_baseline(args.baseline)
+    if not baseline:
+        print(f"\nNo baseline at {args.baseline}, run with --update-baseline to create one")
+        return
+    
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nNo regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark of the storage reconciler on a large image store
+
+Builds an image store of empty files spread over user directories, with a
+database referencing most of them, a share of orphaned files and a share of
+rows whose file is missing, then times the index build, the walk and the
+quarantine of the orphans and checks the counts. Runs in a temporary
+directory; a million files need a million free inodes and take about a minute.
+
+Usage:
+    python -m benchmarks.bench_reconciler --files 1000000 --users 1000
+"""
+import argparse
+import os
+import resource
+import sqlite3
+import tempfile
+import time
+from app.controllers.storage_reconciler import StorageReconciler
+
+def build_store(root, files, users, orphan_share, missing_share):
+    """
+    Write the files and the database
+    
+    Returns:
+        tuple: (database path, image directory, expected orphans, expected missing rows)
+    """
+    image_dir = os.path.join(root, 'images')
+    db_path = os.path.join(root, 'fruit_app.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+    CREATE TABLE images (
+        image_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        image_path TEXT NOT NULL,
+        result TEXT,
+        timestamp TEXT NOT NULL
+    )
+    ''')
+    
+    orphan_every = round(1 / orphan_share) if orphan_share else 0
+    missing_every = round(1 / missing_share) if missing_share else 0
+    orphans, missing, rows = 0, 0, []
+    for user_id in range(1, users + 1):
+        os.makedirs(os.path.join(image_dir, str(user_id)))
+    for number in range(files):
+        user_id = number % users + 1
+        image_path = os.path.join(image_dir, str(user_id), f"20250101_000000_{number:07d}_photo.jpg")
+        if orphan_every and number % orphan_every == 1:
+            orphans += 1
+        else:
+            rows.append((user_id, image_path, 'Ripe', '2025-01-01 00:00:00'))
+        if missing_every and number % missing_every == 2:
+            # The row stays, the file is never written
+            missing += 1
+            continue
+        open(image_path, 'wb').close()
+        if len(rows) >= 50000:
+            conn.executemany('INSERT INTO images (user_id, image_path, result, timestamp) VALUES (?, ?, ?, ?)', rows)
+            rows = []
+    conn.executemany('INSERT INTO images (user_id, image_path, result, timestamp) VALUES (?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+    return db_path, image_dir, orphans, missing
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the storage reconciler on a large image store")
+    parser.add_argument('--files', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--orphans', type=float, default=0.05, help="Share of files without a row")
+    parser.add_argument('--missing', type=float, default=0.01, help="Share of rows without a file")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--batch-pause', type=float, default=0.0)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        db_path, image_dir, orphans, missing = build_store(tmp_dir, args.files, args.users, args.orphans, args.missing)
+        print(f"store of {args.files} files in {args.users} user directories built in "
+              f"{time.perf_counter() - start:.1f} s ({orphans} orphans, {missing} missing files)")
+        
+        for action in ('report', 'quarantine'):
+            reconciler = StorageReconciler(db_path=db_path, image_dir=image_dir,
+                                           quarantine_dir=os.path.join(tmp_dir, 'quarantine'), action=action,
+                                           batch_size=args.batch_size, batch_pause=args.batch_pause,
+                                           min_age_seconds=0)
+            report = reconciler.run()
+            print(f"\n{action}: index {report['index_seconds']:.1f} s, walk {report['scan_seconds']:.1f} s, "
+                  f"total {report['elapsed_seconds']:.1f} s "
+                  f"({report['scanned'] / max(report['elapsed_seconds'], 0.001):,.0f} files/s)")
+            print(f"  {report['orphans']} orphans (expected {orphans}), {report['handled']} quarantined, "
+                  f"{report['missing_count']} missing rows (expected {missing})")
+        print(f"\npeak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark of cropping line photos to the fruit before analysis
+
+Writes synthetic conveyor belt scenes with one to three small fruits as
+JPEGs, then runs them through utils.roi the way the Gemini backend does:
+decoded at analysis size through the image cache and cropped. Reports the
+time to find the region, the pixels removed, how much of the fruit the crop
+kept (every fruit must be inside) and the bytes a model receives with and
+without cropping. A few close-ups where the fruit fills the frame check that
+those are left whole.
+
+Usage:
+    python -m benchmarks.bench_roi --scenes 200 --resolution 1920x1080
+"""
+import argparse
+import io
+import os
+import tempfile
+from benchmarks.synthetic import generate_conveyor_scene
+from utils.image_loader import image_cache
+from utils.metrics import percentile
+from utils.roi import RoiCropper
+
+def coverage(box, fruit_boxes, scale):
+    """
+    Fraction of the fruit area inside the crop box
+    """
+    inside = total = 0
+    for left, top, right, bottom in fruit_boxes:
+        left, top, right, bottom = left * scale, top * scale, right * scale, bottom * scale
+        total += (right - left) * (bottom - top)
+        width = min(right, box[2]) - max(left, box[0])
+        height = min(bottom, box[3]) - max(top, box[1])
+        inside += max(0, width) * max(0, height)
+    return inside / total if total else 1.0
+
+def jpeg_size(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.tell()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fruit region crop")
+    parser.add_argument('--scenes', type=int, default=200)
+    parser.add_argument('--closeups', type=int, default=20)
+    parser.add_argument('--resolution', default='1920x1080')
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.resolution.split('x'))
+    
+    cropper = RoiCropper(enabled=True)
+    times, kept, covered, model_bytes = [], [], [], [[], []]
+    missed = 0
+    whole_closeups = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for seed in range(args.scenes + args.closeups):
+            path = os.path.join(tmp_dir, f"scene_{seed:05d}.jpg")
+            scene, fruit_boxes = generate_conveyor_scene(width, height, seed=seed, fruits=seed % 3 + 1)
+            if seed >= args.scenes:
+                # A close-up: the first fruit cut out tightly and scaled up to the full frame
+                left, top, right, bottom = fruit_boxes[0]
+                scene, fruit_boxes = scene.crop((left - 4, top - 4, right + 4, bottom + 4)).resize((width, height)), None
+            scene.save(path, 'JPEG', quality=90)
+            
+            image = image_cache.get(path)
+            cropped, info = cropper.crop(image)
+            if fruit_boxes is None:
+                whole_closeups += info["box"] is None
+                continue
+            times.append(info["ms"])
+            kept.append(info["kept"])
+            box = info["box"] or (0, 0, image.size[0], image.size[1])
+            covered.append(coverage(box, fruit_boxes, image.size[0] / width))
+            missed += covered[-1] < 0.999
+            
+            model_bytes[0].append(jpeg_size(image))
+            model_bytes[1].append(jpeg_size(cropped))
+    
+    stats = cropper.get_stats()
+    print(f"{args.scenes} conveyor scenes at {width}x{height}, analyzed at {image_cache.max_size} px\n")
+    print(f"find region      p50 {percentile(times, 50):.1f} ms, p95 {percentile(times, 95):.1f} ms, "
+          f"max {max(times):.1f} ms")
+    print(f"pixels kept      mean {sum(kept) / len(kept):.1%}, p95 {percentile(kept, 95):.1%}, "
+          f"overall reduction {stats['pixel_reduction']:.1%} (including close-ups)")
+    print(f"fruit in crop    mean {sum(covered) / len(covered):.2%}, worst {min(covered):.2%}, "
+          f"scenes cutting fruit {missed}")
+    print(f"model input      {sum(model_bytes[0]) / len(kept) / 1024:.0f} KB -> "
+          f"{sum(model_bytes[1]) / len(kept) / 1024:.0f} KB per image (JPEG of the decoded image)")
+    print(f"close-ups whole  {whole_closeups} of {args.closeups}")
+
+if __name__ == "__main__":
+    main()
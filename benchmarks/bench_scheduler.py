@@ -0,0 +1,120 @@
+"""
+Benchmark of interactive analysis latency while bulk work saturates the analyzer
+
+Bulk threads from two users, one with many more threads than the other,
+and a few background threads keep the stub analyzer busy, while
+interactive users click Analyze every so often. The stub serves at most
+--slots calls at once, like a provider quota. The bulk and background
+threads outnumber their caps, so both classes stay saturated. "fifo" sends
+every call through one queue in arrival order, as before the scheduler;
+"no reserve" uses the priority classes with batch and background allowed
+every slot between them; "scheduled" uses the default caps of
+utils.analysis_scheduler, which keep slots free for interactive calls.
+Reports the interactive latency, the waits and queue depths per class and
+how the bulk calls were shared between the two bulk users.
+
+Usage:
+    python -m benchmarks.bench_scheduler --seconds 10 --bulk-threads 24,8
+"""
+import argparse
+import threading
+import time
+from utils.analysis_scheduler import BACKGROUND, BATCH, INTERACTIVE, AnalysisScheduler
+from utils.analyzer_backends import StubBackend
+from utils.metrics import percentile
+
+def worker(scheduler, backend, priority, user_id, stop, think_seconds, latencies, completed, fifo):
+    """
+    Analyze one image after another until stopped, recording the latency of each
+    """
+    while not stop.is_set():
+        start = time.perf_counter()
+        if fifo:
+            # One queue for everybody, served in arrival order
+            slot = scheduler.slot(BATCH, None)
+        else:
+            slot = scheduler.slot(priority, user_id)
+        with slot:
+            backend.analyze(f"{priority}_{user_id}_{len(latencies)}.jpg")
+        latencies.append((time.perf_counter() - start) * 1000)
+        completed[user_id] = completed.get(user_id, 0) + 1
+        if think_seconds:
+            stop.wait(think_seconds)
+
+def run(mode, args):
+    fifo = mode == 'fifo'
+    if fifo:
+        scheduler = AnalysisScheduler(slots=args.slots, batch_slots=args.slots, background_slots=args.slots,
+                                      bulk_slots=args.slots)
+    elif mode == 'no reserve':
+        # Each class under its own cap, but the two caps add up to every slot
+        background_slots = max(1, args.slots // 4)
+        scheduler = AnalysisScheduler(slots=args.slots, batch_slots=args.slots - background_slots,
+                                      background_slots=background_slots, bulk_slots=args.slots)
+    else:
+        scheduler = AnalysisScheduler(slots=args.slots)
+    backend = StubBackend(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 2, distribution='uniform',
+                          max_concurrent=args.slots)
+    stop = threading.Event()
+    latencies = {INTERACTIVE: [], BATCH: [], BACKGROUND: []}
+    completed = {INTERACTIVE: {}, BATCH: {}, BACKGROUND: {}}
+    
+    threads = []
+    # Bulk users are 1, 2, ...; background re-scoring has no user; interactive users start at 100
+    for user_id, count in enumerate(args.bulk_threads, start=1):
+        threads += [(BATCH, user_id, 0) for _ in range(count)]
+    threads += [(BACKGROUND, None, 0) for _ in range(args.background_threads)]
+    threads += [(INTERACTIVE, 100 + number, args.think_ms / 1000) for number in range(args.interactive_users)]
+    threads = [threading.Thread(target=worker, args=(scheduler, backend, priority, user_id, stop, think,
+                                                    latencies[priority], completed[priority], fifo))
+               for priority, user_id, think in threads]
+    
+    for thread in threads:
+        thread.start()
+    # Let the bulk queues fill before measuring
+    time.sleep(1)
+    scheduler.reset_stats()
+    for priority in latencies:
+        latencies[priority].clear()
+        completed[priority].clear()
+    stop.wait(args.seconds)
+    stop.set()
+    stats = scheduler.get_stats()
+    for thread in threads:
+        thread.join()
+    return latencies, completed, stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark interactive latency under bulk analysis load")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--slots', type=int, default=4, help="Analyzer calls served at once")
+    parser.add_argument('--latency-ms', type=float, default=40, help="Mean stub latency per call")
+    parser.add_argument('--bulk-threads', default='24,8', help="Bulk threads per bulk user, comma separated")
+    parser.add_argument('--background-threads', type=int, default=4)
+    parser.add_argument('--interactive-users', type=int, default=3)
+    parser.add_argument('--think-ms', type=float, default=300, help="Pause between an interactive user's clicks")
+    args = parser.parse_args()
+    args.bulk_threads = [int(count) for count in args.bulk_threads.split(',')]
+    
+    print(f"{args.slots} analyzer slots, bulk threads per user {args.bulk_threads}, "
+          f"{args.background_threads} background threads, {args.interactive_users} interactive users\n")
+    print(f"{'mode':<11} {'class':<12} {'calls':>6} {'latency p50':>12} {'p95':>8} {'p99':>8} "
+          f"{'wait p95':>9} {'max queued':>11}")
+    for mode in ('fifo', 'no reserve', 'scheduled'):
+        latencies, completed, stats = run(mode, args)
+        for priority in (INTERACTIVE, BATCH, BACKGROUND):
+            values = latencies[priority]
+            # In fifo mode every call waits in the batch queue
+            class_stats = stats[BATCH if mode == 'fifo' else priority]
+            print(f"{mode:<11} {priority:<12} {len(values):>6} {percentile(values, 50):>12.1f} "
+                  f"{percentile(values, 95):>8.1f} {percentile(values, 99):>8.1f} "
+                  f"{class_stats['wait']['p95_ms']:>9.1f} {class_stats['max_queued']:>11}")
+        shares = completed[BATCH]
+        total = sum(shares.values()) or 1
+        print(f"{'':<11} bulk calls per user: "
+              + ", ".join(f"user {user_id} ({threads} threads) {shares.get(user_id, 0) / total:.0%}"
+                          for user_id, threads in enumerate(args.bulk_threads, start=1)))
+    print("\n(latencies in ms, fifo shares one queue, so its wait and queue columns are for all classes)")
+
+if __name__ == "__main__":
+    main()
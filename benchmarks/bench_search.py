@@ -0,0 +1,101 @@
+"""
+Benchmark of searching the stored analysis text
+
+Fills the images table with synthetic analyses, with a rare defect
+mentioned now and then, and times
+the first page of a few searches through the FTS5 index and through the LIKE
+scan used when SQLite has no FTS5. Runs in a temporary directory.
+
+Usage:
+    python -m benchmarks.bench_search --rows 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from app.models.database import Database
+from benchmarks.synthetic import generate_analysis
+from utils.metrics import percentile
+
+# (label, query), from a word in a few rows to words in most of them
+QUERIES = [
+    ("rare", "mold"),
+    ("uncommon", "bruising"),
+    ("common", "yellow peel"),
+    ("prefix", "wrinkl*"),
+    ("no match", "pineapple"),
+]
+
+def populate(db, rows, users, seed):
+    """
+    Insert the synthetic results and index them in one rebuild
+    
+    Returns:
+        float: Seconds taken
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    store = db.analysis_store
+    conn = store.connect()
+    batch = []
+    for number in range(rows):
+        ripeness, analysis = generate_analysis(rng)
+        batch.append((number % users + 1, f"data/images/{number:07d}.jpg", ripeness, '2025-01-01 00:00:00',
+                      store.compress(analysis)))
+        if len(batch) >= 50000:
+            conn.executemany('INSERT INTO images (user_id, image_path, result, timestamp, analysis) '
+                             'VALUES (?, ?, ?, ?, ?)', batch)
+            batch = []
+    conn.executemany('INSERT INTO images (user_id, image_path, result, timestamp, analysis) VALUES (?, ?, ?, ?, ?)',
+                     batch)
+    conn.commit()
+    conn.close()
+    db.rebuild_search_index()
+    return time.perf_counter() - start
+
+def time_search(db, text, user_id, repeats):
+    """
+    Run a search several times
+    
+    Returns:
+        tuple: (total matches, list of latencies in ms)
+    """
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        total, _ = db.search_images(text, user_id=user_id, limit=50)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return total, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FTS5 search against LIKE scans")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = Database(os.path.join(tmp_dir, 'fruit_app.db'))
+        if not db.fts_enabled:
+            parser.error("this SQLite build has no FTS5")
+        elapsed = populate(db, args.rows, args.users, args.seed)
+        size = os.path.getsize(db.db_path) / 1024 / 1024
+        print(f"{args.rows} analyses written and indexed in {elapsed:.1f} s, database {size:.0f} MB\n")
+        
+        print(f"{'query':<22} {'scope':<5} {'fts matches':>11} {'fts p50 ms':>11} "
+              f"{'like matches':>12} {'like p50 ms':>12} {'speedup':>8}")
+        for label, text in QUERIES:
+            for scope, user_id in (('all', None), ('user', 1)):
+                db.fts_enabled = True
+                fts_total, fts_latencies = time_search(db, text, user_id, args.repeats)
+                db.fts_enabled = False
+                like_total, like_latencies = time_search(db, text, user_id, args.repeats)
+                fts_p50, like_p50 = percentile(fts_latencies, 50), percentile(like_latencies, 50)
+                print(f"{label + ' ' + repr(text):<22} {scope:<5} {fts_total:>11} {fts_p50:>11.1f} "
+                      f"{like_total:>12} {like_p50:>12.1f} {like_p50 / max(fts_p50, 0.001):>7.1f}x")
+        print("\n(match counts differ where stemming finds more than the substring, or LIKE finds words inside words)")
+
+if __name__ == "__main__":
+    main()
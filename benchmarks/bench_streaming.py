@@ -0,0 +1,73 @@
+"""
+Offline benchmark of time to first result with streamed analysis
+
+Drives MainController.save_and_analyze_image, as the Analyze button does,
+against the stub backend generating its response in timed chunks. Without
+streaming the first result is the full result; with streaming it is the
+moment the ripeness is reported, while the explanation keeps arriving.
+
+Usage:
+    python -m benchmarks.bench_streaming --images 20 --latency-ms 300 --chunk-ms 40
+"""
+import argparse
+import os
+import tempfile
+import time
+from benchmarks.synthetic import write_image_set
+from utils.analyzer_backends import StubBackend, set_analyzer
+from utils.metrics import percentile
+
+def run(controller, paths, streaming):
+    """
+    Analyze every image and measure the time to the first and to the full result
+    
+    Returns:
+        tuple: (first result latencies, full result latencies) in milliseconds
+    """
+    first, full = [], []
+    for path in paths:
+        decided = []
+        start = time.perf_counter()
+        if streaming:
+            controller.save_and_analyze_image(path, on_ripeness=lambda ripeness: decided.append(time.perf_counter()))
+        else:
+            controller.save_and_analyze_image(path)
+        end = time.perf_counter()
+        first.append(((decided[0] if decided else end) - start) * 1000)
+        full.append((end - start) * 1000)
+    return first, full
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark time to first result with streamed analysis")
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=300.0, help="Stub time to the first chunk")
+    parser.add_argument('--chunk-ms', type=float, default=40.0, help="Stub time per response chunk")
+    args = parser.parse_args()
+    
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            # Imported here so the controller picks up the temporary working directory
+            from app.controllers.main_controller import MainController
+            
+            paths = write_image_set('input', args.images, (640, 480))
+            set_analyzer(StubBackend(latency_ms=args.latency_ms, chunk_ms=args.chunk_ms, seed=0))
+            controller = MainController()
+            controller.register_user('bench', 'bench')
+            controller.login_user('bench', 'bench')
+            
+            rows = [("buffered", *run(controller, paths, False)),
+                    ("streamed", *run(controller, paths, True))]
+        finally:
+            set_analyzer(None)
+            os.chdir(original_dir)
+    
+    print(f"{args.images} images, stub first chunk after {args.latency_ms:g} ms, {args.chunk_ms:g} ms per chunk\n")
+    print(f"{'mode':<10} {'first p50':>10} {'first p95':>10} {'full p50':>10} {'full p95':>10}")
+    for name, first, full in rows:
+        print(f"{name:<10} {percentile(first, 50):>10.1f} {percentile(first, 95):>10.1f} "
+              f"{percentile(full, 50):>10.1f} {percentile(full, 95):>10.1f}")
+
+if __name__ == "__main__":
+    main()
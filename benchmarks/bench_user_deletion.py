@@ -0,0 +1,111 @@
+"""
+Benchmark of deleting a heavy user while other users keep saving results
+
+Gives one user many images, then deletes them while a writer thread keeps
+inserting rows for another user, the way the window does after every
+analysis. "single" is the old single-transaction DELETE; "chunked" is the
+background UserDeleter. Reports how long the deletion took and how long the
+writer had to wait for the database. Runs in a temporary working directory.
+
+Usage:
+    python -m benchmarks.bench_user_deletion --images 200000 --files 20000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from utils.metrics import percentile
+
+def populate(db, user_id, images, files):
+    """
+    Insert the heavy user's rows, the first files of them with an empty file on disk
+    """
+    user_dir = os.path.join('data', 'images', str(user_id))
+    os.makedirs(user_dir, exist_ok=True)
+    rows = []
+    for number in range(images):
+        image_path = os.path.join(user_dir, f"{number:07d}.jpg")
+        if number < files:
+            open(image_path, 'wb').close()
+        rows.append((user_id, image_path, 'Ripe', '2025-01-01 00:00:00'))
+    conn = sqlite3.connect(db.db_path)
+    conn.executemany('INSERT INTO images (user_id, image_path, result, timestamp) VALUES (?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+    # Written around the application, so they are indexed afterwards
+    db.rebuild_search_index()
+
+def write_while(db, user_id, done, latencies):
+    """
+    Save a result every few milliseconds until done is set, recording each wait
+    """
+    while not done.is_set():
+        start = time.perf_counter()
+        db.save_image_data(user_id, 'data/images/other.jpg', 'Ripe')
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.005)
+
+def run(mode, images, files, chunk_size):
+    # Imported here so the database and image store land in the temporary working directory
+    from app.controllers.main_controller import MainController
+    from app.models.database import Database
+    
+    controller = MainController()
+    controller.register_user(f'heavy_{mode}', 'password')
+    controller.register_user(f'other_{mode}', 'password')
+    db = Database()
+    heavy = db.get_user_credentials(f'heavy_{mode}')[0]
+    other = db.get_user_credentials(f'other_{mode}')[0]
+    populate(db, heavy, images, files)
+    
+    done = threading.Event()
+    latencies = []
+    writer = threading.Thread(target=write_while, args=(Database(), other, done, latencies))
+    writer.start()
+    time.sleep(0.2)
+    
+    start = time.perf_counter()
+    if mode == 'single':
+        db.delete_user(heavy)
+        admin_wait = time.perf_counter() - start
+    else:
+        controller.user_deleter.chunk_size = chunk_size
+        controller.delete_user(heavy)
+        admin_wait = time.perf_counter() - start
+        controller.user_deleter.join()
+    elapsed = time.perf_counter() - start
+    
+    time.sleep(0.2)
+    done.set()
+    writer.join()
+    return elapsed, admin_wait, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark deleting a heavy user under concurrent writes")
+    parser.add_argument('--images', type=int, default=200000)
+    parser.add_argument('--files', type=int, default=20000, help="How many of the images have a file on disk")
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+    
+    original_dir = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            for mode in ('single', 'chunked'):
+                results.append((mode, *run(mode, args.images, args.files, args.chunk_size)))
+        finally:
+            os.chdir(original_dir)
+    
+    print(f"deleting a user with {args.images} images ({args.files} files) while another user saves results\n")
+    print(f"{'mode':<8} {'total s':>8} {'admin waits s':>14} {'writes':>7} {'write p50 ms':>13} "
+          f"{'p99 ms':>8} {'max ms':>8}")
+    for mode, elapsed, admin_wait, latencies in results:
+        print(f"{mode:<8} {elapsed:>8.2f} {admin_wait:>14.3f} {len(latencies):>7} {percentile(latencies, 50):>13.1f} "
+              f"{percentile(latencies, 99):>8.1f} {max(latencies):>8.1f}")
+    print("\n(single leaves the files on disk, chunked removes them)")
+
+if __name__ == "__main__":
+    main()
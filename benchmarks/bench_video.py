@@ -0,0 +1,134 @@
+"""
+Benchmark of the video intake on a sample conveyor video
+
+Writes a synthetic 720p video of fruits riding a slatted belt through the
+picture, or takes a recording given with --video, and measures:
+
+- decoding alone, every frame and every n-th frame, in frames per second
+- the full intake: decoder thread, frame ring, motion gate and analysis
+  workers against a stub analyzer, in frames per second, with the fruits
+  analyzed, how many of the synthetic fruits got exactly one analysis and
+  the memory the ring holds at most
+- the same with the decoder treating the file like a camera, which drops
+  frames rather than wait for the gate, to show that memory stays bounded
+- the analyses that sampling a frame every second would have cost instead,
+  and how many fruits it would have missed or analyzed twice
+
+Runs in a temporary working directory.
+
+Usage:
+    python -m benchmarks.bench_video --fruits 30 --latency-ms 300
+    python -m benchmarks.bench_video --video conveyor.mp4
+"""
+import argparse
+import os
+import tempfile
+import time
+import cv2
+from benchmarks.synthetic import write_conveyor_video
+from utils.analyzer_backends import StubBackend, set_analyzer
+
+def decode_rate(path, stride=1):
+    """
+    Read a video as fast as possible, converting every stride-th frame
+    
+    Returns:
+        tuple: (frames, frames per second)
+    """
+    capture = cv2.VideoCapture(path)
+    frames = 0
+    start = time.perf_counter()
+    while True:
+        ok = capture.read()[0] if frames % stride == 0 else capture.grab()
+        if not ok:
+            break
+        frames += 1
+    elapsed = time.perf_counter() - start
+    capture.release()
+    return frames, frames / elapsed
+
+def score(picked, truth):
+    """
+    Compare the analyzed frames with the frames each fruit was in view
+    
+    Returns:
+        tuple: (fruits analyzed exactly once, fruits missed, extra analyses)
+    """
+    once = missed = extra = 0
+    inside = set()
+    for first, last, _ in truth:
+        hits = [index for index in picked if first <= index <= last]
+        inside.update(hits)
+        once += len(hits) == 1
+        missed += not hits
+        extra += max(0, len(hits) - 1)
+    return once, missed, extra + sum(index not in inside for index in picked)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark video decoding and motion-gated analysis")
+    parser.add_argument('--video', help="A recording to use instead of the synthetic video")
+    parser.add_argument('--fruits', type=int, default=30, help="Fruits in the synthetic video")
+    parser.add_argument('--resolution', default='1280x720')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--ring-frames', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=300, help="Latency of the stub analyzer")
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.resolution.split('x'))
+    
+    original_dir = os.getcwd()
+    video = os.path.abspath(args.video) if args.video else None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            # Imported here so the database and image store land in the temporary directory
+            from app.controllers.request_context import RequestContext
+            from app.controllers.video_intake import VideoIntake
+            from app.models.database import Database
+            from utils.analysis_scheduler import BATCH
+            
+            truth = None
+            if video is None:
+                video = os.path.join(tmp_dir, 'conveyor.mp4')
+                start = time.perf_counter()
+                frames, truth = write_conveyor_video(video, args.fruits, width, height, args.fps)
+                print(f"Wrote {frames} frames at {width}x{height}, {frames / args.fps:.0f} s with {args.fruits} "
+                      f"fruits, in {time.perf_counter() - start:.1f} s\n")
+            
+            print(f"{'decode':<30} {'frames':>7} {'frames/s':>9}")
+            for stride in (1, 2, 3):
+                frames, rate = decode_rate(video, stride)
+                label = "every frame" if stride == 1 else f"1 in {stride} frames converted"
+                print(f"{label:<30} {frames:>7} {rate:>9.0f}")
+            
+            Database().register_user('video', 'x')
+            context = RequestContext(Database().get_user_credentials('video')[0], 'video', BATCH)
+            set_analyzer(StubBackend(latency_ms=args.latency_ms, jitter_ms=0, seed=0))
+            
+            print(f"\n{'intake':<16} {'frames/s':>9} {'analyses':>9} {'once':>6} {'missed':>7} {'extra':>6} "
+                  f"{'dropped':>8} {'ring max':>9} {'ring MB':>8} {'gate p50':>9} {'result p50':>11}")
+            for mode in ('file', 'camera'):
+                picked = []
+                intake = VideoIntake(video, context, workers=args.workers, ring_frames=args.ring_frames,
+                                     on_result=lambda index, saved_path, result: picked.append(index))
+                intake.live = mode == 'camera'
+                intake.run(stats_interval=0)
+                stats = intake.get_stats()
+                once, missed, extra = score(picked, truth) if truth else ('-', '-', '-')
+                print(f"{mode:<16} {stats['frames_per_second']:>9.0f} {stats['analyzed']:>9} {once:>6} "
+                      f"{missed:>7} {extra:>6} {stats['dropped']:>8} {stats['ring_high_water']:>9} "
+                      f"{stats['ring_bytes'] / 2 ** 20:>8.0f} {stats['gate']['p50_ms']:>6.2f} ms "
+                      f"{stats['latency']['p50_ms']:>8.0f} ms")
+        finally:
+            set_analyzer(None)
+            os.chdir(original_dir)
+    
+    if truth:
+        # A frame a second, the simplest alternative to gating
+        sampled = list(range(0, frames, args.fps))
+        once, missed, extra = score(sampled, truth)
+        print(f"\nA frame every second instead: {len(sampled)} analyses, {once} fruits once, "
+              f"{missed} missed, {extra} extra analyses of belt or of a fruit seen before")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Offline benchmark of the watch-folder intake under bursts of files
+
+Simulates cameras dropping bursts of images into sub-folders of an intake
+directory while a FolderWatcher feeds them through save, analyze (stub
+backend) and persist. Part of every burst is written in two steps with a
+pause, like a slow network copy, and part are byte-for-byte duplicates of
+earlier images. Runs in a temporary working directory.
+
+Usage:
+    python -m benchmarks.bench_watch_folder --bursts 3 --burst-size 1000 --workers 4
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+from benchmarks.synthetic import generate_fruit_image
+from utils.analyzer_backends import StubBackend, set_analyzer
+
+def write_bursts(directory, bursts, burst_size, gap_seconds, partial_share, duplicate_share, cameras=4, seed=0):
+    """
+    Write the bursts of files, returning how many were written
+    
+    Every file gets unique bytes appended after the JPEG end marker, except
+    the duplicates, which repeat an earlier file exactly.
+    """
+    rng = random.Random(seed)
+    buffer = io.BytesIO()
+    generate_fruit_image(160, 120, seed=seed).save(buffer, 'JPEG')
+    base = buffer.getvalue()
+    
+    written = []
+    for burst in range(bursts):
+        partial = []
+        for i in range(burst_size):
+            camera_dir = os.path.join(directory, f"camera{i % cameras}")
+            os.makedirs(camera_dir, exist_ok=True)
+            path = os.path.join(camera_dir, f"burst{burst}_{i:05d}.jpg")
+            if written and rng.random() < duplicate_share:
+                data = rng.choice(written)
+            else:
+                data = base + f"{burst}:{i}".encode('ascii')
+            written.append(data)
+            
+            if rng.random() < partial_share:
+                # Only the first half now, the rest after a pause
+                with open(path, 'wb') as image_file:
+                    image_file.write(data[:len(data) // 2])
+                partial.append((path, data))
+            else:
+                with open(path, 'wb') as image_file:
+                    image_file.write(data)
+        
+        time.sleep(0.1)
+        for path, data in partial:
+            with open(path, 'ab') as image_file:
+                image_file.write(data[len(data) // 2:])
+        time.sleep(gap_seconds)
+    return len(written)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark watch-folder intake under bursts")
+    parser.add_argument('--bursts', type=int, default=3)
+    parser.add_argument('--burst-size', type=int, default=500)
+    parser.add_argument('--gap', type=float, default=0.5, help="Seconds between bursts")
+    parser.add_argument('--partial', type=float, default=0.2, help="Share of files written in two steps")
+    parser.add_argument('--duplicates', type=float, default=0.05, help="Share of files repeating an earlier one")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--max-queued', type=int, default=None)
+    parser.add_argument('--settle', type=float, default=0.3)
+    parser.add_argument('--poll', type=float, default=0.1)
+    parser.add_argument('--latency-ms', type=float, default=2.0, help="Latency of the stub analyzer")
+    args = parser.parse_args()
+    
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            # Imported here so the database and image store land in the temporary directory
+            from app.controllers.watch_folder import FolderWatcher
+            from app.models.database import Database
+            
+            Database().register_user('intake', 'x')
+            user_id = Database().get_user_credentials('intake')[0]
+            set_analyzer(StubBackend(latency_ms=args.latency_ms, seed=0))
+            
+            intake_dir = os.path.join(tmp_dir, 'intake')
+            os.makedirs(intake_dir)
+            watcher = FolderWatcher(intake_dir, user_id, workers=args.workers, max_queued=args.max_queued,
+                                    settle_seconds=args.settle, poll_interval=args.poll)
+            stop_event = threading.Event()
+            thread = threading.Thread(target=watcher.run, args=(stop_event, False, 0), daemon=True)
+            thread.start()
+            
+            start = time.monotonic()
+            total = write_bursts(intake_dir, args.bursts, args.burst_size, args.gap, args.partial, args.duplicates)
+            written = time.monotonic() - start
+            
+            # Wait until every file has been handled
+            while True:
+                stats = watcher.get_stats()
+                handled = stats["processed"] + stats["duplicates"] + stats["rejected"] + stats["failed"]
+                if handled >= total:
+                    break
+                time.sleep(0.05)
+            elapsed = time.monotonic() - start
+            stop_event.set()
+            thread.join()
+        finally:
+            set_analyzer(None)
+            os.chdir(original_dir)
+    
+    print(f"{total} files in {args.bursts} bursts written in {written:.1f} s, "
+          f"all handled {elapsed - written:.1f} s after the last write")
+    print(f"processed {stats['processed']}, duplicates {stats['duplicates']}, rejected {stats['rejected']}, "
+          f"failed {stats['failed']}, intake paused {stats['intake_paused']} times")
+    print(f"throughput {stats['processed'] / elapsed:.1f} files/s with {args.workers} workers")
+    for name in ("latency", "processing"):
+        summary = stats[name]
+        print(f"{name:<11} p50 {summary['p50_ms']:>9.1f} ms  p95 {summary['p95_ms']:>9.1f} ms  "
+              f"p99 {summary['p99_ms']:>9.1f} ms  max {summary['max_ms']:>9.1f} ms")
+
+if __name__ == "__main__":
+    main()
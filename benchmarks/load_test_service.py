@@ -0,0 +1,187 @@
+"""
+Load test of the HTTP service
+
+Client threads each log in once and then send analyze, batch and history
+requests over one kept-alive connection, reporting requests per second and
+latency percentiles per endpoint. By default the service runs in-process in
+a temporary working directory with the stub analyzer; --url points the
+clients at a service that is already running instead (the user must exist).
+
+Usage:
+    python -m benchmarks.load_test_service --clients 16 --requests 50 --latency-ms 20
+    python -m benchmarks.load_test_service --url http://127.0.0.1:8080 --user alice --password secret
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+from benchmarks.synthetic import generate_fruit_image
+from utils.analyzer_backends import StubBackend, set_analyzer
+from utils.metrics import percentile
+
+def make_images(count, resolution=(640, 480)):
+    """
+    Encode synthetic JPEGs in memory
+    
+    Returns:
+        list: The encoded images as bytes
+    """
+    images = []
+    for seed in range(count):
+        buffer = io.BytesIO()
+        generate_fruit_image(*resolution, seed=seed).save(buffer, 'JPEG')
+        images.append(buffer.getvalue())
+    return images
+
+class Client:
+    """
+    One kept-alive connection with the session of one login
+    """
+    
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+        self.headers = {}
+        self.connects = 0
+    
+    def request(self, method, path, body=None, headers=None):
+        """
+        Send a request, reconnecting when the server closed the connection
+        
+        Returns:
+            tuple: (status, decoded JSON response)
+        """
+        for attempt in range(2):
+            try:
+                if self.connection.sock is None:
+                    self.connects += 1
+                self.connection.request(method, path, body=body, headers={**self.headers, **(headers or {})})
+                response = self.connection.getresponse()
+                return response.status, json.loads(response.read() or b'{}')
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.connection.close()
+                if attempt:
+                    raise
+    
+    def login(self, username, password):
+        status, payload = self.request('POST', '/login', json.dumps({"username": username, "password": password}),
+                                       {'Content-Type': 'application/json'})
+        if status != 200:
+            raise RuntimeError(f"Login failed: {payload}")
+        self.headers['Authorization'] = f"Bearer {payload['token']}"
+
+def run_client(url, username, password, images, requests, batch_size, mix, seed, results, lock):
+    rng = random.Random(seed)
+    client = Client(url)
+    latencies = {}
+    statuses = {}
+    
+    start = time.perf_counter()
+    client.login(username, password)
+    latencies.setdefault('login', []).append((time.perf_counter() - start) * 1000)
+    
+    endpoints = list(mix)
+    weights = [mix[endpoint] for endpoint in endpoints]
+    for _ in range(requests):
+        endpoint = rng.choices(endpoints, weights)[0]
+        if endpoint == 'analyze':
+            arguments = ('POST', '/analyze', rng.choice(images), {'X-Filename': 'upload.jpg'})
+        elif endpoint == 'batch':
+            boundary = f"batch{rng.getrandbits(64):016x}"
+            body = b''.join(f'--{boundary}\r\nContent-Disposition: form-data; name="images"; '
+                            f'filename="image{i}.jpg"\r\nContent-Type: image/jpeg\r\n\r\n'.encode('ascii') +
+                            rng.choice(images) + b'\r\n' for i in range(batch_size)) + f'--{boundary}--\r\n'.encode('ascii')
+            arguments = ('POST', '/analyze/batch', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        else:
+            arguments = ('GET', '/history?limit=20', None, None)
+        
+        start = time.perf_counter()
+        status, _ = client.request(*arguments)
+        latencies.setdefault(endpoint, []).append((time.perf_counter() - start) * 1000)
+        statuses[status] = statuses.get(status, 0) + 1
+    
+    with lock:
+        for endpoint, values in latencies.items():
+            results["latencies"].setdefault(endpoint, []).extend(values)
+        for status, count in statuses.items():
+            results["statuses"][status] = results["statuses"].get(status, 0) + count
+        results["connects"] += client.connects
+
+def load_test(url, username, password, clients, requests, batch_size, mix, images):
+    """
+    Run the clients against a service and collect the latencies
+    
+    Returns:
+        tuple: (results, elapsed seconds)
+    """
+    results = {"latencies": {}, "statuses": {}, "connects": 0}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=run_client,
+                                args=(url, username, password, images, requests, batch_size, mix, seed, results, lock))
+               for seed in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the HTTP service")
+    parser.add_argument('--url', default=None, help="A running service, otherwise one is started in-process")
+    parser.add_argument('--user', default='load')
+    parser.add_argument('--password', default='load-test')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=50, help="Requests per client after login")
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--mix', default='analyze=6,batch=1,history=3', help="Relative weights of the endpoints")
+    parser.add_argument('--max-concurrent', type=int, default=8, help="In-process service only")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Stub analyzer latency, in-process only")
+    args = parser.parse_args()
+    
+    mix = {name: float(weight) for name, weight in (item.split('=') for item in args.mix.split(','))}
+    images = make_images(8)
+    
+    if args.url:
+        results, elapsed = load_test(args.url, args.user, args.password, args.clients, args.requests,
+                                     args.batch_size, mix, images)
+    else:
+        original_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                # Imported here so the database and image store land in the temporary directory
+                from app.controllers.http_service import FruitService
+                from app.controllers.main_controller import MainController
+                
+                set_analyzer(StubBackend(latency_ms=args.latency_ms, seed=0))
+                MainController().register_user(args.user, args.password)
+                service = FruitService(('127.0.0.1', 0), max_concurrent=args.max_concurrent, queue_timeout=30)
+                service.start_in_thread()
+                try:
+                    results, elapsed = load_test(service.url, args.user, args.password, args.clients,
+                                                 args.requests, args.batch_size, mix, images)
+                finally:
+                    service.shutdown()
+                    service.server_close()
+            finally:
+                set_analyzer(None)
+                os.chdir(original_dir)
+    
+    total = sum(len(values) for values in results["latencies"].values())
+    print(f"{args.clients} clients, {total} requests in {elapsed:.1f} s: {total / elapsed:.1f} requests/s, "
+          f"{results['connects']} connections")
+    print(f"status codes: {dict(sorted(results['statuses'].items()))}\n")
+    print(f"{'endpoint':<10} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for endpoint, values in sorted(results["latencies"].items()):
+        print(f"{endpoint:<10} {len(values):>6} {percentile(values, 50):>9.1f} {percentile(values, 95):>9.1f} "
+              f"{percentile(values, 99):>9.1f} {max(values):>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Result summaries and baseline comparison shared by the benchmarks
+"""
+import json
+import os
+from utils.metrics import percentile
+
+# p99 of a short run is close to its maximum, too noisy to fail a build on
+GATED_METRICS = ("ops_per_second", "p50_ms", "p95_ms")
+
+def summarize(latencies_ms, elapsed_seconds=None):
+    """
+    Summarize a list of per-operation latencies
+    
+    Args:
+        latencies_ms (list): Latency of each operation in milliseconds
+        elapsed_seconds (float, optional): Wall time of the whole run, defaults to the sum of latencies
+    
+    Returns:
+        dict: count, ops_per_second and p50/p95/p99 latencies
+    """
+    elapsed = elapsed_seconds if elapsed_seconds is not None else sum(latencies_ms) / 1000
+    return {
+        "count": len(latencies_ms),
+        "ops_per_second": round(len(latencies_ms) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies_ms, 50), 3),
+        "p95_ms": round(percentile(latencies_ms, 95), 3),
+        "p99_ms": round(percentile(latencies_ms, 99), 3),
+    }
+
+def load_baseline(path):
+    """
+    Load a stored baseline, or an empty one if the file doesn't exist
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+def save_results(path, results):
+    """
+    Write benchmark results as indented JSON
+    """
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+        results_file.write("\n")
+
+def compare_to_baseline(results, baseline, tolerance=0.25, min_delta_ms=1.0):
+    """
+    Find metrics that regressed against the baseline
+    
+    Only GATED_METRICS are compared. Latencies regress when they grow by
+    more than the tolerance, throughput regresses when it drops by more
+    than the tolerance. Changes below min_delta_ms per operation are
+    treated as noise. Metrics missing from either side are ignored.
+    
+    Args:
+        results (dict): benchmark name -> summary, as produced by summarize()
+        baseline (dict): The stored results to compare against
+        tolerance (float): Allowed relative change, 0.25 means 25%
+        min_delta_ms (float): Smallest latency increase that counts as a regression
+    
+    Returns:
+        list: A description of every regression
+    """
+    regressions = []
+    for name, summary in sorted(results.items()):
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        for metric, value in summary.items():
+            expected = reference.get(metric)
+            if not expected or metric not in GATED_METRICS:
+                continue
+            if metric.endswith('_ms') and value > expected * (1 + tolerance) and value - expected >= min_delta_ms:
+                regressions.append(f"{name} {metric}: {value} ms vs baseline {expected} ms")
+            elif metric == "ops_per_second" and value < expected / (1 + tolerance) and 1000 / value - 1000 / expected >= min_delta_ms:
+                regressions.append(f"{name} {metric}: {value}/s vs baseline {expected}/s")
+    return regressions
@@ -0,0 +1,148 @@
+"""
+Concurrency stress test of the controller layer
+
+Many users share one MainController from a pool of threads, the way the
+HTTP service uses it: every call passes the context of the user it is made
+for. Each thread saves and analyzes images, single and batched, and reads
+the history and search results of a random user. Afterwards every user's
+images on disk, rows in the database and finished jobs are checked against
+what was submitted for them, and every history or search result against the
+user who asked.
+
+Runs in a temporary working directory with the stub analyzer.
+
+Usage:
+    python -m benchmarks.stress_controllers --users 8 --threads 16 --operations 50
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from benchmarks.synthetic import write_image_set
+from utils.analyzer_backends import StubBackend, set_analyzer
+from utils.metrics import percentile
+
+def run_thread(controller, contexts, images, operations, batch_size, seed, submitted, results, lock):
+    rng = random.Random(seed)
+    latencies = []
+    errors = []
+    mismatches = 0
+    for _ in range(operations):
+        context = rng.choice(contexts)
+        operation = rng.random()
+        start = time.perf_counter()
+        try:
+            if operation < 0.6:
+                saved_path, _, _ = controller.save_and_analyze_image(rng.choice(images), context=context)
+                saved = [saved_path]
+            elif operation < 0.8:
+                analyzed = controller.save_and_analyze_images(rng.sample(images, batch_size), context=context)
+                saved = [saved_path for saved_path, _, _ in analyzed]
+            elif operation < 0.9:
+                saved = []
+                rows = controller.get_user_images(context=context)
+                user_dir = os.path.join('data', 'images', str(context.user_id))
+                mismatches += sum(1 for row in rows if os.path.dirname(row[1]) != user_dir)
+            else:
+                saved = []
+                _, rows = controller.search_user_images('ripe', limit=20, context=context)
+                mismatches += sum(1 for row in rows if row[1] != context.user_id)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+        with lock:
+            submitted[context.user_id].extend(saved)
+    
+    with lock:
+        results["latencies"].extend(latencies)
+        results["errors"].extend(errors)
+        results["mismatches"] += mismatches
+
+def verify(controller, contexts, submitted):
+    """
+    Check every user's files, image rows and jobs against what was submitted for them
+    
+    Returns:
+        dict: Counts of images stored under the wrong user, rows and jobs missing or extra
+    """
+    problems = {"wrong_directory": 0, "missing_rows": 0, "extra_rows": 0, "unfinished_jobs": 0, "job_mismatches": 0}
+    conn = controller.job_queue.connect()
+    try:
+        for context in contexts:
+            expected = set(submitted[context.user_id])
+            user_dir = os.path.join('data', 'images', str(context.user_id))
+            problems["wrong_directory"] += sum(1 for path in expected if os.path.dirname(path) != user_dir)
+            
+            stored = {row[1] for row in controller.image_controller.db.get_user_images(context.user_id)}
+            problems["missing_rows"] += len(expected - stored)
+            problems["extra_rows"] += len(stored - expected)
+            
+            jobs = conn.execute('SELECT image_path, status FROM jobs WHERE user_id = ?', (context.user_id,)).fetchall()
+            problems["unfinished_jobs"] += sum(1 for _, status in jobs if status != controller.job_queue.DONE)
+            problems["job_mismatches"] += len({image_path for image_path, _ in jobs} ^ expected)
+    finally:
+        conn.close()
+    return problems
+
+def run(args, threads, images):
+    # Imported here so the database and image store land in the temporary directory
+    from app.controllers.main_controller import MainController
+    
+    controller = MainController()
+    contexts = []
+    for number in range(args.users):
+        username = f"stress{threads}_{number}"
+        controller.register_user(username, 'stress-test')
+        contexts.append(controller.authenticate(username, 'stress-test'))
+    
+    submitted = {context.user_id: [] for context in contexts}
+    results = {"latencies": [], "errors": [], "mismatches": 0}
+    lock = threading.Lock()
+    workers = [threading.Thread(target=run_thread,
+                                args=(controller, contexts, images, args.operations, args.batch_size, seed, submitted,
+                                      results, lock))
+               for seed in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return results, verify(controller, contexts, submitted), elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test the controllers with many users and threads")
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--threads', default='1,4,16', help="Thread counts to run, comma separated")
+    parser.add_argument('--operations', type=int, default=50, help="Calls per thread")
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Stub analyzer latency")
+    args = parser.parse_args()
+    
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            set_analyzer(StubBackend(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 2,
+                                     distribution='uniform', seed=0))
+            images = write_image_set('input', 8, resolution=(320, 240))
+            print(f"{args.users} users, {args.operations} calls per thread, one shared controller\n")
+            print(f"{'threads':>7} {'calls/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7} {'mixed up':>9}  problems")
+            for threads in [int(count) for count in args.threads.split(',')]:
+                results, problems, elapsed = run(args, threads, images)
+                latencies = results["latencies"]
+                mixed_up = results["mismatches"] + sum(problems.values())
+                print(f"{threads:>7} {len(latencies) / elapsed:>8.1f} {percentile(latencies, 50):>8.1f} "
+                      f"{percentile(latencies, 95):>8.1f} {len(results['errors']):>7} {mixed_up:>9}  "
+                      + (", ".join(f"{name} {count}" for name, count in problems.items() if count) or "none"))
+                for error in sorted(set(results["errors"]))[:5]:
+                    print(f"{'':>7} {error}")
+        finally:
+            set_analyzer(None)
+            os.chdir(original_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Synthetic fruit images and analyses for the benchmarks
+
+The images are deterministic for a given seed: a textured background with
+one or more coloured ellipses standing in for fruit. The analyses are
+model-style JSON responses assembled from a pool of phrases.
+"""
+import json
+import os
+import random
+from PIL import Image, ImageDraw, ImageFilter
+
+# Typical peel colours per ripeness class
+RIPENESS_COLORS = {
+    "Unripe": (96, 160, 48),
+    "Ripe": (236, 200, 40),
+    "Overripe": (120, 80, 30),
+}
+
+# Phrases the analyses are built from, per ripeness class
+ANALYSIS_CUES = {
+    "Unripe": ["green peel", "firm surface", "no sugar spots", "pale yellow tips", "tight stem",
+               "matte skin", "no aroma visible", "green patches near the stem"],
+    "Ripe": ["even yellow peel", "no green patches", "few brown spots", "vibrant yellow colour",
+             "slight give in the skin", "small sugar spots", "bright, uniform peel"],
+    "Overripe": ["dark brown patches", "soft looking areas", "wrinkled skin", "large black spots",
+                 "leaking near the stem", "dull, blotchy peel", "sunken areas"],
+}
+
+# Defects mentioned now and then, rarer further down the list
+ANALYSIS_DEFECTS = [
+    "a patch of mold near the stem",
+    "bruising on one side",
+    "a small cut in the skin",
+    "a few scratches",
+]
+
+RESOLUTIONS = {
+    "small": (640, 480),
+    "medium": (1920, 1080),
+    "large": (4032, 3024),
+}
+
+def generate_fruit_image(width, height, seed=0, ripeness=None, fruits=1):
+    """
+    Generate a synthetic fruit image
+    
+    Args:
+        width (int): The image width
+        height (int): The image height
+        seed (int): Seed for the random generator
+        ripeness (str, optional): The ripeness class to draw, random if not given
+        fruits (int): How many fruits to draw
+    
+    Returns:
+        PIL.Image: The generated RGB image
+    """
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), (70, 70, 75))
+    draw = ImageDraw.Draw(image)
+    
+    # Conveyor belt texture
+    stripe = max(4, height // 40)
+    for y in range(0, height, stripe * 2):
+        draw.rectangle([0, y, width, y + stripe], fill=(60, 62, 66))
+    
+    for _ in range(fruits):
+        label = ripeness or rng.choice(list(RIPENESS_COLORS))
+        r, g, b = RIPENESS_COLORS[label]
+        radius = rng.randint(min(width, height) // 12, min(width, height) // 5)
+        cx = rng.randint(radius, width - radius)
+        cy = rng.randint(radius, height - radius)
+        jitter = rng.randint(-15, 15)
+        draw.ellipse(
+            [cx - radius, cy - int(radius * 0.8), cx + radius, cy + int(radius * 0.8)],
+            fill=(max(0, r + jitter), max(0, g + jitter), max(0, b + jitter))
+        )
+    
+    return image.filter(ImageFilter.GaussianBlur(1))
+
+def generate_conveyor_scene(width, height, seed=0, fruits=1, fruit_size=(0.04, 0.1)):
+    """
+    Generate a photo of a conveyor belt with a few small fruits on it
+    
+    Unlike generate_fruit_image the belt fills most of the frame, with side
+    rails, uneven lighting, sensor noise and grey debris, and the fruit
+    positions are returned for checking a crop.
+    
+    Args:
+        width (int): The image width
+        height (int): The image height
+        seed (int): Seed for the random generator
+        fruits (int): How many fruits to draw, kept close together like one item on the belt
+        fruit_size (tuple): Smallest and largest fruit radius, as a fraction of the image width
+    
+    Returns:
+        tuple: (PIL.Image, list of (left, top, right, bottom) boxes of the fruits)
+    """
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), (84, 86, 90))
+    draw = ImageDraw.Draw(image)
+    
+    # Belt slats and the darker side rails
+    slat = max(4, height // 30)
+    for y in range(rng.randint(0, slat), height, slat * 2):
+        draw.rectangle([0, y, width, y + slat // 3], fill=(66, 68, 72))
+    rail = width // 12
+    draw.rectangle([0, 0, rail, height], fill=(40, 42, 46))
+    draw.rectangle([width - rail, 0, width, height], fill=(40, 42, 46))
+    
+    # Grey debris and scuffs, which must not be taken for fruit
+    for _ in range(12):
+        x, y = rng.randint(rail, width - rail), rng.randint(0, height)
+        size = rng.randint(2, max(3, width // 100))
+        shade = rng.randint(95, 140)
+        draw.ellipse([x, y, x + size, y + size], fill=(shade, shade, shade + 4))
+    
+    # Fruits near one spot of the belt
+    boxes = []
+    cx0 = rng.randint(width // 3, 2 * width // 3)
+    cy0 = rng.randint(height // 4, 3 * height // 4)
+    for _ in range(fruits):
+        label = rng.choice(list(RIPENESS_COLORS))
+        r, g, b = RIPENESS_COLORS[label]
+        radius = int(width * rng.uniform(*fruit_size))
+        cx = min(max(cx0 + rng.randint(-2, 2) * radius, rail + radius), width - rail - radius)
+        cy = min(max(cy0 + rng.randint(-1, 1) * radius, radius), height - radius)
+        box = (cx - radius, cy - int(radius * 0.8), cx + radius, cy + int(radius * 0.8))
+        draw.ellipse(box, fill=(r, g, b))
+        # Shadowed lower half and a few ripeness spots
+        draw.chord(box, 20, 160, fill=(int(r * 0.75), int(g * 0.75), int(b * 0.75)))
+        for _ in range(rng.randint(0, 5)):
+            sx = rng.randint(box[0] + radius // 2, box[2] - radius // 2)
+            sy = rng.randint(box[1] + radius // 2, box[3] - radius // 2)
+            draw.ellipse([sx, sy, sx + radius // 6, sy + radius // 6], fill=(70, 45, 20))
+        boxes.append(box)
+    
+    # Light falling off towards the bottom, and sensor noise
+    image = image.filter(ImageFilter.GaussianBlur(1))
+    gradient = Image.linear_gradient('L').resize((width, height)).point(lambda value: 255 - value // 3)
+    image = Image.composite(image, Image.new('RGB', (width, height)), gradient)
+    noise = Image.effect_noise((width, height), 12).convert('RGB')
+    return Image.blend(image, noise, 0.06), boxes
+
+def generate_tray_scene(width, height, seed=0, rows=4, columns=6, gap=0.08):
+    """
+    Generate a photo of a tray holding rows of fruits of mixed ripeness
+    
+    Args:
+        width (int): The image width
+        height (int): The image height
+        seed (int): Seed for the random generator
+        rows (int): Rows of fruit on the tray
+        columns (int): Fruits per row
+        gap (float): Mean space between neighbouring fruits as a fraction of their size,
+                     0 or less makes them touch
+    
+    Returns:
+        tuple: (PIL.Image, list of ((left, top, right, bottom), ripeness) per fruit)
+    """
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), (62, 64, 68))
+    draw = ImageDraw.Draw(image)
+    
+    # The tray, lighter than the belt around it
+    margin = min(width, height) // 20
+    draw.rectangle([margin, margin, width - margin, height - margin], fill=(150, 150, 146))
+    
+    cell_width = (width - 2 * margin) / columns
+    cell_height = (height - 2 * margin) / rows
+    radius = min(cell_width, cell_height * 1.25) / (2 * (1 + gap))
+    fruits = []
+    for row in range(rows):
+        for column in range(columns):
+            label = rng.choice(list(RIPENESS_COLORS))
+            r, g, b = RIPENESS_COLORS[label]
+            jitter = rng.randint(-15, 15)
+            size = radius * rng.uniform(0.9, 1.0)
+            cx = margin + (column + 0.5) * cell_width + rng.uniform(-0.3, 0.3) * radius * gap
+            cy = margin + (row + 0.5) * cell_height + rng.uniform(-0.3, 0.3) * radius * gap
+            box = (int(cx - size), int(cy - size * 0.8), int(cx + size), int(cy + size * 0.8))
+            draw.ellipse(box, fill=(max(0, r + jitter), max(0, g + jitter), max(0, b + jitter)))
+            fruits.append((box, label))
+    
+    noise = Image.effect_noise((width, height), 12).convert('RGB')
+    return Image.blend(image.filter(ImageFilter.GaussianBlur(1)), noise, 0.05), fruits
+
+def write_conveyor_video(path, fruits=20, width=1280, height=720, fps=30, crossing_seconds=2.0, seed=0):
+    """
+    Write a video of fruits riding a conveyor belt through the picture, one after another
+    
+    The belt moves left to right with its slats, under sensor noise, and
+    every fruit takes crossing_seconds to cross the picture with a stretch
+    of empty belt between fruits. Needs opencv-python.
+    
+    Args:
+        path (str): The video file to write, an .mp4
+        fruits (int): How many fruits pass
+        width (int): The frame width
+        height (int): The frame height
+        fps (int): Frames per second
+        crossing_seconds (float): Time a fruit takes to cross the picture
+        seed (int): Seed for the random generator
+    
+    Returns:
+        tuple: (frame count, list of (first frame, last frame, ripeness) per fruit in view)
+    """
+    import cv2
+    import numpy
+    
+    rng = random.Random(seed)
+    noise_rng = numpy.random.default_rng(seed)
+    speed = width / (crossing_seconds * fps)
+    
+    # The belt with slats across the direction of travel, one slat period wider than the frame to scroll
+    period = max(8, width // 24)
+    belt = numpy.empty((height, width + period, 3), dtype=numpy.uint8)
+    belt[:] = (90, 86, 84)
+    for x in range(0, width + period, period):
+        belt[:, x:x + period // 4] = (72, 68, 66)
+    # Light falling off towards the bottom
+    belt = (belt * numpy.linspace(1.0, 0.8, height)[:, numpy.newaxis, numpy.newaxis]).astype(numpy.uint8)
+    noise = [noise_rng.normal(0, 4, (height, width, 3)).astype(numpy.int16) for _ in range(8)]
+    
+    # Fruits enter at the left edge, spaced out by a stretch of empty belt
+    passes = []
+    start = fps // 2
+    for _ in range(fruits):
+        label = rng.choice(list(RIPENESS_COLORS))
+        radius = int(width * rng.uniform(0.05, 0.08))
+        cy = rng.randint(height // 4, 3 * height // 4)
+        passes.append((start, radius, cy, label))
+        start += int((width + 2 * radius) / speed) + int(rng.uniform(0.3, 1.5) * fps)
+    total = start + fps // 2
+    
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    try:
+        for frame_index in range(total):
+            offset = period - int(frame_index * speed) % period
+            frame = belt[:, offset:offset + width].copy()
+            for first, radius, cy, label in passes:
+                cx = int((frame_index - first) * speed) - radius
+                if -radius < cx < width + radius:
+                    r, g, b = RIPENESS_COLORS[label]
+                    cv2.ellipse(frame, (cx, cy), (radius, int(radius * 0.8)), 0, 0, 360, (b, g, r), -1)
+            frame = frame.astype(numpy.int16) + noise[frame_index % len(noise)]
+            writer.write(numpy.clip(frame, 0, 255).astype(numpy.uint8))
+    finally:
+        writer.release()
+    
+    truth = [(first, first + int((width + 2 * radius) / speed), label) for first, radius, _, label in passes]
+    return total, truth
+
+def write_image_set(directory, count, resolution=(1920, 1080), image_format='JPEG', fruits=1):
+    """
+    Write a set of synthetic images to a directory
+    
+    Args:
+        directory (str): The directory to write to
+        count (int): How many images to write
+        resolution (tuple): (width, height) of the images
+        image_format (str): The PIL format name
+        fruits (int): How many fruits to draw per image
+    
+    Returns:
+        list: The paths of the written images
+    """
+    os.makedirs(directory, exist_ok=True)
+    extension = {'JPEG': 'jpg', 'PNG': 'png', 'BMP': 'bmp', 'GIF': 'gif'}[image_format]
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"fruit_{i:06d}.{extension}")
+        generate_fruit_image(*resolution, seed=i, fruits=fruits).save(path, image_format)
+        paths.append(path)
+    return paths
+
+def generate_analysis(rng, ripeness=None):
+    """
+    Generate a model-style analysis response
+    
+    Args:
+        rng (random.Random): The random generator
+        ripeness (str, optional): The ripeness class, random if not given
+    
+    Returns:
+        tuple: (ripeness, analysis text)
+    """
+    ripeness = ripeness or rng.choice(list(ANALYSIS_CUES))
+    cues = rng.sample(ANALYSIS_CUES[ripeness], 3)
+    explanation = (f"The fruit shows {cues[0]} and {cues[1]}, with {cues[2]}. "
+                   f"This indicates it is {ripeness.lower()}.")
+    for rarity, defect in enumerate(ANALYSIS_DEFECTS):
+        if rng.random() < 0.02 / (rarity + 1) ** 2:
+            explanation += f" Also noticed {defect}."
+    return ripeness, json.dumps({
+        "ripeness": ripeness,
+        "confidence": rng.randint(60, 99),
+        "explanation": explanation,
+        "visual_cues": cues,
+    }, indent=2)
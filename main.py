@@ -2,8 +2,10 @@
 
 import os
 import sys
+from datetime import datetime
 from app.views.app_view import AppView
 from utils.logger import logger
+from utils.metrics import tracer
 
 def main():
     """
@@ -20,6 +22,12 @@ def main():
     app = AppView()
     app.mainloop()
     
+    # Write the timing spans collected during this session
+    if tracer.enabled:
+        metrics_file = os.path.join('logs', f"metrics_{datetime.now().strftime('%Y%m%d')}.jsonl")
+        tracer.dump_jsonl(metrics_file)
+        logger.info("Analysis pipeline timings:\n%s", tracer.report())
+    
     # Log application exit
     logger.info("Exiting Fruit Ripeness Detection Application")
 
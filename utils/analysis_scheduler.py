@@ -0,0 +1,238 @@
+"""
+Priority scheduling of analysis calls in front of the shared analyzer
+
+The window, the HTTP service, the watch folder and the job worker all call
+the same analyzer, which only takes so many calls at a time. Every call
+first takes a slot from the scheduler:
+    
+    with analysis_scheduler.slot(BATCH, user_id, cost=len(image_paths)):
+        results = get_analyzer().analyze_batch(image_paths)
+
+Free slots go to the interactive class first, then batch, then background.
+Batch and background may each hold at most their own share of the slots,
+and together at most the bulk share, so bulk work always leaves some slots
+free for a user waiting on the Analyze button. Within a class,
+users are served by weighted fair queuing: a user with thousands of queued
+images gets the same share as one with a single image. The call itself runs
+on the caller's thread, so streaming callbacks keep working as before.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from utils.metrics import Histogram, tracer
+
+# Load environment variables from .env file
+load_dotenv()
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+BACKGROUND = 'background'
+
+# Highest priority first
+PRIORITIES = (INTERACTIVE, BATCH, BACKGROUND)
+
+class _Ticket:
+    """
+    A caller waiting for, or holding, a slot
+    """
+    __slots__ = ('priority', 'user_id', 'cost', 'finish', 'granted', 'queued_at')
+    
+    def __init__(self, priority, user_id, cost, finish):
+        self.priority = priority
+        self.user_id = user_id
+        self.cost = cost
+        self.finish = finish
+        self.granted = threading.Event()
+        self.queued_at = time.monotonic()
+
+class _Slot:
+    """
+    Context manager that holds a slot while its block runs
+    """
+    
+    def __init__(self, scheduler, priority, user_id, cost):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.user_id = user_id
+        self.cost = cost
+        self.ticket = None
+    
+    def __enter__(self):
+        self.ticket = self.scheduler.acquire(self.priority, self.user_id, self.cost)
+        return self.ticket
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.scheduler.release(self.ticket)
+        return False
+
+class AnalysisScheduler:
+    """
+    Hands out analyzer slots by priority class, with weighted fair queuing across users
+    """
+    
+    def __init__(self, slots=None, batch_slots=None, background_slots=None, bulk_slots=None, user_weights=None):
+        """
+        Options that are not given are read from the environment
+        (FRUIT_APP_SCHEDULER_SLOTS, FRUIT_APP_SCHEDULER_BATCH_SLOTS,
+        FRUIT_APP_SCHEDULER_BACKGROUND_SLOTS, FRUIT_APP_SCHEDULER_BULK_SLOTS).
+        
+        Args:
+            slots (int, optional): Analyzer calls running at the same time, 0 turns scheduling off
+            batch_slots (int, optional): Most slots batch calls may hold
+            background_slots (int, optional): Most slots background calls may hold
+            bulk_slots (int, optional): Most slots batch and background calls may hold together
+            user_weights (dict, optional): user_id -> weight, users not listed have weight 1
+        """
+        self.slots = int(slots if slots is not None else os.getenv('FRUIT_APP_SCHEDULER_SLOTS', 8))
+        batch_slots = batch_slots if batch_slots is not None else os.getenv('FRUIT_APP_SCHEDULER_BATCH_SLOTS')
+        background_slots = (background_slots if background_slots is not None
+                            else os.getenv('FRUIT_APP_SCHEDULER_BACKGROUND_SLOTS'))
+        bulk_slots = bulk_slots if bulk_slots is not None else os.getenv('FRUIT_APP_SCHEDULER_BULK_SLOTS')
+        # By default bulk work leaves a quarter of the slots, and at least one, free for interactive calls,
+        # and batch leaves background its quarter of the rest. With a single slot nothing can be reserved.
+        self.bulk_slots = (int(bulk_slots) if bulk_slots is not None
+                           else max(1, self.slots - max(1, self.slots // 4)))
+        background_slots = int(background_slots) if background_slots is not None else max(1, self.slots // 4)
+        self.class_slots = {
+            INTERACTIVE: self.slots,
+            BATCH: int(batch_slots) if batch_slots is not None else max(1, self.bulk_slots - background_slots),
+            BACKGROUND: background_slots,
+        }
+        self.user_weights = dict(user_weights or {})
+        
+        self._lock = threading.Lock()
+        self._running = 0
+        # Per class: heap of (finish tag, sequence, ticket), virtual time and each user's last finish tag
+        self._queues = {priority: [] for priority in PRIORITIES}
+        self._class_running = {priority: 0 for priority in PRIORITIES}
+        self._virtual_time = {priority: 0.0 for priority in PRIORITIES}
+        self._last_finish = {priority: {} for priority in PRIORITIES}
+        self._sequence = itertools.count()
+        self._reset_stats()
+    
+    def _reset_stats(self):
+        self.stats = {priority: {"completed": 0, "max_queued": 0} for priority in PRIORITIES}
+        self.wait_ms = {priority: Histogram() for priority in PRIORITIES}
+        self.run_ms = {priority: Histogram() for priority in PRIORITIES}
+    
+    def slot(self, priority=INTERACTIVE, user_id=None, cost=1):
+        """
+        Hold an analyzer slot for the duration of a with block
+        
+        Args:
+            priority (str): 'interactive', 'batch' or 'background'
+            user_id (int, optional): Who the call is for, calls without a user share one queue
+            cost (int): The size of the call, for example the number of images in a batch
+        
+        Returns:
+            A context manager
+        """
+        return _Slot(self, priority, user_id, cost)
+    
+    def acquire(self, priority=INTERACTIVE, user_id=None, cost=1):
+        """
+        Wait for a slot, see slot()
+        
+        Returns:
+            The ticket to pass to release()
+        """
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority: {priority}")
+        cost = max(1, cost)
+        
+        with self._lock:
+            # Self-clocked fair queuing: the tag is where this call would finish if each
+            # backlogged user got their weighted share of the class
+            last_finish = self._last_finish[priority]
+            start = max(self._virtual_time[priority], last_finish.get(user_id, 0.0))
+            ticket = _Ticket(priority, user_id, cost, start + cost / self.user_weights.get(user_id, 1))
+            last_finish[user_id] = ticket.finish
+            if self.slots <= 0:
+                self._class_running[priority] += 1
+                self._running += 1
+                ticket.granted.set()
+            else:
+                heapq.heappush(self._queues[priority], (ticket.finish, next(self._sequence), ticket))
+                stats = self.stats[priority]
+                stats["max_queued"] = max(stats["max_queued"], len(self._queues[priority]))
+                self._dispatch()
+        
+        ticket.granted.wait()
+        waited = (time.monotonic() - ticket.queued_at) * 1000
+        with self._lock:
+            self.wait_ms[priority].record(waited)
+        tracer.record('scheduler.wait', waited, priority=priority)
+        # From now on the ticket times the call
+        ticket.queued_at = time.monotonic()
+        return ticket
+    
+    def _dispatch(self):
+        """
+        Grant free slots to the highest class that is under its cap, called with the lock held
+        """
+        while self.slots <= 0 or self._running < self.slots:
+            bulk_full = self._class_running[BATCH] + self._class_running[BACKGROUND] >= self.bulk_slots
+            for priority in PRIORITIES:
+                queue = self._queues[priority]
+                if (queue and self._class_running[priority] < self.class_slots[priority]
+                        and (priority == INTERACTIVE or self.slots <= 0 or not bulk_full)):
+                    _, _, ticket = heapq.heappop(queue)
+                    self._virtual_time[priority] = ticket.finish
+                    self._class_running[priority] += 1
+                    self._running += 1
+                    ticket.granted.set()
+                    break
+            else:
+                break
+        
+        # Tags at or below the virtual time no longer affect anyone, drop them so the table stays small
+        for priority in PRIORITIES:
+            last_finish = self._last_finish[priority]
+            if len(last_finish) > 1000:
+                virtual_time = self._virtual_time[priority]
+                for user_id in [user_id for user_id, finish in last_finish.items() if finish <= virtual_time]:
+                    del last_finish[user_id]
+    
+    def release(self, ticket):
+        """
+        Give a slot back
+        
+        Args:
+            ticket: The ticket returned by acquire()
+        """
+        duration = (time.monotonic() - ticket.queued_at) * 1000
+        with self._lock:
+            self._class_running[ticket.priority] -= 1
+            self._running -= 1
+            self.stats[ticket.priority]["completed"] += 1
+            self.run_ms[ticket.priority].record(duration)
+            self._dispatch()
+    
+    def get_stats(self):
+        """
+        Get the queue depths and the wait and run times per class
+        
+        Returns:
+            dict: Per class the queued and running calls, the cap, the completed calls,
+                  the most calls ever queued and the wait and run time summaries
+        """
+        with self._lock:
+            return {
+                priority: dict(self.stats[priority], queued=len(self._queues[priority]),
+                               running=self._class_running[priority], cap=self.class_slots[priority],
+                               wait=self.wait_ms[priority].summary(), run=self.run_ms[priority].summary())
+                for priority in PRIORITIES
+            }
+    
+    def reset_stats(self):
+        """
+        Drop the recorded counters and latencies
+        """
+        with self._lock:
+            self._reset_stats()
+
+# Shared by every analyzer call in the process
+analysis_scheduler = AnalysisScheduler()
@@ -0,0 +1,579 @@
+import base64
+import json
+import math
+import os
+import random
+import threading
+import time
+import urllib.request
+import zlib
+import numpy
+from dotenv import load_dotenv
+from PIL import Image
+from utils.ripeness_parser import RipenessStreamParser
+
+# Load environment variables from .env file
+load_dotenv()
+
+RIPENESS_CLASSES = ["Ripe", "Unripe", "Overripe"]
+
+class AnalyzerBackend:
+    """
+    Interface of a fruit analyzer
+    
+    A backend takes the path of a saved image and returns a dict with at
+    least 'ripeness' ('Ripe', 'Unripe', 'Overripe' or 'Unknown') and
+    'full_analysis' (the raw model text). Backends may add 'confidence'.
+    """
+    name = None
+    
+    def analyze(self, image_path):
+        """
+        Analyze a fruit image
+        
+        Args:
+            image_path (str): Path to the fruit image
+        
+        Returns:
+            dict: A dictionary containing ripeness status and detailed analysis
+        """
+        raise NotImplementedError
+    
+    def analyze_batch(self, image_paths):
+        """
+        Analyze several fruit images, in one model call where the backend supports it
+        
+        Args:
+            image_paths (list): Paths to the fruit images
+        
+        Returns:
+            list: One result dict per image, in the same order
+        """
+        return [self.analyze(image_path) for image_path in image_paths]
+    
+    def analyze_streaming(self, image_path, on_ripeness=None, on_text=None):
+        """
+        Analyze a fruit image, reporting the ripeness before the full analysis is done
+        
+        Backends that can't stream report both once the analysis has finished.
+        
+        Args:
+            image_path (str): Path to the fruit image
+            on_ripeness (callable, optional): Called with the ripeness class once it is decided
+            on_text (callable, optional): Called with the analysis text received so far
+        
+        Returns:
+            dict: A dictionary containing ripeness status and detailed analysis
+        """
+        result = self.analyze(image_path)
+        if on_ripeness and result.get('ripeness', 'Unknown') != 'Unknown':
+            on_ripeness(result['ripeness'])
+        if on_text and result.get('full_analysis'):
+            on_text(result['full_analysis'])
+        return result
+
+class GeminiBackend(AnalyzerBackend):
+    """
+    The remote Google Gemini model from utils.gemini_api
+    """
+    name = 'gemini'
+    
+    def analyze(self, image_path):
+        # Imported lazily so offline backends don't need the API client installed
+        from utils.gemini_api import analyze_fruit_image
+        return analyze_fruit_image(image_path)
+    
+    def analyze_batch(self, image_paths):
+        from utils.gemini_api import analyze_fruit_images
+        return analyze_fruit_images(image_paths)
+    
+    def analyze_streaming(self, image_path, on_ripeness=None, on_text=None):
+        from utils.gemini_api import analyze_fruit_image_streaming
+        return analyze_fruit_image_streaming(image_path, on_ripeness, on_text)
+
+def stub_response_text(ripeness, confidence):
+    """
+    Build a response that looks like the one requested from Gemini
+    """
+    cues = {
+        "Ripe": ["even yellow peel", "no green patches", "few brown spots"],
+        "Unripe": ["green peel", "firm surface", "no sugar spots"],
+        "Overripe": ["dark brown patches", "soft looking areas", "wrinkled skin"],
+    }[ripeness]
+    return json.dumps({
+        "ripeness": ripeness,
+        "confidence": confidence,
+        "explanation": f"The fruit shows {cues[0]} and {cues[1]}, which indicates it is {ripeness.lower()}.",
+        "visual_cues": cues,
+    }, indent=2)
+
+def image_key(image_path=None, data=None):
+    """
+    Stable key of an image for the stub analyzers
+    
+    The key is a checksum of the image bytes, so a copy of an image gets the
+    same answer as the original. Paths that don't exist fall back to the file
+    name, which lets benchmarks use placeholder paths.
+    
+    Args:
+        image_path (str, optional): Path to the image file
+        data (bytes, optional): The image bytes, if already read
+    
+    Returns:
+        str: The key
+    """
+    if data is None and image_path and os.path.exists(image_path):
+        with open(image_path, 'rb') as image_file:
+            data = image_file.read()
+    if data:
+        return f"{zlib.crc32(data):08x}"
+    return os.path.basename(image_path or '')
+
+class StubBackend(AnalyzerBackend):
+    """
+    Local deterministic stand-in for the model, for offline benchmarks
+    
+    The label of an image depends only on its content and the seed, so
+    repeated runs classify the same images the same way. Latency and errors
+    are drawn from a seeded random generator.
+    """
+    name = 'stub'
+    
+    def __init__(self, latency_ms=None, jitter_ms=None, distribution=None, error_rate=None, seed=None,
+                 per_image_ms=None, max_concurrent=None, chunk_ms=None, chunk_chars=24):
+        """
+        Initialize the stub
+        
+        Options that are not given are read from the environment
+        (FRUIT_APP_STUB_LATENCY_MS, FRUIT_APP_STUB_JITTER_MS,
+        FRUIT_APP_STUB_DISTRIBUTION, FRUIT_APP_STUB_ERROR_RATE, FRUIT_APP_STUB_SEED,
+        FRUIT_APP_STUB_PER_IMAGE_MS, FRUIT_APP_STUB_MAX_CONCURRENT, FRUIT_APP_STUB_CHUNK_MS).
+        
+        Args:
+            latency_ms (float, optional): Mean simulated latency of a call
+            jitter_ms (float, optional): Spread of the latency, meaning depends on the distribution
+            distribution (str, optional): 'fixed', 'uniform' (mean +- jitter) or 'lognormal' (jitter is the stddev)
+            error_rate (float, optional): Probability that a call fails
+            seed (int, optional): Seed for labels, latencies and errors
+            per_image_ms (float, optional): Extra latency for every image after the first in a batch call
+            max_concurrent (int, optional): Calls served at the same time, like a provider quota, 0 is unlimited
+            chunk_ms (float, optional): Time to generate each chunk of the response text, on top of
+                the latency which then stands for the time to the first chunk
+            chunk_chars (int): Characters per generated chunk
+        """
+        self.latency_ms = float(latency_ms if latency_ms is not None else os.getenv('FRUIT_APP_STUB_LATENCY_MS', 50))
+        self.jitter_ms = float(jitter_ms if jitter_ms is not None else os.getenv('FRUIT_APP_STUB_JITTER_MS', 0))
+        self.distribution = distribution or os.getenv('FRUIT_APP_STUB_DISTRIBUTION', 'fixed')
+        self.error_rate = float(error_rate if error_rate is not None else os.getenv('FRUIT_APP_STUB_ERROR_RATE', 0))
+        self.seed = int(seed if seed is not None else os.getenv('FRUIT_APP_STUB_SEED', 0))
+        self.per_image_ms = float(per_image_ms if per_image_ms is not None else os.getenv('FRUIT_APP_STUB_PER_IMAGE_MS', 0))
+        self.max_concurrent = int(max_concurrent if max_concurrent is not None else os.getenv('FRUIT_APP_STUB_MAX_CONCURRENT', 0))
+        self.chunk_ms = float(chunk_ms if chunk_ms is not None else os.getenv('FRUIT_APP_STUB_CHUNK_MS', 0))
+        self.chunk_chars = chunk_chars
+        if self.distribution not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f"Unknown latency distribution: {self.distribution}")
+        
+        self._random = random.Random(self.seed)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_concurrent) if self.max_concurrent > 0 else None
+        self.calls = 0
+    
+    def _draw(self):
+        """
+        Draw the latency in seconds and whether this call fails
+        """
+        with self._lock:
+            if self.distribution == 'uniform':
+                latency = self._random.uniform(self.latency_ms - self.jitter_ms, self.latency_ms + self.jitter_ms)
+            elif self.distribution == 'lognormal' and self.latency_ms > 0:
+                # Parameters of the underlying normal for the requested mean and stddev
+                variance = math.log(1 + (self.jitter_ms / self.latency_ms) ** 2)
+                latency = self._random.lognormvariate(math.log(self.latency_ms) - variance / 2, math.sqrt(variance))
+            else:
+                latency = self.latency_ms
+            failed = self._random.random() < self.error_rate
+        return max(0.0, latency) / 1000, failed
+    
+    def classify(self, key):
+        """
+        Deterministically pick a label and confidence for an image key
+        
+        Args:
+            key (str): A stable key of the image, see image_key()
+        
+        Returns:
+            tuple: (ripeness, confidence)
+        """
+        digest = zlib.crc32(f"{self.seed}:{key}".encode('utf-8'))
+        return RIPENESS_CLASSES[digest % 3], 50 + (digest >> 8) % 50
+    
+    def _result(self, key):
+        ripeness, confidence = self.classify(key)
+        return {
+            "ripeness": ripeness,
+            "confidence": confidence,
+            "full_analysis": stub_response_text(ripeness, confidence),
+        }
+    
+    def _call(self, count):
+        """
+        Wait like one model call carrying count images and tell whether it failed
+        """
+        latency, failed = self._draw()
+        latency += max(0, count - 1) * self.per_image_ms / 1000
+        if self._slots:
+            self._slots.acquire()
+        try:
+            with self._lock:
+                self.calls += 1
+            time.sleep(latency)
+        finally:
+            if self._slots:
+                self._slots.release()
+        return failed
+    
+    def analyze(self, image_path):
+        return self.analyze_key(image_key(image_path))
+    
+    def analyze_batch(self, image_paths):
+        return self.analyze_keys([image_key(image_path) for image_path in image_paths])
+    
+    def analyze_key(self, key):
+        """
+        Simulate a model call for an image key
+        
+        Args:
+            key (str): A stable key of the image, see image_key()
+        
+        Returns:
+            dict: A dictionary containing ripeness status and detailed analysis
+        """
+        if self._call(1):
+            return {"ripeness": "Unknown", "full_analysis": "Error: simulated analyzer failure"}
+        result = self._result(key)
+        # Without streaming the caller waits for the whole text to be generated
+        time.sleep(len(self._chunks(result["full_analysis"])) * self.chunk_ms / 1000)
+        return result
+    
+    def _chunks(self, text):
+        return [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+    
+    def analyze_streaming(self, image_path, on_ripeness=None, on_text=None):
+        """
+        Simulate a streamed model response, one chunk every chunk_ms
+        """
+        parser = RipenessStreamParser(on_ripeness, on_text)
+        if self._call(1):
+            return {"ripeness": "Unknown", "full_analysis": "Error: simulated analyzer failure"}
+        
+        for chunk in self._chunks(self._result(image_key(image_path))["full_analysis"]):
+            time.sleep(self.chunk_ms / 1000)
+            parser.feed(chunk)
+        return parser.result()
+    
+    def analyze_keys(self, keys):
+        """
+        Simulate one multi-image model call
+        
+        A simulated failure fails the whole call, like a failed request would.
+        
+        Args:
+            keys (list): Stable keys of the images, see image_key()
+        
+        Returns:
+            list: One result dict per key, in the same order
+        """
+        if self._call(len(keys)):
+            return [{"ripeness": "Unknown", "full_analysis": "Error: simulated analyzer failure"} for _ in keys]
+        return [self._result(key) for key in keys]
+
+class HttpBackend(AnalyzerBackend):
+    """
+    Sends images to an HTTP analysis service, such as utils.stub_server
+    
+    The files are uploaded as they are, so the service sees the same image as
+    the stub backend; cropping to the fruit is left to the service (see the
+    stub server's --roi option).
+    """
+    name = 'http'
+    
+    def __init__(self, url=None, timeout=None, batch_url=None):
+        """
+        Args:
+            url (str, optional): The analyze endpoint, read from FRUIT_APP_ANALYZER_URL if not given
+            timeout (float, optional): Request timeout in seconds
+            batch_url (str, optional): The multi-image endpoint, defaults to the analyze endpoint + '_batch'
+        """
+        self.url = url or os.getenv('FRUIT_APP_ANALYZER_URL', 'http://127.0.0.1:8765/analyze')
+        self.timeout = float(timeout or os.getenv('FRUIT_APP_ANALYZER_TIMEOUT', 60))
+        self.batch_url = batch_url or os.getenv('FRUIT_APP_ANALYZER_BATCH_URL', f"{self.url.rstrip('/')}_batch")
+    
+    def analyze(self, image_path):
+        try:
+            with open(image_path, 'rb') as image_file:
+                data = image_file.read()
+            
+            request = urllib.request.Request(self.url, data=data, method='POST', headers={
+                'Content-Type': 'application/octet-stream',
+                'X-Image-Name': os.path.basename(image_path),
+            })
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except Exception as e:
+            print(f"Error analyzing image with HTTP backend: {e}")
+            return {"ripeness": "Unknown", "full_analysis": f"Error: {str(e)}"}
+    
+    def analyze_batch(self, image_paths):
+        try:
+            images = []
+            for image_path in image_paths:
+                with open(image_path, 'rb') as image_file:
+                    images.append({
+                        "name": os.path.basename(image_path),
+                        "data": base64.b64encode(image_file.read()).decode('ascii'),
+                    })
+            
+            request = urllib.request.Request(self.batch_url, data=json.dumps({"images": images}).encode('utf-8'),
+                                             method='POST', headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                results = json.loads(response.read().decode('utf-8'))["results"]
+            if len(results) != len(image_paths):
+                raise ValueError(f"Expected {len(image_paths)} results, got {len(results)}")
+            return results
+        except Exception as e:
+            print(f"Error analyzing image batch with HTTP backend: {e}")
+            return [{"ripeness": "Unknown", "full_analysis": f"Error: {str(e)}"} for _ in image_paths]
+
+class ColorHeuristicBackend(AnalyzerBackend):
+    """
+    Cheap local classifier based on the hue of the fruit pixels
+    
+    Strongly saturated pixels are treated as fruit and each one votes green
+    (Unripe), yellow (Ripe) or dark orange/brown (Overripe). The confidence is
+    the share of the winning vote. It runs in a few milliseconds and is meant
+    as the first tier of a cascade, not as a replacement for the model.
+    """
+    name = 'color'
+    
+    # PIL hue range is 0-255 for 0-360 degrees
+    GREEN_HUES = (50, 120)
+    YELLOW_HUES = (20, 50)
+    MIN_SATURATION = 80
+    DARK_VALUE = 150
+    
+    # Pixel classes 1, 2 and 3 of classify_pixels(), 0 is not fruit
+    VOTE_CLASSES = ("Unripe", "Ripe", "Overripe")
+    
+    def __init__(self, sample_size=128):
+        """
+        Args:
+            sample_size (int): The image is reduced to fit this size before voting
+        """
+        self.sample_size = sample_size
+    
+    def analyze(self, image_path):
+        try:
+            with Image.open(image_path) as image:
+                # draft() lets the JPEG decoder skip most of the full resolution work
+                image.draft('RGB', (self.sample_size, self.sample_size))
+                image = image.convert('RGB')
+            image.thumbnail((self.sample_size, self.sample_size))
+            hsv = numpy.asarray(image.convert('HSV'), dtype=numpy.int16).reshape(-1, 3)
+        except Exception as e:
+            return {"ripeness": "Unknown", "confidence": 0, "full_analysis": f"Error: {str(e)}"}
+        
+        counts = numpy.bincount(self.classify_pixels(hsv), minlength=len(self.VOTE_CLASSES) + 1)
+        votes = {label: int(count) for label, count in zip(self.VOTE_CLASSES, counts[1:])}
+        
+        total = sum(votes.values())
+        if total == 0:
+            return {"ripeness": "Unknown", "confidence": 0, "full_analysis": "No fruit coloured pixels found"}
+        
+        ripeness = max(votes, key=votes.get)
+        confidence = round(100 * votes[ripeness] / total)
+        shares = ", ".join(f"{label} {100 * count / total:.0f}%" for label, count in votes.items())
+        return {
+            "ripeness": ripeness,
+            "confidence": confidence,
+            "full_analysis": f"Colour heuristic: {shares} of fruit pixels.",
+        }
+    
+    @classmethod
+    def classify_pixels(cls, hsv):
+        """
+        Vote every pixel for a ripeness class by its hue
+        
+        Args:
+            hsv (numpy.ndarray): PIL HSV values, any shape with the channels last, at least int16
+        
+        Returns:
+            numpy.ndarray: Per pixel 0 (not fruit) or 1-3, the index into VOTE_CLASSES plus one
+        """
+        hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+        fruit = saturation >= cls.MIN_SATURATION
+        green = fruit & (hue >= cls.GREEN_HUES[0]) & (hue < cls.GREEN_HUES[1])
+        warm = fruit & (hue >= cls.YELLOW_HUES[0] - 10) & (hue < cls.YELLOW_HUES[1])
+        brown = warm & ((value < cls.DARK_VALUE) | (hue < cls.YELLOW_HUES[0]))
+        classes = numpy.zeros(hue.shape, dtype=numpy.intp)
+        classes[green] = 1
+        classes[warm & ~brown] = 2
+        classes[brown] = 3
+        return classes
+
+class CascadeBackend(AnalyzerBackend):
+    """
+    Answers from cheap backends first and escalates to a heavy backend when needed
+    
+    Every fast backend is asked first. The request is escalated to the heavy
+    backend when a fast backend fails, when the fast backends disagree, or
+    when the lowest fast confidence is below the threshold. Routing counters
+    and per-tier latencies are available from get_stats().
+    """
+    name = 'cascade'
+    
+    def __init__(self, fast=None, heavy=None, threshold=None):
+        """
+        Options that are not given are read from the environment
+        (FRUIT_APP_CASCADE_FAST, FRUIT_APP_CASCADE_HEAVY, FRUIT_APP_CASCADE_THRESHOLD).
+        
+        Args:
+            fast (list, optional): Fast backends or their names, comma separated names are accepted
+            heavy (AnalyzerBackend or str, optional): The heavy backend or its name
+            threshold (float, optional): Minimum confidence (0-100) to accept a fast answer
+        """
+        fast = fast or os.getenv('FRUIT_APP_CASCADE_FAST', ColorHeuristicBackend.name)
+        if isinstance(fast, str):
+            fast = [name.strip() for name in fast.split(',') if name.strip()]
+        self.fast_backends = [create_backend(backend) if isinstance(backend, str) else backend for backend in fast]
+        
+        heavy = heavy or os.getenv('FRUIT_APP_CASCADE_HEAVY', GeminiBackend.name)
+        self.heavy_backend = create_backend(heavy) if isinstance(heavy, str) else heavy
+        self.threshold = float(threshold if threshold is not None else os.getenv('FRUIT_APP_CASCADE_THRESHOLD', 75))
+        
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "answered_fast": 0, "escalated": 0,
+                      "low_confidence": 0, "disagreement": 0, "fast_failed": 0,
+                      "fast_ms": 0.0, "heavy_ms": 0.0}
+    
+    def _escalation_reason(self, results):
+        labels = {result.get('ripeness', 'Unknown') for result in results}
+        if 'Unknown' in labels:
+            return 'fast_failed'
+        if len(labels) > 1:
+            return 'disagreement'
+        if min(float(result.get('confidence') or 0) for result in results) < self.threshold:
+            return 'low_confidence'
+        return None
+    
+    def analyze(self, image_path):
+        start = time.perf_counter()
+        fast_results = [backend.analyze(image_path) for backend in self.fast_backends]
+        fast_ms = (time.perf_counter() - start) * 1000
+        reason = self._escalation_reason(fast_results)
+        
+        heavy_ms = 0.0
+        if reason is None:
+            result = dict(fast_results[0], tier='fast')
+        else:
+            start = time.perf_counter()
+            result = dict(self.heavy_backend.analyze(image_path), tier='heavy', escalation_reason=reason)
+            heavy_ms = (time.perf_counter() - start) * 1000
+        
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["fast_ms"] += fast_ms
+            self.stats["heavy_ms"] += heavy_ms
+            if reason is None:
+                self.stats["answered_fast"] += 1
+            else:
+                self.stats["escalated"] += 1
+                self.stats[reason] += 1
+        return result
+    
+    def get_stats(self):
+        """
+        Get the routing counters
+        
+        Returns:
+            dict: Request and escalation counts, the escalation rate and mean latency per tier
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        requests = stats["requests"] or 1
+        stats["escalation_rate"] = round(stats["escalated"] / requests, 4)
+        stats["mean_fast_ms"] = round(stats.pop("fast_ms") / requests, 3)
+        stats["mean_heavy_ms"] = round(stats.pop("heavy_ms") / max(1, stats["escalated"]), 3)
+        return stats
+
+# Registered backend factories by name
+_BACKENDS = {}
+_default_backend = None
+_default_lock = threading.Lock()
+
+def register_backend(name, factory):
+    """
+    Register an analyzer backend
+    
+    Args:
+        name (str): The name used in FRUIT_APP_ANALYZER
+        factory (callable): Returns a new AnalyzerBackend, called with the options of create_backend()
+    """
+    _BACKENDS[name] = factory
+
+def available_backends():
+    """
+    Get the names of all registered backends
+    """
+    return sorted(_BACKENDS)
+
+def create_backend(name=None, **options):
+    """
+    Create an analyzer backend by name
+    
+    Args:
+        name (str, optional): The backend name, read from FRUIT_APP_ANALYZER if not given
+        **options: Passed to the backend factory
+    
+    Returns:
+        AnalyzerBackend: The new backend
+    """
+    name = name or os.getenv('FRUIT_APP_ANALYZER', GeminiBackend.name)
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown analyzer backend '{name}', available: {', '.join(available_backends())}")
+    return _BACKENDS[name](**options)
+
+def _create_batching_backend(**options):
+    # Imported lazily, utils.micro_batcher depends on this module
+    from utils.micro_batcher import BatchingBackend
+    return BatchingBackend(**options)
+
+def get_analyzer():
+    """
+    Get the process-wide analyzer selected by the configuration
+    
+    Returns:
+        AnalyzerBackend: The shared default backend
+    """
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            _default_backend = create_backend()
+        return _default_backend
+
+def set_analyzer(backend):
+    """
+    Replace the process-wide analyzer, for example with a stub in benchmarks
+    
+    Args:
+        backend (AnalyzerBackend or None): The new default, None to reload it from the configuration
+    """
+    global _default_backend
+    with _default_lock:
+        _default_backend = backend
+
+register_backend(GeminiBackend.name, GeminiBackend)
+register_backend(StubBackend.name, StubBackend)
+register_backend(HttpBackend.name, HttpBackend)
+register_backend(ColorHeuristicBackend.name, ColorHeuristicBackend)
+register_backend(CascadeBackend.name, CascadeBackend)
+register_backend('batch', _create_batching_backend)
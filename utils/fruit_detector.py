@@ -0,0 +1,202 @@
+"""
+Find the individual fruits in a tray photo and classify each one
+
+The fruit pixels come from the same mask as the crop in utils.roi. Fruits
+on a tray touch each other, so the mask is split with a distance transform
+and a watershed: every fruit has a core far from the belt, the cores are
+the seeds and the watershed grows them back out to the fruit edges. Each
+region is one fruit with its own box.
+
+Classifying them takes one pass either way. The local classifier votes
+every pixel with the hue rules of the colour heuristic and counts the votes
+of all fruits at once. The model classifier crops every fruit from the
+image and sends all crops in one batch call.
+
+Needs opencv-python.
+"""
+import os
+import numpy
+from dotenv import load_dotenv
+from PIL import Image
+from utils.analyzer_backends import ColorHeuristicBackend
+from utils.metrics import tracer
+from utils.roi import cv2, roi_cropper
+
+# Load environment variables from .env file
+load_dotenv()
+
+LOCAL = 'local'
+MODEL = 'model'
+
+class FruitDetector:
+    """
+    Segments a tray photo into fruits and classifies them in one pass
+    """
+    
+    def __init__(self, detect_size=None, split=0.7, min_area=0.001, margin=0.08):
+        """
+        Options that are not given are read from the environment (FRUIT_APP_FRUITS_DETECT_SIZE).
+        
+        Args:
+            detect_size (int, optional): Longest side of the reduced copy the fruits are found on
+            split (float): Share of a blob's largest distance to the belt that counts as fruit core,
+                           lower values split touching fruits less eagerly
+            min_area (float): Smallest fruit, as a fraction of the image area
+            margin (float): Border added around each fruit's crop, as a fraction of its size
+        """
+        self.detect_size = int(detect_size or os.getenv('FRUIT_APP_FRUITS_DETECT_SIZE', 640))
+        self.split = split
+        self.min_area = min_area
+        self.margin = margin
+    
+    def segment(self, image):
+        """
+        Label every fruit of an image
+        
+        Args:
+            image (PIL.Image): The decoded RGB image
+        
+        Returns:
+            tuple: (labels, boxes, scale) where labels is an int32 array of the reduced image with
+                   0 for belt and 1..n per fruit, boxes the (left, top, right, bottom) box of fruit
+                   1..n in image pixels, and scale the size of the reduced image relative to the image
+        """
+        if cv2 is None:
+            raise RuntimeError("Fruit detection needs the opencv-python package")
+        
+        width, height = image.size
+        scale = min(1.0, self.detect_size / max(width, height))
+        small = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR) \
+            if scale < 1 else image
+        pixels = numpy.asarray(small)
+        mask = roi_cropper.foreground_mask(pixels)
+        
+        # Cores: the pixels furthest from the belt within their blob
+        distance = cv2.distanceTransform(mask, cv2.DIST_L2, 5)
+        blob_count, blobs = cv2.connectedComponents(mask)
+        blob_peak = numpy.zeros(blob_count, dtype=numpy.float32)
+        numpy.maximum.at(blob_peak, blobs.ravel(), distance.ravel())
+        cores = ((distance >= self.split * blob_peak[blobs]) & (mask > 0)).astype(numpy.uint8)
+        
+        # Seeds are 2.. so that 1 marks the belt, 0 is left for the watershed to fill
+        _, markers = cv2.connectedComponents(cores)
+        markers = markers + 1
+        markers[(mask > 0) & (cores == 0)] = 0
+        labels = cv2.watershed(cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR), markers)
+        labels = numpy.where(labels > 1, labels - 1, 0).astype(numpy.int32)
+        
+        # Box and area of every region in one pass
+        count = labels.max() + 1
+        rows, columns = numpy.nonzero(labels)
+        region = labels[rows, columns]
+        area = numpy.bincount(region, minlength=count)
+        left = numpy.full(count, labels.shape[1])
+        top = numpy.full(count, labels.shape[0])
+        right = numpy.zeros(count, dtype=numpy.intp)
+        bottom = numpy.zeros(count, dtype=numpy.intp)
+        numpy.minimum.at(left, region, columns)
+        numpy.minimum.at(top, region, rows)
+        numpy.maximum.at(right, region, columns + 1)
+        numpy.maximum.at(bottom, region, rows + 1)
+        
+        # Drop specks and renumber the fruits 1..n in reading order
+        kept = [index for index in range(1, count) if area[index] >= self.min_area * labels.size]
+        kept = self._reading_order(kept, top, bottom, left)
+        renumber = numpy.zeros(count, dtype=numpy.int32)
+        renumber[kept] = numpy.arange(1, len(kept) + 1)
+        boxes = []
+        for index in kept:
+            pad_x = (right[index] - left[index]) * self.margin
+            pad_y = (bottom[index] - top[index]) * self.margin
+            boxes.append((max(0, int((left[index] - pad_x) / scale)), max(0, int((top[index] - pad_y) / scale)),
+                          min(width, int((right[index] + pad_x) / scale + 0.5)),
+                          min(height, int((bottom[index] + pad_y) / scale + 0.5))))
+        return renumber[labels], boxes, scale
+    
+    def _reading_order(self, kept, top, bottom, left):
+        """
+        Sort regions into rows by their vertical centres, then left to right within a row
+        
+        A region starts a new row when its centre is more than half the median fruit height
+        below the centre of the row's first region, so small and large fruits lying side by
+        side share a row.
+        
+        Returns:
+            list: The region indexes in reading order
+        """
+        if not kept:
+            return kept
+        centre = (top + bottom) / 2
+        row_height = max(1.0, float(numpy.median([bottom[index] - top[index] for index in kept])))
+        rows = []
+        for index in sorted(kept, key=lambda index: centre[index]):
+            if rows and centre[index] - centre[rows[-1][0]] <= row_height / 2:
+                rows[-1].append(index)
+            else:
+                rows.append([index])
+        return [index for row in rows for index in sorted(row, key=lambda index: left[index])]
+    
+    def classify_local(self, image, labels, count):
+        """
+        Classify every fruit by the hue votes of its pixels, all fruits in one pass
+        
+        Args:
+            image (PIL.Image): The decoded RGB image
+            labels (numpy.ndarray): The fruit labels from segment()
+            count (int): The number of fruits
+        
+        Returns:
+            list: A (ripeness, confidence) tuple per fruit
+        """
+        small = image.resize((labels.shape[1], labels.shape[0]), Image.BILINEAR)
+        classes = ColorHeuristicBackend.classify_pixels(numpy.asarray(small.convert('HSV'), dtype=numpy.int16))
+        slots = len(ColorHeuristicBackend.VOTE_CLASSES) + 1
+        votes = numpy.bincount((labels * slots + classes).ravel(), minlength=(count + 1) * slots)
+        votes = votes.reshape(count + 1, slots)[1:, 1:]
+        
+        results = []
+        for fruit_votes in votes:
+            total = fruit_votes.sum()
+            if total == 0:
+                results.append(("Unknown", 0))
+                continue
+            winner = int(fruit_votes.argmax())
+            results.append((ColorHeuristicBackend.VOTE_CLASSES[winner], round(100 * fruit_votes[winner] / total)))
+        return results
+    
+    def crop_fruits(self, image, boxes, directory):
+        """
+        Write every fruit of an image as a JPEG of its own, for a batch call to the model
+        
+        Args:
+            image (PIL.Image): The decoded RGB image the boxes were found on
+            boxes (list): The fruit boxes from segment()
+            directory (str): Where to write the crops
+        
+        Returns:
+            list: The paths of the crops, in the order of the boxes
+        """
+        paths = []
+        for number, box in enumerate(boxes, 1):
+            path = os.path.join(directory, f"fruit_{number:03d}.jpg")
+            image.crop(box).save(path, 'JPEG', quality=90)
+            paths.append(path)
+        return paths
+    
+    def detect(self, image):
+        """
+        Find the fruits of an image
+        
+        Args:
+            image (PIL.Image): The decoded RGB image
+        
+        Returns:
+            tuple: (labels, boxes) as returned by segment()
+        """
+        with tracer.span('fruits.segment') as span:
+            labels, boxes, _ = self.segment(image)
+            span.set(fruits=len(boxes))
+        return labels, boxes
+
+# Shared by the image controller
+fruit_detector = FruitDetector()
@@ -1,8 +1,11 @@
 import os
+import json
 import base64
 import google.generativeai as genai
 from dotenv import load_dotenv
-from PIL import Image
+from utils.roi import roi_cropper
+from utils.metrics import tracer
+from utils.ripeness_parser import RipenessStreamParser, extract_ripeness
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,6 +20,20 @@ def initialize_gemini_api():
     
     genai.configure(api_key=api_key)
 
+# Ripeness comes first so a streamed response can be acted on early
+ANALYSIS_PROMPT = """
+        Analyze this fruit image and determine its ripeness level. 
+        Classify it as one of the following: 'Ripe', 'Unripe', or 'Overripe'.
+        
+        Provide a brief explanation for your classification based on visual cues like color, texture, and any visible defects.
+        
+        Format your response as a JSON-like structure with the following fields:
+        - ripeness: The classification ('Ripe', 'Unripe', or 'Overripe')
+        - confidence: A percentage (0-100) indicating your confidence in this classification
+        - explanation: A brief explanation of why you classified it this way
+        - visual_cues: A list of visual cues that led to this classification
+        """
+
 def analyze_fruit_image(image_path):
     """
     Analyze a fruit image using Google Gemini API to determine ripeness
@@ -31,45 +48,26 @@ def analyze_fruit_image(image_path):
         # Initialize the API
         initialize_gemini_api()
         
-        # Load the image
-        image = Image.open(image_path)
+        # Load the image, cropped to the fruit
+        with tracer.span('gemini.decode'):
+            image = roi_cropper.model_image(image_path)
         
         # Set up the model
         model = genai.GenerativeModel('gemini-2.5-pro-exp-03-25')
         
-        # Create the prompt
-        prompt = """
-        Analyze this fruit image and determine its ripeness level. 
-        Classify it as one of the following: 'Ripe', 'Unripe', or 'Overripe'.
-        
-        Provide a brief explanation for your classification based on visual cues like color, texture, and any visible defects.
-        
-        Format your response as a JSON-like structure with the following fields:
-        - ripeness: The classification ('Ripe', 'Unripe', or 'Overripe')
-        - confidence: A percentage (0-100) indicating your confidence in this classification
-        - explanation: A brief explanation of why you classified it this way
-        - visual_cues: A list of visual cues that led to this classification
-        """
-        
         # Generate the response
-        response = model.generate_content([prompt, image])
+        with tracer.span('gemini.model_call'):
+            response = model.generate_content([ANALYSIS_PROMPT, image])
         
-        # Parse the response
-        response_text = response.text
-        
-        # Extract the ripeness classification
-        if "Ripe" in response_text and not "Unripe" in response_text:
-            ripeness = "Ripe"
-        elif "Unripe" in response_text:
-            ripeness = "Unripe"
-        elif "Overripe" in response_text:
-            ripeness = "Overripe"
-        else:
-            ripeness = "Unknown"
+        with tracer.span('gemini.parse'):
+            # Parse the response
+            response_text = response.text
+            ripeness, confidence = extract_ripeness(response_text)
         
         # Return the result
         return {
             "ripeness": ripeness,
+            "confidence": confidence,
             "full_analysis": response_text
         }
     
@@ -79,3 +77,125 @@ def analyze_fruit_image(image_path):
             "ripeness": "Unknown",
             "full_analysis": f"Error: {str(e)}"
         }
+
+def analyze_fruit_image_streaming(image_path, on_ripeness=None, on_text=None):
+    """
+    Analyze a fruit image with a streamed Gemini response
+    
+    The ripeness is reported through on_ripeness as soon as the model has
+    written it, while the explanation is still being generated.
+    
+    Args:
+        image_path (str): Path to the fruit image
+        on_ripeness (callable, optional): Called with the ripeness class once it is decided
+        on_text (callable, optional): Called with the response text received so far
+        
+    Returns:
+        dict: A dictionary containing ripeness status and detailed analysis
+    """
+    parser = RipenessStreamParser(on_ripeness, on_text)
+    try:
+        # Initialize the API
+        initialize_gemini_api()
+        
+        # Load the image, cropped to the fruit
+        with tracer.span('gemini.decode'):
+            image = roi_cropper.model_image(image_path)
+        
+        # Set up the model
+        model = genai.GenerativeModel('gemini-2.5-pro-exp-03-25')
+        
+        # Feed the chunks to the parser as they arrive
+        with tracer.span('gemini.model_call', stream=True):
+            response = model.generate_content([ANALYSIS_PROMPT, image], stream=True)
+            for chunk in response:
+                parser.feed(chunk.text)
+        
+        return parser.result()
+    
+    except Exception as e:
+        print(f"Error analyzing image with Gemini API: {e}")
+        # Keep a ripeness that was already decided, the caller may have shown it
+        if parser.ripeness:
+            return parser.result()
+        return {
+            "ripeness": "Unknown",
+            "full_analysis": f"Error: {str(e)}"
+        }
+
+def analyze_fruit_images(image_paths):
+    """
+    Analyze several fruit images in a single Gemini API call
+    
+    The prompt is sent once for the whole batch and the model answers with a
+    JSON array holding one entry per image, which is split back into one
+    result per image.
+    
+    Args:
+        image_paths (list): Paths to the fruit images
+        
+    Returns:
+        list: One dictionary per image, in the same order, as returned by analyze_fruit_image
+    """
+    try:
+        # Initialize the API
+        initialize_gemini_api()
+        
+        # Load the images, cropped to the fruit
+        with tracer.span('gemini.decode', images=len(image_paths)):
+            images = roi_cropper.model_images(image_paths)
+        
+        # Set up the model
+        model = genai.GenerativeModel('gemini-2.5-pro-exp-03-25')
+        
+        # Create the prompt, every image is preceded by its number
+        prompt = f"""
+        Analyze each of the following {len(images)} fruit images and determine its ripeness level.
+        Classify each one as one of the following: 'Ripe', 'Unripe', or 'Overripe'.
+        
+        Provide a brief explanation for each classification based on visual cues like color, texture, and any visible defects.
+        
+        Respond with only a JSON array containing one object per image, in order, with the following fields:
+        - image: The number of the image
+        - ripeness: The classification ('Ripe', 'Unripe', or 'Overripe')
+        - confidence: A percentage (0-100) indicating your confidence in this classification
+        - explanation: A brief explanation of why you classified it this way
+        - visual_cues: A list of visual cues that led to this classification
+        """
+        contents = [prompt]
+        for number, image in enumerate(images, 1):
+            contents.extend([f"Image {number}:", image])
+        
+        # Generate the response
+        with tracer.span('gemini.model_call', images=len(images)):
+            response = model.generate_content(contents)
+        
+        with tracer.span('gemini.parse'):
+            response_text = response.text
+            # The array may be wrapped in a markdown code block
+            entries = json.loads(response_text[response_text.index('['):response_text.rindex(']') + 1])
+            
+            results = [None] * len(image_paths)
+            for position, entry in enumerate(entries):
+                index = int(entry.get("image", position + 1)) - 1
+                if 0 <= index < len(results):
+                    entry_text = json.dumps(entry, indent=2)
+                    ripeness, confidence = extract_ripeness(entry_text)
+                    if entry.get("ripeness") in ("Ripe", "Unripe", "Overripe"):
+                        ripeness = entry["ripeness"]
+                    results[index] = {
+                        "ripeness": ripeness,
+                        "confidence": confidence,
+                        "full_analysis": entry_text
+                    }
+        
+        # Images the model skipped count as failed
+        return [result or {"ripeness": "Unknown", "full_analysis": "Error: no result for this image in the batch response"}
+                for result in results]
+    
+    except Exception as e:
+        print(f"Error analyzing image batch with Gemini API: {e}")
+        return [{
+            "ripeness": "Unknown",
+            "full_analysis": f"Error: {str(e)}"
+        } for _ in image_paths]
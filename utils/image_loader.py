@@ -0,0 +1,197 @@
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+from utils.metrics import tracer
+
+# Load environment variables from .env file
+load_dotenv()
+
+# EXIF tag of the image orientation
+_EXIF_ORIENTATION = 0x0112
+
+def decode_image(image_path, max_size=None):
+    """
+    Decode an image into memory and close the file
+    
+    With max_size the JPEG decoder is asked for a reduced decode through
+    draft(), which skips most of the full resolution work, and the result is
+    then shrunk to fit. Photos are turned upright from their EXIF orientation.
+    
+    Args:
+        image_path (str): The path to the image file
+        max_size (int, optional): Longest side of the decoded image, None keeps the full resolution
+    
+    Returns:
+        PIL.Image: A loaded RGB image that holds no open file
+    """
+    with Image.open(image_path) as image:
+        if max_size:
+            image.draft('RGB', (max_size, max_size))
+        if image.getexif().get(_EXIF_ORIENTATION, 1) != 1:
+            decoded = ImageOps.exif_transpose(image).convert('RGB')
+        else:
+            decoded = image.convert('RGB')
+    if max_size:
+        decoded.thumbnail((max_size, max_size), Image.LANCZOS)
+    return decoded
+
+class DecodedImageCache:
+    """
+    Small LRU of decoded images shared by the preview and the analysis
+    
+    An uploaded image is decoded once, at the size the analysis needs, and
+    both the preview and the model input are derived from that buffer. The
+    copy saved into the image store is registered as an alias, so analyzing
+    it does not decode the file again. Entries are checked against the file
+    size and modification time, and at most max_entries images are kept.
+    
+    Cached images are shared and must not be modified; resize() and convert()
+    return new images.
+    """
+    
+    def __init__(self, max_entries=None, max_size=None):
+        """
+        Initialize the cache
+        
+        Settings that are not given are read from the environment
+        (FRUIT_APP_IMAGE_CACHE_ENTRIES, FRUIT_APP_ANALYSIS_MAX_SIZE).
+        
+        Args:
+            max_entries (int, optional): Decoded images kept, 0 disables the cache
+            max_size (int, optional): Longest side of the decoded images
+        """
+        self.max_entries = int(max_entries if max_entries is not None
+                               else os.getenv('FRUIT_APP_IMAGE_CACHE_ENTRIES', 4))
+        self.max_size = int(max_size or os.getenv('FRUIT_APP_ANALYSIS_MAX_SIZE', 1024))
+        # path -> (size, mtime_ns, image)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+    
+    def _signature(self, image_path):
+        stat = os.stat(image_path)
+        return stat.st_size, stat.st_mtime_ns
+    
+    def _store(self, key, size, mtime_ns, image):
+        # Caller holds the lock
+        self._entries[key] = (size, mtime_ns, image)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+    
+    def get(self, image_path):
+        """
+        Get the decoded image of a file, decoding it on a miss
+        
+        Args:
+            image_path (str): The path to the image file
+        
+        Returns:
+            PIL.Image: The shared RGB image, at most max_size on its longest side
+        """
+        key = os.path.abspath(image_path)
+        size, mtime_ns = self._signature(image_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[:2] == (size, mtime_ns):
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[2]
+            self.stats["misses"] += 1
+        
+        # Decode outside the lock so other images are not held up
+        with tracer.span('image.decode', max_size=self.max_size):
+            image = decode_image(image_path, self.max_size)
+        if self.max_entries:
+            with self._lock:
+                self._store(key, size, mtime_ns, image)
+        return image
+    
+    def get_many(self, image_paths, pool=None):
+        """
+        Get the decoded images of several files, decoding the misses together
+        
+        Args:
+            image_paths (list): The paths to the image files
+            pool (ImagePreprocessPool, optional): Decodes the misses in parallel in its worker
+                                                  processes, without it they are decoded one by one
+        
+        Returns:
+            list: The shared RGB images in the order of image_paths
+        """
+        images = [None] * len(image_paths)
+        misses = []
+        with self._lock:
+            for index, image_path in enumerate(image_paths):
+                size, mtime_ns = self._signature(image_path)
+                entry = self._entries.get(os.path.abspath(image_path))
+                if entry and entry[:2] == (size, mtime_ns):
+                    self._entries.move_to_end(os.path.abspath(image_path))
+                    self.stats["hits"] += 1
+                    images[index] = entry[2]
+                else:
+                    self.stats["misses"] += 1
+                    misses.append((index, size, mtime_ns))
+        if not misses:
+            return images
+        
+        # A single miss is not worth the round trip to a worker process
+        paths = [image_paths[index] for index, _, _ in misses]
+        with tracer.span('image.decode', max_size=self.max_size, images=len(paths), pooled=bool(pool)):
+            if pool and len(paths) > 1:
+                decoded = pool.decode(paths, self.max_size)
+            else:
+                decoded = [decode_image(image_path, self.max_size) for image_path in paths]
+        
+        with self._lock:
+            for (index, size, mtime_ns), image in zip(misses, decoded):
+                images[index] = image
+                if self.max_entries:
+                    self._store(os.path.abspath(image_paths[index]), size, mtime_ns, image)
+        return images
+    
+    def alias(self, image_path, source_path):
+        """
+        Share the decoded image of source_path with a copy of the file
+        
+        Args:
+            image_path (str): The path of the copy
+            source_path (str): The path of the original, nothing happens if it is not cached
+        """
+        try:
+            size, mtime_ns = self._signature(image_path)
+        except OSError:
+            return
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(source_path))
+            if entry and entry[0] == size:
+                self._store(os.path.abspath(image_path), size, mtime_ns, entry[2])
+    
+    def discard(self, image_path):
+        """
+        Drop the decoded image of a file, for example after it was deleted
+        """
+        with self._lock:
+            self._entries.pop(os.path.abspath(image_path), None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def get_stats(self):
+        """
+        Get the cache counters
+        
+        Returns:
+            dict: hits, misses, evictions and the number of cached images
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        return stats
+
+# Shared cache configured from the environment
+image_cache = DecodedImageCache()
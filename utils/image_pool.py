@@ -0,0 +1,273 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from dotenv import load_dotenv
+from PIL import Image, ImageStat
+from utils.image_loader import decode_image
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Number of hue bins in the colour histogram feature
+HUE_BINS = 12
+
+def fit_size(width, height, max_width, max_height):
+    """
+    Compute the largest size that fits the bounds while maintaining aspect ratio
+    
+    Args:
+        width (int): The original width
+        height (int): The original height
+        max_width (int): The maximum width
+        max_height (int): The maximum height
+    
+    Returns:
+        tuple: (new_width, new_height)
+    """
+    ratio = min(max_width / width, max_height / height)
+    return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+def resize_to_fit(image, max_width, max_height):
+    """
+    Resize an image to fit within the specified dimensions while maintaining aspect ratio
+    
+    Args:
+        image (PIL.Image): The image to resize
+        max_width (int): The maximum width
+        max_height (int): The maximum height
+    
+    Returns:
+        PIL.Image: The resized image
+    """
+    return image.resize(fit_size(*image.size, max_width, max_height), Image.LANCZOS)
+
+def extract_features(image):
+    """
+    Extract cheap colour features used for ripeness heuristics
+    
+    Args:
+        image (PIL.Image): An RGB image
+    
+    Returns:
+        dict: Mean and standard deviation per RGB channel and a normalized hue histogram
+    """
+    stats = ImageStat.Stat(image)
+    hue = image.convert('HSV').getchannel('H').histogram()
+    
+    # Fold the 256 hue values into coarser bins
+    bin_width = 256 // HUE_BINS
+    bins = [sum(hue[i * bin_width:(i + 1) * bin_width]) for i in range(HUE_BINS)]
+    bins[-1] += sum(hue[HUE_BINS * bin_width:])
+    total = float(sum(bins)) or 1.0
+    
+    return {
+        "mean_rgb": [round(value, 2) for value in stats.mean],
+        "stddev_rgb": [round(value, 2) for value in stats.stddev],
+        "hue_histogram": [round(count / total, 4) for count in bins],
+    }
+
+def preprocess_image(image_path, max_width=1024, max_height=1024):
+    """
+    Decode, resize and extract features from an image in the current process
+    
+    Args:
+        image_path (str): The path to the image file
+        max_width (int): The maximum width of the preprocessed image
+        max_height (int): The maximum height of the preprocessed image
+    
+    Returns:
+        tuple: (image, features) with the resized RGB image and its features
+    """
+    with Image.open(image_path) as image:
+        image = image.convert('RGB')
+    image = resize_to_fit(image, max_width, max_height)
+    return image, extract_features(image)
+
+def _to_shared_memory(image):
+    """
+    Worker side of the pool: copy the pixels of an image into a new shared memory block
+    
+    Only the name of the shared memory block is sent back through the pipe,
+    which avoids pickling the whole pixel buffer.
+    
+    Returns:
+        tuple: (name, size, length) of the block, see _load_from_shared_memory()
+    """
+    data = image.tobytes()
+    
+    block = shared_memory.SharedMemory(create=True, size=len(data))
+    try:
+        block.buf[:len(data)] = data
+    finally:
+        # The parent process unlinks the block after copying it out, so this
+        # process must not clean it up when it exits. On POSIX the block is
+        # tracked under its name with the leading slash that name leaves out.
+        if os.name == 'posix':
+            resource_tracker.unregister('/' + block.name, 'shared_memory')
+        block.close()
+    
+    return block.name, image.size, len(data)
+
+def _preprocess_to_shared_memory(image_path, max_width, max_height):
+    """
+    Worker side of the pool: preprocess and hand the pixels over in shared memory
+    """
+    image, features = preprocess_image(image_path, max_width, max_height)
+    return _to_shared_memory(image) + (features,)
+
+def _decode_to_shared_memory(image_path, max_size):
+    """
+    Worker side of the pool: decode an image for the analysis and hand the pixels over in shared memory
+    """
+    return _to_shared_memory(decode_image(image_path, max_size))
+
+def _load_from_shared_memory(name, size, length):
+    """
+    Parent side of the pool: rebuild the image and release the shared memory
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return Image.frombytes('RGB', size, bytes(block.buf[:length]))
+    finally:
+        block.close()
+        block.unlink()
+
+class ImagePreprocessPool:
+    """
+    Process pool that decodes, resizes and extracts features from images
+    
+    PIL decoding and resampling hold the GIL, so batch preprocessing is spread
+    over processes instead of threads. Pixel buffers are returned through
+    multiprocessing.shared_memory rather than pickled through the result pipe.
+    
+    The batch analysis decodes its images through the shared pool from
+    get_preprocess_pool(), see DecodedImageCache.get_many().
+    """
+    
+    def __init__(self, workers=None, max_width=1024, max_height=1024):
+        """
+        Initialize the pool
+        
+        Args:
+            workers (int, optional): Number of worker processes, defaults to the CPU count
+            max_width (int): The maximum width of the preprocessed images
+            max_height (int): The maximum height of the preprocessed images
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_width = max_width
+        self.max_height = max_height
+        # Workers are started from a clean server process rather than forked from the application,
+        # which may hold threads, locks and database connections at that moment
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+    
+    def submit(self, image_path):
+        """
+        Schedule preprocessing of a single image
+        
+        Args:
+            image_path (str): The path to the image file
+        
+        Returns:
+            concurrent.futures.Future: Resolves to the raw worker result, see collect()
+        """
+        return self.executor.submit(_preprocess_to_shared_memory, image_path, self.max_width, self.max_height)
+    
+    def collect(self, future):
+        """
+        Wait for a submitted image and load it from shared memory
+        
+        Returns:
+            tuple: (image, features) with the resized RGB image and its features
+        """
+        name, size, length, features = future.result()
+        return _load_from_shared_memory(name, size, length), features
+    
+    def map(self, image_paths):
+        """
+        Preprocess a batch of images
+        
+        Args:
+            image_paths (list): The paths of the image files
+        
+        Returns:
+            list: (image, features) tuples in the order of image_paths
+        """
+        return self._collect_all([self.submit(image_path) for image_path in image_paths], self.collect)
+    
+    def decode(self, image_paths, max_size=None):
+        """
+        Decode a batch of images the way the analysis does, see utils.image_loader.decode_image()
+        
+        Args:
+            image_paths (list): The paths of the image files
+            max_size (int, optional): Longest side of the decoded images, None keeps the full resolution
+        
+        Returns:
+            list: The decoded RGB images in the order of image_paths
+        """
+        futures = [self.executor.submit(_decode_to_shared_memory, image_path, max_size)
+                   for image_path in image_paths]
+        return self._collect_all(futures, lambda future: _load_from_shared_memory(*future.result()))
+    
+    def _collect_all(self, futures, collect):
+        """
+        Collect every future, even after a failure, so no shared memory block leaks
+        """
+        results, error = [], None
+        for future in futures:
+            try:
+                results.append(collect(future))
+            except Exception as e:
+                error = error or e
+        if error:
+            raise error
+        return results
+    
+    def close(self):
+        """
+        Shut down the worker processes
+        """
+        self.executor.shutdown()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_preprocess_pool():
+    """
+    Get the pool shared by the batch analyses of this process, started on first use
+    
+    The number of worker processes is FRUIT_APP_PREPROCESS_WORKERS, by default
+    the CPU count. With fewer than two there is nothing to gain over decoding
+    in the calling thread, and no pool is started.
+    
+    Returns:
+        ImagePreprocessPool or None: The pool, or None if batches are decoded in the calling thread
+    """
+    global _pool
+    workers = int(os.getenv('FRUIT_APP_PREPROCESS_WORKERS', os.cpu_count() or 1))
+    if workers < 2:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ImagePreprocessPool(workers=workers)
+        return _pool
+
+def _forget_preprocess_pool():
+    """
+    Drop the pool inherited by a forked child process, its worker processes belong to the parent
+    """
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_preprocess_pool)
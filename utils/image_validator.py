@@ -0,0 +1,329 @@
+import os
+import struct
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Formats accepted by the upload dialog
+SUPPORTED_FORMATS = ("JPEG", "PNG", "GIF", "BMP")
+
+# JPEG start-of-frame markers carry the dimensions, C4, C8 and CC are other segments
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# EXIF tag of the image orientation
+_EXIF_ORIENTATION = 0x0112
+
+class ImageValidationError(ValueError):
+    """
+    Raised when a file is not an acceptable image
+    """
+
+def _read_exact(image_file, size):
+    data = image_file.read(size)
+    if len(data) != size:
+        raise ImageValidationError("The image file is truncated")
+    return data
+
+def _has_trailer(image_file, marker, window):
+    """
+    Check that a marker appears in the last bytes of the file, cut off files lose their trailer
+    """
+    image_file.seek(0, os.SEEK_END)
+    image_file.seek(max(0, image_file.tell() - window))
+    return marker in image_file.read(window)
+
+def _has_jpeg_end(image_file, scan_start, chunk=64 * 1024):
+    """
+    Check that an end of image marker follows the scan data, searching back from the end of the file
+    
+    Writers may append data after the marker, such as the video of a motion photo or
+    the other images of a multi-picture file, so it need not be in the last bytes.
+    Inside scan data 0xFF is only followed by 0x00 or a restart marker, so a marker
+    after scan_start ends the image or something appended to it. A cut off file is
+    read back to scan_start before it is rejected.
+    """
+    position = image_file.seek(0, os.SEEK_END)
+    while position > scan_start:
+        start = max(scan_start, position - chunk)
+        image_file.seek(start)
+        # One byte more than the step, so a marker split between two reads is still found
+        if b'\xff\xd9' in image_file.read(position - start + 1):
+            return True
+        position = start
+    return False
+
+def _exif_orientation(tiff):
+    """
+    Read the orientation tag from the first IFD of a TIFF structured EXIF block
+    
+    Returns:
+        int: The orientation 1-8, 1 when the tag is missing
+    """
+    if len(tiff) < 8 or tiff[:2] not in (b'II', b'MM'):
+        return 1
+    endian = '<' if tiff[:2] == b'II' else '>'
+    offset, = struct.unpack(f'{endian}I', tiff[4:8])
+    if offset + 2 > len(tiff):
+        return 1
+    count, = struct.unpack(f'{endian}H', tiff[offset:offset + 2])
+    for entry in range(count):
+        start = offset + 2 + entry * 12
+        if start + 12 > len(tiff):
+            break
+        tag, field_type, _, value = struct.unpack(f'{endian}HHI4s', tiff[start:start + 12])
+        if tag == _EXIF_ORIENTATION:
+            orientation, = struct.unpack(f'{endian}H', value[:2])
+            return orientation if 1 <= orientation <= 8 else 1
+    return 1
+
+def _sniff_jpeg(image_file):
+    """
+    Walk the JPEG segments up to the first scan, reading only segment headers, the frame header and EXIF
+    
+    The file is left at the start of the scan data.
+    """
+    orientation = 1
+    header = None
+    image_file.seek(2)
+    while True:
+        marker = _read_exact(image_file, 2)
+        if marker[0] != 0xFF:
+            raise ImageValidationError("Corrupt JPEG segment")
+        # Fill bytes may precede a marker
+        while marker[1] == 0xFF:
+            marker = marker[1:] + _read_exact(image_file, 1)
+        code = marker[1]
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        if code in (0xD9, 0xDA) and header is None:
+            raise ImageValidationError("JPEG has no frame header")
+        if code == 0xD9:
+            raise ImageValidationError("JPEG has no image data")
+        
+        length, = struct.unpack('>H', _read_exact(image_file, 2))
+        if length < 2 or (code in _JPEG_SOF_MARKERS and length < 7):
+            raise ImageValidationError("Corrupt JPEG segment")
+        if code == 0xDA:
+            image_file.seek(length - 2, os.SEEK_CUR)
+            return header
+        if code in _JPEG_SOF_MARKERS and header is None:
+            _, height, width = struct.unpack('>BHH', _read_exact(image_file, 5))
+            header = width, height, orientation, 1
+            image_file.seek(length - 7, os.SEEK_CUR)
+        elif code == 0xE1:
+            segment = _read_exact(image_file, length - 2)
+            if segment.startswith(b'Exif\x00\x00'):
+                orientation = _exif_orientation(segment[6:])
+        else:
+            image_file.seek(length - 2, os.SEEK_CUR)
+
+def _sniff_png(image_file):
+    """
+    Read the PNG header chunk, then the chunk headers up to the image data for
+    the APNG frame count and EXIF orientation
+    """
+    image_file.seek(8)
+    length, chunk_type = struct.unpack('>I4s', _read_exact(image_file, 8))
+    if chunk_type != b'IHDR' or length < 8:
+        raise ImageValidationError("PNG has no header chunk")
+    width, height = struct.unpack('>II', _read_exact(image_file, 8))
+    image_file.seek(length - 8 + 4, os.SEEK_CUR)
+    
+    orientation, frames = 1, 1
+    while True:
+        header = image_file.read(8)
+        if len(header) < 8:
+            raise ImageValidationError("The image file is truncated")
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type in (b'IDAT', b'IEND'):
+            return width, height, orientation, frames
+        if chunk_type == b'acTL':
+            frames, = struct.unpack('>I', _read_exact(image_file, 4))
+            image_file.seek(length - 4 + 4, os.SEEK_CUR)
+        elif chunk_type == b'eXIf':
+            orientation = _exif_orientation(_read_exact(image_file, length))
+            image_file.seek(4, os.SEEK_CUR)
+        else:
+            image_file.seek(length + 4, os.SEEK_CUR)
+
+def _skip_gif_sub_blocks(image_file):
+    while True:
+        size = _read_exact(image_file, 1)[0]
+        if size == 0:
+            return
+        image_file.seek(size, os.SEEK_CUR)
+
+def _sniff_gif(image_file, max_frames):
+    """
+    Read the GIF screen size and count the frames by skipping over their data
+    
+    Counting stops one frame past max_frames, so long animations are rejected
+    without walking the whole file.
+    """
+    image_file.seek(6)
+    width, height, flags = struct.unpack('<HHB', _read_exact(image_file, 5))
+    image_file.seek(2, os.SEEK_CUR)
+    if flags & 0x80:
+        image_file.seek(3 * 2 ** ((flags & 0x07) + 1), os.SEEK_CUR)
+    
+    frames = 0
+    while True:
+        block = image_file.read(1)
+        if block in (b';', b''):
+            # A missing trailer is common and harmless once the frames are read
+            if frames == 0:
+                raise ImageValidationError("GIF has no frames")
+            return width, height, 1, frames
+        if block == b'!':
+            image_file.seek(1, os.SEEK_CUR)
+            _skip_gif_sub_blocks(image_file)
+        elif block == b',':
+            frames += 1
+            if max_frames and frames > max_frames:
+                return width, height, 1, frames
+            left, top, frame_width, frame_height, flags = struct.unpack('<HHHHB', _read_exact(image_file, 9))
+            if left + frame_width > width or top + frame_height > height:
+                raise ImageValidationError("GIF frame lies outside the image")
+            if flags & 0x80:
+                image_file.seek(3 * 2 ** ((flags & 0x07) + 1), os.SEEK_CUR)
+            image_file.seek(1, os.SEEK_CUR)
+            _skip_gif_sub_blocks(image_file)
+        else:
+            raise ImageValidationError("Corrupt GIF block")
+
+def _sniff_bmp(image_file):
+    """
+    Read the dimensions from the BMP info header
+    """
+    image_file.seek(14)
+    header_size, = struct.unpack('<I', _read_exact(image_file, 4))
+    if header_size == 12:
+        width, height = struct.unpack('<HH', _read_exact(image_file, 4))
+    elif header_size >= 40:
+        width, height = struct.unpack('<ii', _read_exact(image_file, 8))
+    else:
+        raise ImageValidationError("Unsupported BMP header")
+    # A negative height marks a top-down bitmap
+    return width, abs(height), 1, 1
+
+class ImageValidator:
+    """
+    Checks uploaded images from their headers, before anything is decoded
+    
+    Only the few bytes that describe the format, dimensions, EXIF orientation
+    and frame count are read, so corrupt, oversized or wrong-format files and
+    decompression bombs are rejected before any copy, decode or model call.
+    """
+    
+    def __init__(self, max_bytes=None, max_pixels=None, max_dimension=None, max_frames=None, formats=None):
+        """
+        Initialize the validator
+        
+        Limits that are not given are read from the environment
+        (FRUIT_APP_MAX_IMAGE_BYTES, FRUIT_APP_MAX_IMAGE_PIXELS,
+        FRUIT_APP_MAX_IMAGE_DIMENSION, FRUIT_APP_MAX_IMAGE_FRAMES,
+        FRUIT_APP_IMAGE_FORMATS). A limit of 0 disables the check.
+        
+        Args:
+            max_bytes (int, optional): Largest accepted file size
+            max_pixels (int, optional): Largest accepted width * height * frames, guards against decompression bombs
+            max_dimension (int, optional): Largest accepted width or height
+            max_frames (int, optional): Largest accepted number of animation frames
+            formats (list, optional): Accepted format names, a subset of SUPPORTED_FORMATS
+        """
+        self.max_bytes = int(max_bytes if max_bytes is not None else os.getenv('FRUIT_APP_MAX_IMAGE_BYTES', 25 * 1024 * 1024))
+        self.max_pixels = int(max_pixels if max_pixels is not None else os.getenv('FRUIT_APP_MAX_IMAGE_PIXELS', 50000000))
+        self.max_dimension = int(max_dimension if max_dimension is not None else os.getenv('FRUIT_APP_MAX_IMAGE_DIMENSION', 12000))
+        self.max_frames = int(max_frames if max_frames is not None else os.getenv('FRUIT_APP_MAX_IMAGE_FRAMES', 100))
+        if formats is None:
+            formats = os.getenv('FRUIT_APP_IMAGE_FORMATS', ','.join(SUPPORTED_FORMATS)).split(',')
+        self.formats = {image_format.strip().upper() for image_format in formats if image_format.strip()}
+        unknown = self.formats - set(SUPPORTED_FORMATS)
+        if unknown:
+            raise ValueError(f"Unsupported image formats: {', '.join(sorted(unknown))}")
+    
+    def inspect(self, image_path):
+        """
+        Read the format, dimensions, orientation and frame count from the file header
+        
+        Args:
+            image_path (str): Path to the image file
+        
+        Returns:
+            dict: format, width, height, orientation (EXIF 1-8), frames and size_bytes
+        """
+        try:
+            size_bytes = os.path.getsize(image_path)
+            with open(image_path, 'rb') as image_file:
+                signature = image_file.read(8)
+                if signature[:3] == b'\xff\xd8\xff':
+                    image_format, header = "JPEG", _sniff_jpeg(image_file)
+                    complete = _has_jpeg_end(image_file, image_file.tell())
+                elif signature == b'\x89PNG\r\n\x1a\n':
+                    image_format, header = "PNG", _sniff_png(image_file)
+                    complete = _has_trailer(image_file, b'IEND', 12)
+                elif signature[:6] in (b'GIF87a', b'GIF89a'):
+                    # The frames were walked, a cut off file already failed
+                    image_format, header = "GIF", _sniff_gif(image_file, self.max_frames)
+                    complete = True
+                elif signature[:2] == b'BM':
+                    image_format, header = "BMP", _sniff_bmp(image_file)
+                    complete = size_bytes >= struct.unpack('<I', signature[2:6])[0]
+                else:
+                    raise ImageValidationError("Unrecognized image format")
+                if not complete:
+                    raise ImageValidationError("The image file is truncated")
+        except OSError as e:
+            raise ImageValidationError(f"Cannot read the image file: {e}")
+        except struct.error:
+            raise ImageValidationError("The image file is truncated")
+        
+        width, height, orientation, frames = header
+        return {
+            "format": image_format,
+            "width": width,
+            "height": height,
+            "orientation": orientation,
+            "frames": frames,
+            "size_bytes": size_bytes,
+        }
+    
+    def validate(self, image_path):
+        """
+        Check an image file against the limits
+        
+        Args:
+            image_path (str): Path to the image file
+        
+        Returns:
+            dict: The header information, see inspect()
+        
+        Raises:
+            ImageValidationError: If the file is not an acceptable image
+        """
+        # Reject oversized files before opening them
+        try:
+            size_bytes = os.path.getsize(image_path)
+        except OSError as e:
+            raise ImageValidationError(f"Cannot read the image file: {e}")
+        if self.max_bytes and size_bytes > self.max_bytes:
+            raise ImageValidationError(f"The image file is too large ({size_bytes // 1024} KB, "
+                                       f"limit {self.max_bytes // 1024} KB)")
+        
+        info = self.inspect(image_path)
+        if info["format"] not in self.formats:
+            raise ImageValidationError(f"{info['format']} images are not accepted")
+        if info["width"] <= 0 or info["height"] <= 0:
+            raise ImageValidationError("The image has no pixels")
+        if self.max_dimension and max(info["width"], info["height"]) > self.max_dimension:
+            raise ImageValidationError(f"The image is too large ({info['width']}x{info['height']}, "
+                                       f"limit {self.max_dimension} pixels per side)")
+        if self.max_frames and info["frames"] > self.max_frames:
+            raise ImageValidationError(f"The animation has too many frames (limit {self.max_frames})")
+        if self.max_pixels and info["width"] * info["height"] * info["frames"] > self.max_pixels:
+            raise ImageValidationError("The image has too many pixels and may be a decompression bomb")
+        return info
+
+# Shared validator configured from the environment
+image_validator = ImageValidator()
@@ -1,43 +1,204 @@
+import atexit
+import json
 import logging
 import os
+import queue
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 
-# Create logs directory if it doesn't exist
-os.makedirs('logs', exist_ok=True)
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
-def setup_logger(name='fruit_app'):
+class SizedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """
+    File handler that rotates at midnight and whenever the file grows past max_bytes
+    """
+    
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, when='midnight', backup_count=14, **kwargs):
+        """
+        Args:
+            filename (str): The log file path
+            max_bytes (int): Rotate when the file would grow past this size, 0 disables size rotation
+            when (str): The time based rotation interval, see TimedRotatingFileHandler
+            backup_count (int): How many rotated files to keep
+        """
+        TimedRotatingFileHandler.__init__(self, filename, when=when, backupCount=backup_count, **kwargs)
+        self.max_bytes = max_bytes
+    
+    def shouldRollover(self, record):
+        if TimedRotatingFileHandler.shouldRollover(self, record):
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            message = f"{self.format(record)}\n"
+            self.stream.seek(0, 2)
+            if self.stream.tell() + len(message) >= self.max_bytes:
+                return True
+        return False
+    
+    def rotation_filename(self, default_name):
+        # Size based rollovers can happen several times per day, keep their names unique
+        if os.path.exists(default_name):
+            index = 1
+            while os.path.exists(f"{default_name}.{index}"):
+                index += 1
+            return f"{default_name}.{index}"
+        return default_name
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line
     """
-    Set up a logger with file and console handlers
+    
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Lets through only one in every N DEBUG records, all other levels pass
+    """
+    
+    def __init__(self, sample_rate):
+        """
+        Args:
+            sample_rate (float): The fraction of DEBUG records to keep, between 0 and 1
+        """
+        logging.Filter.__init__(self)
+        self.every = max(1, round(1 / sample_rate)) if sample_rate > 0 else 0
+        self.seen = 0
+    
+    def filter(self, record):
+        if record.levelno != logging.DEBUG:
+            return True
+        if not self.every:
+            return False
+        self.seen += 1
+        return (self.seen - 1) % self.every == 0
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves formatting to the listener thread
+    
+    The standard QueueHandler formats and copies every record on the calling
+    thread so it can be pickled. The queue never leaves this process, so only
+    the message arguments are merged here and the rest happens off-thread.
+    """
+    
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+# Listeners started by setup_logger by logger name, stopped at exit so queued records are flushed
+_listeners = {}
+
+def setup_logger(name='fruit_app', log_dir=None, json_format=None, max_bytes=None,
+                 backup_count=None, debug_sample_rate=None):
+    """
+    Set up a logger whose handlers run on a background thread
+    
+    Log calls only put the record on a queue; a QueueListener thread writes
+    them to a rotating file and the console, so callers (including the Tk
+    main thread) never wait for file I/O.
+    
+    Settings that are not given are read from the environment
+    (FRUIT_APP_LOG_DIR, FRUIT_APP_LOG_JSON, FRUIT_APP_LOG_MAX_BYTES,
+    FRUIT_APP_LOG_BACKUPS, FRUIT_APP_LOG_DEBUG_SAMPLE).
     
     Args:
         name (str): The name of the logger
-        
+        log_dir (str, optional): The directory of the log files, logs in the working directory by default
+        json_format (bool, optional): Write the log file as JSON lines
+        max_bytes (int, optional): Rotate the log file when it grows past this size
+        backup_count (int, optional): How many rotated log files to keep
+        debug_sample_rate (float, optional): Fraction of DEBUG records written to the file
+    
     Returns:
         logging.Logger: The configured logger
     """
+    if log_dir is None:
+        log_dir = os.getenv('FRUIT_APP_LOG_DIR', 'logs')
+    if json_format is None:
+        json_format = os.getenv('FRUIT_APP_LOG_JSON', '0') == '1'
+    if max_bytes is None:
+        max_bytes = int(os.getenv('FRUIT_APP_LOG_MAX_BYTES', 10 * 1024 * 1024))
+    if backup_count is None:
+        backup_count = int(os.getenv('FRUIT_APP_LOG_BACKUPS', 14))
+    if debug_sample_rate is None:
+        debug_sample_rate = float(os.getenv('FRUIT_APP_LOG_DEBUG_SAMPLE', 1.0))
+    
     # Create a logger
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
     
-    # Create a file handler
-    log_file = os.path.join('logs', f"{name}_{datetime.now().strftime('%Y%m%d')}.log")
-    file_handler = logging.FileHandler(log_file)
+    # Don't attach a second queue if the logger was already set up
+    if any(isinstance(handler, QueueHandler) for handler in logger.handlers):
+        return logger
+    
+    # Create the logs directory if it doesn't exist
+    os.makedirs(log_dir, exist_ok=True)
+    
+    # Create a rotating file handler
+    log_file = os.path.join(log_dir, f"{name}.log")
+    file_handler = SizedTimedRotatingFileHandler(log_file, max_bytes=max_bytes, backup_count=backup_count,
+                                                 encoding='utf-8', delay=True)
     file_handler.setLevel(logging.DEBUG)
+    if debug_sample_rate < 1.0:
+        file_handler.addFilter(DebugSamplingFilter(debug_sample_rate))
     
     # Create a console handler
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     
-    # Create a formatter and add it to the handlers
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
+    # Create the formatters and add them to the handlers
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler.setFormatter(JsonFormatter() if json_format else formatter)
     console_handler.setFormatter(formatter)
     
-    # Add the handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    # The logger only enqueues records, the listener thread does the I/O
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(_DeferredQueueHandler(log_queue))
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    _listeners[name] = listener
     
     return logger
 
+def shutdown_logger(name):
+    """
+    Stop the listener thread of one logger after writing its queued records
+    
+    The logger is left without handlers, a later setup_logger() call starts a new listener.
+    
+    Args:
+        name (str): The name the logger was set up with
+    """
+    listener = _listeners.pop(name, None)
+    if listener is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    logger = logging.getLogger(name)
+    for handler in [handler for handler in logger.handlers if isinstance(handler, QueueHandler)]:
+        logger.removeHandler(handler)
+
+@atexit.register
+def shutdown_logging():
+    """
+    Stop the listener threads after writing every queued record
+    """
+    for name in list(_listeners):
+        shutdown_logger(name)
+
 # Create a default logger
 logger = setup_logger()
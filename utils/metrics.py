@@ -0,0 +1,248 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+
+def percentile(values, p):
+    """
+    Compute a percentile with linear interpolation between closest ranks
+    
+    Args:
+        values (list): The sample values, in any order
+        p (float): The percentile, between 0 and 100
+    
+    Returns:
+        float: The percentile value, or 0.0 for an empty sample
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100.0
+    low, high = math.floor(rank), math.ceil(rank)
+    if low == high:
+        return ordered[int(rank)]
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+class Histogram:
+    """
+    Latency histogram with exact count, total and max, and a bounded
+    reservoir sample for percentiles
+    """
+    
+    def __init__(self, reservoir_size=10000):
+        self.reservoir_size = reservoir_size
+        self.samples = []
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def record(self, value):
+        """
+        Record a value, in milliseconds
+        """
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if len(self.samples) < self.reservoir_size:
+            self.samples.append(value)
+        else:
+            # Reservoir sampling keeps a uniform sample of all recorded values
+            index = random.randrange(self.count)
+            if index < self.reservoir_size:
+                self.samples[index] = value
+    
+    def summary(self):
+        """
+        Get the histogram statistics
+        
+        Returns:
+            dict: count, mean, p50, p95, p99 and max in milliseconds
+        """
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(percentile(self.samples, 50), 3),
+            "p95_ms": round(percentile(self.samples, 95), 3),
+            "p99_ms": round(percentile(self.samples, 99), 3),
+            "max_ms": round(self.max, 3),
+        }
+
+class _NullSpan:
+    """
+    Span returned while tracing is disabled, it does nothing
+    """
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+    
+    def set(self, **attributes):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    """
+    A timed section of code, recorded when the context manager exits
+    """
+    
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.start = None
+    
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = (time.perf_counter() - self.start) * 1000
+        self.tracer._stack().pop()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer._finish(self, duration)
+        return False
+    
+    def set(self, **attributes):
+        """
+        Attach attributes to the span, for example sizes or results
+        """
+        self.attributes.update(attributes)
+
+class Tracer:
+    """
+    Lightweight tracing of timed spans with per-name latency histograms
+    
+    Tracing is disabled unless FRUIT_APP_METRICS=1 is set or enable() is
+    called. While disabled, span() returns a shared no-op context manager,
+    so instrumented code pays only for one attribute check.
+    """
+    
+    def __init__(self, enabled=None, max_events=100000):
+        """
+        Initialize the tracer
+        
+        Args:
+            enabled (bool, optional): Whether to record spans, read from FRUIT_APP_METRICS if not given
+            max_events (int): Maximum number of span events kept for dump_jsonl()
+        """
+        if enabled is None:
+            enabled = os.getenv('FRUIT_APP_METRICS', '0') == '1'
+        self.enabled = enabled
+        self.histograms = {}
+        self.events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+    
+    def enable(self):
+        self.enabled = True
+    
+    def disable(self):
+        self.enabled = False
+    
+    def reset(self):
+        """
+        Drop all recorded histograms and events
+        """
+        with self._lock:
+            self.histograms = {}
+            self.events.clear()
+    
+    def span(self, name, **attributes):
+        """
+        Time a section of code
+        
+        Usage:
+            with tracer.span('gemini.model_call', model=model_name):
+                ...
+        
+        Args:
+            name (str): The span name, used as histogram key
+            **attributes: Extra attributes stored with the span event
+        
+        Returns:
+            A context manager
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, attributes)
+    
+    def record(self, name, duration_ms, **attributes):
+        """
+        Record a duration that was measured elsewhere
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).record(duration_ms)
+            self.events.append({"name": name, "ts": time.time(), "duration_ms": round(duration_ms, 3), **attributes})
+    
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+    
+    def _finish(self, span, duration_ms):
+        event = {"name": span.name, "parent": span.parent, "ts": time.time(),
+                 "duration_ms": round(duration_ms, 3), "thread": threading.current_thread().name}
+        event.update(span.attributes)
+        with self._lock:
+            self.histograms.setdefault(span.name, Histogram()).record(duration_ms)
+            self.events.append(event)
+    
+    def summary(self):
+        """
+        Get the statistics of every recorded span name
+        
+        Returns:
+            dict: A mapping of span name to its histogram summary
+        """
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+    
+    def report(self):
+        """
+        Format the summary as a text table
+        
+        Returns:
+            str: One line per span name with count and latency percentiles
+        """
+        lines = [f"{'span':<28} {'count':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"]
+        for name, stats in self.summary().items():
+            lines.append(f"{name:<28} {stats['count']:>7} {stats['mean_ms']:>9.2f} {stats['p50_ms']:>9.2f} "
+                         f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f}")
+        return "\n".join(lines)
+    
+    def dump_jsonl(self, path):
+        """
+        Append all recorded span events to a JSON lines file
+        
+        Args:
+            path (str): The output file
+        
+        Returns:
+            int: The number of events written
+        """
+        with self._lock:
+            events = list(self.events)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a') as output:
+            for event in events:
+                output.write(json.dumps(event) + "\n")
+        return len(events)
+
+# Create a default tracer configured from the environment
+tracer = Tracer()
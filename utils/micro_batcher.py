@@ -0,0 +1,188 @@
+"""
+Micro-batching of analysis requests into multi-image model calls
+
+Callers submit single images and get a future back. A background thread
+collects submissions until max_batch_size images are waiting or the oldest
+has waited max_wait_ms, sends them to the backend's analyze_batch() in one
+call, and resolves every caller's future with its own result. Up to
+max_in_flight batches are sent at the same time; while all of them are
+busy, arriving images wait and go out in the next, fuller batch.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from utils.analyzer_backends import AnalyzerBackend, create_backend
+
+class MicroBatcher:
+    """
+    Groups concurrent analysis requests into batch calls of one backend
+    """
+    
+    def __init__(self, backend, max_batch_size=None, max_wait_ms=None, max_in_flight=None):
+        """
+        Options that are not given are read from the environment
+        (FRUIT_APP_BATCH_SIZE, FRUIT_APP_BATCH_WAIT_MS, FRUIT_APP_BATCH_IN_FLIGHT).
+        
+        Args:
+            backend (AnalyzerBackend): The backend whose analyze_batch() is called
+            max_batch_size (int, optional): Send a batch as soon as this many images are waiting
+            max_wait_ms (float, optional): Send a batch when its first image has waited this long
+            max_in_flight (int, optional): How many batch calls may run at the same time
+        """
+        self.backend = backend
+        self.max_batch_size = int(max_batch_size or os.getenv('FRUIT_APP_BATCH_SIZE', 8))
+        self.max_wait_ms = float(max_wait_ms if max_wait_ms is not None else os.getenv('FRUIT_APP_BATCH_WAIT_MS', 50))
+        self.max_in_flight = int(max_in_flight or os.getenv('FRUIT_APP_BATCH_IN_FLIGHT', 4))
+        
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(self.max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='micro-batch')
+        self._closed = False
+        self._lock = threading.Lock()
+        self.stats = {"batches": 0, "images": 0, "full_batches": 0, "timed_out_batches": 0, "failed_batches": 0}
+        
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+    
+    def submit(self, image_path):
+        """
+        Queue an image for the next batch
+        
+        Args:
+            image_path (str): Path to the fruit image
+        
+        Returns:
+            concurrent.futures.Future: Resolves to the result dict of this image
+        """
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        
+        future = Future()
+        self._queue.put((image_path, future))
+        return future
+    
+    def _collect(self):
+        """
+        Wait for the next batch
+        
+        Returns:
+            tuple: (list of (image_path, future), whether the batch is full),
+                   or (None, False) once closed and drained
+        """
+        item = self._queue.get()
+        if item is None:
+            return None, False
+        
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Send what we have, then stop on the next call
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch, len(batch) == self.max_batch_size
+    
+    def _run(self):
+        while True:
+            # Start the next batch only when it can be sent right away
+            self._slots.acquire()
+            batch, full = self._collect()
+            if batch is None:
+                self._slots.release()
+                return
+            self._executor.submit(self._dispatch, batch, full)
+    
+    def _dispatch(self, batch, full):
+        """
+        Send one batch to the backend and resolve its futures
+        """
+        image_paths = [image_path for image_path, _ in batch]
+        failed = False
+        try:
+            results = self.backend.analyze_batch(image_paths)
+            if len(results) != len(batch):
+                raise ValueError(f"Backend returned {len(results)} results for {len(batch)} images")
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            failed = True
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+        
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["images"] += len(batch)
+            self.stats["full_batches" if full else "timed_out_batches"] += 1
+            self.stats["failed_batches"] += failed
+    
+    def get_stats(self):
+        """
+        Get the batching counters
+        
+        Returns:
+            dict: Batch and image counts and the mean batch size
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        stats["mean_batch_size"] = round(stats["images"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
+    
+    def close(self):
+        """
+        Stop accepting images, send the ones still queued and stop the thread
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+class BatchingBackend(AnalyzerBackend):
+    """
+    Analyzer that routes single-image calls through a MicroBatcher
+    
+    Useful where several threads analyze at the same time; a lone caller
+    only pays max_wait_ms extra.
+    """
+    name = 'batch'
+    
+    def __init__(self, inner=None, max_batch_size=None, max_wait_ms=None, max_in_flight=None):
+        """
+        Args:
+            inner (AnalyzerBackend or str, optional): The batched backend or its name,
+                read from FRUIT_APP_BATCH_INNER if not given
+            max_batch_size (int, optional): See MicroBatcher
+            max_wait_ms (float, optional): See MicroBatcher
+            max_in_flight (int, optional): See MicroBatcher
+        """
+        inner = inner or os.getenv('FRUIT_APP_BATCH_INNER', 'gemini')
+        self.inner = create_backend(inner) if isinstance(inner, str) else inner
+        self.batcher = MicroBatcher(self.inner, max_batch_size, max_wait_ms, max_in_flight)
+    
+    def analyze(self, image_path):
+        return self.batcher.submit(image_path).result()
+    
+    def analyze_batch(self, image_paths):
+        # Already a batch, no need to wait for more
+        return self.inner.analyze_batch(image_paths)
+    
+    def get_stats(self):
+        return self.batcher.get_stats()
@@ -0,0 +1,175 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+SCRYPT = 'scrypt'
+PBKDF2 = 'pbkdf2_sha256'
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+def _b64decode(text):
+    return base64.b64decode(text.encode('ascii'))
+
+class PasswordHasher:
+    """
+    Salted password hashing with tunable KDF cost parameters
+    
+    Hashes are stored as self-describing strings, for example
+    'scrypt$16384$8$1$<salt>$<hash>' or 'pbkdf2_sha256$600000$<salt>$<hash>',
+    so parameters can be changed per deployment and old hashes still verify.
+    Any stored value without a known prefix is treated as a legacy plaintext
+    password.
+    """
+    
+    def __init__(self, algorithm=None, scrypt_n=None, scrypt_r=None, scrypt_p=None,
+                 pbkdf2_iterations=None, cache_size=1024, cache_ttl=300):
+        """
+        Initialize the password hasher
+        
+        Parameters that are not given are read from the environment
+        (FRUIT_APP_KDF, FRUIT_APP_SCRYPT_N, FRUIT_APP_SCRYPT_R, FRUIT_APP_SCRYPT_P,
+        FRUIT_APP_PBKDF2_ITERATIONS).
+        
+        Args:
+            algorithm (str, optional): 'scrypt' or 'pbkdf2_sha256'
+            scrypt_n (int, optional): scrypt CPU/memory cost, a power of two
+            scrypt_r (int, optional): scrypt block size
+            scrypt_p (int, optional): scrypt parallelization
+            pbkdf2_iterations (int, optional): PBKDF2-HMAC-SHA256 iteration count
+            cache_size (int): Maximum number of cached successful verifications
+            cache_ttl (float): Seconds a cached verification stays valid, 0 disables the cache
+        """
+        self.algorithm = algorithm or os.getenv('FRUIT_APP_KDF', SCRYPT)
+        if self.algorithm not in (SCRYPT, PBKDF2):
+            raise ValueError(f"Unsupported password hashing algorithm: {self.algorithm}")
+        
+        self.scrypt_n = int(scrypt_n or os.getenv('FRUIT_APP_SCRYPT_N', 2 ** 14))
+        self.scrypt_r = int(scrypt_r or os.getenv('FRUIT_APP_SCRYPT_R', 8))
+        self.scrypt_p = int(scrypt_p or os.getenv('FRUIT_APP_SCRYPT_P', 1))
+        self.pbkdf2_iterations = int(pbkdf2_iterations or os.getenv('FRUIT_APP_PBKDF2_ITERATIONS', 600000))
+        
+        # Successful verifications, keyed by a keyed digest of (stored hash, password).
+        # The key is random per process, so cached entries reveal nothing about passwords.
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()
+        self._cache_key = os.urandom(32)
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+    
+    def _derive(self, algorithm, password, salt, params):
+        """
+        Run the KDF with explicit parameters
+        """
+        if algorithm == SCRYPT:
+            n, r, p = params
+            # scrypt needs about 128 * n * r bytes, leave headroom above the default limit
+            return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                                  maxmem=256 * n * r * p + 1024 * 1024, dklen=32)
+        iterations, = params
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations, dklen=32)
+    
+    def _current_params(self):
+        if self.algorithm == SCRYPT:
+            return (self.scrypt_n, self.scrypt_r, self.scrypt_p)
+        return (self.pbkdf2_iterations,)
+    
+    def _parse(self, encoded):
+        """
+        Split a stored hash into its parts
+        
+        Returns:
+            tuple or None: (algorithm, params, salt, digest) or None for legacy plaintext values
+        """
+        parts = encoded.split('$')
+        try:
+            if parts[0] == SCRYPT and len(parts) == 6:
+                return SCRYPT, tuple(int(value) for value in parts[1:4]), _b64decode(parts[4]), _b64decode(parts[5])
+            if parts[0] == PBKDF2 and len(parts) == 4:
+                return PBKDF2, (int(parts[1]),), _b64decode(parts[2]), _b64decode(parts[3])
+        except ValueError:
+            pass
+        return None
+    
+    def hash(self, password):
+        """
+        Hash a password with the current algorithm and parameters
+        
+        Args:
+            password (str): The plaintext password
+        
+        Returns:
+            str: The encoded hash to store in the database
+        """
+        salt = os.urandom(16)
+        params = self._current_params()
+        digest = self._derive(self.algorithm, password, salt, params)
+        fields = [self.algorithm] + [str(value) for value in params] + [_b64encode(salt), _b64encode(digest)]
+        return '$'.join(fields)
+    
+    def verify(self, password, encoded):
+        """
+        Check a password against a stored hash
+        
+        Args:
+            password (str): The plaintext password
+            encoded (str): The stored hash, or a legacy plaintext password
+        
+        Returns:
+            bool: True if the password matches, False otherwise
+        """
+        cache_key = None
+        if self.cache_ttl > 0:
+            cache_key = hmac.new(self._cache_key, f"{encoded}\0{password}".encode('utf-8'), hashlib.sha256).digest()
+            with self._lock:
+                expires = self._cache.get(cache_key)
+                if expires is not None and expires > time.monotonic():
+                    self._cache.move_to_end(cache_key)
+                    self.cache_hits += 1
+                    return True
+                self.cache_misses += 1
+        
+        parsed = self._parse(encoded)
+        if parsed is None:
+            # Legacy row created before passwords were hashed
+            matches = hmac.compare_digest(password.encode('utf-8'), encoded.encode('utf-8'))
+        else:
+            algorithm, params, salt, digest = parsed
+            matches = hmac.compare_digest(self._derive(algorithm, password, salt, params), digest)
+        
+        if matches and cache_key is not None:
+            with self._lock:
+                self._cache[cache_key] = time.monotonic() + self.cache_ttl
+                self._cache.move_to_end(cache_key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return matches
+    
+    def needs_rehash(self, encoded):
+        """
+        Check whether a stored hash was made with different parameters than the current ones
+        
+        Args:
+            encoded (str): The stored hash, or a legacy plaintext password
+        
+        Returns:
+            bool: True if the password should be rehashed on the next successful login
+        """
+        parsed = self._parse(encoded)
+        if parsed is None:
+            return True
+        algorithm, params, salt, digest = parsed
+        return algorithm != self.algorithm or params != self._current_params()
+
+# Create a default hasher configured from the environment
+password_hasher = PasswordHasher()
@@ -0,0 +1,109 @@
+"""
+Parsing of ripeness answers from model responses, complete or streamed
+"""
+import re
+import time
+from utils.metrics import tracer
+
+# The ripeness field with a complete class name, the lookahead makes sure the
+# word has ended so a chunk ending in "Ripe" is not mistaken for "Ripeness"
+RIPENESS_FIELD = re.compile(r'ripeness\W{0,6}(Unripe|Overripe|Ripe)(?=[^A-Za-z])', re.IGNORECASE)
+CONFIDENCE_FIELD = re.compile(r'confidence\W{0,4}(\d{1,3})(?=\D)', re.IGNORECASE)
+
+def extract_ripeness(response_text):
+    """
+    Find the ripeness class in a model response
+    
+    Args:
+        response_text (str): The response text
+    
+    Returns:
+        tuple: (ripeness, confidence), confidence is None when not stated
+    """
+    # Extract the ripeness classification
+    if "Ripe" in response_text and not "Unripe" in response_text:
+        ripeness = "Ripe"
+    elif "Unripe" in response_text:
+        ripeness = "Unripe"
+    elif "Overripe" in response_text:
+        ripeness = "Overripe"
+    else:
+        ripeness = "Unknown"
+    
+    # Extract the confidence percentage, used by the cascade analyzer
+    match = re.search(r'confidence\W{0,4}(\d{1,3})', response_text, re.IGNORECASE)
+    confidence = int(match.group(1)) if match else None
+    return ripeness, confidence
+
+class RipenessStreamParser:
+    """
+    Incremental parser of a streamed model response
+    
+    Chunks are fed as they arrive. As soon as the ripeness field holds a
+    complete class name, on_ripeness is called once with it, while the rest of
+    the response keeps arriving; on_text is called with the text so far after
+    every chunk. Both callbacks run on the thread that feeds the parser.
+    """
+    
+    def __init__(self, on_ripeness=None, on_text=None):
+        """
+        Args:
+            on_ripeness (callable, optional): Called with the ripeness class once it is decided
+            on_text (callable, optional): Called with the response text received so far
+        """
+        self.on_ripeness = on_ripeness
+        self.on_text = on_text
+        self.text = ""
+        self.ripeness = None
+        self.confidence = None
+        self.started = time.perf_counter()
+    
+    def feed(self, chunk):
+        """
+        Add the next chunk of the response
+        
+        Args:
+            chunk (str): The new text
+        
+        Returns:
+            bool: True if this chunk decided the ripeness
+        """
+        # Fields may be split across chunks, search a little before the new text as well
+        search_from = max(0, len(self.text) - 32)
+        self.text += chunk
+        
+        decided = False
+        if self.ripeness is None:
+            match = RIPENESS_FIELD.search(self.text, search_from)
+            if match:
+                self.ripeness = match.group(1).capitalize()
+                decided = True
+                tracer.record('analysis.first_result', (time.perf_counter() - self.started) * 1000)
+                if self.on_ripeness:
+                    self.on_ripeness(self.ripeness)
+        if self.confidence is None:
+            match = CONFIDENCE_FIELD.search(self.text, search_from)
+            if match:
+                self.confidence = int(match.group(1))
+        
+        if self.on_text:
+            self.on_text(self.text)
+        return decided
+    
+    def result(self):
+        """
+        Build the final result once the stream has ended
+        
+        Falls back to searching the whole text when no ripeness field was found.
+        
+        Returns:
+            dict: A dictionary containing ripeness status and detailed analysis
+        """
+        ripeness, confidence = extract_ripeness(self.text)
+        if self.ripeness is None and ripeness != "Unknown" and self.on_ripeness:
+            self.on_ripeness(ripeness)
+        return {
+            "ripeness": self.ripeness or ripeness,
+            "confidence": self.confidence if self.confidence is not None else confidence,
+            "full_analysis": self.text
+        }
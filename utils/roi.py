@@ -0,0 +1,206 @@
+"""
+Crop photos to the fruit before they are sent for analysis
+
+Line photos are mostly conveyor belt with the fruit in a small part of the
+frame. The cropper finds the fruit on a reduced copy of the decoded image:
+peel is saturated while the belt is grey, so a saturation threshold in HSV
+separates them. When that finds nothing, pixels that differ strongly in Lab
+from the median of both their row and their column are used instead: a
+belt, its rails and its slats run along or across the frame, so those
+medians are belt wherever the fruit covers less than half a line. The
+contours of the mask, with specks dropped, give bounding boxes whose union
+plus a margin is the crop. Images where the fruit fills most of the frame
+are left whole.
+    
+    image, info = roi_cropper.crop(image_cache.get(image_path))
+
+Needs opencv-python; without it images are passed through unchanged.
+"""
+import os
+import threading
+import time
+import numpy
+from dotenv import load_dotenv
+from PIL import Image
+from utils.image_loader import image_cache
+from utils.image_pool import get_preprocess_pool
+from utils.logger import logger
+from utils.metrics import Histogram, tracer
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+class RoiCropper:
+    """
+    Finds the fruit region of an image and crops to it
+    """
+    
+    def __init__(self, enabled=None, margin=None, min_saturation=None, min_area=0.002, max_keep=0.85,
+                 detect_size=320, contrast=40):
+        """
+        Options that are not given are read from the environment
+        (FRUIT_APP_ROI, FRUIT_APP_ROI_MARGIN, FRUIT_APP_ROI_MIN_SATURATION).
+        
+        Args:
+            enabled (bool, optional): Crop at all, on by default when OpenCV is installed
+            margin (float, optional): Border kept around the fruit, as a fraction of the region's size
+            min_saturation (int, optional): HSV saturation (0-255) from which a pixel counts as peel
+            min_area (float): Smallest blob kept, as a fraction of the image area
+            max_keep (float): Leave the image whole if the crop would keep more than this fraction of it
+            detect_size (int): Longest side of the reduced copy the region is searched on
+            contrast (int): Lab distance from the belt for the fallback mask
+        """
+        if enabled is None:
+            enabled = os.getenv('FRUIT_APP_ROI', '1') != '0'
+        if enabled and cv2 is None:
+            logger.warning("opencv-python is not installed, images are analyzed without cropping")
+        self.enabled = bool(enabled) and cv2 is not None
+        self.margin = float(margin if margin is not None else os.getenv('FRUIT_APP_ROI_MARGIN', 0.1))
+        self.min_saturation = int(min_saturation if min_saturation is not None
+                                  else os.getenv('FRUIT_APP_ROI_MIN_SATURATION', 70))
+        self.min_area = min_area
+        self.max_keep = max_keep
+        self.detect_size = detect_size
+        self.contrast = contrast
+        
+        self._lock = threading.Lock()
+        self._reset_stats()
+    
+    def _reset_stats(self):
+        self.stats = {"images": 0, "cropped": 0, "pixels_in": 0, "pixels_out": 0}
+        self.crop_ms = Histogram()
+    
+    def foreground_mask(self, pixels):
+        """
+        Get the fruit pixels of a reduced image
+        
+        Args:
+            pixels (numpy.ndarray): The RGB image as a height x width x 3 uint8 array
+        
+        Returns:
+            numpy.ndarray: A uint8 array of the same height and width, 1 for fruit and 0 for belt
+        """
+        hsv = cv2.cvtColor(pixels, cv2.COLOR_RGB2HSV)
+        # Very dark pixels have an unreliable hue and saturation
+        mask = ((hsv[:, :, 1] >= self.min_saturation) & (hsv[:, :, 2] >= 40)).astype(numpy.uint8)
+        if mask.sum() < self.min_area * mask.size:
+            # Nothing colourful, look for what stands out from the belt along its row and its column
+            lab = cv2.cvtColor(pixels, cv2.COLOR_RGB2LAB).astype(numpy.int16)
+            from_columns = numpy.abs(lab - numpy.median(lab, axis=0)[numpy.newaxis]).sum(axis=2)
+            from_rows = numpy.abs(lab - numpy.median(lab, axis=1)[:, numpy.newaxis]).sum(axis=2)
+            mask = (numpy.minimum(from_columns, from_rows) > self.contrast).astype(numpy.uint8)
+        
+        # Drop isolated pixels, then fill small holes such as spots on the peel
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, numpy.ones((3, 3), numpy.uint8))
+        return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, numpy.ones((7, 7), numpy.uint8))
+    
+    def find_region(self, image):
+        """
+        Find the box around the fruit
+        
+        Args:
+            image (PIL.Image): The decoded RGB image
+        
+        Returns:
+            tuple or None: (left, top, right, bottom) in image pixels, None when the image should stay whole
+        """
+        width, height = image.size
+        scale = min(1.0, self.detect_size / max(width, height))
+        small = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR) \
+            if scale < 1 else image
+        mask = self.foreground_mask(numpy.asarray(small))
+        
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = [cv2.boundingRect(contour) for contour in contours
+                 if cv2.contourArea(contour) >= self.min_area * mask.size]
+        if not boxes:
+            return None
+        
+        left = min(x for x, _, _, _ in boxes)
+        top = min(y for _, y, _, _ in boxes)
+        right = max(x + w for x, _, w, _ in boxes)
+        bottom = max(y + h for _, y, _, h in boxes)
+        pad_x = (right - left) * self.margin + 2
+        pad_y = (bottom - top) * self.margin + 2
+        box = (max(0, int((left - pad_x) / scale)), max(0, int((top - pad_y) / scale)),
+               min(width, int((right + pad_x) / scale + 0.5)), min(height, int((bottom + pad_y) / scale + 0.5)))
+        if (box[2] - box[0]) * (box[3] - box[1]) > self.max_keep * width * height:
+            return None
+        return box
+    
+    def crop(self, image):
+        """
+        Crop an image to its fruit region
+        
+        Args:
+            image (PIL.Image): The decoded RGB image, not modified
+        
+        Returns:
+            tuple: (image, info) with the cropped image, or the same image when it stays whole,
+                   and a dict with the box, the fraction of pixels kept and the time taken in ms
+        """
+        if not self.enabled:
+            return image, {"box": None, "kept": 1.0, "ms": 0.0}
+        
+        start = time.perf_counter()
+        with tracer.span('roi.crop') as span:
+            box = self.find_region(image)
+            cropped = image.crop(box) if box else image
+            kept = cropped.size[0] * cropped.size[1] / (image.size[0] * image.size[1])
+            span.set(cropped=box is not None, kept=round(kept, 3))
+        elapsed = (time.perf_counter() - start) * 1000
+        
+        with self._lock:
+            self.stats["images"] += 1
+            self.stats["cropped"] += box is not None
+            self.stats["pixels_in"] += image.size[0] * image.size[1]
+            self.stats["pixels_out"] += cropped.size[0] * cropped.size[1]
+            self.crop_ms.record(elapsed)
+        logger.debug("Region of interest %s keeps %.0f%% of the pixels, found in %.1f ms", box, kept * 100, elapsed)
+        return cropped, {"box": box, "kept": kept, "ms": elapsed}
+    
+    def model_image(self, image_path):
+        """
+        Get the image to send to a model: decoded through the shared cache and cropped
+        
+        Returns:
+            PIL.Image: The cropped RGB image
+        """
+        return self.crop(image_cache.get(image_path))[0]
+    
+    def model_images(self, image_paths):
+        """
+        Get the images to send to a model for a batch, decoding them in the preprocessing pool
+        
+        Returns:
+            list: The cropped RGB images, in the order of image_paths
+        """
+        return [self.crop(image)[0] for image in image_cache.get_many(image_paths, get_preprocess_pool())]
+    
+    def get_stats(self):
+        """
+        Get the cropping counters
+        
+        Returns:
+            dict: Images seen and cropped, the fraction of pixels removed and a summary of the crop time
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["crop"] = self.crop_ms.summary()
+        stats["pixel_reduction"] = round(1 - stats["pixels_out"] / stats["pixels_in"], 3) if stats["pixels_in"] else 0.0
+        return stats
+    
+    def reset_stats(self):
+        """
+        Drop the recorded counters and times
+        """
+        with self._lock:
+            self._reset_stats()
+
+# Shared by the analyzer backends
+roi_cropper = RoiCropper()
@@ -0,0 +1,127 @@
+"""
+Local HTTP stand-in for the analysis model
+
+Serves POST /analyze (one image) and POST /analyze_batch (several images in
+one call) with the same deterministic answers, latency and error
+distribution as the 'stub' analyzer backend, so the 'http' backend and the
+whole pipeline can be load-tested without the real service. With --roi every
+upload is cropped to its fruit before it is answered, as a service that crops
+on its side would; the answer still depends on the uploaded file only.
+
+Usage:
+    python -m utils.stub_server --port 8765 --latency-ms 200 --jitter-ms 80 --distribution lognormal
+"""
+import argparse
+import base64
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+from utils.analyzer_backends import StubBackend, image_key
+from utils.roi import RoiCropper
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _crop(self, data):
+        """
+        Crop an upload to its fruit when the server was started with --roi
+        """
+        if self.server.cropper is None:
+            return
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                self.server.cropper.crop(image.convert('RGB'))
+        except OSError:
+            # Not an image the stub can decode, it is answered all the same
+            pass
+    
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+        
+        if self.path == '/analyze':
+            self._crop(data)
+            key = image_key(self.headers.get('X-Image-Name'), data)
+            self._send_json(200, self.server.backend.analyze_key(key))
+        elif self.path == '/analyze_batch':
+            # JSON body {"images": [{"name": ..., "data": base64}, ...]}, answered in one model call
+            images = json.loads(data.decode('utf-8'))["images"]
+            keys = []
+            for image in images:
+                image_data = base64.b64decode(image["data"])
+                self._crop(image_data)
+                keys.append(image_key(image["name"], image_data))
+            self._send_json(200, {"results": self.server.backend.analyze_keys(keys)})
+        else:
+            self._send_json(404, {"error": "Not found"})
+    
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    
+    def __init__(self, address=('127.0.0.1', 8765), backend=None, roi=False):
+        """
+        Args:
+            address (tuple): (host, port) to listen on, port 0 picks a free port
+            backend (StubBackend, optional): Decides the answers, latency and errors
+            roi (bool): Crop every upload to its fruit on the server, needs OpenCV
+        """
+        ThreadingHTTPServer.__init__(self, address, StubRequestHandler)
+        self.backend = backend or StubBackend()
+        self.cropper = RoiCropper(enabled=True) if roi else None
+    
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/analyze"
+    
+    def start_in_thread(self):
+        """
+        Serve in a daemon thread, for use inside benchmarks
+        
+        Returns:
+            threading.Thread: The serving thread
+        """
+        thread = threading.Thread(target=self.serve_forever, name='stub-server', daemon=True)
+        thread.start()
+        return thread
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the analysis model")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=None)
+    parser.add_argument('--jitter-ms', type=float, default=None)
+    parser.add_argument('--distribution', choices=['fixed', 'uniform', 'lognormal'], default=None)
+    parser.add_argument('--error-rate', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--per-image-ms', type=float, default=None)
+    parser.add_argument('--max-concurrent', type=int, default=None)
+    parser.add_argument('--roi', action='store_true', help="Crop every upload to its fruit on the server")
+    args = parser.parse_args()
+    
+    backend = StubBackend(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                          distribution=args.distribution, error_rate=args.error_rate, seed=args.seed,
+                          per_image_ms=args.per_image_ms, max_concurrent=args.max_concurrent)
+    server = StubServer((args.host, args.port), backend, roi=args.roi)
+    print(f"Stub analyzer listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()